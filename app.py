@@ -1,27 +1,130 @@
 from functools import wraps
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from flask_mysqldb import MySQL
 from datetime import timedelta, datetime, date
 from config import DevelopmentConfig
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
+from db import MySQLPool, solo_lectura
+import instrumentacion
+from referencias import CacheReferencia
+from catalogo_cache import CacheCatalogo
+from busqueda import IndiceProductos
+from carrito import CarritoServidor
+from condicional import GetCondicional
+from idempotencia import Idempotencia
+from facturacion import ColaFacturas
+from contrasenas import HasherContrasenas, ContrasenasOcupadasError
+from limite_login import LimiteLogin
+from dashboard import Dashboards
+import ventas_diarias
 import MySQLdb.cursors
+import click
+import base64
 import json
+import math
+import time
 import traceback
-
-ph = PasswordHasher()
+from decimal import Decimal
 
 app = Flask(__name__)
 # Usar configuración de desarrollo
 app.config.from_object(DevelopmentConfig)
 
-# Configuración de MySQL
-mysql = MySQL(app)
+# Configuración de MySQL (pool de conexiones, ver db.py)
+mysql = MySQLPool(app)
+try:
+    mysql.precalentar()
+except Exception as e:
+    # La app puede arrancar sin BD; el pool abrirá conexiones bajo demanda
+    print(f"[pool] No se pudieron abrir las conexiones iniciales: {e}")
 app.permanent_session_lifetime = timedelta(days=7)
 
+# Conteo de SQL por request, header Server-Timing y log de consultas lentas
+instrumentacion.init_app(app)
+
+# Catálogos pequeños (categorías, métodos de pago, estados, ...) en memoria
+referencias = CacheReferencia(mysql, ttl=app.config['REFERENCIAS_TTL'])
+try:
+    with app.app_context():
+        referencias.cargar_todo()
+except Exception as e:
+    print(f"[referencias] No se pudieron precargar los catálogos: {e}")
+
+# Catálogo público por categoría (productosCatalogo), invalidado por Catalogo_Version
+catalogo_cache = CacheCatalogo(
+    mysql,
+    ttl=app.config['CATALOGO_CACHE_TTL'],
+    intervalo_verificacion=app.config['CATALOGO_CACHE_VERIFICAR_SEG']
+)
+
+# Búsqueda de productos en memoria (nombre, SKU, categoría, material, kilataje, ley)
+indice_productos = IndiceProductos(mysql, intervalo_verificacion=app.config['CATALOGO_CACHE_VERIFICAR_SEG'])
+
+# Carrito de compras en la base de datos; la cookie solo lleva el id (ver carrito.py)
+carrito_servidor = CarritoServidor(
+    mysql,
+    ttl=app.config['CARRITO_TTL_DIAS'] * 24 * 3600,
+    ttl_reserva=app.config['RESERVA_STOCK_MINUTOS'] * 60,
+    politica_surtido=app.config['SURTIDO_POLITICA']
+)
+
+# ETag / Last-Modified para páginas de catálogo y reportes (ver condicional.py)
+condicional = GetCondicional(app, mysql)
+
+# Idempotency-Key en checkout, alta de pedidos y pagos (ver idempotencia.py)
+idempotente = Idempotencia(app, mysql)
+
+# Hash y verificación de contraseñas en un ejecutor acotado (ver contrasenas.py)
+contrasenas = HasherContrasenas(
+    time_cost=app.config['ARGON2_TIME_COST'],
+    memory_cost=app.config['ARGON2_MEMORY_COST'],
+    parallelism=app.config['ARGON2_PARALLELISM'],
+    max_concurrentes=app.config['ARGON2_CONCURRENCIA'],
+    espera=app.config['ARGON2_ESPERA_SEGUNDOS']
+)
+
+def _respuesta_contrasenas_ocupadas():
+    """503 cuando el ejecutor de Argon2 no tuvo cupo a tiempo"""
+    respuesta = jsonify({
+        'success': False,
+        'error': 'ERROR_SERVIDOR_OCUPADO',
+        'mensaje': 'El servidor está atendiendo muchas solicitudes. Intenta de nuevo en unos segundos.'
+    })
+    respuesta.status_code = 503
+    respuesta.headers['Retry-After'] = '2'
+    return respuesta
+
+# Token buckets por IP y usuario antes de consultar o verificar en /login (ver limite_login.py)
+limite_login = LimiteLogin(
+    mysql,
+    capacidad_ip=app.config['LOGIN_LIMITE_IP_CAPACIDAD'],
+    por_minuto_ip=app.config['LOGIN_LIMITE_IP_POR_MINUTO'],
+    capacidad_usuario=app.config['LOGIN_LIMITE_USUARIO_CAPACIDAD'],
+    por_minuto_usuario=app.config['LOGIN_LIMITE_USUARIO_POR_MINUTO'],
+    compartido=app.config['LOGIN_LIMITE_COMPARTIDO']
+)
+
+# Widgets de cada dashboard en una sola petición, /api/dashboard/<panel> (ver dashboard.py)
+dashboards = Dashboards(mysql)
+dashboards.panel('admin', ('Admin',), dominios=('catalogo', 'ventas', 'inventario', 'devoluciones'),
+                 solo_lectura=True)
+dashboards.panel('finanzas', ('Analista Financiero',))
+dashboards.panel('inventario', ('Inventarios', 'Gestor de Sucursal'))
+dashboards.panel('auditor', ('Auditor',), dominios=('catalogo', 'ventas', 'inventario', 'devoluciones'),
+                 solo_lectura=True)
+
+# Facturas del checkout generadas fuera de la petición (ver facturacion.py)
+cola_facturas = ColaFacturas(
+    mysql,
+    max_intentos=app.config['FACTURAS_MAX_INTENTOS'],
+    espera=app.config['FACTURAS_ESPERA_SEGUNDOS'],
+    ttl_proceso=app.config['FACTURAS_PROCESO_SEGUNDOS']
+)
+
 # ----------------------------------
 # Decoradores de sesión y roles
 # ----------------------------------
+# Las rutas de reportes usan además @solo_lectura (db.py) para leer de la
+# réplica de MariaDB; las escrituras se quedan siempre en la primaria.
+
 def login_requerido(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -100,30 +203,61 @@ def role_required(*roles):
         return decorated_function
     return decorator
 
+# ==================== PAGINACIÓN DEL CATÁLOGO ====================
+# Paginación por llave (nombre_producto, id_producto): el cursor `despues` es
+# la llave del último producto entregado, codificada en base64 para que el
+# cliente la trate como opaca.
+
+def _codificar_cursor_catalogo(fila):
+    llave = json.dumps([fila['nombre'], fila['id_producto']], ensure_ascii=False)
+    return base64.urlsafe_b64encode(llave.encode('utf-8')).decode('ascii')
+
+def _leer_cursor_catalogo(cursor_str):
+    """(nombre, id_producto) del cursor; (None, None) para la primera página"""
+    if not cursor_str:
+        return None, None
+    try:
+        nombre, id_producto = json.loads(base64.urlsafe_b64decode(cursor_str.encode('ascii')))
+        return str(nombre), int(id_producto)
+    except Exception:
+        raise ValueError('Cursor de paginación inválido')
+
+def _limite_pagina_catalogo(limite_str):
+    """Tamaño de página pedido, acotado a CATALOGO_PAGINA_MAX"""
+    try:
+        limite = int(limite_str) if limite_str else app.config['CATALOGO_PAGINA_TAMANO']
+    except ValueError:
+        limite = app.config['CATALOGO_PAGINA_TAMANO']
+    return max(1, min(limite, app.config['CATALOGO_PAGINA_MAX']))
+
+def _cortar_pagina_catalogo(filas, limite):
+    """Los SP devuelven limite + 1 filas: la extra solo indica que hay más"""
+    productos = list(filas[:limite])
+    siguiente = _codificar_cursor_catalogo(productos[-1]) if len(filas) > limite else None
+    return productos, siguiente
+
+def _producto_catalogo_json(fila):
+    """Fila del catálogo lista para jsonify (DECIMAL -> float)"""
+    return {k: float(v) if isinstance(v, Decimal) else v for k, v in fila.items()}
+
 # ==================== RUTAS PÚBLICAS ====================
 
 @app.route('/')
+@condicional('catalogo')
 def catalogo():
     """Catálogo público de productos - Página de inicio"""
     categoria_seleccionada = request.args.get('categoria', '')
+    siguiente = None
     
     try:
-        import MySQLdb.cursors
-        # Usar DictCursor para acceder a los campos por nombre en el template
-        cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        
-        # Obtener todas las categorías activas usando SP categoriasActivas - SOLO SP, NO SQL EMBEBIDO
-        cursor.callproc('categoriasActivas', [])
-        categorias = cursor.fetchall()
-        while cursor.nextset():
-            pass
+        # Categorías activas desde el cache de referencia (SP categoriasActivas)
+        categorias = referencias.obtener('categorias')
         
-        # Obtener productos activos usando SP productosCatalogo - SOLO SP, NO SQL EMBEBIDO
-        categoria_param = categoria_seleccionada if categoria_seleccionada else None
-        cursor.callproc('productosCatalogo', [categoria_param])
-        productos = cursor.fetchall()
-        while cursor.nextset():
-            pass
+        # Primera página de productos activos (SP productosCatalogoPagina, desde el cache);
+        # el resto lo pide catalogo.js a /api/catalogo
+        limite = app.config['CATALOGO_PAGINA_TAMANO']
+        filas = catalogo_cache.pagina(categoria_seleccionada, None, None, limite + 1)
+        productos, siguiente = _cortar_pagina_catalogo(filas, limite)
         
         # Depuración: imprimir algunos productos para verificar que los descuentos se obtengan correctamente
         if productos:
@@ -132,16 +266,63 @@ def catalogo():
                 print(f"  Producto {i+1}: id={p.get('id_producto')}, nombre={p.get('nombre')}, "
                       f"precio_original={p.get('precio_original')}, descuento={p.get('descuento_producto')}, "
                       f"precio={p.get('precio')}")
-        
-        cursor.close()
     except Exception as e:
+        condicional.sin_validadores()
         print(f"Error cargando productos: {e}")
         import traceback
         traceback.print_exc()
         productos = []
         categorias = []
     
-    return render_template('catalogo.html', productos=productos, categorias=categorias, categoria_seleccionada=categoria_seleccionada)
+    return render_template('catalogo.html', productos=productos, categorias=categorias,
+                           categoria_seleccionada=categoria_seleccionada, siguiente=siguiente)
+
+@app.route('/api/catalogo')
+@condicional('catalogo')
+def api_catalogo():
+    """Página del catálogo público: ?categoria=&despues=<cursor>&limite= (SP productosCatalogoPagina)"""
+    categoria = request.args.get('categoria', '')
+    try:
+        despues_nombre, despues_id = _leer_cursor_catalogo(request.args.get('despues'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limite = _limite_pagina_catalogo(request.args.get('limite'))
+    
+    try:
+        filas = catalogo_cache.pagina(categoria, despues_nombre, despues_id, limite + 1)
+        productos, siguiente = _cortar_pagina_catalogo(filas, limite)
+        return jsonify({
+            'productos': [_producto_catalogo_json(p) for p in productos],
+            'siguiente': siguiente
+        })
+    except Exception as e:
+        print(f"Error obteniendo página del catálogo: {str(e)}\n{traceback.format_exc()}")
+        return jsonify({'error': 'Error al obtener productos'}), 500
+
+@app.route('/api/productos/buscar')
+@condicional('catalogo')
+def api_buscar_productos():
+    """Búsqueda de productos activos por prefijo: ?q=&categoria=&limite= (índice en memoria, ver busqueda.py)"""
+    consulta = request.args.get('q', '').strip()
+    categoria = request.args.get('categoria', '').strip() or None
+    try:
+        limite = int(request.args.get('limite') or app.config['BUSQUEDA_LIMITE'])
+    except ValueError:
+        limite = app.config['BUSQUEDA_LIMITE']
+    limite = max(1, min(limite, app.config['BUSQUEDA_LIMITE_MAX']))
+    
+    try:
+        productos = [_producto_catalogo_json(p) for p in
+                     indice_productos.buscar(consulta, limite=limite, categoria=categoria)]
+        # El costo solo lo ve el personal (catálogo de ventas), no el público
+        if session.get('role') not in ('Admin', 'Vendedor', 'Inventarios', 'Gestor de Sucursal',
+                                       'Analista Financiero', 'Auditor'):
+            for producto in productos:
+                producto.pop('costo_unitario', None)
+        return jsonify({'productos': productos, 'consulta': consulta})
+    except Exception as e:
+        print(f"Error buscando productos: {str(e)}\n{traceback.format_exc()}")
+        return jsonify({'error': 'Error al buscar productos'}), 500
 
 # ==================== API PARA REGISTRO DE CLIENTES ====================
 
@@ -188,7 +369,10 @@ def api_crear_cliente():
             return jsonify({'error': 'La contraseña debe tener al menos 6 caracteres'}), 400
         
         # Hashear la contraseña con Argon2 antes de guardarla
-        contrasena_hash = ph.hash(contrasena)
+        try:
+            contrasena_hash = contrasenas.hash(contrasena)
+        except ContrasenasOcupadasError:
+            return _respuesta_contrasenas_ocupadas()
         
         cursor = mysql.connection.cursor()
         
@@ -221,15 +405,6 @@ def api_crear_cliente():
         except Exception as e:
             print(f"Error leyendo resultado del SP: {e}")
         
-        if not id_cliente or id_cliente == 0:
-            print("No se pudo obtener ID del SP, consultando MAX(id_cliente)...")
-            cursor.callproc('sp_cliente_max_id', [])
-            resultado_max = cursor.fetchone()
-            while cursor.nextset():
-                pass
-            id_cliente = resultado_max.get('id_cliente', 0) if resultado_max else 0
-            print(f"ID obtenido de MAX: {id_cliente}")
-        
         while cursor.nextset():
             pass
         
@@ -250,7 +425,7 @@ def api_crear_cliente():
                 usuario = resultado_usuario[0]
                 
                 # Guardar carrito antes de limpiar sesión (si existe)
-                carrito_anterior = session.get('carrito', [])
+                carrito_anterior = session.get('carrito_id')
                 
                 # Crear sesión automáticamente
                 session.clear()
@@ -264,9 +439,12 @@ def api_crear_cliente():
                 session['usuario_id'] = usuario['id_usuario']
                 session['roles'] = [usuario['nombre_rol']]
                 
-                # Restaurar carrito si existía antes del registro
+                # Asociar al nuevo usuario el carrito que tenía antes del registro
                 if carrito_anterior:
-                    session['carrito'] = carrito_anterior
+                    try:
+                        carrito_servidor.asignar_usuario(carrito_anterior, usuario['id_usuario'])
+                    except Exception as e:
+                        print(f"[carrito] No se pudo asociar el carrito al usuario: {e}")
                 
                 session.permanent = True
                 
@@ -350,58 +528,24 @@ def agregar_al_carrito():
         if not id_producto:
             return jsonify({'error': 'ID de producto requerido'}), 400
         
-        cursor = mysql.connection.cursor()
         try:
-            cursor.callproc('producto_info_carrito', [id_producto])
-            producto = cursor.fetchone()
-            while cursor.nextset():
-                pass
-        finally:
-            cursor.close()
-
-        if not producto:
+            cantidad = int(cantidad)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Cantidad inválida'}), 400
+        if cantidad < 1:
+            return jsonify({'error': 'Cantidad inválida'}), 400
+
+        # Alta o incremento en el carrito del servidor; nombre, SKU y precio con
+        # descuento los toma el SP de Productos en la misma llamada
+        resumen = carrito_servidor.agregar(int(id_producto), cantidad)
+        if resumen is None:
             return jsonify({'error': 'Producto no encontrado o no está activo'}), 404
         
-        if hasattr(producto, 'keys'):
-            producto_dict = dict(producto)
-        else:
-            producto_dict = producto
-        
-        # Obtener precio y descuento del producto
-        precio_unitario = float(producto_dict.get('precio', 0))
-        descuento = float(producto_dict.get('descuento_producto', 0) or 0)
-        
-        # Aplicar descuento al precio: precio - precio*descuento (el precio ya incluye IVA)
-        precio_con_descuento = precio_unitario - (precio_unitario * descuento / 100)
-        
-        if 'carrito' not in session:
-            session['carrito'] = []
-        
-        carrito = session.get('carrito', [])
-        producto_existente = next((item for item in carrito if item.get('id_producto') == id_producto), None)
-        
-        if producto_existente:
-            producto_existente['cantidad'] += cantidad
-            # Actualizar el precio en caso de que haya cambiado el descuento
-            producto_existente['precio'] = precio_con_descuento
-        else:
-            carrito.append({
-                'id_producto': int(id_producto),
-                'nombre': str(producto_dict.get('nombre', 'Producto sin nombre')),
-                'precio': precio_con_descuento,  # Precio con descuento aplicado
-                'sku': str(producto_dict.get('sku', 'N/A')),
-                'cantidad': int(cantidad)
-            })
-        
-        session['carrito'] = carrito
-        session.modified = True
-        
-        total_items = sum(item.get('cantidad', 0) for item in carrito)
-        
         return jsonify({
             'success': True,
             'mensaje': 'Producto agregado al carrito',
-            'total_items': total_items
+            'total_items': resumen['total_items'],
+            'reservado': resumen['reservado']
         })
     except Exception as e:
         import traceback
@@ -422,14 +566,46 @@ def obtener_carrito():
         # Para la página principal, permitir obtener el carrito sin autenticación
         # pero cuando se intenta hacer checkout, se verificará la autenticación
         
-        carrito = session.get('carrito', [])
-        total = sum(item['precio'] * item['cantidad'] for item in carrito)
-        total_items = sum(item['cantidad'] for item in carrito)
+        # Precios vigentes y disponibilidad de todo el carrito en una llamada,
+        # sin apartar ni escribir (eso se hace al cambiarlo y al validar/pagar)
+        carrito = carrito_servidor.consultar()
+        resumen = carrito_servidor.resumen(carrito)
         
         return jsonify({
             'carrito': carrito,
-            'total': total,
-            'total_items': total_items
+            'total': resumen['total'],
+            'total_items': resumen['total_items'],
+            'todos_disponibles': all(item['disponible'] for item in carrito)
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _respuesta_carrito_no_disponible(carrito):
+    """409 con los productos que ya no se pueden surtir (antes de crear el pedido)"""
+    no_disponibles = [item for item in carrito if not item['disponible']]
+    return jsonify({
+        'error': 'ERROR_STOCK_INSUFICIENTE',
+        'mensaje': 'Lo sentimos, algunos productos en tu carrito no tienen suficiente inventario disponible en este momento. Por favor, revisa las cantidades o intenta más tarde.',
+        'no_disponibles': no_disponibles,
+        'carrito': carrito
+    }), 409
+
+@app.route('/api/carrito/validar', methods=['POST'])
+def validar_carrito():
+    """Recotizar el carrito y verificar existencias antes de pagar"""
+    try:
+        carrito = carrito_servidor.cotizar()
+        if not carrito:
+            return jsonify({'error': 'El carrito está vacío'}), 400
+        if not all(item['disponible'] for item in carrito):
+            return _respuesta_carrito_no_disponible(carrito)
+        resumen = carrito_servidor.resumen(carrito)
+        return jsonify({
+            'success': True,
+            'carrito': carrito,
+            'total': resumen['total'],
+            'total_items': resumen['total_items'],
+            'precios_actualizados': any(item['precio_cambio'] for item in carrito)
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -444,21 +620,15 @@ def eliminar_del_carrito():
         if not id_producto:
             return jsonify({'error': 'ID de producto requerido'}), 400
         
-        if 'carrito' not in session:
+        if 'carrito_id' not in session:
             return jsonify({'error': 'Carrito vacío'}), 400
         
-        carrito = session['carrito']
-        carrito = [item for item in carrito if item['id_producto'] != id_producto]
-        session['carrito'] = carrito
-        session.modified = True
-        
-        total = sum(item['precio'] * item['cantidad'] for item in carrito)
-        total_items = sum(item['cantidad'] for item in carrito)
+        resumen = carrito_servidor.eliminar(int(id_producto))
         
         return jsonify({
             'success': True,
-            'total': total,
-            'total_items': total_items
+            'total': resumen['total'],
+            'total_items': resumen['total_items']
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -474,24 +644,15 @@ def actualizar_cantidad_carrito():
         if not id_producto or cantidad < 1:
             return jsonify({'error': 'Datos inválidos'}), 400
         
-        if 'carrito' not in session:
+        if 'carrito_id' not in session:
             return jsonify({'error': 'Carrito vacío'}), 400
         
-        carrito = session['carrito']
-        producto = next((item for item in carrito if item['id_producto'] == id_producto), None)
-        
-        if producto:
-            producto['cantidad'] = cantidad
-            session['carrito'] = carrito
-            session.modified = True
-        
-        total = sum(item['precio'] * item['cantidad'] for item in carrito)
-        total_items = sum(item['cantidad'] for item in carrito)
+        resumen = carrito_servidor.cambiar_cantidad(int(id_producto), int(cantidad))
         
         return jsonify({
             'success': True,
-            'total': total,
-            'total_items': total_items
+            'total': resumen['total'],
+            'total_items': resumen['total_items']
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -500,8 +661,7 @@ def actualizar_cantidad_carrito():
 def vaciar_carrito():
     """Vaciar el carrito completamente"""
     try:
-        session['carrito'] = []
-        session.modified = True
+        carrito_servidor.vaciar()
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -519,21 +679,24 @@ def restaurar_carrito():
         if not carrito or not isinstance(carrito, list):
             return jsonify({'error': 'Carrito inválido'}), 400
         
-        # Validar que cada item tenga los campos necesarios
-        for item in carrito:
-            if 'id_producto' not in item or 'cantidad' not in item or 'precio' not in item:
-                return jsonify({'error': 'Formato de carrito inválido'}), 400
-        
-        # Restaurar el carrito en la sesión
-        session['carrito'] = carrito
-        session.modified = True
+        # Validar que cada item tenga los campos necesarios; el precio que
+        # mande el cliente se ignora, el SP toma el vigente de Productos
+        try:
+            items = [
+                {'id_producto': int(item['id_producto']), 'cantidad': int(item['cantidad'])}
+                for item in carrito
+            ]
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'Formato de carrito inválido'}), 400
         
-        total = sum(item['precio'] * item['cantidad'] for item in carrito)
-        total_items = sum(item['cantidad'] for item in carrito)
+        # Restaurar el carrito en el servidor (reemplaza el contenido actual)
+        carrito = carrito_servidor.reemplazar(items)
+        resumen = carrito_servidor.resumen(carrito)
         return jsonify({
             'success': True,
-            'total': total,
-            'total_items': total_items,
+            'carrito': carrito,
+            'total': resumen['total'],
+            'total_items': resumen['total_items'],
             'mensaje': 'Carrito restaurado exitosamente'
         })
     except Exception as e:
@@ -542,6 +705,8 @@ def restaurar_carrito():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/carrito/checkout', methods=['POST'])
+@login_requerido
+@idempotente('checkout')
 def api_checkout_carrito():
     """Endpoint para procesar checkout del carrito: crear pedido y preparar pago"""
     try:
@@ -551,9 +716,12 @@ def api_checkout_carrito():
                 'require_login': True
             }), 401
         
-        carrito = session.get('carrito', [])
+        # Recotizar y verificar existencias antes de crear el pedido
+        carrito = carrito_servidor.cotizar()
         if not carrito or len(carrito) == 0:
             return jsonify({'error': 'El carrito está vacío'}), 400
+        if not all(item['disponible'] for item in carrito):
+            return _respuesta_carrito_no_disponible(carrito)
         
         # Obtener parámetro opcional para solicitar factura
         data = request.get_json() if request.is_json else {}
@@ -561,169 +729,37 @@ def api_checkout_carrito():
         
         id_usuario = session.get('user_id')
         
-        cursor = mysql.connection.cursor()
-        
-        cursor.execute("""
-            CREATE TEMPORARY TABLE IF NOT EXISTS TmpPedidos (
-                id_tmp_pedido INT AUTO_INCREMENT PRIMARY KEY,
-                fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
-                id_usuario INT NULL
-            )
-        """)
-        cursor.execute("""
-            CREATE TEMPORARY TABLE IF NOT EXISTS TmpItems_Pedido (
-                id_tmp_item INT AUTO_INCREMENT PRIMARY KEY,
-                id_producto INT NOT NULL,
-                cantidad_producto INT NOT NULL,
-                id_tmp_pedido INT NOT NULL
-            )
-        """)
-        
-        cursor.callproc('sp_tmp_pedido_insertar', [id_usuario])
-        resultado_tmp = cursor.fetchone()
-        while cursor.nextset():
-            pass
-        id_tmp_pedido = resultado_tmp.get('id_tmp_pedido', 0) if resultado_tmp else cursor.lastrowid
-        
-        for item in carrito:
-            id_producto = item.get('id_producto')
-            cantidad = item.get('cantidad', 1)
-            if id_producto and cantidad > 0:
-                cursor.callproc('sp_tmp_item_pedido_insertar', [id_producto, cantidad, id_tmp_pedido])
-                while cursor.nextset():
-                    pass
-        
-        try:
-            cursor.callproc('pedidoCrear', [id_tmp_pedido])
-            # Consumir todos los resultados del SP
-            while cursor.nextset():
-                pass
-        except Exception as sp_error:
-            # Cerrar cursor y hacer rollback antes de procesar el error
-            try:
-                cursor.close()
-            except:
-                pass
-            try:
-                mysql.connection.rollback()
-            except:
-                pass
-            # Re-lanzar el error para que sea manejado en el bloque except externo
-            raise sp_error
-        
-        cursor.callproc('sp_pedido_max_id', [])
-        resultado = cursor.fetchone()
-        while cursor.nextset():
-            pass
-        id_pedido = resultado.get('id_pedido', 0) if resultado else 0
+        # Pedido y detalles en una sola llamada y una sola transacción
+        # (pedidoCheckout recibe el carrito como JSON, reparte cada producto
+        # entre sucursales empezando por las reservadas y vacía el carrito).
+        # La factura solicitada queda en cola y la genera el worker
+        # (flask --app app facturar-pendientes)
+        items_json = json.dumps([
+            {'id_producto': item['id_producto'], 'cantidad': item['cantidad']}
+            for item in carrito
+        ])
+        resultado = mysql.ejecutar_sp_uno('pedidoCheckout', [
+            id_usuario, session.get('carrito_id'), items_json, bool(solicitar_factura),
+            app.config['SURTIDO_POLITICA']
+        ])
+        mysql.connection.commit()
         
+        id_pedido = resultado.get('id_pedido') if resultado else None
         if not id_pedido:
-            cursor.close()
             return jsonify({'error': 'No se pudo crear el pedido'}), 500
         
-
-        # Obtener la clasificación del cliente y su descuento
-        cursor.execute("""
-            SELECT COALESCE(cl.descuento_clasificacion, 0) AS descuento_clasificacion
-            FROM Clientes c
-            LEFT JOIN Clasificaciones cl ON c.id_clasificacion = cl.id_clasificacion
-            WHERE c.id_usuario = %s
-        """, (id_usuario,))
-        clasificacion_result = cursor.fetchone()
-        descuento_clasificacion = float(clasificacion_result.get('descuento_clasificacion', 0) or 0) if clasificacion_result else 0
-        
-        # Calcular el total del pedido aplicando descuentos de productos (sumando los detalles)
-        # Nota: El precio del producto ya incluye IVA, y se debe aplicar el descuento: precio - precio*descuento
-        cursor.execute("""
-            SELECT COALESCE(SUM((pr.precio_unitario - (pr.precio_unitario * COALESCE(pr.descuento_producto, 0) / 100)) * pd.cantidad_producto), 0) AS total_pedido
-            FROM Pedidos_Detalles pd
-            JOIN Productos pr ON pd.id_producto = pr.id_producto
-            WHERE pd.id_pedido = %s
-        """, (id_pedido,))
-        total_result = cursor.fetchone()
-        total_pedido = float(total_result.get('total_pedido', 0) or 0) if total_result else 0
-        
-        # Aplicar descuento de clasificación del cliente al total
-        # total_final = total_pedido - (total_pedido * descuento_clasificacion / 100)
-        total_con_descuento_clasificacion = total_pedido - (total_pedido * descuento_clasificacion / 100) if descuento_clasificacion > 0 else total_pedido
-        # El precio ya incluye IVA y se aplicó el descuento de producto, ahora también se aplica el descuento de clasificación
-        
-        # Crear factura solo si se solicita
-        id_factura = None
-        total_factura = None
-        
-        if solicitar_factura:
-            try:
-                cursor.callproc('pedidoFacturar', [id_pedido])
-                # Consumir todos los resultados del SP
-                while cursor.nextset():
-                    pass
-                
-                # Obtener la factura creada usando SP
-                cursor.callproc('sp_factura_por_pedido', [id_pedido])
-                factura = cursor.fetchone()
-                while cursor.nextset():
-                    pass
-                
-                if factura:
-                    id_factura = factura.get('id_factura')
-                    total_factura_sin_desc = float(factura.get('total', 0))
-                    
-                    # Aplicar descuento de clasificación al total de la factura
-                    if descuento_clasificacion > 0:
-                        total_factura = total_factura_sin_desc - (total_factura_sin_desc * descuento_clasificacion / 100)
-                        # Actualizar el total de la factura con el descuento aplicado
-                        cursor.callproc('sp_factura_actualizar_total_descuento', [id_factura, total_factura])
-                        while cursor.nextset():
-                            pass
-                    else:
-                        total_factura = total_factura_sin_desc
-                    
-            except Exception as sp_error:
-                error_msg = str(sp_error)
-                # Si ya tiene factura, intentar obtenerla
-                if 'ya tiene una factura' in error_msg.lower():
-                    try:
-                        cursor.callproc('sp_factura_por_pedido', [id_pedido])
-                        factura = cursor.fetchone()
-                        while cursor.nextset():
-                            pass
-                        if factura:
-                            id_factura = factura.get('id_factura')
-                            total_factura_sin_desc = float(factura.get('total', 0))
-                            
-                            # Aplicar descuento de clasificación al total de la factura
-                            if descuento_clasificacion > 0:
-                                total_factura = total_factura_sin_desc - (total_factura_sin_desc * descuento_clasificacion / 100)
-                                # Actualizar el total de la factura con el descuento aplicado
-                                cursor.callproc('sp_factura_actualizar_total_descuento', [id_factura, total_factura])
-                                while cursor.nextset():
-                                    pass
-                            else:
-                                total_factura = total_factura_sin_desc
-                    except:
-                        pass
-                else:
-                    # Si es otro error y se solicitó factura, reportarlo
-                    cursor.close()
-                    mysql.connection.rollback()
-                    return jsonify({'error': f'Error al crear factura: {error_msg}'}), 500
-        
-        mysql.connection.commit()
-        cursor.close()
-        
-        # Vaciar el carrito después de crear el pedido exitosamente
-        session['carrito'] = []
-        session.modified = True
-        
-        # Retornar respuesta - siempre mostrar modal de pago, con o sin factura
-        # Si hay factura, usar su total, si no, usar el total del pedido con descuento de clasificación
-        total_a_pagar = total_factura if (id_factura and total_factura) else total_con_descuento_clasificacion
+        descuento_clasificacion = float(resultado.get('descuento_clasificacion') or 0)
+        total_pedido = float(resultado.get('total_pedido') or 0)
+        # Total del pedido con descuento de clasificación (el mismo que tendrá la factura)
+        total_a_pagar = float(resultado.get('total') or 0)
         
+        # Retornar respuesta - siempre mostrar modal de pago; el pago se
+        # registra por pedido y se liga a la factura cuando se genere
         return jsonify({
             'success': True,
             'id_pedido': id_pedido,
-            'id_factura': id_factura,  # Puede ser None
+            'id_factura': None,  # Se genera después: consultar estado_factura
+            'estado_factura': resultado.get('estado_factura'),  # 'Pendiente' o None sin factura
             'total': total_a_pagar,
             'descuento_clasificacion': descuento_clasificacion,
             'total_sin_descuento_clasificacion': total_pedido,  # Para mostrar en el modal si hay descuento
@@ -735,12 +771,7 @@ def api_checkout_carrito():
         error_msg = f"Error en checkout: {error_str}\n{traceback.format_exc()}"
         print(error_msg)
         
-        # Asegurar que el cursor esté cerrado y se haga rollback
-        try:
-            if 'cursor' in locals():
-                cursor.close()
-        except:
-            pass
+        # pedidoCheckout ya hizo rollback de su transacción; limpiar la conexión
         try:
             mysql.connection.rollback()
         except:
@@ -817,12 +848,19 @@ def login():
         if not username or not password:
             return render_template('login.html', error='Usuario y contraseña son requeridos')
 
+        # Antes de cualquier consulta o hash: límite de intentos por IP y usuario
+        espera = limite_login.permitir(request.remote_addr, username)
+        if espera:
+            respuesta = app.make_response((
+                render_template('login.html', error='Demasiados intentos de inicio de sesión. Espera un momento e intenta de nuevo.'),
+                429
+            ))
+            respuesta.headers['Retry-After'] = str(math.ceil(espera))
+            return respuesta
+
         try:
             # Obtener usuario desde el SP
-            cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-            cur.callproc('sp_usuario_obtener_rol_por_username', [username])
-            resultado = cur.fetchall()
-            cur.close()
+            resultado = mysql.ejecutar_sp_filas('sp_usuario_obtener_rol_por_username', [username])
 
             if not resultado:
                 return render_template('login.html', error='Usuario no encontrado o sin rol activo')
@@ -830,17 +868,28 @@ def login():
             usuario = resultado[0]
             hash_bd = usuario['contrasena']
 
-            # Verificación Argon2
+            # Verificación Argon2 (en el ejecutor acotado, ver contrasenas.py)
             try:
-                ph.verify(hash_bd, password)
-            except VerifyMismatchError:
-                return render_template('login.html', error='Contraseña incorrecta')
+                if not contrasenas.verificar(hash_bd, password):
+                    return render_template('login.html', error='Contraseña incorrecta')
+            except ContrasenasOcupadasError:
+                return render_template('login.html', error='Hay muchos inicios de sesión en este momento. Intenta de nuevo en unos segundos.'), 503
+
+            # Hash hecho con parámetros anteriores de Argon2: rehacerlo con los vigentes
+            try:
+                hash_nuevo = contrasenas.rehash(hash_bd, password)
+                if hash_nuevo:
+                    mysql.ejecutar_sp('usuarioContrasenaRehash', [usuario['id_usuario'], hash_bd, hash_nuevo])
+                    mysql.connection.commit()
+            except Exception as e:
+                mysql.connection.rollback()
+                print(f"[contrasenas] No se pudo actualizar el hash del usuario {usuario['id_usuario']}: {e}")
 
             # ==============================
             #       CREAR SESIÓN
             # ==============================
             # Guardar carrito antes de limpiar sesión (si existe)
-            carrito_anterior = session.get('carrito', [])
+            carrito_anterior = session.get('carrito_id')
             session.clear()
 
             session['user_id']        = usuario['id_usuario']
@@ -853,9 +902,11 @@ def login():
             session['usuario_id']     = usuario['id_usuario']
             session['roles']          = [usuario['nombre_rol']]
 
-            # Restaurar carrito si existía antes del login
-            if carrito_anterior:
-                session['carrito'] = carrito_anterior
+            # Unir el carrito anónimo con el que el usuario ya tenía (otro dispositivo)
+            try:
+                carrito_servidor.asignar_usuario(carrito_anterior, usuario['id_usuario'])
+            except Exception as e:
+                print(f"[carrito] No se pudo asociar el carrito al usuario: {e}")
 
             session.permanent = True
             flash('Sesión iniciada correctamente', 'info')
@@ -905,17 +956,8 @@ def register():
     """Página de registro de nuevos clientes"""
     if request.method == 'GET':
         try:
-            import MySQLdb.cursors
-            cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-            cursor.callproc('sp_clasificaciones_lista', [])
-            clasificaciones = cursor.fetchall()
-            while cursor.nextset():
-                pass
-            cursor.callproc('sp_generos_lista', [])
-            generos = cursor.fetchall()
-            while cursor.nextset():
-                pass
-            cursor.close()
+            clasificaciones = referencias.obtener('clasificaciones')
+            generos = referencias.obtener('generos')
             return render_template('register.html', clasificaciones=clasificaciones, generos=generos)
         except Exception as e:
             import traceback
@@ -978,10 +1020,7 @@ def admin_pedidos():
         while cursor.nextset():
             pass
         
-        cursor.callproc('ventas_estados_pedidos', [])
-        estados_disponibles = cursor.fetchall()
-        while cursor.nextset():
-            pass
+        estados_disponibles = referencias.obtener('estados_pedidos')
         cursor.close()
         
         return render_template('ventas_pedidos.html', pedidos=pedidos, estados_disponibles=estados_disponibles)
@@ -1040,17 +1079,9 @@ def admin_facturas():
             except ValueError:
                 fecha_fin_date = None
         
-        # Configurar charset en la conexión antes de crear el cursor
-        try:
-            mysql.connection.ping()
-        except:
-            # Si la conexión está cerrada, se reconectará automáticamente al hacer la siguiente query
-            pass
-        
         # Verificar si el stored procedure existe y cuántas facturas hay
         import MySQLdb.cursors
         cursor_check = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor_check.execute("SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci")
         
         cursor_check.execute("""
             SELECT ROUTINE_NAME 
@@ -1077,7 +1108,6 @@ def admin_facturas():
         
         # Crear un cursor nuevo para el stored procedure usando DictCursor
         cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute("SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci")
         
         # Obtener facturas usando SP admin_facturas_lista - SOLO SP, NO SQL EMBEBIDO
         facturas = []
@@ -1119,8 +1149,7 @@ def admin_facturas():
             
             if len(facturas) == 0 and total_facturas and total_facturas.get('total', 0) > 0:
                 print(f"[DEBUG finanzas_facturas] No se obtuvieron facturas del SP pero hay {total_facturas.get('total', 0)} en BD. Usando fallback SQL.")
-                cursor.callproc('sp_facturas_lista_filtrada', [fecha_inicio_date, fecha_fin_date])
-                facturas_fallback = cursor.fetchall()
+                facturas_fallback = mysql.ejecutar_sp_filas('sp_facturas_lista_filtrada', [fecha_inicio_date, fecha_fin_date])
                 for row in facturas_fallback:
                     decoded_row = decode_row(row)
                     if decoded_row:
@@ -1169,7 +1198,6 @@ def admin_facturas():
         
         try:
             cursor = mysql.connection.cursor()
-            cursor.execute("SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci")
             cursor.callproc('admin_facturas_lista', [fecha_inicio_date, fecha_fin_date, busqueda])
             facturas_raw = cursor.fetchall()
             while cursor.nextset():
@@ -1276,28 +1304,10 @@ def admin_empleados():
 def admin_empleados_crear():
     """Página para crear nuevo empleado"""
     try:
-        import MySQLdb.cursors
-        cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        
-        # Obtener roles usando SP
-        cursor.callproc('sp_roles_empleados', [])
-        roles = cursor.fetchall()
-        while cursor.nextset():
-            pass
-        
-        # Obtener sucursales activas usando SP
-        cursor.callproc('sp_sucursales_activas', [])
-        sucursales = cursor.fetchall()
-        while cursor.nextset():
-            pass
-        
-        # Obtener géneros usando SP
-        cursor.callproc('sp_generos_lista', [])
-        generos = cursor.fetchall()
-        while cursor.nextset():
-            pass
-        
-        cursor.close()
+        # Roles, sucursales activas y géneros desde el cache de referencia
+        roles = referencias.obtener('roles_empleados')
+        sucursales = referencias.obtener('sucursales_activas')
+        generos = referencias.obtener('generos')
         
         user = {
             "full_name": session.get("full_name", "Admin"),
@@ -1317,10 +1327,8 @@ def api_admin_empleados_crear():
     """Endpoint para crear empleado y asociarlo a sucursal"""
     try:
         import MySQLdb.cursors
-        from argon2 import PasswordHasher
         
         data = request.get_json()
-        ph = PasswordHasher()
         
         # Validar datos requeridos
         nombre_usuario = data.get('nombre_usuario', '').strip()
@@ -1343,7 +1351,10 @@ def api_admin_empleados_crear():
             }), 400
         
         # Hash de la contraseña
-        contrasena_hash = ph.hash(contrasena)
+        try:
+            contrasena_hash = contrasenas.hash(contrasena)
+        except ContrasenasOcupadasError:
+            return _respuesta_contrasenas_ocupadas()
         
         # Obtener id_usuario_rol del admin actual
         user_id = session.get('user_id')
@@ -1448,8 +1459,10 @@ def admin_reportes():
 # ==================== ENDPOINTS API PARA REPORTES AVANZADOS ====================
 
 @app.route('/api/reporte/resumen-ejecutivo')
+@solo_lectura
 @login_requerido
 @requiere_rol('Admin', 'Auditor')
+@condicional('ventas', 'inventario', 'devoluciones')
 def api_resumen_ejecutivo():
     """Endpoint para obtener resumen ejecutivo con KPIs - Todos los datos si no hay filtros"""
     try:
@@ -1521,6 +1534,7 @@ def api_resumen_ejecutivo():
             'tasa_devolucion': tasa_devolucion
         })
     except Exception as e:
+        condicional.sin_validadores()
         import traceback
         error_msg = f"Error en api_resumen_ejecutivo: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
@@ -1535,8 +1549,10 @@ def api_resumen_ejecutivo():
         }), 200  # Devolver 200 para que el frontend pueda procesarlo
 
 @app.route('/api/reporte/ventas-mes')
+@solo_lectura
 @login_requerido
 @requiere_rol('Admin', 'Auditor')
+@condicional('ventas')
 def api_ventas_mes():
     """Endpoint para obtener ventas agrupadas por año - Últimos 5 años"""
     try:
@@ -1582,6 +1598,7 @@ def api_ventas_mes():
         
         return jsonify(ventas_anio)
     except Exception as e:
+        condicional.sin_validadores()
         import traceback
         error_msg = f"Error en api_ventas_mes: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
@@ -1589,8 +1606,10 @@ def api_ventas_mes():
         return jsonify([])
 
 @app.route('/api/reporte/clientes-frecuentes')
+@solo_lectura
 @login_requerido
 @requiere_rol('Admin', 'Auditor')
+@condicional('ventas')
 def api_clientes_frecuentes():
     """Endpoint para obtener clientes más frecuentes - Todos los datos si no hay filtros"""
     try:
@@ -1644,8 +1663,10 @@ def api_clientes_frecuentes():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/reporte/clientes-vip')
+@solo_lectura
 @login_requerido
 @requiere_rol('Admin', 'Auditor')
+@condicional('ventas')
 def api_clientes_vip():
     """Endpoint para obtener clientes VIP (mayor gasto) - Todos los datos si no hay filtros"""
     try:
@@ -1675,12 +1696,7 @@ def api_clientes_vip():
             else:
                 fecha_desde = date(2000, 1, 1)
         
-        cursor = mysql.connection.cursor()
-        
-        cursor.callproc('sp_top_clientes_gasto', [fecha_desde, fecha_hasta, limite])
-        
-        resultados = cursor.fetchall()
-        cursor.close()
+        resultados = mysql.ejecutar_sp_filas('sp_top_clientes_gasto', [fecha_desde, fecha_hasta, limite])
         
         clientes = []
         for row in resultados:
@@ -1698,8 +1714,10 @@ def api_clientes_vip():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/reporte/devoluciones-analisis')
+@solo_lectura
 @login_requerido
 @requiere_rol('Admin', 'Auditor')
+@condicional('ventas', 'devoluciones')
 def api_devoluciones_analisis():
     """Endpoint para análisis de devoluciones - Todos los datos si no hay filtros"""
     try:
@@ -1776,6 +1794,7 @@ def api_devoluciones_analisis():
             } for r in devoluciones_recientes]
         })
     except Exception as e:
+        condicional.sin_validadores()
         import traceback
         error_msg = f"Error en api_devoluciones_analisis: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
@@ -1787,8 +1806,10 @@ def api_devoluciones_analisis():
         }), 200  # Devolver 200 para que el frontend pueda procesarlo
 
 @app.route('/api/reporte/inventario-bajo-stock')
+@solo_lectura
 @login_requerido
 @requiere_rol('Admin', 'Auditor')
+@condicional('catalogo', 'inventario')
 def api_inventario_bajo_stock():
     """Endpoint para obtener productos con bajo stock"""
     try:
@@ -1834,14 +1855,17 @@ def api_inventario_bajo_stock():
         print(f"Inventario bajo stock - {len(productos)} productos encontrados (usando consulta directa)")
         return jsonify(productos)
     except Exception as e:
+        condicional.sin_validadores()
         import traceback
         error_msg = f"Error en api_inventario_bajo_stock: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
         return jsonify([])  # Devolver array vacío en caso de error
 
 @app.route('/api/reporte/productos-rentables')
+@solo_lectura
 @login_requerido
 @requiere_rol('Admin', 'Auditor')
+@condicional('catalogo', 'ventas')
 def api_productos_rentables():
     """Endpoint para obtener productos más rentables - Todos los datos si no hay filtros"""
     try:
@@ -1871,12 +1895,7 @@ def api_productos_rentables():
             else:
                 fecha_desde = date(2000, 1, 1)
         
-        cursor = mysql.connection.cursor()
-        
-        cursor.callproc('sp_top_productos_vendidos', [fecha_desde, fecha_hasta, limite])
-        
-        resultados = cursor.fetchall()
-        cursor.close()
+        resultados = mysql.ejecutar_sp_filas('sp_top_productos_vendidos', [fecha_desde, fecha_hasta, limite])
         
         productos = []
         for row in resultados:
@@ -1891,6 +1910,7 @@ def api_productos_rentables():
         print(f"Productos rentables - {len(productos)} productos encontrados")
         return jsonify(productos)
     except Exception as e:
+        condicional.sin_validadores()
         import traceback
         error_msg = f"Error en api_productos_rentables: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
@@ -1973,24 +1993,16 @@ def admin_inventario():
         pass
     cur.close()
 
-    # 2. Obtener sucursales para el filtro
-    cur2 = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur2.callproc('sp_sucursales_activas', [])
-    sucursales = cur2.fetchall()
-    while cur2.nextset():
-        pass
-    cur2.close()
+    # 2. Obtener sucursales para el filtro (cache de referencia)
+    sucursales = referencias.obtener('sucursales_activas')
 
     # 3. Obtener la sucursal del usuario actual (si tiene una asignada)
     sucursal_usuario = None
     id_usuario = session.get('user_id')
     if id_usuario:
-        cur3 = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        cur3.callproc('sp_usuario_sucursal', [id_usuario])
-        resultado_sucursal = cur3.fetchone()
+        resultado_sucursal = mysql.ejecutar_sp_uno('sp_usuario_sucursal', [id_usuario])
         if resultado_sucursal:
             sucursal_usuario = resultado_sucursal['nombre_sucursal']
-        cur3.close()
     
     # Si no tiene sucursal asignada, usar la primera sucursal activa
     if not sucursal_usuario and sucursales:
@@ -2066,15 +2078,8 @@ def admin_sucursales():
 @requiere_rol('Admin')
 def admin_sucursales_crear():
     """Página para crear una nueva sucursal"""
-    import MySQLdb.cursors
-    
-    # Obtener todos los estados
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur.callproc('sp_estados_direcciones_lista', [])
-    estados = cur.fetchall()
-    while cur.nextset():
-        pass
-    cur.close()
+    # Obtener todos los estados (cache de referencia)
+    estados = referencias.obtener('estados_direcciones')
     
     user = {
         "full_name": session.get("full_name", "Admin"),
@@ -2094,13 +2099,8 @@ def admin_sucursales_asignar_producto():
     """Página para asignar un producto a una sucursal"""
     import MySQLdb.cursors
     
-    # Obtener todas las sucursales activas
-    cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur.callproc('sp_sucursales_activas', [])
-    sucursales = cur.fetchall()
-    while cur.nextset():
-        pass
-    cur.close()
+    # Obtener todas las sucursales activas (cache de referencia)
+    sucursales = referencias.obtener('sucursales_activas')
     
     # Obtener todos los productos activos usando SP
     cur2 = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
@@ -2133,11 +2133,7 @@ def api_codigos_postales_por_estado():
         if not id_estado:
             return jsonify({'success': False, 'error': 'ID de estado requerido'}), 400
         
-        cur = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        cur.callproc('sp_codigos_postales_por_estado', [id_estado])
-        
-        codigos_postales = cur.fetchall()
-        cur.close()
+        codigos_postales = mysql.ejecutar_sp_filas('sp_codigos_postales_por_estado', [id_estado])
         
         return jsonify({
             'success': True,
@@ -2204,6 +2200,7 @@ def api_crear_sucursal():
         
         mysql.connection.commit()
         cursor.close()
+        referencias.refrescar('sucursales_activas')
         
         if resultado:
             return jsonify({
@@ -2268,6 +2265,7 @@ def api_cambiar_estado_sucursal():
             pass
         mysql.connection.commit()
         cursor.close()
+        referencias.refrescar('sucursales_activas')
         
         accion = 'activada' if activo_sucursal else 'desactivada'
         return jsonify({
@@ -2352,6 +2350,7 @@ def api_actualizar_sucursal():
         
         mysql.connection.commit()
         cursor.close()
+        referencias.refrescar('sucursales_activas')
         
         if resultado:
             return jsonify({
@@ -2494,12 +2493,8 @@ def ventas_pedidos():
         while cursor.nextset():
             pass
         
-        # Obtener estados disponibles usando SP ventas_estados_pedidos - SOLO SP, NO SQL EMBEBIDO
-        cursor.callproc('ventas_estados_pedidos', [])
-        estados_disponibles = cursor.fetchall()
-        # Consumir todos los resultados del SP
-        while cursor.nextset():
-            pass
+        # Estados disponibles desde el cache de referencia (SP ventas_estados_pedidos)
+        estados_disponibles = referencias.obtener('estados_pedidos')
         cursor.close()
         
         return render_template('ventas_pedidos.html', pedidos=pedidos, estados_disponibles=estados_disponibles)
@@ -2535,15 +2530,8 @@ def ventas_facturas():
             except ValueError:
                 fecha_fin_date = None
 
-        # Asegurar que la conexión siga viva
-        try:
-            mysql.connection.ping(reconnect=True)
-        except:
-            pass
-
         # Crear cursor para el stored procedure
         cursor = mysql.connection.cursor()
-        cursor.execute("SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci")
 
         facturas = []
 
@@ -2625,12 +2613,7 @@ def ventas_facturas():
 def api_metodos_pago():
     """Endpoint para obtener métodos de pago"""
     try:
-        cursor = mysql.connection.cursor()
-        cursor.callproc('sp_metodos_pago_lista', [])
-        metodos = cursor.fetchall()
-        while cursor.nextset():
-            pass
-        cursor.close()
+        metodos = referencias.obtener('metodos_pago')
         return jsonify(metodos)
     except Exception as e:
         import traceback
@@ -2671,11 +2654,8 @@ def ventas_pagos():
         while cursor.nextset():
             pass
         
-        # Obtener métodos de pago
-        cursor.callproc('sp_metodos_pago_lista', [])
-        metodos_pago = cursor.fetchall()
-        while cursor.nextset():
-            pass
+        # Métodos de pago desde el cache de referencia
+        metodos_pago = referencias.obtener('metodos_pago')
         
         cursor.close()
         
@@ -2751,6 +2731,8 @@ def api_registrar_pago():
         }), 500
 
 @app.route('/api/ventas/pedidos/<int:id_pedido>/pagar', methods=['POST'])
+@login_requerido
+@idempotente('pagar_pedido')
 def api_pagar_pedido(id_pedido):
     """Endpoint para registrar pago inmediato después de crear pedido usando SOLO SP pagoRegistrar"""
     try:
@@ -2913,39 +2895,56 @@ def api_pagar_pedido(id_pedido):
 @app.route('/ventas/catalogo')
 @login_requerido
 @requiere_rol('Vendedor')
+@condicional('catalogo')
 def ventas_catalogo():
     """Catálogo de productos para ventas"""
     categoria_seleccionada = request.args.get('categoria', '')
     
     try:
-        # Cursor normal para stored procedures
-        cursor_cat = mysql.connection.cursor()
-        
-        # Obtener categorías activas usando SP categoriasActivas - SOLO SP, NO SQL EMBEBIDO
-        cursor_cat.callproc('categoriasActivas', [])
-        categorias = cursor_cat.fetchall()
-        while cursor_cat.nextset():
-            pass
-        cursor_cat.close()
-        
-        # Cursor con DictCursor para consultas SQL directas (permite acceso por nombre)
-        cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        
-        # Obtener productos con información completa para ventas usando SP
-        categoria_param = categoria_seleccionada if categoria_seleccionada else None
-        cursor.callproc('sp_productos_catalogo_ventas', [categoria_param])
-        productos = cursor.fetchall()
-        while cursor.nextset():
-            pass
-        
-        cursor.close()
+        # Categorías activas desde el cache de referencia (SP categoriasActivas)
+        categorias = referencias.obtener('categorias')
+        
+        # Primera página (SP sp_productos_catalogo_ventas_pagina); el resto lo pide
+        # ventas_catalogo.js a /api/ventas/catalogo
+        limite = app.config['CATALOGO_PAGINA_TAMANO']
+        filas = mysql.ejecutar_sp_filas('sp_productos_catalogo_ventas_pagina',
+                                        [categoria_seleccionada or None, None, None, limite + 1])
+        productos, siguiente = _cortar_pagina_catalogo(filas, limite)
     except Exception as e:
+        condicional.sin_validadores()
         import traceback
         print(f"Error cargando catálogo ventas: {str(e)}\n{traceback.format_exc()}")
         productos = []
         categorias = []
+        siguiente = None
     
-    return render_template('ventas_catalogo.html', productos=productos, categorias=categorias, categoria_seleccionada=categoria_seleccionada)
+    return render_template('ventas_catalogo.html', productos=productos, categorias=categorias,
+                           categoria_seleccionada=categoria_seleccionada, siguiente=siguiente)
+
+@app.route('/api/ventas/catalogo')
+@login_requerido
+@requiere_rol('Vendedor')
+@condicional('catalogo')
+def api_ventas_catalogo():
+    """Página del catálogo de ventas: ?categoria=&despues=<cursor>&limite= (SP sp_productos_catalogo_ventas_pagina)"""
+    categoria = request.args.get('categoria', '')
+    try:
+        despues_nombre, despues_id = _leer_cursor_catalogo(request.args.get('despues'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limite = _limite_pagina_catalogo(request.args.get('limite'))
+    
+    try:
+        filas = mysql.ejecutar_sp_filas('sp_productos_catalogo_ventas_pagina',
+                                        [categoria or None, despues_nombre, despues_id, limite + 1])
+        productos, siguiente = _cortar_pagina_catalogo(filas, limite)
+        return jsonify({
+            'productos': [_producto_catalogo_json(p) for p in productos],
+            'siguiente': siguiente
+        })
+    except Exception as e:
+        print(f"Error obteniendo página del catálogo de ventas: {str(e)}\n{traceback.format_exc()}")
+        return jsonify({'error': 'Error al obtener productos'}), 500
 
 @app.route('/ventas/devoluciones')
 @login_requerido
@@ -3017,11 +3016,13 @@ def api_obtener_productos_pedido(id_pedido):
     """Obtener productos de un pedido para devolución"""
     try:
         cursor = mysql.connection.cursor()
+        # Un producto surtido de varias sucursales tiene un renglón por
+        # sucursal: se devuelve por producto y devolucionCrear reparte
         cursor.execute("""
             SELECT 
-                pd.id_pedido_detalle,
+                MIN(pd.id_pedido_detalle) AS id_pedido_detalle,
                 pd.id_producto,
-                pd.cantidad_producto,
+                CAST(SUM(pd.cantidad_producto) AS SIGNED) AS cantidad_producto,
                 m.nombre_producto,
                 p.precio_unitario,
                 s.sku
@@ -3030,6 +3031,8 @@ def api_obtener_productos_pedido(id_pedido):
             JOIN Modelos m ON p.id_modelo = m.id_modelo
             JOIN Sku s ON p.id_sku = s.id_sku
             WHERE pd.id_pedido = %s
+            GROUP BY pd.id_producto, m.nombre_producto, p.precio_unitario, s.sku
+            ORDER BY MIN(pd.id_pedido_detalle)
         """, (id_pedido,))
         productos = cursor.fetchall()
         cursor.close()
@@ -3100,21 +3103,8 @@ def api_crear_devolucion():
         except Exception as e:
             print(f"Error leyendo resultado del SP: {e}")
         
-        # Cerrar cursor antes de abrir otro
         cursor.close()
         
-        # Si no se pudo obtener del resultado, obtener el último ID insertado
-        if not id_devolucion or id_devolucion == 0:
-            print("No se pudo obtener ID del SP, consultando MAX(id_devolucion)...")
-            cursor2 = mysql.connection.cursor()
-            cursor2.callproc('sp_devolucion_max_id', [])
-            resultado_max = cursor2.fetchone()
-            while cursor2.nextset():
-                pass
-            id_devolucion = resultado_max.get('id_devolucion', 0) if resultado_max else 0
-            cursor2.close()
-            print(f"ID obtenido de MAX: {id_devolucion}")
-        
         return jsonify({
             'success': True,
             'mensaje': 'Devolución creada exitosamente',
@@ -3233,6 +3223,8 @@ def ventas_crear_pedido():
     )
 
 @app.route('/api/ventas/pedidos/crear', methods=['POST'])
+@login_requerido
+@idempotente('crear_pedido')
 def api_crear_pedido():
     """
     Endpoint para crear pedido usando SP pedidoCrear.
@@ -3338,8 +3330,9 @@ def api_crear_pedido():
 
         # Ejecutar SP
         try:
-            cur.callproc('pedidoCrear', [id_tmp_pedido])
-            # Consumir todos los resultados del SP (si los hay)
+            # pedidoCrear devuelve el id del pedido que creó
+            cur.callproc('pedidoCrear', [id_tmp_pedido, app.config['SURTIDO_POLITICA']])
+            res = cur.fetchone()
             while cur.nextset():
                 pass
         except Exception as sp_error:
@@ -3349,11 +3342,6 @@ def api_crear_pedido():
             cur.close()
             raise sp_error
 
-        # Obtener pedido creado usando SP
-        cur.callproc('sp_pedido_max_id', [])
-        res = cur.fetchone()
-        while cur.nextset():
-            pass
         id_pedido = res.get('id_pedido', 0) if res else 0
         
         # Obtener factura si existe usando SP
@@ -3455,13 +3443,8 @@ def inventario_inventario():
         pass
     cur.close()
 
-    # 2. Obtener sucursales para el filtro usando SP
-    cur2 = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cur2.callproc('sp_sucursales_activas', [])
-    sucursales = cur2.fetchall()
-    while cur2.nextset():
-        pass
-    cur2.close()
+    # 2. Obtener sucursales para el filtro (cache de referencia)
+    sucursales = referencias.obtener('sucursales_activas')
 
     # 3. Obtener la sucursal del usuario actual usando SP
     # Para Gestor de Sucursal, obtener específicamente la sucursal de ese rol
@@ -3478,8 +3461,7 @@ def inventario_inventario():
             sucursal_usuario = resultado_sucursal['nombre_sucursal']
         else:
             # Si no tiene sucursal como Gestor de Sucursal, buscar cualquier sucursal asignada
-            cur3.callproc('sp_usuario_sucursal', [id_usuario])
-            resultado_sucursal = cur3.fetchone()
+            resultado_sucursal = mysql.ejecutar_sp_uno('sp_usuario_sucursal', [id_usuario])
             if resultado_sucursal:
                 sucursal_usuario = resultado_sucursal['nombre_sucursal']
         cur3.close()
@@ -3699,11 +3681,13 @@ def api_inventario_obtener_productos_pedido(id_pedido):
     """Obtener productos de un pedido para devolución - inventario (misma funcionalidad que ventas)"""
     try:
         cursor = mysql.connection.cursor()
+        # Un producto surtido de varias sucursales tiene un renglón por
+        # sucursal: se devuelve por producto y devolucionCrear reparte
         cursor.execute("""
             SELECT 
-                pd.id_pedido_detalle,
+                MIN(pd.id_pedido_detalle) AS id_pedido_detalle,
                 pd.id_producto,
-                pd.cantidad_producto,
+                CAST(SUM(pd.cantidad_producto) AS SIGNED) AS cantidad_producto,
                 m.nombre_producto,
                 p.precio_unitario,
                 s.sku
@@ -3712,6 +3696,8 @@ def api_inventario_obtener_productos_pedido(id_pedido):
             JOIN Modelos m ON p.id_modelo = m.id_modelo
             JOIN Sku s ON p.id_sku = s.id_sku
             WHERE pd.id_pedido = %s
+            GROUP BY pd.id_producto, m.nombre_producto, p.precio_unitario, s.sku
+            ORDER BY MIN(pd.id_pedido_detalle)
         """, (id_pedido,))
         productos = cursor.fetchall()
         cursor.close()
@@ -3794,19 +3780,6 @@ def api_inventario_crear_devolucion():
                 except:
                     pass
             
-            # Si no se pudo obtener del resultado, obtener el último ID insertado
-            # PERO primero debemos asegurarnos de que todos los result sets estén consumidos
-            if not id_devolucion or id_devolucion == 0:
-                # Crear un nuevo cursor para evitar problemas de sincronización
-                cursor.close()
-                cursor2 = mysql.connection.cursor()
-                cursor2.callproc('sp_devolucion_max_id', [])
-                resultado_max = cursor2.fetchone()
-                while cursor2.nextset():
-                    pass
-                id_devolucion = resultado_max.get('id_devolucion', 0) if resultado_max else 0
-                cursor2.close()
-            
             # Asegurar que el commit se refleje
             mysql.connection.commit()
             
@@ -4114,11 +4087,8 @@ def finanzas_pagos():
         """)
         pagos_pendientes = cursor.fetchall()
         
-        # Obtener métodos de pago usando SP
-        cursor.callproc('sp_metodos_pago_lista_nombre', [])
-        metodos_pago = cursor.fetchall()
-        while cursor.nextset():
-            pass
+        # Métodos de pago desde el cache de referencia
+        metodos_pago = referencias.obtener('metodos_pago_nombre')
         
         cursor.close()
         
@@ -4184,17 +4154,9 @@ def finanzas_facturas():
             except ValueError:
                 fecha_fin_date = None
         
-        # Configurar charset en la conexión antes de crear el cursor
-        try:
-            mysql.connection.ping()
-        except:
-            # Si la conexión está cerrada, se reconectará automáticamente al hacer la siguiente query
-            pass
-        
         # Verificar si el stored procedure existe y cuántas facturas hay
         import MySQLdb.cursors
         cursor_check = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor_check.execute("SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci")
         
         cursor_check.execute("""
             SELECT ROUTINE_NAME 
@@ -4221,7 +4183,6 @@ def finanzas_facturas():
         
         # Crear un cursor nuevo para el stored procedure usando DictCursor
         cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute("SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci")
         
         # Obtener facturas usando SP admin_facturas_lista - SOLO SP, NO SQL EMBEBIDO
         facturas = []
@@ -4260,7 +4221,6 @@ def finanzas_facturas():
             if len(facturas) == 0 and total_facturas and total_facturas.get('total', 0) > 0:
                 # Usar DictCursor para la consulta fallback también
                 cursor_fallback = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-                cursor_fallback.execute("SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci")
                 cursor_fallback.execute("""
                     SELECT 
                         f.id_factura,
@@ -4365,7 +4325,6 @@ def finanzas_facturas():
         
         try:
             cursor = mysql.connection.cursor()
-            cursor.execute("SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci")
             cursor.callproc('admin_facturas_lista', [fecha_inicio_date, fecha_fin_date, busqueda])
             facturas_raw = cursor.fetchall()
             while cursor.nextset():
@@ -4425,8 +4384,10 @@ def finanzas_reportes():
 # ========== API ENDPOINTS PARA REPORTES FINANCIEROS ==========
 
 @app.route('/api/finanzas/reporte/resumen')
+@solo_lectura
 @login_requerido
 @requiere_rol('Analista Financiero')
+@condicional('ventas')
 def api_finanzas_resumen():
     """Resumen financiero: ingresos totales, facturas, pagadas, pendiente"""
     try:
@@ -4484,6 +4445,7 @@ def api_finanzas_resumen():
         print(f"[DEBUG finanzas_resumen] Resultado final: {resultado}")
         return jsonify(resultado)
     except Exception as e:
+        condicional.sin_validadores()
         import traceback
         error_msg = f"Error en resumen financiero: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
@@ -4495,8 +4457,10 @@ def api_finanzas_resumen():
         }), 200
 
 @app.route('/api/finanzas/reporte/facturacion-anio')
+@solo_lectura
 @login_requerido
 @requiere_rol('Analista Financiero')
+@condicional('ventas')
 def api_finanzas_facturacion_anio():
     """Facturación agrupada por año (últimos 5 años)"""
     try:
@@ -4538,13 +4502,16 @@ def api_finanzas_facturacion_anio():
         
         return jsonify(data)
     except Exception as e:
+        condicional.sin_validadores()
         import traceback
         print(f"Error en facturación por año: {str(e)}\n{traceback.format_exc()}")
         return jsonify([]), 200
 
 @app.route('/api/finanzas/reporte/estado-pagos')
+@solo_lectura
 @login_requerido
 @requiere_rol('Analista Financiero')
+@condicional('ventas')
 def api_finanzas_estado_pagos():
     """Distribución de facturas por estado de pago"""
     try:
@@ -4579,13 +4546,16 @@ def api_finanzas_estado_pagos():
         
         return jsonify(data)
     except Exception as e:
+        condicional.sin_validadores()
         import traceback
         print(f"Error en estado de pagos: {str(e)}\n{traceback.format_exc()}")
         return jsonify([]), 200
 
 @app.route('/api/finanzas/reporte/pagos-metodo')
+@solo_lectura
 @login_requerido
 @requiere_rol('Analista Financiero')
+@condicional('ventas')
 def api_finanzas_pagos_metodo():
     """Pagos agrupados por método de pago"""
     try:
@@ -4608,13 +4578,16 @@ def api_finanzas_pagos_metodo():
         
         return jsonify(data)
     except Exception as e:
+        condicional.sin_validadores()
         import traceback
         print(f"Error en pagos por método: {str(e)}\n{traceback.format_exc()}")
         return jsonify([]), 200
 
 @app.route('/api/finanzas/reporte/top-clientes')
+@solo_lectura
 @login_requerido
 @requiere_rol('Analista Financiero')
+@condicional('ventas')
 def api_finanzas_top_clientes():
     """Top 10 clientes por facturación total"""
     try:
@@ -4648,13 +4621,16 @@ def api_finanzas_top_clientes():
         
         return jsonify(data)
     except Exception as e:
+        condicional.sin_validadores()
         import traceback
         print(f"Error en top clientes: {str(e)}\n{traceback.format_exc()}")
         return jsonify([]), 200
 
 @app.route('/api/finanzas/reporte/facturacion-mensual')
+@solo_lectura
 @login_requerido
 @requiere_rol('Analista Financiero')
+@condicional('ventas')
 def api_finanzas_facturacion_mensual():
     """Facturación mensual de los últimos 12 meses"""
     try:
@@ -4678,6 +4654,7 @@ def api_finanzas_facturacion_mensual():
         
         return jsonify(data)
     except Exception as e:
+        condicional.sin_validadores()
         import traceback
         print(f"Error en facturación mensual: {str(e)}\n{traceback.format_exc()}")
         return jsonify([]), 200
@@ -4739,15 +4716,8 @@ def auditor_facturas():
             except ValueError:
                 fecha_fin_date = None
         
-        # Configurar charset en la conexión antes de crear el cursor
-        try:
-            mysql.connection.ping()
-        except:
-            pass
-        
         # Crear cursor para el stored procedure
         cursor = mysql.connection.cursor()
-        cursor.execute("SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci")
         
         # Obtener facturas usando SP admin_facturas_lista - SOLO SP, NO SQL EMBEBIDO
         facturas = []
@@ -4821,19 +4791,12 @@ def auditor_reportes():
 # ==================== ENDPOINTS API PARA CATEGORÍAS ====================
 
 @app.route('/api/categorias/activas')
+@condicional('catalogo')
 def api_categorias_activas():
     """Endpoint para obtener categorías activas usando SP categoriasActivas - SOLO SP, NO SQL EMBEBIDO"""
     try:
-        cursor = mysql.connection.cursor()
-        
-        # Obtener todas las categorías activas usando SP categoriasActivas - SOLO SP, NO SQL EMBEBIDO
-        cursor.callproc('categoriasActivas', [])
-        categorias = cursor.fetchall()
-        # Consumir todos los resultados del SP
-        while cursor.nextset():
-            pass
-        
-        cursor.close()
+        # Categorías activas desde el cache de referencia (SP categoriasActivas)
+        categorias = referencias.obtener('categorias')
         
         # Retornar directamente los resultados del SP (PyMySQL ya maneja la codificación)
         return jsonify(categorias)
@@ -4845,9 +4808,9 @@ def api_categorias_activas():
 
 # ==================== ENDPOINTS API PARA REPORTES (JSON) ====================
 
-@app.route('/api/reporte/top-productos')
-def api_top_productos():
-    """Endpoint para obtener top productos - invoca SP sp_top_productos"""
+@dashboards.widget('admin', 'top_productos')
+def _dashboard_admin_top_productos():
+    """(datos, estado) del widget; lo sirven api_top_productos y /api/dashboard/admin"""
     try:
         formato = '%Y-%m-%d'
         hoy = date.today()
@@ -4897,15 +4860,23 @@ def api_top_productos():
                 'nombre': nombre,
                 'cantidad_vendida': int(cantidad) if cantidad else 0
             })
-        return jsonify(productos)
+        return productos, 200
     except Exception as e:
         import traceback
         print(f"Error en api_top_productos: {str(e)}\n{traceback.format_exc()}")
-        return jsonify({'error': str(e), 'message': 'Error al obtener top productos'}), 500
+        return {'error': str(e), 'message': 'Error al obtener top productos'}, 500
 
-@app.route('/api/reporte/facturacion-diaria')
-def api_facturacion_diaria():
-    """Endpoint para facturación diaria - usa VIEW vfacturaciondiaria (más eficiente que SP)"""
+@app.route('/api/reporte/top-productos')
+@solo_lectura
+@condicional('catalogo', 'ventas')
+def api_top_productos():
+    """Endpoint para obtener top productos - invoca SP sp_top_productos"""
+    datos, estado = _dashboard_admin_top_productos()
+    return jsonify(datos), estado
+
+@dashboards.widget('admin', 'facturacion_diaria')
+def _dashboard_admin_facturacion_diaria():
+    """(datos, estado) del widget; lo sirven api_facturacion_diaria y /api/dashboard/admin"""
     try:
         from datetime import datetime, timedelta
         
@@ -4947,16 +4918,24 @@ def api_facturacion_diaria():
                 'numero_facturas': int(row.get('Numero_Facturas', 0) or 0)
             })
         
-        return jsonify(facturacion)
+        return facturacion, 200
     except Exception as e:
         import traceback
         error_msg = f"Error en api_facturacion_diaria: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
-        return jsonify({'error': str(e), 'message': 'Error al obtener facturación diaria'}), 500
+        return {'error': str(e), 'message': 'Error al obtener facturación diaria'}, 500
 
-@app.route('/api/reporte/margen-categoria')
-def api_margen_categoria():
-    """Endpoint para margen por categoría - usa View vmargenporcategoria"""
+@app.route('/api/reporte/facturacion-diaria')
+@solo_lectura
+@condicional('ventas')
+def api_facturacion_diaria():
+    """Endpoint para facturación diaria - usa VIEW vfacturaciondiaria (más eficiente que SP)"""
+    datos, estado = _dashboard_admin_facturacion_diaria()
+    return jsonify(datos), estado
+
+@dashboards.widget('admin', 'margen_categoria')
+def _dashboard_admin_margen_categoria():
+    """(datos, estado) del widget; lo sirven api_margen_categoria y /api/dashboard/admin"""
     try:
         cursor = mysql.connection.cursor()
         cursor.callproc('sp_margen_por_categoria', [])
@@ -4977,14 +4956,22 @@ def api_margen_categoria():
                 'margen_porcentaje': float(row.get('Margen_Porcentaje', 0) or 0)
             })
         
-        return jsonify(categorias)
+        return categorias, 200
     except Exception as e:
         print(f"Error en api_margen_categoria: {e}")
-        return jsonify([]), 500
+        return [], 500
 
-@app.route('/api/reporte/kpis')
-def api_kpis():
-    """Endpoint para KPIs del dashboard usando views disponibles donde sea posible"""
+@app.route('/api/reporte/margen-categoria')
+@solo_lectura
+@condicional('catalogo', 'ventas')
+def api_margen_categoria():
+    """Endpoint para margen por categoría - usa View vmargenporcategoria"""
+    datos, estado = _dashboard_admin_margen_categoria()
+    return jsonify(datos), estado
+
+@dashboards.widget('admin', 'kpis')
+def _dashboard_admin_kpis():
+    """(datos, estado) del widget; lo sirven api_kpis y /api/dashboard/admin"""
     try:
         cursor = mysql.connection.cursor()
         
@@ -5047,7 +5034,7 @@ def api_kpis():
         
         cursor.close()
         
-        return jsonify({
+        return {
             'total_ventas': total_ventas,
             'total_productos': total_productos,
             'total_productos_stock': total_productos,  # Alias para compatibilidad
@@ -5057,12 +5044,12 @@ def api_kpis():
             'stock_trend': stock_trend,
             'total_pedidos': total_pedidos,
             'total_clientes': total_clientes
-        })
+        }, 200
     except Exception as e:
         import traceback
         error_msg = f"Error en api_kpis: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
-        return jsonify({
+        return {
             'total_ventas': 0,
             'total_productos': 0,
             'total_productos_stock': 0,
@@ -5073,7 +5060,15 @@ def api_kpis():
             'total_pedidos': 0,
             'total_clientes': 0,
             'error': str(e)
-        }), 500
+        }, 500
+
+@app.route('/api/reporte/kpis')
+@solo_lectura
+@condicional('ventas', 'inventario', 'devoluciones')
+def api_kpis():
+    """Endpoint para KPIs del dashboard usando views disponibles donde sea posible"""
+    datos, estado = _dashboard_admin_kpis()
+    return jsonify(datos), estado
 
 # ==================== ENDPOINTS API PARA PANEL DE VENTAS ====================
 
@@ -5265,19 +5260,10 @@ def api_ventas_por_categoria():
 def api_estados_disponibles_pedido(id_pedido):
     """Endpoint para obtener los estados disponibles según el estado actual del pedido"""
     try:
-        cursor = mysql.connection.cursor()
-
         # Obtener el estado actual del pedido
-        cursor.callproc('sp_pedido_estado_obtener', [id_pedido])
-
-        # Leer resultado del SELECT
-        pedido = None
-        for result in cursor.stored_results():
-            pedido = result.fetchone()
-            break  # Solo necesitamos la primera fila
+        pedido = mysql.ejecutar_sp_uno('sp_pedido_estado_obtener', [id_pedido])
 
         if not pedido:
-            cursor.close()
             return jsonify({'error': 'Pedido no encontrado'}), 404
 
         estado_actual = pedido.get('estado_pedido') if hasattr(pedido, 'get') else pedido[0]
@@ -5300,8 +5286,6 @@ def api_estados_disponibles_pedido(id_pedido):
             # Estados finales, no se pueden cambiar
             estados_disponibles = []
 
-        cursor.close()
-
         return jsonify({
             'estado_actual': estado_actual,
             'estados_disponibles': estados_disponibles
@@ -5652,17 +5636,14 @@ def api_ventas_semanal():
 
 # ==================== ENDPOINTS API PARA PANEL DE INVENTARIO ====================
 
-@app.route('/api/inventario/kpis')
-def api_inventario_kpis():
-    """Endpoint para KPIs del panel de inventario usando views y tablas"""
+@dashboards.widget('inventario', 'kpis')
+def _dashboard_inventario_kpis():
+    """(datos, estado) del widget; lo sirven api_inventario_kpis y /api/dashboard/inventario"""
     try:
         cursor = mysql.connection.cursor()
         
-        # 1. Productos en Stock usando SP
-        cursor.callproc('sp_total_stock', [])
-        stock_result = cursor.fetchone()
-        while cursor.nextset():
-            pass
+        # 1. Productos en Stock usando SP (compartido con estado-stock en /api/dashboard/inventario)
+        stock_result = dashboards.sp_uno('sp_total_stock')
         productos_stock = int(stock_result.get('total_stock', 0) or 0) if stock_result else 0
         
         # Stock ayer (para trend) - aproximación usando mismo valor por ahora
@@ -5671,12 +5652,7 @@ def api_inventario_kpis():
         
         # 2. Stock Bajo - usando SP VistaInventarioBajoCount - SOLO SP, NO SQL EMBEBIDO
         try:
-            cursor.callproc('VistaInventarioBajoCount', [])
-            # Obtener el resultado del SP
-            stock_bajo_result = cursor.fetchone()
-            # Consumir todos los resultados del SP
-            while cursor.nextset():
-                pass
+            stock_bajo_result = dashboards.sp_uno('VistaInventarioBajoCount')
             
             if stock_bajo_result and hasattr(stock_bajo_result, 'keys'):
                 pass
@@ -5735,7 +5711,7 @@ def api_inventario_kpis():
         
         cursor.close()
         
-        return jsonify({
+        return {
             'productos_stock': productos_stock,
             'stock_trend': stock_trend,
             'stock_bajo': stock_bajo,
@@ -5744,12 +5720,12 @@ def api_inventario_kpis():
             'valor_trend': valor_trend,
             'rotacion_promedio': round(rotacion, 1),
             'rotacion_trend': rotacion_trend
-        })
+        }, 200
     except Exception as e:
         import traceback
         error_msg = f"Error en api_inventario_kpis: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
-        return jsonify({
+        return {
             'productos_stock': 0,
             'stock_trend': 0,
             'stock_bajo': 0,
@@ -5758,7 +5734,13 @@ def api_inventario_kpis():
             'valor_trend': 0,
             'rotacion_promedio': 0,
             'rotacion_trend': 0
-        }), 500
+        }, 500
+
+@app.route('/api/inventario/kpis')
+def api_inventario_kpis():
+    """Endpoint para KPIs del panel de inventario usando views y tablas"""
+    datos, estado = _dashboard_inventario_kpis()
+    return jsonify(datos), estado
 
 @app.route('/api/inventario/por-categoria')
 def api_inventario_por_categoria():
@@ -5828,8 +5810,10 @@ def obtener_sucursal_usuario(id_usuario):
     return id_sucursal
 
 @app.route('/api/gestor/resumen-sucursal')
+@solo_lectura
 @login_requerido
 @requiere_rol('Inventarios', 'Gestor de Sucursal')
+@condicional('ventas', 'inventario', 'devoluciones')
 def api_gestor_resumen_sucursal():
     """Endpoint para obtener resumen ejecutivo de la sucursal del gestor"""
     try:
@@ -5901,8 +5885,10 @@ def api_gestor_resumen_sucursal():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/gestor/top-productos')
+@solo_lectura
 @login_requerido
 @requiere_rol('Inventarios', 'Gestor de Sucursal')
+@condicional('catalogo', 'ventas')
 def api_gestor_top_productos():
     """Endpoint para obtener top productos de la sucursal"""
     try:
@@ -5950,8 +5936,10 @@ def api_gestor_top_productos():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/gestor/inventario')
+@solo_lectura
 @login_requerido
 @requiere_rol('Inventarios', 'Gestor de Sucursal')
+@condicional('catalogo', 'inventario')
 def api_gestor_inventario():
     """Endpoint para obtener inventario de la sucursal"""
     try:
@@ -5977,8 +5965,10 @@ def api_gestor_inventario():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/gestor/stock-bajo')
+@solo_lectura
 @login_requerido
 @requiere_rol('Inventarios', 'Gestor de Sucursal')
+@condicional('catalogo', 'inventario')
 def api_gestor_stock_bajo():
     """Endpoint para obtener productos con stock bajo de la sucursal"""
     try:
@@ -6004,8 +5994,10 @@ def api_gestor_stock_bajo():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/gestor/kpis-inventario')
+@solo_lectura
 @login_requerido
 @requiere_rol('Inventarios', 'Gestor de Sucursal')
+@condicional('catalogo', 'inventario')
 def api_gestor_kpis_inventario():
     """Endpoint para obtener KPIs de inventario de la sucursal"""
     try:
@@ -6036,67 +6028,25 @@ def api_gestor_kpis_inventario():
         print(f"Error en api_gestor_kpis_inventario: {str(e)}\n{traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/inventario/estado-stock')
-def api_inventario_estado_stock():
-    """Endpoint para distribución de estado de stock usando view vinventariobajo"""
+@dashboards.widget('inventario', 'estado_stock')
+def _dashboard_inventario_estado_stock():
+    """(datos, estado) del widget; lo sirven api_inventario_estado_stock y /api/dashboard/inventario"""
     try:
-        cursor = mysql.connection.cursor()
-        
         # Obtener estado de stock usando SP VistaEstadoStock - SOLO SP, NO SQL EMBEBIDO
-        # El SP devuelve 3 result sets: normal, bajo, critico
-        cursor.callproc('VistaEstadoStock', [])
-        
-        # Primer result set: Stock bajo
-        bajo_result = cursor.fetchone()
-        # Debug: imprimir el resultado crudo
-        print(f"[DEBUG] Resultado crudo del primer result set: {bajo_result}")
-        if bajo_result:
-            # Intentar obtener el valor de diferentes formas
-            if isinstance(bajo_result, dict):
-                stock_bajo = int(bajo_result.get('bajo', 0) or 0)
-            elif isinstance(bajo_result, (tuple, list)):
-                stock_bajo = int(bajo_result[0] or 0) if len(bajo_result) > 0 else 0
-            else:
-                stock_bajo = int(bajo_result or 0)
-        else:
-            stock_bajo = 0
-        
-        # Segundo result set: Stock normal
-        cursor.nextset()
-        normal_result = cursor.fetchone()
-        # Debug: imprimir el resultado crudo
-        print(f"[DEBUG] Resultado crudo del segundo result set: {normal_result}")
-        if normal_result:
-            if isinstance(normal_result, dict):
-                stock_normal = int(normal_result.get('normal', 0) or 0)
-            elif isinstance(normal_result, (tuple, list)):
-                stock_normal = int(normal_result[0] or 0) if len(normal_result) > 0 else 0
-            else:
-                stock_normal = int(normal_result or 0)
-        else:
-            stock_normal = 0
-        
-        # Consumir todos los resultados restantes del SP
-        while cursor.nextset():
-            pass
+        # El SP devuelve 2 result sets en una sola llamada: bajo, normal
+        resultados = mysql.ejecutar_sp('VistaEstadoStock', [])
+        bajo_result = resultados[0][0] if len(resultados) > 0 and resultados[0] else None
+        normal_result = resultados[1][0] if len(resultados) > 1 and resultados[1] else None
+        stock_bajo = int(bajo_result.get('bajo', 0) or 0) if bajo_result else 0
+        stock_normal = int(normal_result.get('normal', 0) or 0) if normal_result else 0
         
         # Validación: verificar que normal + bajo = total (para debugging)
-        # Obtener total para validar
-        cursor.close()
-        cursor = mysql.connection.cursor()
-        
         # Obtener total usando sp_total_stock
-        cursor.callproc('sp_total_stock', [])
-        total_result = cursor.fetchone()
-        while cursor.nextset():
-            pass
+        total_result = dashboards.sp_uno('sp_total_stock')
         total_stock = int(total_result.get('total_stock', 0) or 0) if total_result else 0
         
         # También obtener stock bajo usando VistaInventarioBajoCount para comparar
-        cursor.callproc('VistaInventarioBajoCount', [])
-        stock_bajo_verificacion = cursor.fetchone()
-        while cursor.nextset():
-            pass
+        stock_bajo_verificacion = dashboards.sp_uno('VistaInventarioBajoCount')
         stock_bajo_count = int(stock_bajo_verificacion.get('stock_bajo', 0) or 0) if stock_bajo_verificacion else 0
         
         print(f"[DEBUG] Comparación - VistaEstadoStock bajo: {stock_bajo}, VistaInventarioBajoCount: {stock_bajo_count}")
@@ -6115,20 +6065,24 @@ def api_inventario_estado_stock():
         # Log de los valores que se están enviando
         print(f"[DEBUG] VistaEstadoStock - Normal: {stock_normal}, Bajo: {stock_bajo}, Total: {total_stock}")
         
-        cursor.close()
-        
-        return jsonify({
+        return {
             'normal': stock_normal,
             'bajo': stock_bajo
-        })
+        }, 200
     except Exception as e:
         import traceback
         error_msg = f"Error en api_inventario_estado_stock: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
-        return jsonify({
+        return {
             'normal': 0,
             'bajo': 0
-        }), 500
+        }, 500
+
+@app.route('/api/inventario/estado-stock')
+def api_inventario_estado_stock():
+    """Endpoint para distribución de estado de stock usando view vinventariobajo"""
+    datos, estado = _dashboard_inventario_estado_stock()
+    return jsonify(datos), estado
 
 @app.route('/api/inventario/producto/<sku>/sucursal', methods=['GET'])
 @login_requerido
@@ -6354,9 +6308,9 @@ def api_inventario_stock_critico():
 
 # ==================== ENDPOINTS API PARA PANEL DE FINANZAS ====================
 
-@app.route('/api/finanzas/kpis')
-def api_finanzas_kpis():
-    """Endpoint para KPIs del panel de finanzas usando solo SPs y views"""
+@dashboards.widget('finanzas', 'kpis')
+def _dashboard_finanzas_kpis():
+    """(datos, estado) del widget; lo sirven api_finanzas_kpis y /api/dashboard/finanzas"""
     try:
         cursor = mysql.connection.cursor()
         
@@ -6407,7 +6361,7 @@ def api_finanzas_kpis():
         
         cursor.close()
 
-        return jsonify({
+        return {
             'ingresos_mes': ingresos_mes,
             'ingresos_trend': round(ingresos_trend, 1),
             'margen_promedio': round(margen_promedio, 1),
@@ -6416,12 +6370,12 @@ def api_finanzas_kpis():
             'pagos_trend': pagos_trend,
             'gastos_operacionales': gastos_operacionales,
             'gastos_trend': gastos_trend
-        })
+        }, 200
     except Exception as e:
         import traceback
         error_msg = f"Error en api_finanzas_kpis: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
-        return jsonify({
+        return {
             'ingresos_mes': 0,
             'ingresos_trend': 0,
             'margen_promedio': 0,
@@ -6430,11 +6384,17 @@ def api_finanzas_kpis():
             'pagos_trend': 0,
             'gastos_operacionales': 0,
             'gastos_trend': 0
-        }), 500
+        }, 500
 
-@app.route('/api/finanzas/margen-categoria')
-def api_finanzas_margen_categoria():
-    """Endpoint para margen por categoría usando view vmargenporcategoria"""
+@app.route('/api/finanzas/kpis')
+def api_finanzas_kpis():
+    """Endpoint para KPIs del panel de finanzas usando solo SPs y views"""
+    datos, estado = _dashboard_finanzas_kpis()
+    return jsonify(datos), estado
+
+@dashboards.widget('finanzas', 'margen_categoria')
+def _dashboard_finanzas_margen_categoria():
+    """(datos, estado) del widget; lo sirven api_finanzas_margen_categoria y /api/dashboard/finanzas"""
     try:
         cursor = mysql.connection.cursor()
         cursor.callproc('sp_margen_por_categoria', [])
@@ -6451,16 +6411,22 @@ def api_finanzas_margen_categoria():
                 'margen_porcentaje': float(row.get('Margen_Porcentaje', 0) or 0)
             })
         
-        return jsonify(categorias)
+        return categorias, 200
     except Exception as e:
         import traceback
         error_msg = f"Error en api_finanzas_margen_categoria: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
-        return jsonify([]), 500
+        return [], 500
 
-@app.route('/api/reporte/ticket-promedio')
-def api_ticket_promedio():
-    """Endpoint para ticket promedio usando VIEW vticketspromedio"""
+@app.route('/api/finanzas/margen-categoria')
+def api_finanzas_margen_categoria():
+    """Endpoint para margen por categoría usando view vmargenporcategoria"""
+    datos, estado = _dashboard_finanzas_margen_categoria()
+    return jsonify(datos), estado
+
+@dashboards.widget('admin', 'ticket_promedio')
+def _dashboard_admin_ticket_promedio():
+    """(datos, estado) del widget; lo sirven api_ticket_promedio y /api/dashboard/admin"""
     try:
         cursor = mysql.connection.cursor()
         
@@ -6473,27 +6439,35 @@ def api_ticket_promedio():
         cursor.close()
         
         if not resultado:
-            return jsonify({
+            return {
                 'ticket_promedio': 0,
                 'numero_total_pedidos': 0,
                 'ingresos_totales': 0
-            })
+            }, 200
         
-        return jsonify({
+        return {
             'ticket_promedio': float(resultado.get('Ticket_Promedio', 0) or 0),
             'numero_total_pedidos': int(resultado.get('Numero_Total_Pedidos', 0) or 0),
             'ingresos_totales': float(resultado.get('Ingresos_Totales', 0) or 0)
-        })
+        }, 200
     except Exception as e:
         import traceback
         error_msg = f"Error en api_ticket_promedio: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
-        return jsonify({
+        return {
             'ticket_promedio': 0,
             'numero_total_pedidos': 0,
             'ingresos_totales': 0,
             'error': str(e)
-        }), 500
+        }, 500
+
+@app.route('/api/reporte/ticket-promedio')
+@solo_lectura
+@condicional('ventas')
+def api_ticket_promedio():
+    """Endpoint para ticket promedio usando VIEW vticketspromedio"""
+    datos, estado = _dashboard_admin_ticket_promedio()
+    return jsonify(datos), estado
 
 @app.route('/api/finanzas/pagos/registrar', methods=['POST'])
 @login_requerido
@@ -6574,9 +6548,9 @@ def api_finanzas_registrar_pago():
             'error': f'Error interno del servidor: {str(e)}'
         }), 500
 
-@app.route('/api/finanzas/facturacion-vs-cobrado')
-def api_finanzas_facturacion_vs_cobrado():
-    """Endpoint para facturación vs cobrado (6 meses) usando SP facturacionDiaria y tabla pagos"""
+@dashboards.widget('finanzas', 'facturacion_vs_cobrado')
+def _dashboard_finanzas_facturacion_vs_cobrado():
+    """(datos, estado) del widget; lo sirven api_finanzas_facturacion_vs_cobrado y /api/dashboard/finanzas"""
     try:
         cursor = mysql.connection.cursor()
         
@@ -6649,26 +6623,32 @@ def api_finanzas_facturacion_vs_cobrado():
         facturacion_data = [facturacion_por_mes.get(m, 0) for m in meses]
         cobrado_data = [cobrado_por_mes.get(m, 0) for m in meses]
         
-        return jsonify({
+        return {
             'meses': meses_labels,
             'facturado': facturacion_data,
             'cobrado': cobrado_data
-        })
+        }, 200
     except Exception as e:
         import traceback
         error_msg = f"Error en api_finanzas_facturacion_vs_cobrado: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
-        return jsonify({
+        return {
             'meses': ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun'],
             'facturado': [0, 0, 0, 0, 0, 0],
             'cobrado': [0, 0, 0, 0, 0, 0]
-        }), 500
+        }, 500
+
+@app.route('/api/finanzas/facturacion-vs-cobrado')
+def api_finanzas_facturacion_vs_cobrado():
+    """Endpoint para facturación vs cobrado (6 meses) usando SP facturacionDiaria y tabla pagos"""
+    datos, estado = _dashboard_finanzas_facturacion_vs_cobrado()
+    return jsonify(datos), estado
 
 # ==================== ENDPOINTS API PARA PANEL DE AUDITORÍA ====================
 
-@app.route('/api/auditor/kpis')
-def api_auditor_kpis():
-    """Endpoint para KPIs del panel de auditoría"""
+@dashboards.widget('auditor', 'kpis')
+def _dashboard_auditor_kpis():
+    """(datos, estado) del widget; lo sirven api_auditor_kpis y /api/dashboard/auditor"""
     try:
         import MySQLdb.cursors
         cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
@@ -6713,7 +6693,7 @@ def api_auditor_kpis():
         conformidad_trend = 0.0
         reportes_trend = 0
 
-        return jsonify({
+        return {
             'registros_auditados': int(registros_auditados),
             'registros_trend': registros_trend,
             'discrepancias': int(discrepancias),
@@ -6722,12 +6702,12 @@ def api_auditor_kpis():
             'conformidad_trend': conformidad_trend,
             'reportes_generados': int(reportes_generados),
             'reportes_trend': reportes_trend
-        })
+        }, 200
     except Exception as e:
         import traceback
         error_msg = f"Error en api_auditor_kpis: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
-        return jsonify({
+        return {
             'registros_auditados': 0,
             'registros_trend': 0,
             'discrepancias': 0,
@@ -6736,11 +6716,19 @@ def api_auditor_kpis():
             'conformidad_trend': 0,
             'reportes_generados': 0,
             'reportes_trend': 0
-        }), 500
+        }, 500
 
-@app.route('/api/auditor/devoluciones-motivo')
-def api_auditor_devoluciones_motivo():
-    """Endpoint para devoluciones por motivo usando SP auditor_devoluciones_motivo - SOLO SP, NO SQL EMBEBIDO"""
+@app.route('/api/auditor/kpis')
+@solo_lectura
+@condicional('ventas', 'devoluciones')
+def api_auditor_kpis():
+    """Endpoint para KPIs del panel de auditoría"""
+    datos, estado = _dashboard_auditor_kpis()
+    return jsonify(datos), estado
+
+@dashboards.widget('auditor', 'devoluciones_motivo')
+def _dashboard_auditor_devoluciones_motivo():
+    """(datos, estado) del widget; lo sirven api_auditor_devoluciones_motivo y /api/dashboard/auditor"""
     try:
         cursor = mysql.connection.cursor()
         
@@ -6787,21 +6775,29 @@ def api_auditor_devoluciones_motivo():
         
         # Si no hay datos, retornar lista vacía
         if not devoluciones:
-            return jsonify([])
+            return [], 200
         
         # Ordenar por cantidad descendente (por si acaso)
         devoluciones.sort(key=lambda x: x['cantidad'], reverse=True)
         
-        return jsonify(devoluciones)
+        return devoluciones, 200
     except Exception as e:
         import traceback
         error_msg = f"Error en api_auditor_devoluciones_motivo: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
-        return jsonify([]), 500
+        return [], 500
 
-@app.route('/api/auditor/actividad-modulo')
-def api_auditor_actividad_modulo():
-    """Endpoint para actividad de auditoría por módulo"""
+@app.route('/api/auditor/devoluciones-motivo')
+@solo_lectura
+@condicional('devoluciones')
+def api_auditor_devoluciones_motivo():
+    """Endpoint para devoluciones por motivo usando SP auditor_devoluciones_motivo - SOLO SP, NO SQL EMBEBIDO"""
+    datos, estado = _dashboard_auditor_devoluciones_motivo()
+    return jsonify(datos), estado
+
+@dashboards.widget('auditor', 'actividad_modulo')
+def _dashboard_auditor_actividad_modulo():
+    """(datos, estado) del widget; lo sirven api_auditor_actividad_modulo y /api/dashboard/auditor"""
     try:
         import MySQLdb.cursors
         cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
@@ -6867,21 +6863,29 @@ def api_auditor_actividad_modulo():
             }
         }
 
-        return jsonify(actividad)
+        return actividad, 200
     except Exception as e:
         import traceback
         error_msg = f"Error en api_auditor_actividad_modulo: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
-        return jsonify({
+        return {
             'inventario': {'conformes': 0, 'discrepancias': 0},
             'ventas': {'conformes': 0, 'discrepancias': 0},
             'facturas': {'conformes': 0, 'discrepancias': 0},
             'usuarios': {'conformes': 0, 'discrepancias': 0}
-        }), 500
+        }, 500
 
-@app.route('/api/auditor/registros-recientes')
-def api_auditor_registros_recientes():
-    """Endpoint para obtener registros de auditoría recientes"""
+@app.route('/api/auditor/actividad-modulo')
+@solo_lectura
+@condicional('catalogo', 'ventas', 'inventario')
+def api_auditor_actividad_modulo():
+    """Endpoint para actividad de auditoría por módulo"""
+    datos, estado = _dashboard_auditor_actividad_modulo()
+    return jsonify(datos), estado
+
+@dashboards.widget('auditor', 'registros_recientes')
+def _dashboard_auditor_registros_recientes():
+    """(datos, estado) del widget; lo sirven api_auditor_registros_recientes y /api/dashboard/auditor"""
     try:
         import MySQLdb.cursors
         cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
@@ -6925,12 +6929,47 @@ def api_auditor_registros_recientes():
         
         cursor.close()
         
-        return jsonify(registros)
+        return registros, 200
     except Exception as e:
         import traceback
         error_msg = f"Error en api_auditor_registros_recientes: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
-        return jsonify([]), 500
+        return [], 500
+
+@app.route('/api/auditor/registros-recientes')
+@solo_lectura
+@condicional('ventas')
+def api_auditor_registros_recientes():
+    """Endpoint para obtener registros de auditoría recientes"""
+    datos, estado = _dashboard_auditor_registros_recientes()
+    return jsonify(datos), estado
+
+# ==================== DASHBOARD POR PANEL (UNA SOLA PETICIÓN) ====================
+
+@app.route('/api/dashboard/<panel>')
+@login_requerido
+def api_dashboard(panel):
+    """Todos los widgets de un panel (admin, finanzas, inventario, auditor) en un solo JSON"""
+    definicion = dashboards.obtener(panel)
+    if definicion is None:
+        return jsonify({'success': False, 'error': 'Panel no encontrado'}), 404
+    if not definicion.permite(session.get('role')):
+        return jsonify({'success': False, 'error': 'No tienes permisos para ver este panel'}), 403
+
+    def componer():
+        # Un widget en error no tumba el panel: 200 con los demás y la lista
+        # en 'errores', pero sin ETag para no validar después el resultado parcial
+        documento = dashboards.componer(definicion)
+        if documento['errores']:
+            condicional.sin_validadores()
+        return jsonify(documento)
+
+    # Mismos decoradores que los endpoints individuales del panel
+    if definicion.dominios:
+        componer = condicional(*definicion.dominios)(componer)
+    if definicion.solo_lectura:
+        componer = solo_lectura(componer)
+    return componer()
 
 # ==================== GESTIÓN DE PRODUCTOS ====================
 
@@ -6963,12 +7002,8 @@ def productos_crear():
     try:
         cursor = mysql.connection.cursor()
         
-        # Obtener todas las categorías activas usando SP categoriasActivas - SOLO SP, NO SQL EMBEBIDO
-        cursor.callproc('categoriasActivas', [])
-        categorias_raw = cursor.fetchall()
-        # Consumir todos los resultados del SP
-        while cursor.nextset():
-            pass
+        # Categorías activas desde el cache de referencia (SP categoriasActivas)
+        categorias_raw = referencias.obtener('categorias')
         
         # Obtener materiales usando SP sp_materiales_obtener_todos - SOLO SP, NO SQL EMBEBIDO
         cursor.callproc('sp_materiales_obtener_todos', [])
@@ -7071,17 +7106,11 @@ def productos_editar(id_producto):
         while cursor.nextset():
             pass
         
-        # Obtener categorías activas usando SP categoriasActivas - SOLO SP, NO SQL EMBEBIDO
-        cursor.callproc('categoriasActivas', [])
-        categorias_raw = cursor.fetchall()
-        while cursor.nextset():
-            pass
+        # Categorías activas desde el cache de referencia (SP categoriasActivas)
+        categorias_raw = referencias.obtener('categorias')
         
-        # Obtener materiales usando SP
-        cursor.callproc('sp_materiales_lista', [])
-        materiales_raw = cursor.fetchall()
-        while cursor.nextset():
-            pass
+        # Materiales desde el cache de referencia
+        materiales_raw = referencias.obtener('materiales')
         
         # Obtener géneros de productos usando SP
         cursor.callproc('sp_generos_productos_lista', [])
@@ -7218,9 +7247,7 @@ def api_crear_producto():
             kilataje if kilataje else None,
             ley if ley else None
         ])
-        
-        # Obtener el ID del producto creado usando SP
-        cursor.callproc('sp_producto_max_id', [])
+        # productoAlta devuelve el id del producto creado
         resultado = cursor.fetchone()
         while cursor.nextset():
             pass
@@ -7228,6 +7255,9 @@ def api_crear_producto():
         
         mysql.connection.commit()
         cursor.close()
+        referencias.refrescar('categorias', 'materiales')
+        catalogo_cache.invalidar()
+        indice_productos.invalidar()
         
         return jsonify({
             'success': True,
@@ -7329,6 +7359,9 @@ def api_actualizar_producto():
 
         mysql.connection.commit()
         cursor.close()
+        referencias.refrescar('categorias', 'materiales')
+        catalogo_cache.invalidar()
+        indice_productos.invalidar()
 
         return jsonify({'success': True, 'mensaje': 'Producto actualizado correctamente'})
 
@@ -7342,6 +7375,7 @@ def api_actualizar_producto():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/productos/ver/<int:id_producto>')
+@condicional('catalogo', 'inventario')
 def api_ver_producto(id_producto):
     """Endpoint para obtener detalles completos de un producto usando SP admin_producto_detalles - SOLO SP, NO SQL EMBEBIDO"""
     try:
@@ -7775,24 +7809,11 @@ def cliente_dashboard():
     categoria_seleccionada = request.args.get('categoria', '')
     
     try:
-        import MySQLdb.cursors
-        # Usar DictCursor para acceder a los campos por nombre en el template
-        cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+        # Categorías activas desde el cache de referencia (SP categoriasActivas)
+        categorias = referencias.obtener('categorias')
         
-        # Obtener todas las categorías activas usando SP categoriasActivas
-        cursor.callproc('categoriasActivas', [])
-        categorias = cursor.fetchall()
-        while cursor.nextset():
-            pass
-        
-        # Obtener productos activos usando SP productosCatalogo
-        categoria_param = categoria_seleccionada if categoria_seleccionada else None
-        cursor.callproc('productosCatalogo', [categoria_param])
-        productos = cursor.fetchall()
-        while cursor.nextset():
-            pass
-        
-        cursor.close()
+        # Productos activos (SP productosCatalogo) desde el cache del catálogo por categoría
+        productos = catalogo_cache.productos(categoria_seleccionada)
     except Exception as e:
         import traceback        
         print(traceback.format_exc())
@@ -7843,6 +7864,20 @@ def cliente_facturas():
         print(f"Error cargando facturas del cliente: {str(e)}\n{traceback.format_exc()}")
         return render_template('cliente_facturas.html', facturas=[])
 
+@app.route('/api/cliente/pedidos/<int:id_pedido>/factura')
+@login_requerido
+def api_cliente_pedido_factura_estado(id_pedido):
+    """Estado de la factura solicitada en el checkout (la genera el worker de facturas)"""
+    try:
+        estado = cola_facturas.estado_pedido(id_pedido, session.get('user_id'))
+        if not estado:
+            return jsonify({'success': False, 'error': 'Pedido no encontrado'}), 404
+        return jsonify({'success': True, **estado})
+    except Exception as e:
+        import traceback
+        print(f"Error consultando factura del pedido: {str(e)}\n{traceback.format_exc()}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/cliente/facturas/crear', methods=['POST'])
 @login_requerido
 def api_cliente_crear_factura():
@@ -8172,11 +8207,8 @@ def cliente_pago(id_factura):
             flash('Factura no encontrada', 'danger')
             return redirect(url_for('cliente_facturas'))
         
-        # Obtener métodos de pago usando SP
-        cursor.callproc('sp_metodos_pago_lista_nombre', [])
-        metodos_pago = cursor.fetchall()
-        while cursor.nextset():
-            pass
+        # Métodos de pago desde el cache de referencia
+        metodos_pago = referencias.obtener('metodos_pago_nombre')
         
         cursor.close()
         
@@ -8197,6 +8229,7 @@ def cliente_pago(id_factura):
 
 @app.route('/api/cliente/pago/registrar', methods=['POST'])
 @login_requerido
+@idempotente('registrar_pago')
 def api_cliente_registrar_pago():
     """Endpoint para registrar pago desde el cliente"""
     try:
@@ -8319,21 +8352,10 @@ def cliente_perfil():
         if perfil:
             print(f"[DEBUG] Perfil obtenido - nombre_clasificacion: {perfil.get('nombre_clasificacion')}, descuento_clasificacion: {perfil.get('descuento_clasificacion')}")
         
-        # Obtener catálogos usando SP
-        cursor.callproc('sp_generos_lista', [])
-        generos = cursor.fetchall()
-        while cursor.nextset():
-            pass
-        
-        cursor.callproc('sp_clasificaciones_lista', [])
-        clasificaciones = cursor.fetchall()
-        while cursor.nextset():
-            pass
-        
-        cursor.callproc('sp_estados_direcciones_lista', [])
-        estados = cursor.fetchall()
-        while cursor.nextset():
-            pass
+        # Catálogos desde el cache de referencia
+        generos = referencias.obtener('generos')
+        clasificaciones = referencias.obtener('clasificaciones')
+        estados = referencias.obtener('estados_direcciones')
         
         cursor.close()
         
@@ -8773,11 +8795,8 @@ def cliente_completar_datos():
         """, (id_usuario,))
         usuario_data = cursor.fetchone()
         
-        # Obtener lista de estados para el dropdown usando SP
-        cursor.callproc('sp_estados_direcciones_lista', [])
-        estados = cursor.fetchall()
-        while cursor.nextset():
-            pass
+        # Lista de estados para el dropdown (cache de referencia)
+        estados = referencias.obtener('estados_direcciones')
         
         cursor.close()
         
@@ -8978,14 +8997,13 @@ def api_cliente_actualizar_contrasena():
         if not usuario:
             return jsonify({'success': False, 'error': 'Usuario no encontrado'}), 404
         
-        # 2. Verificar contraseña actual con Argon2
+        # 2. Verificar contraseña actual y 3. hashear la nueva con Argon2
         try:
-            ph.verify(usuario['contrasena'], contrasena_actual)
-        except VerifyMismatchError:
-            return jsonify({'success': False, 'error': 'Contraseña actual incorrecta'}), 400
-        
-        # 3. Hashear nueva contraseña
-        hash_nueva = ph.hash(contrasena_nueva)
+            if not contrasenas.verificar(usuario['contrasena'], contrasena_actual):
+                return jsonify({'success': False, 'error': 'Contraseña actual incorrecta'}), 400
+            hash_nueva = contrasenas.hash(contrasena_nueva)
+        except ContrasenasOcupadasError:
+            return _respuesta_contrasenas_ocupadas()
         
         # 4. Actualizar contraseña con el SP (SOLO 2 PARÁMETROS)
         cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
@@ -9052,6 +9070,28 @@ def api_cliente_actualizar_contrasena():
             'error': mensaje_usuario
         }), 500
 
+# ==================== DIAGNÓSTICO DE BASE DE DATOS ====================
+
+@app.route('/api/admin/diagnostico/sp')
+@login_requerido
+@requiere_rol('Admin')
+def api_diagnostico_sp():
+    """Tiempos y filas por stored procedure (todas las llamadas por mysql.connection) y estado del pool"""
+    return jsonify({
+        'success': True,
+        'pool': mysql.estadisticas(),
+        'referencias': referencias.estadisticas(),
+        'catalogo': catalogo_cache.estadisticas(),
+        'busqueda': indice_productos.estadisticas(),
+        'get_condicional': condicional.estadisticas(),
+        'idempotencia': idempotente.estadisticas(),
+        'facturacion': cola_facturas.estadisticas(),
+        'contrasenas': contrasenas.estadisticas(),
+        'limite_login': limite_login.estadisticas(),
+        'dashboards': dashboards.estadisticas(),
+        'stored_procedures': mysql.estadisticas_sp.resumen()
+    })
+
 # ==================== MANEJO DE ERRORES ====================
 
 @app.errorhandler(403)
@@ -9099,6 +9139,78 @@ def internal_error(error):
         }), 500
     return render_template('500.html'), 500
 
+# ==================== COMANDOS DE MANTENIMIENTO ====================
+
+@app.cli.command('limpiar-carritos')
+def limpiar_carritos_comando():
+    """Borra los carritos vencidos (programar con cron: flask --app app limpiar-carritos)"""
+    eliminados = carrito_servidor.limpiar_expirados()
+    print(f"Carritos vencidos eliminados: {eliminados}")
+
+@app.cli.command('limpiar-reservas')
+def limpiar_reservas_comando():
+    """Borra por lotes las reservas de existencias vencidas (flask --app app limpiar-reservas)"""
+    eliminadas = carrito_servidor.limpiar_reservas_expiradas(app.config['RESERVA_STOCK_LOTE_LIMPIEZA'])
+    print(f"Reservas vencidas eliminadas: {eliminadas}")
+
+@app.cli.command('limpiar-idempotencia')
+def limpiar_idempotencia_comando():
+    """Borra por lotes las claves de idempotencia vencidas (flask --app app limpiar-idempotencia)"""
+    eliminadas = idempotente.limpiar_expiradas(app.config['IDEMPOTENCIA_LOTE_LIMPIEZA'])
+    print(f"Claves de idempotencia vencidas eliminadas: {eliminadas}")
+
+@app.cli.command('facturar-pendientes')
+@click.option('--continuo', is_flag=True, help='Seguir revisando la cola en lugar de terminar al vaciarla')
+@click.option('--intervalo', default=5.0, show_default=True, help='Segundos entre revisiones con --continuo')
+def facturar_pendientes_comando(continuo, intervalo):
+    """Genera las facturas en cola del checkout (flask --app app facturar-pendientes [--continuo])"""
+    while True:
+        # Un contexto por pasada: la conexión vuelve al pool entre revisiones
+        try:
+            with app.app_context():
+                resultado = cola_facturas.procesar_pendientes(app.config['FACTURAS_LOTE'])
+        except Exception as e:
+            if not continuo:
+                raise
+            # Base reiniciada, conexión perdida o pool agotado: el proceso
+            # permanente sigue; los trabajos tomados en esta pasada los
+            # retoma cualquier worker al vencer ttl_proceso
+            print(f"[facturacion] Error al procesar la cola, se reintenta en {intervalo} s: {e}")
+            time.sleep(intervalo)
+            continue
+        if any(resultado.values()):
+            print(f"Facturas generadas: {resultado['completados']}, "
+                  f"a reintentar: {resultado['reintentos']}, con error: {resultado['errores']}, "
+                  f"de pedidos cancelados: {resultado['cancelados']}")
+        if not continuo:
+            break
+        time.sleep(intervalo)
+
+@app.cli.command('limpiar-limites-login')
+def limpiar_limites_login_comando():
+    """Borra por lotes los límites de inicio de sesión ya recargados (flask --app app limpiar-limites-login)"""
+    eliminados = limite_login.limpiar_compartido(app.config['LOGIN_LIMITE_LOTE_LIMPIEZA'])
+    print(f"Límites de inicio de sesión eliminados: {eliminados}")
+
+@app.cli.command('reconstruir-ventas-diarias')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), help='Primer día (por omisión, el del primer pedido)')
+@click.option('--hasta', type=click.DateTime(formats=['%Y-%m-%d']), help='Último día (por omisión, el del último pedido)')
+@click.option('--dias', default=31, show_default=True, help='Días por transacción')
+def reconstruir_ventas_diarias_comando(desde, hasta, dias):
+    """Recalcula los hechos de ventas diarias desde los pedidos (flask --app app reconstruir-ventas-diarias)"""
+    def avance(inicio, fin, fila):
+        print(f"  {inicio} a {fin}: {fila['filas_ventas'] if fila else 0} filas")
+
+    resultado = ventas_diarias.reconstruir(
+        mysql,
+        desde.date() if desde else None,
+        hasta.date() if hasta else None,
+        dias=max(dias, 1),
+        avance=avance
+    )
+    print(f"Ventas diarias reconstruidas: {resultado['periodos']} periodos, "
+          f"{resultado['filas_ventas']} filas de ventas, {resultado['filas_pedidos']} filas de pedidos")
+
 # ==================== INICIO DE LA APLICACIÓN ====================
 
 if __name__ == '__main__':   
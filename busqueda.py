@@ -0,0 +1,158 @@
+"""
+Búsqueda de productos con índice invertido en memoria.
+
+Se indexan nombre del modelo, SKU, categoría, material, kilataje y ley de los
+productos activos (SP sp_productos_indice_busqueda). Cada palabra de la
+consulta debe coincidir como prefijo con alguna palabra del producto
+(búsqueda mientras se escribe) y los resultados se ordenan por relevancia:
+pesa más coincidir en el SKU o el nombre que en la categoría o el material,
+y una palabra completa más que un prefijo.
+
+El índice se reconstruye cuando cambia la versión 'catalogo' de
+Versiones_Datos (mismo mecanismo que catalogo_cache.py) o con `invalidar()`
+después de dar de alta o editar productos.
+"""
+import bisect
+import re
+import threading
+import time
+import unicodedata
+
+# Peso de cada campo indexado en la relevancia
+PESOS_CAMPOS = {
+    'sku': 5.0,
+    'nombre': 4.0,
+    'nombre_categoria': 2.0,
+    'material': 2.0,
+    'kilataje': 1.5,
+    'ley': 1.5,
+}
+
+# Bonificación cuando la palabra de la consulta coincide completa
+FACTOR_PALABRA_COMPLETA = 2.0
+
+_SEPARADORES = re.compile(r'[^0-9a-z]+')
+
+
+def normalizar(texto):
+    """Minúsculas sin acentos ('Añillo de Oro' -> 'anillo de oro')"""
+    if texto is None:
+        return ''
+    texto = unicodedata.normalize('NFKD', str(texto).lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def palabras(texto):
+    return [p for p in _SEPARADORES.split(normalizar(texto)) if p]
+
+
+class IndiceProductos:
+    """Índice invertido palabra -> {id_producto: peso} con búsqueda por prefijo"""
+
+    def __init__(self, mysql, intervalo_verificacion=5):
+        self.mysql = mysql
+        self.intervalo_verificacion = intervalo_verificacion
+        self._lock = threading.Lock()
+        # (productos, postings, vocabulario ordenado): se reemplaza completo al
+        # reconstruir para que una búsqueda en curso no mezcle dos versiones
+        self._datos = ({}, {}, [])
+        self._version = None
+        self._construido = False
+        self._ultima_verificacion = 0.0
+        self.reconstrucciones = 0
+        self.busquedas = 0
+
+    def _construir(self):
+        filas = self.mysql.ejecutar_sp_filas('sp_productos_indice_busqueda', [])
+        productos = {}
+        postings = {}
+        for fila in filas:
+            id_producto = fila['id_producto']
+            productos[id_producto] = fila
+            for campo, peso in PESOS_CAMPOS.items():
+                valor = fila.get(campo)
+                tokens = palabras(valor)
+                if campo == 'sku' and valor:
+                    # 'AUR-123A' también se encuentra como 'aur123a'
+                    tokens.append(''.join(tokens))
+                for token in tokens:
+                    por_producto = postings.setdefault(token, {})
+                    if por_producto.get(id_producto, 0) < peso:
+                        por_producto[id_producto] = peso
+        self._datos = (productos, postings, sorted(postings))
+        self._construido = True
+        self.reconstrucciones += 1
+
+    def _asegurar_vigente(self):
+        ahora = time.monotonic()
+        if self._construido and ahora - self._ultima_verificacion < self.intervalo_verificacion:
+            return
+        with self._lock:
+            if self._construido and ahora - self._ultima_verificacion < self.intervalo_verificacion:
+                return
+            self._ultima_verificacion = ahora
+            try:
+                fila = self.mysql.ejecutar_sp_uno('sp_catalogo_version', [])
+                version = fila.get('version') if fila else None
+            except Exception as e:
+                print(f"[busqueda] No se pudo leer sp_catalogo_version: {e}")
+                version = self._version
+            if not self._construido or version != self._version:
+                self._construir()
+                self._version = version
+
+    @staticmethod
+    def _coincidencias(postings, vocabulario, termino):
+        """{id_producto: puntaje} de las palabras que empiezan con `termino`"""
+        puntajes = {}
+        for posicion in range(bisect.bisect_left(vocabulario, termino), len(vocabulario)):
+            token = vocabulario[posicion]
+            if not token.startswith(termino):
+                break
+            factor = FACTOR_PALABRA_COMPLETA if token == termino else 1.0
+            for id_producto, peso in postings[token].items():
+                puntaje = peso * factor
+                if puntaje > puntajes.get(id_producto, 0):
+                    puntajes[id_producto] = puntaje
+        return puntajes
+
+    def buscar(self, consulta, limite=20, categoria=None):
+        """
+        Productos (dicts compartidos, no modificarlos) que coinciden con todas
+        las palabras de la consulta, de mayor a menor relevancia.
+        """
+        self._asegurar_vigente()
+        self.busquedas += 1
+        terminos = palabras(consulta)
+        if not terminos:
+            return []
+
+        productos, postings, vocabulario = self._datos
+        total = None
+        for termino in terminos:
+            puntajes = self._coincidencias(postings, vocabulario, termino)
+            if total is None:
+                total = puntajes
+            else:
+                total = {i: total[i] + p for i, p in puntajes.items() if i in total}
+            if not total:
+                return []
+
+        if categoria:
+            total = {i: p for i, p in total.items() if productos[i].get('nombre_categoria') == categoria}
+        orden = sorted(total, key=lambda i: (-total[i], normalizar(productos[i].get('nombre')), i))
+        return [productos[i] for i in orden[:limite]]
+
+    def invalidar(self):
+        """Fuerza la reconstrucción en la siguiente búsqueda (llamar después del commit)"""
+        with self._lock:
+            self._construido = False
+
+    def estadisticas(self):
+        return {
+            'version': self._version,
+            'productos': len(self._datos[0]),
+            'palabras': len(self._datos[2]),
+            'reconstrucciones': self.reconstrucciones,
+            'busquedas': self.busquedas,
+        }
@@ -0,0 +1,239 @@
+"""
+Carrito de compras guardado en la base de datos (tablas Carritos y
+Carritos_Items).
+
+La cookie de sesión solo lleva `session['carrito_id']`; los productos viven
+en el servidor, así que el carrito no infla cada request ni se pierde al
+cambiar de dispositivo (al iniciar sesión se une con el carrito del usuario,
+ver carritoAsignarUsuario). Cada alta, cambio de cantidad o baja es un solo
+upsert / delete por llave (id_carrito, id_producto) y extiende el
+vencimiento del carrito; los carritos abandonados vencen tras `ttl`
+segundos.
+
+Los precios nunca vienen del cliente: carritoItemAgregar y carritoReemplazar
+los toman de Productos. `consultar()` muestra el carrito completo con precio
+vigente y existencia en sucursales activas sin escribir nada (ver el carrito
+es un GET); `cotizar()` además renueva las reservas y guarda los precios, y
+se usa solo al validar el carrito y en el checkout.
+
+Reservas de existencias: agregar o cambiar la cantidad aparta esa cantidad
+(tabla Reservas_Stock) por `ttl_reserva` segundos, repartida entre
+sucursales según `politica_surtido` igual que se surtirá el pedido (ver
+surtidoAsignar); lo disponible para otros carritos es stock_actual menos
+las reservas vigentes.
+`cotizar()` renueva las reservas que están por vencer o se perdieron y el
+checkout (pedidoCheckout) convierte las reservas en renglones del pedido.
+"""
+import json
+import secrets
+
+from flask import session
+
+
+def _item_json(fila):
+    return {
+        'id_producto': int(fila['id_producto']),
+        'nombre': fila['nombre'],
+        'precio': float(fila['precio']),
+        'sku': fila['sku'],
+        'cantidad': int(fila['cantidad']),
+    }
+
+
+def _item_cotizado_json(fila):
+    item = _item_json(fila)
+    precio_anterior = float(fila['precio_anterior'])
+    item.update({
+        'precio_anterior': precio_anterior,
+        'precio_cambio': abs(item['precio'] - precio_anterior) >= 0.005,
+        'activo': bool(fila['activo']),
+        'reservado': bool(fila['reservado']),
+        'reserva_expira': fila['reserva_expira'].isoformat() if fila['reserva_expira'] else None,
+        'stock_total': int(fila['stock_total'] or 0),
+        'stock_max_sucursal': int(fila['stock_max_sucursal'] or 0),
+        'disponible': bool(fila['disponible']),
+    })
+    return item
+
+
+def _resumen_json(fila):
+    if not fila:
+        return {'total': 0.0, 'total_items': 0}
+    return {'total': float(fila['total'] or 0), 'total_items': int(fila['total_items'] or 0)}
+
+
+class CarritoServidor:
+    """Operaciones sobre el carrito de la sesión actual (requieren contexto de request)"""
+
+    def __init__(self, mysql, ttl=7 * 24 * 3600, ttl_reserva=15 * 60, politica_surtido='mayor_existencia'):
+        self.mysql = mysql
+        self.ttl = ttl
+        self.ttl_reserva = ttl_reserva
+        self.politica_surtido = politica_surtido
+
+    def _id(self, crear=False):
+        id_carrito = session.get('carrito_id')
+        if id_carrito is None and crear:
+            id_carrito = secrets.token_hex(16)
+            session['carrito_id'] = id_carrito
+        return id_carrito
+
+    def _escribir(self, sp, params):
+        """Ejecuta un SP de escritura, hace commit y devuelve el resumen"""
+        try:
+            fila = self.mysql.ejecutar_sp_uno(sp, params)
+            self.mysql.connection.commit()
+        except Exception:
+            self.mysql.connection.rollback()
+            raise
+        return _resumen_json(fila)
+
+    def obtener(self):
+        """Lista de productos del carrito (dicts id_producto, nombre, precio, sku, cantidad)"""
+        id_carrito = self._id()
+        if id_carrito is None:
+            return []
+        return [_item_json(f) for f in self.mysql.ejecutar_sp_filas('carritoObtener', [id_carrito])]
+
+    def agregar(self, id_producto, cantidad):
+        """
+        Suma `cantidad` del producto con su precio vigente y la aparta.
+        Devuelve {'total', 'total_items', 'reservado'} o None si el producto
+        no existe o no está activo.
+        """
+        try:
+            fila = self.mysql.ejecutar_sp_uno('carritoItemAgregar', [
+                self._id(crear=True), session.get('user_id'), self.ttl, self.ttl_reserva,
+                self.politica_surtido, id_producto, cantidad
+            ])
+            self.mysql.connection.commit()
+        except Exception:
+            self.mysql.connection.rollback()
+            raise
+        if not fila or not fila['agregado']:
+            return None
+        resumen = _resumen_json(fila)
+        resumen['reservado'] = bool(fila['reservado'])
+        return resumen
+
+    def consultar(self):
+        """
+        Productos del carrito con precio vigente y disponibilidad, de solo
+        lectura (ver carritoConsultar); además de los campos de obtener()
+        cada item trae precio_anterior, precio_cambio, activo, reservado,
+        reserva_expira, stock_total, stock_max_sucursal y disponible.
+        """
+        id_carrito = self._id()
+        if id_carrito is None:
+            return []
+        return [_item_cotizado_json(f) for f in self.mysql.ejecutar_sp_filas('carritoConsultar', [id_carrito, False])]
+
+    def cotizar(self):
+        """
+        Como consultar(), pero antes renueva las reservas y después guarda
+        los precios vigentes (ver carritoCotizar); disponible exige que la
+        cantidad quede apartada.
+        """
+        id_carrito = self._id()
+        if id_carrito is None:
+            return []
+        try:
+            filas = self.mysql.ejecutar_sp_filas('carritoCotizar', [id_carrito, self.ttl_reserva, self.politica_surtido])
+            self.mysql.connection.commit()
+        except Exception:
+            self.mysql.connection.rollback()
+            raise
+        return [_item_cotizado_json(f) for f in filas]
+
+    def reemplazar(self, items):
+        """
+        Sustituye el contenido por `items` ([{'id_producto', 'cantidad'}]) en
+        una sola llamada; devuelve el carrito recotizado como cotizar().
+        """
+        items_json = json.dumps([
+            {'id_producto': int(item['id_producto']), 'cantidad': int(item['cantidad'])}
+            for item in items
+        ])
+        try:
+            filas = self.mysql.ejecutar_sp_filas('carritoReemplazar', [
+                self._id(crear=True), session.get('user_id'), self.ttl, self.ttl_reserva,
+                self.politica_surtido, items_json
+            ])
+            self.mysql.connection.commit()
+        except Exception:
+            self.mysql.connection.rollback()
+            raise
+        return [_item_cotizado_json(f) for f in filas]
+
+    def cambiar_cantidad(self, id_producto, cantidad):
+        id_carrito = self._id()
+        if id_carrito is None:
+            return _resumen_json(None)
+        return self._escribir('carritoItemCantidad', [
+            id_carrito, self.ttl, self.ttl_reserva, self.politica_surtido, id_producto, cantidad
+        ])
+
+    def eliminar(self, id_producto):
+        id_carrito = self._id()
+        if id_carrito is None:
+            return _resumen_json(None)
+        return self._escribir('carritoItemEliminar', [id_carrito, self.ttl, id_producto])
+
+    def vaciar(self):
+        id_carrito = self._id()
+        if id_carrito is None:
+            return
+        try:
+            self.mysql.ejecutar_sp('carritoVaciar', [id_carrito])
+            self.mysql.connection.commit()
+        except Exception:
+            self.mysql.connection.rollback()
+            raise
+
+    def asignar_usuario(self, id_carrito, id_usuario):
+        """
+        Al iniciar sesión: une el carrito anónimo `id_carrito` con el del
+        usuario y deja en la sesión el id resultante.
+        """
+        try:
+            fila = self.mysql.ejecutar_sp_uno('carritoAsignarUsuario', [
+                id_carrito, id_usuario, self.ttl, self.ttl_reserva, self.politica_surtido
+            ])
+            self.mysql.connection.commit()
+        except Exception:
+            self.mysql.connection.rollback()
+            raise
+        id_final = fila.get('id_carrito') if fila else None
+        if id_final:
+            session['carrito_id'] = id_final
+        else:
+            session.pop('carrito_id', None)
+        return id_final
+
+    @staticmethod
+    def resumen(items):
+        """{'total', 'total_items'} de una lista ya obtenida con obtener() o cotizar()"""
+        return {
+            'total': sum(item['precio'] * item['cantidad'] for item in items),
+            'total_items': sum(item['cantidad'] for item in items),
+        }
+
+    def limpiar_expirados(self):
+        """Borra los carritos vencidos; devuelve cuántos se eliminaron"""
+        fila = self.mysql.ejecutar_sp_uno('carritosExpiradosLimpiar', [])
+        self.mysql.connection.commit()
+        return int(fila['carritos_eliminados']) if fila else 0
+
+    def limpiar_reservas_expiradas(self, lote=1000):
+        """
+        Borra las reservas vencidas en lotes de `lote` (transacciones cortas
+        para no bloquear a los carritos activos); devuelve cuántas se borraron
+        """
+        total = 0
+        while True:
+            fila = self.mysql.ejecutar_sp_uno('reservasExpiradasLimpiar', [lote])
+            self.mysql.connection.commit()
+            eliminadas = int(fila['reservas_eliminadas']) if fila else 0
+            total += eliminadas
+            if eliminadas < lote:
+                return total
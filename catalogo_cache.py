@@ -0,0 +1,115 @@
+"""
+Cache del catálogo público (SP productosCatalogo) por categoría.
+
+El catálogo es la página con más tráfico pero solo cambia cuando un admin da
+de alta o edita productos o agrega imágenes. Se guardan el resultado de
+productosCatalogo por valor de `categoria` (incluido "todas") y las páginas
+de productosCatalogoPagina por categoría y cursor. Todo se descarta:
+
+- de inmediato en el worker que hizo el cambio (`invalidar()` tras el commit);
+- en los demás workers cuando cambia la versión 'catalogo' de Versiones_Datos,
+  que incrementan los triggers de Productos, Modelos, Categorias e
+  Imagenes_Productos. La versión se consulta como máximo una vez cada
+  `intervalo_verificacion` segundos, así que la mayoría de los requests
+  anónimos no tocan la base de datos.
+"""
+import threading
+import time
+
+# Clave usada para el catálogo sin filtro de categoría
+TODAS = ''
+
+
+class CacheCatalogo:
+    """Resultados de productosCatalogo / productosCatalogoPagina en memoria"""
+
+    def __init__(self, mysql, ttl=600, intervalo_verificacion=5, max_entradas=256):
+        self.mysql = mysql
+        self.ttl = ttl
+        self.intervalo_verificacion = intervalo_verificacion
+        # Categoría y cursor vienen del query string: acotar cuántas claves se guardan
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._entradas = {}
+        self._generacion = 0
+        self._version = None
+        self._ultima_verificacion = 0.0
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def _leer_version(self):
+        fila = self.mysql.ejecutar_sp_uno('sp_catalogo_version', [])
+        return fila.get('version') if fila else None
+
+    def _verificar_version(self):
+        """Descarta el cache si otro worker (o un trigger) cambió el catálogo"""
+        ahora = time.monotonic()
+        if ahora - self._ultima_verificacion < self.intervalo_verificacion:
+            return
+        self._ultima_verificacion = ahora
+        try:
+            version = self._leer_version()
+        except Exception as e:
+            # Sin tabla de versión (scripts viejos) se depende solo del TTL
+            print(f"[catalogo_cache] No se pudo leer sp_catalogo_version: {e}")
+            return
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    self.invalidaciones += 1
+                self._entradas.clear()
+                self._generacion += 1
+                self._version = version
+
+    def _obtener(self, clave, sp, params):
+        self._verificar_version()
+
+        entrada = self._entradas.get(clave)
+        if entrada is not None and time.monotonic() - entrada[1] < self.ttl:
+            self.aciertos += 1
+            return entrada[0]
+
+        self.fallos += 1
+        generacion = self._generacion
+        filas = self.mysql.ejecutar_sp_filas(sp, params)
+        with self._lock:
+            # No guardar si se invalidó mientras se consultaba (el resultado puede ser viejo)
+            if generacion == self._generacion and (
+                    clave in self._entradas or len(self._entradas) < self.max_entradas):
+                self._entradas[clave] = (filas, time.monotonic())
+        return filas
+
+    def productos(self, categoria=None):
+        """
+        Productos del catálogo para la categoría (None o '' = todas).
+        La lista devuelta es compartida entre requests: no modificarla.
+        """
+        return self._obtener(('todos', categoria or TODAS), 'productosCatalogo', [categoria or None])
+
+    def pagina(self, categoria, despues_nombre, despues_id, limite):
+        """
+        Filas de productosCatalogoPagina: hasta `limite` productos después de
+        (despues_nombre, despues_id); None = primera página. Compartidas, no modificar.
+        """
+        clave = ('pagina', categoria or TODAS, despues_nombre, despues_id, limite)
+        return self._obtener(clave, 'productosCatalogoPagina',
+                             [categoria or None, despues_nombre, despues_id, limite])
+
+    def invalidar(self):
+        """Descarta todo el catálogo en este worker (llamar después del commit)"""
+        with self._lock:
+            self._entradas.clear()
+            self._generacion += 1
+            self.invalidaciones += 1
+        # Forzar que la siguiente lectura tome la versión nueva del trigger
+        self._ultima_verificacion = 0.0
+
+    def estadisticas(self):
+        return {
+            'version': self._version,
+            'entradas_en_cache': len(self._entradas),
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'invalidaciones': self.invalidaciones,
+        }
@@ -0,0 +1,149 @@
+"""
+GET condicionales (ETag / Last-Modified) para páginas y APIs de solo lectura.
+
+Cada ruta declara de qué dominios de datos depende ('catalogo', 'ventas',
+'inventario', 'devoluciones'). Antes de ejecutar la vista se leen las
+versiones de esos dominios (SP sp_versiones_datos, tabla Versiones_Datos que
+mantienen los triggers) y se arma el ETag con ellas, el usuario de la sesión,
+la fecha del día (hay reportes relativos a "hoy" / "este mes") y la versión de
+la app desplegada. Si el cliente ya tiene esa representación se responde
+`304 Not Modified` sin ejecutar los SP del reporte, sin renderizar el
+template y sin serializar JSON.
+
+Las respuestas llevan `Cache-Control: private, no-cache`: el navegador guarda
+la copia pero la revalida en cada visita, así que el JS de los dashboards
+(fetch) recibe el 304 de forma transparente.
+
+Las vistas que ante un error responden 200 con datos de respaldo (listas
+vacías, ceros) llaman `condicional.sin_validadores()` en su `except`: esa
+respuesta sale sin ETag para que el navegador no la revalide con 304 cuando
+la base vuelva a responder.
+"""
+import hashlib
+import os
+from datetime import date, datetime, time as dt_time, timezone
+from functools import wraps
+
+from flask import g, make_response, request, session
+
+
+def _version_despliegue(app):
+    """Identifica el código desplegado: cambia al modificar app.py o los templates"""
+    rutas = [os.path.join(app.root_path, 'app.py')]
+    carpeta = os.path.join(app.root_path, app.template_folder or 'templates')
+    for raiz, _, archivos in os.walk(carpeta):
+        rutas.extend(os.path.join(raiz, a) for a in archivos)
+    ultima = 0.0
+    for ruta in rutas:
+        try:
+            ultima = max(ultima, os.path.getmtime(ruta))
+        except OSError:
+            pass
+    return ultima
+
+
+def _utc(fecha):
+    """datetime naive de MySQL -> aware en UTC (para comparar con If-Modified-Since)"""
+    if fecha is None:
+        return None
+    if fecha.tzinfo is None:
+        fecha = fecha.astimezone()
+    return fecha.astimezone(timezone.utc).replace(microsecond=0)
+
+
+class GetCondicional:
+    """
+    Fábrica del decorador `@condicional(*dominios)`.
+
+    Va debajo de los decoradores de autenticación y de @solo_lectura, para que
+    las versiones se lean por la misma conexión (primaria o réplica) que la
+    vista y el ETag corresponda a los datos que esta vería.
+    """
+
+    def __init__(self, app, mysql):
+        self.mysql = mysql
+        app.config.setdefault('HTTP_CONDICIONAL', True)
+        self.activo = app.config['HTTP_CONDICIONAL']
+        self._despliegue = _version_despliegue(app)
+        self.respuestas_304 = 0
+        self.respuestas_completas = 0
+        self.respuestas_respaldo = 0
+
+    def _versiones(self):
+        """Versiones de todos los dominios, leídas una sola vez por request"""
+        if '_versiones_datos' not in g:
+            filas = self.mysql.ejecutar_sp_filas('sp_versiones_datos', [])
+            g._versiones_datos = {f['nombre_dato']: f for f in filas}
+        return g._versiones_datos
+
+    def validadores(self, dominios):
+        """(etag, last_modified) de la representación actual del request"""
+        versiones = self._versiones()
+        hoy = date.today()
+        partes = [f'{self._despliegue:.0f}', hoy.isoformat(), str(session.get('user_id'))]
+        modificado = datetime.combine(hoy, dt_time.min)
+        for dominio in dominios:
+            fila = versiones.get(dominio)
+            partes.append(f"{dominio}:{fila['version'] if fila else 0}")
+            if fila and fila['fecha_actualizacion'] and fila['fecha_actualizacion'] > modificado:
+                modificado = fila['fecha_actualizacion']
+        etag = hashlib.sha1('|'.join(partes).encode('utf-8')).hexdigest()[:20]
+        despliegue = datetime.fromtimestamp(self._despliegue)
+        return etag, _utc(max(modificado, despliegue))
+
+    def __call__(self, *dominios):
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not self.activo or request.method not in ('GET', 'HEAD'):
+                    return f(*args, **kwargs)
+                try:
+                    etag, modificado = self.validadores(dominios)
+                except Exception as e:
+                    # Sin Versiones_Datos (scripts viejos): responder sin validadores
+                    print(f"[condicional] No se pudieron leer las versiones de datos: {e}")
+                    return f(*args, **kwargs)
+
+                if self._no_modificado(etag, modificado):
+                    self.respuestas_304 += 1
+                    return self._con_validadores(make_response('', 304), etag, modificado)
+
+                respuesta = make_response(f(*args, **kwargs))
+                if g.pop('_condicional_sin_validadores', False):
+                    self.respuestas_respaldo += 1
+                    respuesta.headers['Cache-Control'] = 'no-store'
+                elif respuesta.status_code == 200:
+                    self.respuestas_completas += 1
+                    self._con_validadores(respuesta, etag, modificado)
+                return respuesta
+            return decorated_function
+        return decorator
+
+    @staticmethod
+    def sin_validadores():
+        """La respuesta del request actual es un respaldo por error: no darle ETag"""
+        g._condicional_sin_validadores = True
+
+    @staticmethod
+    def _no_modificado(etag, modificado):
+        # If-None-Match tiene prioridad sobre If-Modified-Since (RFC 9110)
+        if request.if_none_match:
+            return request.if_none_match.contains(etag)
+        if request.if_modified_since and modificado:
+            return modificado <= request.if_modified_since
+        return False
+
+    @staticmethod
+    def _con_validadores(respuesta, etag, modificado):
+        respuesta.set_etag(etag)
+        respuesta.last_modified = modificado
+        respuesta.headers['Cache-Control'] = 'private, no-cache'
+        return respuesta
+
+    def estadisticas(self):
+        return {
+            'activo': self.activo,
+            'respuestas_304': self.respuestas_304,
+            'respuestas_completas': self.respuestas_completas,
+            'respuestas_respaldo': self.respuestas_respaldo,
+        }
@@ -17,7 +17,100 @@ class Config:
     MYSQL_PORT = int(os.environ.get('MYSQL_PORT') or 3306)
     MYSQL_CURSORCLASS = 'DictCursor'
     MYSQL_CHARSET = 'utf8mb4'
+    MYSQL_COLLATION = 'utf8mb4_unicode_ci'
     MYSQL_USE_UNICODE = True
+    MYSQL_SQL_MODE = os.environ.get('MYSQL_SQL_MODE') or None
+
+    # Pool de conexiones (ver db.py)
+    MYSQL_POOL_MIN_SIZE = int(os.environ.get('MYSQL_POOL_MIN_SIZE') or 2)
+    MYSQL_POOL_MAX_SIZE = int(os.environ.get('MYSQL_POOL_MAX_SIZE') or 10)
+    MYSQL_POOL_TIMEOUT = float(os.environ.get('MYSQL_POOL_TIMEOUT') or 10)       # segundos esperando conexión libre
+    MYSQL_POOL_RECYCLE = int(os.environ.get('MYSQL_POOL_RECYCLE') or 1800)       # segundos de vida por conexión
+    MYSQL_POOL_MAX_USES = int(os.environ.get('MYSQL_POOL_MAX_USES') or 5000)     # checkouts antes de reabrir
+    MYSQL_POOL_PRE_PING = True
+
+    # Réplica de solo lectura para reportes (rutas con @solo_lectura).
+    # Sin MYSQL_REPLICA_HOST todo va a la primaria; el resto de valores
+    # vacíos se toman de la primaria.
+    MYSQL_REPLICA_HOST = os.environ.get('MYSQL_REPLICA_HOST') or None
+    MYSQL_REPLICA_PORT = int(os.environ.get('MYSQL_REPLICA_PORT') or 0) or None
+    MYSQL_REPLICA_USER = os.environ.get('MYSQL_REPLICA_USER') or None
+    MYSQL_REPLICA_PASSWORD = os.environ.get('MYSQL_REPLICA_PASSWORD') or None
+    MYSQL_REPLICA_DB = os.environ.get('MYSQL_REPLICA_DB') or None
+    MYSQL_REPLICA_POOL_MAX_SIZE = int(os.environ.get('MYSQL_REPLICA_POOL_MAX_SIZE') or 0) or None
+    # Espera corta por una conexión de la réplica: si está agotada se usa la primaria
+    MYSQL_REPLICA_POOL_TIMEOUT = float(os.environ.get('MYSQL_REPLICA_POOL_TIMEOUT') or 0.2)
+
+    # Segundos que se conservan en memoria los catálogos de referencia (ver referencias.py)
+    REFERENCIAS_TTL = int(os.environ.get('REFERENCIAS_TTL') or 300)
+
+    # Cache del catálogo público (ver catalogo_cache.py)
+    CATALOGO_CACHE_TTL = int(os.environ.get('CATALOGO_CACHE_TTL') or 600)
+    CATALOGO_CACHE_VERIFICAR_SEG = float(os.environ.get('CATALOGO_CACHE_VERIFICAR_SEG') or 5)
+
+    # Paginación del catálogo (/api/catalogo, /api/ventas/catalogo)
+    CATALOGO_PAGINA_TAMANO = int(os.environ.get('CATALOGO_PAGINA_TAMANO') or 24)
+    CATALOGO_PAGINA_MAX = int(os.environ.get('CATALOGO_PAGINA_MAX') or 100)
+
+    # Búsqueda de productos (/api/productos/buscar, ver busqueda.py)
+    BUSQUEDA_LIMITE = int(os.environ.get('BUSQUEDA_LIMITE') or 20)
+    BUSQUEDA_LIMITE_MAX = int(os.environ.get('BUSQUEDA_LIMITE_MAX') or 50)
+
+    # Días sin cambios tras los que vence un carrito (ver carrito.py)
+    CARRITO_TTL_DIAS = int(os.environ.get('CARRITO_TTL_DIAS') or 7)
+
+    # Minutos que un carrito aparta existencias y tamaño de lote al limpiar
+    # las reservas vencidas (ver carrito.py)
+    RESERVA_STOCK_MINUTOS = int(os.environ.get('RESERVA_STOCK_MINUTOS') or 15)
+    RESERVA_STOCK_LOTE_LIMPIEZA = int(os.environ.get('RESERVA_STOCK_LOTE_LIMPIEZA') or 1000)
+
+    # Cómo se reparte un producto entre sucursales al reservar y al crear
+    # pedidos: 'mayor_existencia' o 'menos_sucursales' (ver surtidoAsignar)
+    SURTIDO_POLITICA = os.environ.get('SURTIDO_POLITICA') or 'mayor_existencia'
+
+    # Idempotency-Key en checkout, alta de pedidos y pagos (ver idempotencia.py):
+    # horas que se guarda la respuesta (una clave que se quedó 'En proceso'
+    # responde 409 hasta entonces) y tamaño de lote al limpiar
+    IDEMPOTENCIA_TTL_HORAS = int(os.environ.get('IDEMPOTENCIA_TTL_HORAS') or 24)
+    IDEMPOTENCIA_LOTE_LIMPIEZA = int(os.environ.get('IDEMPOTENCIA_LOTE_LIMPIEZA') or 1000)
+
+    # Cola de facturas del checkout (ver facturacion.py): intentos antes de
+    # dejar un trabajo en 'Error', segundos de espera del primer reintento
+    # (se duplica en cada uno), segundos tras los que un trabajo 'En proceso'
+    # se da por abandonado y trabajos que toma el worker por lote
+    FACTURAS_MAX_INTENTOS = int(os.environ.get('FACTURAS_MAX_INTENTOS') or 5)
+    FACTURAS_ESPERA_SEGUNDOS = int(os.environ.get('FACTURAS_ESPERA_SEGUNDOS') or 60)
+    FACTURAS_PROCESO_SEGUNDOS = int(os.environ.get('FACTURAS_PROCESO_SEGUNDOS') or 300)
+    FACTURAS_LOTE = int(os.environ.get('FACTURAS_LOTE') or 50)
+
+    # Argon2 (ver contrasenas.py): parámetros de los hashes nuevos (sugerirlos
+    # con scripts/benchmark_argon2.py), hashes simultáneos y segundos que un
+    # request espera cupo antes de responder 503
+    ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST') or 3)
+    ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST') or 65536)    # KiB
+    ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM') or 4)
+    ARGON2_CONCURRENCIA = int(os.environ.get('ARGON2_CONCURRENCIA') or 2)
+    ARGON2_ESPERA_SEGUNDOS = float(os.environ.get('ARGON2_ESPERA_SEGUNDOS') or 5)
+
+    # Límite de intentos de inicio de sesión (ver limite_login.py): fichas
+    # por cubeta (ráfaga permitida) y fichas que se recuperan por minuto,
+    # por IP y por nombre de usuario. LOGIN_LIMITE_COMPARTIDO aplica además
+    # el límite entre workers con la tabla Limites_Login
+    LOGIN_LIMITE_IP_CAPACIDAD = int(os.environ.get('LOGIN_LIMITE_IP_CAPACIDAD') or 20)
+    LOGIN_LIMITE_IP_POR_MINUTO = float(os.environ.get('LOGIN_LIMITE_IP_POR_MINUTO') or 10)
+    LOGIN_LIMITE_USUARIO_CAPACIDAD = int(os.environ.get('LOGIN_LIMITE_USUARIO_CAPACIDAD') or 5)
+    LOGIN_LIMITE_USUARIO_POR_MINUTO = float(os.environ.get('LOGIN_LIMITE_USUARIO_POR_MINUTO') or 2)
+    LOGIN_LIMITE_COMPARTIDO = True
+    LOGIN_LIMITE_LOTE_LIMPIEZA = int(os.environ.get('LOGIN_LIMITE_LOTE_LIMPIEZA') or 1000)
+
+    # GET condicionales (ETag / Last-Modified) en catálogo y reportes (ver condicional.py)
+    HTTP_CONDICIONAL = True
+
+    # Instrumentación SQL (ver instrumentacion.py)
+    SQL_INSTRUMENTACION = True
+    SQL_SLOW_REQUEST_MS = float(os.environ.get('SQL_SLOW_REQUEST_MS') or 500)
+    SQL_SLOW_CALL_MS = float(os.environ.get('SQL_SLOW_CALL_MS') or 200)
+    SQL_SLOW_LOG_FILE = os.environ.get('SQL_SLOW_LOG_FILE') or None
 
 class DevelopmentConfig(Config):
     """Configuración para desarrollo"""
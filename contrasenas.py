@@ -0,0 +1,105 @@
+"""
+Hash y verificación de contraseñas con Argon2 en un ejecutor acotado.
+
+Cada verificación de Argon2 ocupa CPU y `memory_cost` KiB durante decenas de
+milisegundos. Hecha en el hilo del request, una ráfaga de inicios de sesión
+(apertura de tienda) deja sin CPU al catálogo y al checkout. Aquí los
+hashes corren en un ThreadPoolExecutor de `max_concurrentes` hilos (la
+biblioteca de Argon2 suelta el GIL mientras calcula) y cada request espera
+cupo como máximo `espera` segundos; si no lo consigue se lanza
+ContrasenasOcupadasError y la ruta responde 503 en lugar de encolar más
+trabajo.
+
+Los parámetros (time_cost, memory_cost, parallelism) vienen de la
+configuración; `scripts/benchmark_argon2.py` sugiere valores para una
+latencia objetivo. Al iniciar sesión, `rehash()` rehace con los parámetros
+vigentes los hashes que se hicieron con otros.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
+
+
+class ContrasenasOcupadasError(Exception):
+    """No hubo cupo en el ejecutor de Argon2 dentro del tiempo de espera"""
+
+
+class HasherContrasenas:
+    """PasswordHasher compartido con concurrencia limitada"""
+
+    def __init__(self, time_cost=3, memory_cost=65536, parallelism=4,
+                 max_concurrentes=2, espera=5):
+        self.ph = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        self.espera = espera
+        self._cupos = threading.BoundedSemaphore(max_concurrentes)
+        self._ejecutor = ThreadPoolExecutor(max_workers=max_concurrentes, thread_name_prefix='argon2')
+        self._lock = threading.Lock()
+        self.max_concurrentes = max_concurrentes
+        self.operaciones = 0
+        self.rechazadas = 0
+        self.rehashes = 0
+        self.espera_ms_total = 0.0
+        self.calculo_ms_total = 0.0
+
+    def _ejecutar(self, funcion, *args):
+        inicio = time.perf_counter()
+        # El semáforo tiene tantos cupos como hilos: el ejecutor nunca
+        # acumula cola propia y la espera queda acotada aquí
+        if not self._cupos.acquire(timeout=self.espera):
+            with self._lock:
+                self.rechazadas += 1
+            raise ContrasenasOcupadasError(
+                f'Sin cupo para Argon2 en {self.espera}s ({self.max_concurrentes} en curso)'
+            )
+        adquirido = time.perf_counter()
+        try:
+            return self._ejecutor.submit(funcion, *args).result()
+        finally:
+            self._cupos.release()
+            fin = time.perf_counter()
+            with self._lock:
+                self.operaciones += 1
+                self.espera_ms_total += (adquirido - inicio) * 1000
+                self.calculo_ms_total += (fin - adquirido) * 1000
+
+    def hash(self, contrasena):
+        return self._ejecutar(self.ph.hash, contrasena)
+
+    def verificar(self, hash_bd, contrasena):
+        """True si la contraseña coincide; False si no o si el hash no es de Argon2"""
+        try:
+            return self._ejecutar(self.ph.verify, hash_bd, contrasena)
+        except (VerifyMismatchError, InvalidHashError):
+            return False
+
+    def rehash(self, hash_bd, contrasena):
+        """
+        Tras verificar `contrasena`: hash nuevo con los parámetros vigentes si
+        `hash_bd` se hizo con otros, o None si no hace falta
+        """
+        if not self.ph.check_needs_rehash(hash_bd):
+            return None
+        nuevo = self.hash(contrasena)
+        with self._lock:
+            self.rehashes += 1
+        return nuevo
+
+    def estadisticas(self):
+        with self._lock:
+            operaciones = self.operaciones
+            return {
+                'max_concurrentes': self.max_concurrentes,
+                'parametros': {
+                    'time_cost': self.ph.time_cost,
+                    'memory_cost': self.ph.memory_cost,
+                    'parallelism': self.ph.parallelism,
+                },
+                'operaciones': operaciones,
+                'rechazadas': self.rechazadas,
+                'rehashes': self.rehashes,
+                'espera_ms_promedio': round(self.espera_ms_total / operaciones, 2) if operaciones else 0,
+                'calculo_ms_promedio': round(self.calculo_ms_total / operaciones, 2) if operaciones else 0,
+            }
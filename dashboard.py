@@ -0,0 +1,98 @@
+"""
+Dashboards por panel en una sola petición (/api/dashboard/<panel>).
+
+Al cargar, cada dashboard (admin, finanzas, inventario, auditor) pedía cada
+widget a su propio endpoint: 3 a 5 peticiones, cada una con su decodificación
+de sesión, su conexión del pool y sus SP en serie. Cada panel declara aquí
+qué roles lo ven, de qué dominios de datos depende (para @condicional) y si
+puede leer de la réplica; sus widgets son las mismas funciones que atienden
+los endpoints individuales y devuelven (datos, estado HTTP).
+
+`componer` corre los widgets del panel en el mismo request: comparten la
+conexión, la verificación de sesión y rol, las versiones de datos que lee
+@condicional y los SP de solo lectura que repiten entre ellos (`sp_uno`).
+Los endpoints individuales siguen disponibles (filtros, recargas).
+"""
+from flask import g
+
+
+class Panel:
+    """Definición de un dashboard: roles con acceso, dominios y widgets en orden"""
+
+    __slots__ = ('nombre', 'roles', 'dominios', 'solo_lectura', 'widgets')
+
+    def __init__(self, nombre, roles, dominios=(), solo_lectura=False):
+        self.nombre = nombre
+        self.roles = tuple(r.lower() for r in roles)
+        self.dominios = tuple(dominios)
+        self.solo_lectura = solo_lectura
+        self.widgets = {}
+
+    def permite(self, rol):
+        return (rol or '').lower() in self.roles
+
+
+class Dashboards:
+    """Registro de paneles y composición de sus widgets en un solo documento"""
+
+    def __init__(self, mysql):
+        self.mysql = mysql
+        self._paneles = {}
+        self.composiciones = 0
+        self.widgets_con_error = 0
+        self.sp_reutilizados = 0
+
+    def panel(self, nombre, roles, dominios=(), solo_lectura=False):
+        self._paneles[nombre] = Panel(nombre, roles, dominios, solo_lectura)
+
+    def widget(self, panel, nombre):
+        """Decorador: registra una función `() -> (datos, estado)` como widget del panel"""
+        def decorador(func):
+            self._paneles[panel].widgets[nombre] = func
+            return func
+        return decorador
+
+    def obtener(self, nombre):
+        return self._paneles.get(nombre)
+
+    def sp_uno(self, nombre, params=()):
+        """
+        mysql.ejecutar_sp_uno memorizado durante el request: dos widgets que
+        consultan el mismo SP de solo lectura lo ejecutan una sola vez
+        """
+        memo = g.setdefault('_dashboard_sp', {})
+        clave = (nombre, tuple(params))
+        if clave in memo:
+            self.sp_reutilizados += 1
+        else:
+            memo[clave] = self.mysql.ejecutar_sp_uno(nombre, list(params))
+        return memo[clave]
+
+    def componer(self, panel):
+        """
+        {'panel', 'widgets': {nombre: datos}, 'errores': [nombres]}; un widget
+        que falla deja sus datos de respaldo (None si lanzó una excepción) y
+        aparece en 'errores', sin impedir que se compongan los demás
+        """
+        widgets = {}
+        errores = []
+        for nombre, func in panel.widgets.items():
+            try:
+                datos, estado = func()
+            except Exception as e:
+                print(f"Error en widget {panel.nombre}/{nombre}: {e}")
+                datos, estado = None, 500
+            widgets[nombre] = datos
+            if estado != 200:
+                errores.append(nombre)
+        self.composiciones += 1
+        self.widgets_con_error += len(errores)
+        return {'panel': panel.nombre, 'widgets': widgets, 'errores': errores}
+
+    def estadisticas(self):
+        return {
+            'paneles': {nombre: list(p.widgets) for nombre, p in self._paneles.items()},
+            'composiciones': self.composiciones,
+            'widgets_con_error': self.widgets_con_error,
+            'sp_reutilizados': self.sp_reutilizados,
+        }
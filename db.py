@@ -0,0 +1,618 @@
+"""
+Pool de conexiones a MariaDB para la aplicación.
+
+Reemplaza a flask_mysqldb.MySQL: en lugar de abrir una conexión nueva por
+cada request (handshake TCP + autenticación) se reutilizan conexiones de un
+pool con tamaño mínimo/máximo, tiempo de espera al pedir conexión,
+verificación (ping) antes de entregarla y reciclado por número de usos o
+antigüedad. La configuración de sesión (charset, SET NAMES, sql_mode) se
+hace una sola vez cuando se abre cada conexión; el estado que deja cada
+request (transacción, tablas temporales, variables de usuario) se limpia al
+devolverla (REINICIO_SESION).
+
+También ofrece `ejecutar_sp`, que llama un stored procedure, devuelve todos
+sus result sets y deja la conexión limpia. El tiempo y las filas por SP se
+registran en la conexión del request (ConexionEstadisticasSP), así que cubren
+tanto `ejecutar_sp` como las rutas que todavía usan `cursor.callproc` directo.
+
+Mantiene la misma interfaz que usa app.py (`mysql.connection`), por lo que
+las rutas no necesitan cambios.
+"""
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+import MySQLdb
+import MySQLdb.cursors
+from flask import g
+
+from instrumentacion import ConexionInstrumentada, metricas_actuales
+
+
+# Estado de sesión que crean app.py y los SP y que no debe pasar al siguiente
+# request al reutilizar la conexión (antes se perdía al cerrarla). mysqlclient
+# no expone COM_RESET_CONNECTION, así que se limpia por nombre: agregar aquí
+# toda tabla temporal o variable de usuario nueva.
+REINICIO_SESION = (
+    'DROP TEMPORARY TABLE IF EXISTS TmpPedidos, TmpItems_Pedido, TmpFacturacion, '
+    'TmpSurtido, TmpSurtidoLineas, TmpTrabajosTomados, TmpTop_Productos',
+    'SET @pedido_detalles_surtido = NULL, @sql = NULL',
+)
+
+
+class PoolAgotadoError(Exception):
+    """No hubo conexión libre dentro del tiempo de espera configurado"""
+
+
+class _ConexionPool:
+    """Conexión física del pool con sus datos de reciclado"""
+
+    __slots__ = ('conn', 'creada', 'usos')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.creada = time.monotonic()
+        self.usos = 0
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones thread-safe.
+
+    - min_size: conexiones que se abren al iniciar y que se mantienen.
+    - max_size: límite de conexiones abiertas (nunca se supera max_connections).
+    - timeout: segundos que se espera una conexión libre antes de fallar.
+    - recycle: segundos de vida de una conexión antes de reabrirla (0 = nunca).
+    - max_usos: checkouts por conexión antes de reabrirla (0 = sin límite).
+    - pre_ping: hacer ping antes de entregar una conexión ociosa.
+    - reinicio: sentencias que limpian la sesión al devolver la conexión.
+    """
+
+    def __init__(self, conectar, min_size=1, max_size=10, timeout=10,
+                 recycle=3600, max_usos=0, pre_ping=True, reinicio=()):
+        if max_size < 1:
+            raise ValueError('max_size debe ser al menos 1')
+        self._conectar = conectar
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.max_usos = max_usos
+        self.pre_ping = pre_ping
+        self.reinicio = tuple(reinicio)
+
+        self._libres = deque()
+        self._abiertas = 0
+        self._cond = threading.Condition(threading.Lock())
+
+        # Estadísticas simples para diagnóstico
+        self.total_checkouts = 0
+        self.total_creadas = 0
+        self.total_descartadas = 0
+        self.total_esperas_agotadas = 0
+
+    # ---------- ciclo de vida de conexiones físicas ----------
+
+    def _abrir(self):
+        conn = self._conectar()
+        self.total_creadas += 1
+        return _ConexionPool(conn)
+
+    def _cerrar(self, entrada):
+        self.total_descartadas += 1
+        try:
+            entrada.conn.close()
+        except Exception:
+            pass
+
+    def _expirada(self, entrada):
+        if self.recycle and time.monotonic() - entrada.creada >= self.recycle:
+            return True
+        if self.max_usos and entrada.usos >= self.max_usos:
+            return True
+        return False
+
+    def _viva(self, entrada):
+        try:
+            entrada.conn.ping()
+            return True
+        except Exception:
+            return False
+
+    def llenar(self):
+        """Abre conexiones hasta alcanzar min_size"""
+        while True:
+            with self._cond:
+                if self._abiertas >= self.min_size:
+                    return
+                self._abiertas += 1
+            try:
+                entrada = self._abrir()
+            except Exception:
+                with self._cond:
+                    self._abiertas -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._libres.append(entrada)
+                self._cond.notify()
+
+    # ---------- checkout / checkin ----------
+
+    def checkout(self):
+        """Entrega una conexión sana del pool (o abre una nueva si hay cupo)"""
+        limite = time.monotonic() + self.timeout
+        entrada = None
+        with self._cond:
+            while not self._libres and self._abiertas >= self.max_size:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self.total_esperas_agotadas += 1
+                    raise PoolAgotadoError(
+                        f'No hay conexiones libres tras {self.timeout}s '
+                        f'(max_size={self.max_size})'
+                    )
+                self._cond.wait(restante)
+            if self._libres:
+                # LIFO: la más reciente es la que más probablemente siga viva
+                entrada = self._libres.pop()
+            else:
+                self._abiertas += 1
+
+        if entrada is None:
+            try:
+                entrada = self._abrir()
+            except Exception:
+                with self._cond:
+                    self._abiertas -= 1
+                    self._cond.notify()
+                raise
+        elif self._expirada(entrada) or (self.pre_ping and not self._viva(entrada)):
+            # Reabrir en el mismo cupo; si falla, liberar el cupo y propagar el error
+            self._cerrar(entrada)
+            try:
+                entrada = self._abrir()
+            except Exception:
+                with self._cond:
+                    self._abiertas -= 1
+                    self._cond.notify()
+                raise
+
+        entrada.usos += 1
+        self.total_checkouts += 1
+        return entrada
+
+    def _reiniciar(self, conn):
+        """Descarta la transacción pendiente y el estado de sesión del request"""
+        conn.rollback()
+        if not self.reinicio:
+            return
+        cursor = conn.cursor()
+        try:
+            for sentencia in self.reinicio:
+                cursor.execute(sentencia)
+        finally:
+            cursor.close()
+
+    def checkin(self, entrada, descartar=False):
+        """Devuelve una conexión al pool sin transacción ni estado de sesión del request"""
+        if not descartar:
+            try:
+                # rollback() solo descarta la transacción: las tablas temporales
+                # y variables de usuario siguen vivas en la conexión reutilizada
+                self._reiniciar(entrada.conn)
+            except Exception:
+                descartar = True
+
+        if descartar or self._expirada(entrada):
+            self._cerrar(entrada)
+            with self._cond:
+                self._abiertas -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._libres.append(entrada)
+            self._cond.notify()
+
+    def cerrar_todo(self):
+        """Cierra las conexiones ociosas (las prestadas se cierran al devolverse)"""
+        with self._cond:
+            libres = list(self._libres)
+            self._libres.clear()
+            self._abiertas -= len(libres)
+            self._cond.notify_all()
+        for entrada in libres:
+            self._cerrar(entrada)
+
+    def estadisticas(self):
+        with self._cond:
+            return {
+                'abiertas': self._abiertas,
+                'libres': len(self._libres),
+                'en_uso': self._abiertas - len(self._libres),
+                'max_size': self.max_size,
+                'checkouts': self.total_checkouts,
+                'creadas': self.total_creadas,
+                'descartadas': self.total_descartadas,
+                'esperas_agotadas': self.total_esperas_agotadas,
+            }
+
+
+class EstadisticasSP:
+    """Tiempo acumulado y filas devueltas por nombre de stored procedure"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_sp = {}
+
+    def registrar(self, nombre, segundos, filas):
+        with self._lock:
+            est = self._por_sp.get(nombre)
+            if est is None:
+                est = self._por_sp[nombre] = {
+                    'llamadas': 0, 'errores': 0, 'tiempo_total': 0.0,
+                    'tiempo_max': 0.0, 'filas_total': 0,
+                }
+            est['llamadas'] += 1
+            est['tiempo_total'] += segundos
+            est['tiempo_max'] = max(est['tiempo_max'], segundos)
+            if filas is None:
+                est['errores'] += 1
+            else:
+                est['filas_total'] += filas
+
+    def resumen(self):
+        """Copia de las estadísticas ordenada por tiempo total (el más lento primero)"""
+        with self._lock:
+            filas = []
+            for nombre, est in self._por_sp.items():
+                fila = dict(est, sp=nombre)
+                fila['tiempo_promedio'] = est['tiempo_total'] / est['llamadas'] if est['llamadas'] else 0.0
+                filas.append(fila)
+        return sorted(filas, key=lambda f: f['tiempo_total'], reverse=True)
+
+    def reiniciar(self):
+        with self._lock:
+            self._por_sp.clear()
+
+
+class CursorEstadisticasSP:
+    """
+    Envoltorio de cursor que registra en EstadisticasSP cada `callproc`: el
+    tiempo de la llamada más el de sus `nextset` y las filas de todos sus
+    result sets. La llamada se da por terminada al empezar otra en el mismo
+    cursor, al cerrarlo o al devolver la conexión al pool.
+    """
+
+    def __init__(self, cursor, estadisticas, pendientes):
+        self._cursor = cursor
+        self._estadisticas = estadisticas
+        self._pendientes = pendientes
+        self._llamada = None
+
+    def _sumar_filas(self):
+        if self._llamada is not None and self._cursor.description is not None:
+            filas = self._cursor.rowcount
+            if filas and filas > 0:
+                self._llamada[2] += filas
+
+    def terminar(self):
+        """Registra la llamada en curso (si la hay)"""
+        llamada, self._llamada = self._llamada, None
+        if llamada is not None:
+            self._pendientes.discard(self)
+            self._estadisticas.registrar(*llamada)
+
+    def callproc(self, procname, args=()):
+        self.terminar()
+        inicio = time.perf_counter()
+        try:
+            resultado = self._cursor.callproc(procname, args)
+        except Exception:
+            self._estadisticas.registrar(procname, time.perf_counter() - inicio, None)
+            raise
+        # [nombre, segundos, filas]
+        self._llamada = [procname, time.perf_counter() - inicio, 0]
+        self._pendientes.add(self)
+        self._sumar_filas()
+        return resultado
+
+    def execute(self, query, args=None):
+        self.terminar()
+        return self._cursor.execute(query, args)
+
+    def executemany(self, query, args):
+        self.terminar()
+        return self._cursor.executemany(query, args)
+
+    def nextset(self):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.nextset()
+        except Exception:
+            # El SP falló en una sentencia posterior: cuenta como error
+            if self._llamada is not None:
+                self._llamada[2] = None
+            raise
+        finally:
+            if self._llamada is not None:
+                self._llamada[1] += time.perf_counter() - inicio
+                if self._llamada[2] is None:
+                    self.terminar()
+                else:
+                    self._sumar_filas()
+
+    def close(self):
+        self.terminar()
+        return self._cursor.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+
+class ConexionEstadisticasSP:
+    """Envoltorio de la conexión del pool cuyo cursor() registra los SP en EstadisticasSP"""
+
+    def __init__(self, conexion, estadisticas):
+        self._conexion = conexion
+        self._estadisticas = estadisticas
+        self._pendientes = set()
+
+    def cursor(self, *args, **kwargs):
+        return CursorEstadisticasSP(self._conexion.cursor(*args, **kwargs),
+                                    self._estadisticas, self._pendientes)
+
+    def terminar(self):
+        """Registra las llamadas de cursores que nunca se cerraron"""
+        for cursor in list(self._pendientes):
+            cursor.terminar()
+
+    def __getattr__(self, nombre):
+        return getattr(self._conexion, nombre)
+
+
+def ejecutar_sp(conexion, nombre, params=None, estadisticas=None):
+    """
+    Ejecuta un stored procedure y devuelve TODOS sus result sets como listas
+    (una lista de filas dict por cada SELECT del SP, en orden).
+
+    Siempre consume los result sets pendientes y cierra el cursor, incluso si
+    el SP falla a la mitad, para que la conexión no quede en estado
+    "Commands out of sync".
+
+    `estadisticas` es para conexiones sueltas; la conexión del request
+    (`mysql.connection`) ya registra sus SP por sí misma.
+    """
+    cursor = conexion.cursor(MySQLdb.cursors.DictCursor)
+    resultados = []
+    inicio = time.perf_counter()
+    try:
+        cursor.callproc(nombre, list(params or []))
+        while True:
+            # El último "result set" de un CALL es el estado, sin columnas
+            if cursor.description is not None:
+                resultados.append(list(cursor.fetchall()))
+            if not cursor.nextset():
+                break
+    except Exception:
+        if estadisticas is not None:
+            estadisticas.registrar(nombre, time.perf_counter() - inicio, None)
+        raise
+    finally:
+        try:
+            while cursor.nextset():
+                pass
+        except Exception:
+            pass
+        cursor.close()
+
+    if estadisticas is not None:
+        estadisticas.registrar(nombre, time.perf_counter() - inicio,
+                               sum(len(rs) for rs in resultados))
+    return resultados
+
+
+def solo_lectura(func):
+    """
+    Declara una ruta como de solo lectura: sus consultas van a la réplica
+    configurada en MYSQL_REPLICA_HOST (si no hay réplica, a la primaria).
+    Solo debe usarse en rutas que no escriben ni necesitan leer sus propias
+    escrituras recientes.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        g._mysql_destino = 'replica'
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class MySQLPool:
+    """
+    Extensión de Flask compatible con flask_mysqldb.MySQL.
+
+    `mysql.connection` entrega la conexión del pool asignada al contexto de
+    la aplicación actual; al terminar el contexto se devuelve al pool. Las
+    rutas marcadas con @solo_lectura reciben una conexión de la réplica.
+    """
+
+    # Claves de conexión que la réplica puede sobreescribir (MYSQL_REPLICA_<CLAVE>)
+    _CLAVES_REPLICA = ('HOST', 'PORT', 'USER', 'PASSWORD', 'DB',
+                       'POOL_MIN_SIZE', 'POOL_MAX_SIZE', 'POOL_TIMEOUT')
+
+    def __init__(self, app=None):
+        self.app = app
+        self.pool = None
+        self.pool_replica = None
+        self.estadisticas_sp = EstadisticasSP()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MYSQL_HOST', 'localhost')
+        app.config.setdefault('MYSQL_USER', None)
+        app.config.setdefault('MYSQL_PASSWORD', None)
+        app.config.setdefault('MYSQL_DB', None)
+        app.config.setdefault('MYSQL_PORT', 3306)
+        app.config.setdefault('MYSQL_CONNECT_TIMEOUT', 10)
+        app.config.setdefault('MYSQL_CHARSET', 'utf8mb4')
+        app.config.setdefault('MYSQL_COLLATION', 'utf8mb4_unicode_ci')
+        app.config.setdefault('MYSQL_USE_UNICODE', True)
+        app.config.setdefault('MYSQL_SQL_MODE', None)
+        app.config.setdefault('MYSQL_CURSORCLASS', None)
+        app.config.setdefault('MYSQL_POOL_MIN_SIZE', 1)
+        app.config.setdefault('MYSQL_POOL_MAX_SIZE', 10)
+        app.config.setdefault('MYSQL_POOL_TIMEOUT', 10)
+        app.config.setdefault('MYSQL_POOL_RECYCLE', 3600)
+        app.config.setdefault('MYSQL_POOL_MAX_USES', 0)
+        app.config.setdefault('MYSQL_POOL_PRE_PING', True)
+        app.config.setdefault('MYSQL_REPLICA_HOST', None)
+        # La réplica no espera el timeout completo: si no hay conexión libre
+        # enseguida, el request sigue en la primaria
+        app.config.setdefault('MYSQL_REPLICA_POOL_TIMEOUT', 0.2)
+        for clave in self._CLAVES_REPLICA[1:]:
+            app.config.setdefault(f'MYSQL_REPLICA_{clave}', None)
+
+        self.app = app
+        cfg = app.config
+
+        self.pool = self._crear_pool(self._parametros(cfg, replica=False))
+        if cfg['MYSQL_REPLICA_HOST']:
+            self.pool_replica = self._crear_pool(self._parametros(cfg, replica=True))
+        app.extensions['mysql_pool'] = self
+        app.teardown_appcontext(self.teardown)
+
+    def _parametros(self, cfg, replica):
+        """Config de la primaria; para la réplica, sus MYSQL_REPLICA_* con respaldo en la primaria"""
+        params = {clave[len('MYSQL_'):]: valor for clave, valor in cfg.items()
+                  if clave.startswith('MYSQL_') and not clave.startswith('MYSQL_REPLICA_')}
+        if replica:
+            for clave in self._CLAVES_REPLICA:
+                valor = cfg.get(f'MYSQL_REPLICA_{clave}')
+                if valor is not None:
+                    params[clave] = valor
+        return params
+
+    def _crear_pool(self, params):
+        return ConnectionPool(
+            lambda: self._conectar(params),
+            min_size=params['POOL_MIN_SIZE'],
+            max_size=params['POOL_MAX_SIZE'],
+            timeout=params['POOL_TIMEOUT'],
+            recycle=params['POOL_RECYCLE'],
+            max_usos=params['POOL_MAX_USES'],
+            pre_ping=params['POOL_PRE_PING'],
+            reinicio=REINICIO_SESION,
+        )
+
+    @staticmethod
+    def _conectar(params):
+        """Abre una conexión física y aplica la configuración de sesión una sola vez"""
+        kwargs = {
+            'host': params['HOST'],
+            'port': int(params['PORT']),
+            'connect_timeout': params['CONNECT_TIMEOUT'],
+            'use_unicode': params['USE_UNICODE'],
+            'charset': params['CHARSET'],
+        }
+        if params['USER']:
+            kwargs['user'] = params['USER']
+        if params['PASSWORD']:
+            kwargs['passwd'] = params['PASSWORD']
+        if params['DB']:
+            kwargs['db'] = params['DB']
+        if params['SQL_MODE']:
+            kwargs['sql_mode'] = params['SQL_MODE']
+        if params['CURSORCLASS']:
+            kwargs['cursorclass'] = getattr(MySQLdb.cursors, params['CURSORCLASS'])
+
+        conn = MySQLdb.connect(**kwargs)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SET NAMES {params['CHARSET']} COLLATE {params['COLLATION']}")
+        finally:
+            cursor.close()
+        return conn
+
+    def precalentar(self):
+        """Abre las conexiones mínimas de los pools (llamar al arrancar la app)"""
+        self.pool.llenar()
+        if self.pool_replica is not None:
+            self.pool_replica.llenar()
+
+    def _checkout(self, destino):
+        """
+        Toma una conexión del pool del destino; si la réplica no responde o
+        está agotada tras MYSQL_REPLICA_POOL_TIMEOUT, usa la primaria
+        """
+        if destino == 'replica' and self.pool_replica is not None:
+            try:
+                return 'replica', self.pool_replica.checkout()
+            except Exception as e:
+                print(f"[pool] Réplica no disponible, usando primaria: {e}")
+        return 'primaria', self.pool.checkout()
+
+    @property
+    def connection(self):
+        """Conexión del pool asignada al contexto actual"""
+        conexion = g.get('_mysql_conexion')
+        if conexion is None:
+            origen, entrada = self._checkout(g.get('_mysql_destino', 'primaria'))
+            g._mysql_pool_entrada = (origen, entrada)
+            conexion = ConexionEstadisticasSP(entrada.conn, self.estadisticas_sp)
+            g._mysql_conexion_sp = conexion
+            # Medir callproc/execute si el request tiene métricas activas
+            metricas = metricas_actuales()
+            if metricas is not None:
+                conexion = ConexionInstrumentada(conexion, metricas)
+            g._mysql_conexion = conexion
+        return conexion
+
+    @property
+    def en_replica(self):
+        """True si la conexión del request actual viene de la réplica"""
+        entrada = g.get('_mysql_pool_entrada')
+        return entrada is not None and entrada[0] == 'replica'
+
+    def ejecutar_sp(self, nombre, params=None):
+        """Ejecuta un SP en la conexión del request; devuelve la lista de result sets"""
+        return ejecutar_sp(self.connection, nombre, params)
+
+    def ejecutar_sp_filas(self, nombre, params=None):
+        """Atajo: solo el primer result set del SP (lista vacía si no devolvió filas)"""
+        resultados = self.ejecutar_sp(nombre, params)
+        return resultados[0] if resultados else []
+
+    def ejecutar_sp_uno(self, nombre, params=None):
+        """Atajo: primera fila del primer result set, o None"""
+        filas = self.ejecutar_sp_filas(nombre, params)
+        return filas[0] if filas else None
+
+    def estadisticas(self):
+        """Estado de los pools para diagnóstico"""
+        return {
+            'primaria': self.pool.estadisticas(),
+            'replica': self.pool_replica.estadisticas() if self.pool_replica is not None else None,
+        }
+
+    def teardown(self, exception):
+        g.pop('_mysql_conexion', None)
+        g.pop('_mysql_destino', None)
+        conexion_sp = g.pop('_mysql_conexion_sp', None)
+        if conexion_sp is not None:
+            conexion_sp.terminar()
+        entrada = g.pop('_mysql_pool_entrada', None)
+        if entrada is not None:
+            origen, entrada = entrada
+            pool = self.pool_replica if origen == 'replica' else self.pool
+            pool.checkin(entrada)
@@ -0,0 +1,111 @@
+"""
+Cola de facturación diferida.
+
+El checkout con factura ya no llama a pedidoFacturar dentro de la misma
+transacción: pedidoCheckout deja el pedido en Facturacion_Trabajos y
+responde de inmediato con `estado_factura: 'Pendiente'`. El worker
+(`flask --app app facturar-pendientes`) toma trabajos por lotes
+(facturacionTrabajosTomar, con SKIP LOCKED para que varios workers no se
+estorben) y genera cada factura en su propia transacción
+(facturacionTrabajoEjecutar).
+
+- Si una factura falla, el pedido no se pierde: el trabajo vuelve a
+  'Pendiente' y se reintenta tras `espera` segundos, duplicando la espera en
+  cada intento; al llegar a `max_intentos` queda en 'Error' con el mensaje en
+  ultimo_error.
+- Un trabajo 'En proceso' sin avance en `ttl_proceso` segundos (worker
+  caído) lo puede retomar otro worker; si la factura ya existía solo se
+  marca como completado.
+- La factura se emite por el total que se cobró en el checkout (guardado
+  en el trabajo), no por los precios vigentes cuando corre el worker. Si el
+  pedido se canceló mientras esperaba, el trabajo queda 'Cancelado' sin
+  factura.
+- El cliente consulta el estado con `estado_pedido()` (facturaEstadoPedido).
+"""
+
+
+class ColaFacturas:
+    """Worker de la cola Facturacion_Trabajos (requiere contexto de aplicación)"""
+
+    def __init__(self, mysql, max_intentos=5, espera=60, ttl_proceso=300):
+        self.mysql = mysql
+        self.max_intentos = max_intentos
+        self.espera = espera
+        self.ttl_proceso = ttl_proceso
+        self.completados = 0
+        self.reintentos = 0
+        self.errores = 0
+        self.cancelados = 0
+
+    def _tomar(self, lote):
+        try:
+            filas = self.mysql.ejecutar_sp_filas('facturacionTrabajosTomar', [lote, self.ttl_proceso])
+            self.mysql.connection.commit()
+        except Exception:
+            self.mysql.connection.rollback()
+            raise
+        return filas
+
+    def _ejecutar(self, id_trabajo):
+        try:
+            fila = self.mysql.ejecutar_sp_uno('facturacionTrabajoEjecutar', [
+                id_trabajo, self.max_intentos, self.espera
+            ])
+            self.mysql.connection.commit()
+        except Exception:
+            self.mysql.connection.rollback()
+            raise
+        return fila
+
+    def procesar_pendientes(self, lote=50):
+        """
+        Factura los trabajos listos en lotes de `lote` hasta vaciar la cola;
+        devuelve {'completados', 'reintentos', 'errores', 'cancelados'} de
+        esta pasada
+        """
+        resultado = {'completados': 0, 'reintentos': 0, 'errores': 0, 'cancelados': 0}
+        while True:
+            trabajos = self._tomar(lote)
+            for trabajo in trabajos:
+                fila = self._ejecutar(trabajo['id_trabajo'])
+                estado = fila['estado'] if fila else None
+                if estado == 'Completado':
+                    resultado['completados'] += 1
+                elif estado == 'Error':
+                    resultado['errores'] += 1
+                    print(f"[facturacion] Pedido {trabajo['id_pedido']} sin factura tras "
+                          f"{trabajo['intentos']} intentos: {fila['ultimo_error']}")
+                elif estado == 'Pendiente':
+                    resultado['reintentos'] += 1
+                elif estado == 'Cancelado':
+                    resultado['cancelados'] += 1
+            if len(trabajos) < lote:
+                break
+        self.completados += resultado['completados']
+        self.reintentos += resultado['reintentos']
+        self.errores += resultado['errores']
+        self.cancelados += resultado['cancelados']
+        return resultado
+
+    def estado_pedido(self, id_pedido, id_usuario):
+        """
+        {'id_pedido', 'id_factura', 'estado_factura', 'intentos'} del pedido
+        del usuario, o None si el pedido no es suyo
+        """
+        fila = self.mysql.ejecutar_sp_uno('facturaEstadoPedido', [id_pedido, id_usuario])
+        if not fila:
+            return None
+        return {
+            'id_pedido': int(fila['id_pedido']),
+            'id_factura': int(fila['id_factura']) if fila['id_factura'] else None,
+            'estado_factura': fila['estado_factura'],
+            'intentos': int(fila['intentos'] or 0),
+        }
+
+    def estadisticas(self):
+        return {
+            'completados': self.completados,
+            'reintentos': self.reintentos,
+            'errores': self.errores,
+            'cancelados': self.cancelados,
+        }
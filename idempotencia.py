@@ -0,0 +1,160 @@
+"""
+Idempotency-Key para las rutas que crean pedidos o registran pagos.
+
+Si el navegador reintenta un POST después de un error de red o de tiempo de
+espera, la operación original pudo haberse completado: repetirla crearía un
+pedido o un pago duplicado. Con el header `Idempotency-Key` la primera
+petición registra la clave (tabla Claves_Idempotencia, SP
+idempotenciaIniciar) y, al terminar bien, guarda su respuesta; los
+reintentos con la misma clave reciben esa respuesta sin ejecutar la vista
+(ni pedidoCheckout / pedidoCrear / pagoRegistrar).
+
+- La clave es por usuario de la sesión y operación.
+- Se guarda un hash de la petición (método, ruta y cuerpo): la misma clave
+  con otro cuerpo responde 422.
+- Mientras la primera sigue en proceso, los reintentos reciben 409 con
+  Retry-After.
+- Solo se guardan respuestas 2xx. Si la vista falla, la clave se libera
+  para que el reintento vuelva a ejecutar la operación (los SP son
+  transaccionales, así que el intento fallido no dejó filas).
+- Si la operación se confirmó pero no se pudo guardar su respuesta (tras
+  INTENTOS_GUARDAR intentos), la clave sigue 'En proceso' y los reintentos
+  reciben 409 hasta que vence: nunca se vuelve a ejecutar la operación.
+- Sin header la ruta funciona igual que antes.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from flask import make_response, request, session
+
+HEADER = 'Idempotency-Key'
+LONGITUD_MAXIMA = 100
+# Intentos y espera (segundos) entre intentos al guardar la respuesta
+INTENTOS_GUARDAR = 3
+ESPERA_GUARDAR = 0.2
+
+
+def _hash_solicitud():
+    digest = hashlib.sha256()
+    digest.update(request.method.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(request.path.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+def _error(codigo, error, mensaje):
+    return make_response({'success': False, 'error': error, 'mensaje': mensaje}, codigo)
+
+
+class Idempotencia:
+    """
+    Fábrica del decorador `@idempotente('operacion')`.
+
+    Va debajo de los decoradores de autenticación: las peticiones rechazadas
+    por sesión o rol no registran la clave.
+    """
+
+    def __init__(self, app, mysql):
+        self.mysql = mysql
+        self.ttl = app.config['IDEMPOTENCIA_TTL_HORAS'] * 3600
+        self.repeticiones = 0
+        self.conflictos = 0
+        self.en_proceso = 0
+        self.guardadas = 0
+        self.sin_guardar = 0
+
+    def _llamar(self, sp, params):
+        try:
+            fila = self.mysql.ejecutar_sp_uno(sp, params)
+            self.mysql.connection.commit()
+        except Exception:
+            self.mysql.connection.rollback()
+            raise
+        return fila
+
+    def _completar(self, llave, respuesta):
+        """Guarda la respuesta de la clave; reintenta antes de darse por vencido"""
+        for intento in range(INTENTOS_GUARDAR):
+            try:
+                self._llamar('idempotenciaCompletar', llave + [
+                    respuesta.status_code, respuesta.content_type, respuesta.get_data(as_text=True)
+                ])
+                return True
+            except Exception as e:
+                print(f"[idempotencia] Intento {intento + 1} de guardar la respuesta de {llave[1]} falló: {e}")
+                if intento + 1 < INTENTOS_GUARDAR:
+                    time.sleep(ESPERA_GUARDAR * (intento + 1))
+        return False
+
+    def __call__(self, operacion):
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                clave = request.headers.get(HEADER, '').strip()
+                if not clave:
+                    return f(*args, **kwargs)
+                if len(clave) > LONGITUD_MAXIMA:
+                    return _error(400, 'ERROR_IDEMPOTENCIA_CLAVE',
+                                  f'{HEADER} admite hasta {LONGITUD_MAXIMA} caracteres')
+
+                llave = [session.get('user_id') or 0, operacion, clave]
+                hash_solicitud = _hash_solicitud()
+                fila = self._llamar('idempotenciaIniciar', llave + [hash_solicitud, self.ttl])
+
+                if fila and not fila['nueva']:
+                    if fila['hash_solicitud'] != hash_solicitud:
+                        self.conflictos += 1
+                        return _error(422, 'ERROR_IDEMPOTENCIA_CONFLICTO',
+                                      f'La {HEADER} ya se usó con otra petición')
+                    if fila['estado'] != 'Completada':
+                        self.en_proceso += 1
+                        respuesta = _error(409, 'ERROR_IDEMPOTENCIA_EN_PROCESO',
+                                           'La petición original aún se está procesando')
+                        respuesta.headers['Retry-After'] = '2'
+                        return respuesta
+                    self.repeticiones += 1
+                    respuesta = make_response(fila['respuesta'] or '', fila['codigo_respuesta'])
+                    respuesta.content_type = fila['tipo_contenido'] or 'application/json'
+                    respuesta.headers['Idempotent-Replayed'] = 'true'
+                    return respuesta
+
+                try:
+                    respuesta = make_response(f(*args, **kwargs))
+                except Exception:
+                    self._llamar('idempotenciaLiberar', llave)
+                    raise
+
+                if 200 <= respuesta.status_code < 300 and not respuesta.is_streamed:
+                    if self._completar(llave, respuesta):
+                        self.guardadas += 1
+                    else:
+                        # La operación ya se confirmó: responder igual; la clave
+                        # queda 'En proceso' (409 a los reintentos) hasta vencer
+                        self.sin_guardar += 1
+                else:
+                    self._llamar('idempotenciaLiberar', llave)
+                return respuesta
+            return decorated_function
+        return decorator
+
+    def limpiar_expiradas(self, lote=1000):
+        """Borra las claves vencidas en lotes de `lote`; devuelve cuántas se borraron"""
+        total = 0
+        while True:
+            fila = self._llamar('idempotenciaExpiradasLimpiar', [lote])
+            eliminadas = int(fila['claves_eliminadas']) if fila else 0
+            total += eliminadas
+            if eliminadas < lote:
+                return total
+
+    def estadisticas(self):
+        return {
+            'guardadas': self.guardadas,
+            'repeticiones': self.repeticiones,
+            'conflictos': self.conflictos,
+            'en_proceso': self.en_proceso,
+            'sin_guardar': self.sin_guardar,
+        }
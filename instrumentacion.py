@@ -0,0 +1,227 @@
+"""
+Instrumentación SQL por request.
+
+Cuenta las llamadas `callproc` / `execute` que hace cada request, suma el
+tiempo pasado en la base de datos contra el tiempo de Python y lo publica en
+el header `Server-Timing` de la respuesta. Los requests o llamadas que pasan
+el umbral configurado se escriben en el log de consultas lentas con el nombre
+del procedimiento, parámetros redactados y filas devueltas.
+
+La conexión del pool (db.py) se envuelve en ConexionInstrumentada cuando hay
+métricas activas en el request, así que no hace falta tocar las rutas.
+"""
+import logging
+import time
+from collections import Counter
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import g, request
+
+logger_lento = logging.getLogger('joyeria.sql_lento')
+
+
+class MetricasSQL:
+    """Acumulador de llamadas SQL de un request"""
+
+    def __init__(self):
+        self.num_callproc = 0
+        self.num_execute = 0
+        self.tiempo_db = 0.0
+        self.llamadas = []
+
+    def registrar(self, tipo, nombre, params, segundos):
+        if tipo == 'callproc':
+            self.num_callproc += 1
+        else:
+            self.num_execute += 1
+        self.tiempo_db += segundos
+        llamada = {'tipo': tipo, 'nombre': nombre, 'params': params, 'segundos': segundos, 'filas': 0}
+        self.llamadas.append(llamada)
+        return llamada
+
+    def agregar_tiempo(self, llamada, segundos):
+        """Tiempo extra de la misma llamada (p. ej. nextset de un SP)"""
+        self.tiempo_db += segundos
+        if llamada is not None:
+            llamada['segundos'] += segundos
+
+
+def redactar_params(params):
+    """
+    Representación segura de los parámetros para el log: se conservan
+    números enteros, booleanos, None y fechas (ids, límites, rangos); las
+    cadenas y el resto se reemplazan por su tipo y longitud.
+    """
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: redactar_params([v])[0] for k, v in params.items()}
+    redactados = []
+    for valor in params:
+        if valor is None or isinstance(valor, (bool, int, date, datetime)):
+            redactados.append(valor if not isinstance(valor, (date, datetime)) else valor.isoformat())
+        elif isinstance(valor, (float, Decimal)):
+            redactados.append('<num>')
+        elif isinstance(valor, (str, bytes)):
+            redactados.append(f'<{type(valor).__name__}:{len(valor)}>')
+        else:
+            redactados.append(f'<{type(valor).__name__}>')
+    return redactados
+
+
+def _nombre_sql(query):
+    """Primeras palabras de una sentencia SQL, normalizando espacios"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    texto = ' '.join(str(query).split())
+    return texto[:80]
+
+
+class CursorInstrumentado:
+    """Envoltorio de un cursor MySQLdb que mide callproc / execute / nextset"""
+
+    def __init__(self, cursor, metricas):
+        self._cursor = cursor
+        self._metricas = metricas
+        self._llamada = None
+
+    def _medir(self, tipo, nombre, params, funcion, *args):
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args)
+        finally:
+            self._llamada = self._metricas.registrar(
+                tipo, nombre, params, time.perf_counter() - inicio
+            )
+            self._sumar_filas()
+
+    def _sumar_filas(self):
+        if self._llamada is not None and self._cursor.description is not None:
+            filas = self._cursor.rowcount
+            if filas and filas > 0:
+                self._llamada['filas'] += filas
+
+    def callproc(self, procname, args=()):
+        return self._medir('callproc', procname, args, self._cursor.callproc, procname, args)
+
+    def execute(self, query, args=None):
+        return self._medir('execute', _nombre_sql(query), args, self._cursor.execute, query, args)
+
+    def executemany(self, query, args):
+        return self._medir('execute', _nombre_sql(query), None, self._cursor.executemany, query, args)
+
+    def nextset(self):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.nextset()
+        finally:
+            self._metricas.agregar_tiempo(self._llamada, time.perf_counter() - inicio)
+            self._sumar_filas()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+
+class ConexionInstrumentada:
+    """Envoltorio de la conexión cuyo cursor() devuelve cursores instrumentados"""
+
+    def __init__(self, conexion, metricas):
+        self._conexion = conexion
+        self._metricas = metricas
+
+    def cursor(self, *args, **kwargs):
+        return CursorInstrumentado(self._conexion.cursor(*args, **kwargs), self._metricas)
+
+    def commit(self):
+        inicio = time.perf_counter()
+        try:
+            return self._conexion.commit()
+        finally:
+            self._metricas.agregar_tiempo(None, time.perf_counter() - inicio)
+
+    def __getattr__(self, nombre):
+        return getattr(self._conexion, nombre)
+
+
+def metricas_actuales():
+    """Métricas del request actual (None fuera de un request o si están desactivadas)"""
+    return g.get('_metricas_sql')
+
+
+def init_app(app):
+    """Registra los hooks de medición y el header Server-Timing"""
+    app.config.setdefault('SQL_INSTRUMENTACION', True)
+    app.config.setdefault('SQL_SLOW_REQUEST_MS', 500)
+    app.config.setdefault('SQL_SLOW_CALL_MS', 200)
+    app.config.setdefault('SQL_SLOW_LOG_FILE', None)
+
+    if not app.config['SQL_INSTRUMENTACION']:
+        return
+
+    if app.config['SQL_SLOW_LOG_FILE'] and not logger_lento.handlers:
+        handler = logging.FileHandler(app.config['SQL_SLOW_LOG_FILE'], encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger_lento.addHandler(handler)
+        logger_lento.setLevel(logging.INFO)
+        logger_lento.propagate = False
+
+    @app.before_request
+    def _iniciar_metricas_sql():
+        g._metricas_sql = MetricasSQL()
+        g._inicio_request = time.perf_counter()
+
+    @app.after_request
+    def _publicar_metricas_sql(response):
+        metricas = g.pop('_metricas_sql', None)
+        inicio = g.pop('_inicio_request', None)
+        if metricas is None or inicio is None:
+            return response
+
+        total_ms = (time.perf_counter() - inicio) * 1000
+        db_ms = metricas.tiempo_db * 1000
+        app_ms = max(0.0, total_ms - db_ms)
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={db_ms:.2f};desc="{metricas.num_callproc} SP, {metricas.num_execute} SQL", '
+            f'app;dur={app_ms:.2f}, total;dur={total_ms:.2f}'
+        )
+
+        _registrar_lentos(app, metricas, total_ms, db_ms, response.status_code)
+        return response
+
+
+def _registrar_lentos(app, metricas, total_ms, db_ms, status):
+    umbral_llamada = app.config['SQL_SLOW_CALL_MS']
+    umbral_request = app.config['SQL_SLOW_REQUEST_MS']
+    ruta = f'{request.method} {request.path}'
+
+    for llamada in metricas.llamadas:
+        ms = llamada['segundos'] * 1000
+        if ms >= umbral_llamada:
+            logger_lento.warning(
+                '[SQL LENTO] %s %s %s params=%s filas=%d %.1fms',
+                ruta, llamada['tipo'], llamada['nombre'],
+                redactar_params(llamada['params']), llamada['filas'], ms
+            )
+
+    if total_ms >= umbral_request:
+        repetidas = Counter(l['nombre'] for l in metricas.llamadas)
+        detalle = ', '.join(
+            f"{l['nombre']}({l['filas']} filas, {l['segundos'] * 1000:.1f}ms)"
+            for l in metricas.llamadas
+        )
+        logger_lento.warning(
+            '[REQUEST LENTO] %s -> %s total=%.1fms db=%.1fms callproc=%d execute=%d repetidas=%s llamadas=[%s]',
+            ruta, status, total_ms, db_ms, metricas.num_callproc, metricas.num_execute,
+            {n: c for n, c in repetidas.items() if c > 1}, detalle
+        )
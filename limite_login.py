@@ -0,0 +1,149 @@
+"""
+Límite de intentos de inicio de sesión (token bucket por IP y por usuario).
+
+Cada POST a /login cuesta una consulta (sp_usuario_obtener_rol_por_username)
+y una verificación de Argon2; un ataque de credential stuffing puede ocupar
+todos los núcleos solo en hashes. Antes de tocar la base o Argon2, el login
+consume una ficha de la cubeta de la IP y otra de la del usuario: cada
+cubeta tiene `capacidad` fichas y recupera `por_minuto` por minuto. Sin
+fichas se responde 429 con Retry-After.
+
+- Primero las cubetas en memoria del proceso: rechazan sin ninguna consulta
+  el grueso del ataque. Son un dict acotado a `max_claves` (se descartan las
+  menos usadas).
+- Si pasan, y con `compartido`, las cubetas de la tabla Limites_Login
+  (loginLimiteConsumir, una sola llamada por llave primaria) aplican el
+  mismo límite entre todos los workers. Si esa llamada falla se deja pasar:
+  el límite local sigue activo.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Cubeta:
+    __slots__ = ('fichas', 'actualizada')
+
+    def __init__(self, capacidad, ahora):
+        self.fichas = float(capacidad)
+        self.actualizada = ahora
+
+    def rellenar(self, capacidad, por_segundo, ahora):
+        self.fichas = min(capacidad, self.fichas + (ahora - self.actualizada) * por_segundo)
+        self.actualizada = ahora
+
+    def espera(self, por_segundo):
+        """Segundos hasta tener una ficha (0 si ya la tiene)"""
+        return 0.0 if self.fichas >= 1 else (1 - self.fichas) / por_segundo
+
+
+class LimiteLogin:
+    """Token buckets por IP y por nombre de usuario para /login"""
+
+    def __init__(self, mysql, capacidad_ip=20, por_minuto_ip=10, capacidad_usuario=5,
+                 por_minuto_usuario=2, compartido=True, max_claves=10000):
+        self.mysql = mysql
+        self.capacidad_ip = capacidad_ip
+        self.por_segundo_ip = por_minuto_ip / 60.0
+        self.capacidad_usuario = capacidad_usuario
+        self.por_segundo_usuario = por_minuto_usuario / 60.0
+        self.compartido = compartido
+        self.max_claves = max_claves
+        self._cubetas = OrderedDict()
+        self._lock = threading.Lock()
+        self.permitidos = 0
+        self.limitados_ip = 0
+        self.limitados_usuario = 0
+        self.limitados_compartido = 0
+        self.errores_compartido = 0
+
+    def _cubeta(self, clave, capacidad, ahora):
+        cubeta = self._cubetas.get(clave)
+        if cubeta is None:
+            cubeta = self._cubetas[clave] = _Cubeta(capacidad, ahora)
+            if len(self._cubetas) > self.max_claves:
+                self._cubetas.popitem(last=False)
+        else:
+            self._cubetas.move_to_end(clave)
+        return cubeta
+
+    def _consumir_local(self, ip, usuario):
+        """Segundos de espera, o 0 si se consumió una ficha de cada cubeta"""
+        ahora = time.monotonic()
+        with self._lock:
+            cubeta_ip = self._cubeta('ip:' + ip, self.capacidad_ip, ahora)
+            cubeta_usuario = self._cubeta('u:' + usuario, self.capacidad_usuario, ahora)
+            cubeta_ip.rellenar(self.capacidad_ip, self.por_segundo_ip, ahora)
+            cubeta_usuario.rellenar(self.capacidad_usuario, self.por_segundo_usuario, ahora)
+            espera_ip = cubeta_ip.espera(self.por_segundo_ip)
+            espera_usuario = cubeta_usuario.espera(self.por_segundo_usuario)
+            if espera_ip:
+                self.limitados_ip += 1
+                return espera_ip
+            if espera_usuario:
+                self.limitados_usuario += 1
+                return espera_usuario
+            cubeta_ip.fichas -= 1
+            cubeta_usuario.fichas -= 1
+            return 0.0
+
+    def _consumir_compartido(self, ip, usuario):
+        try:
+            fila = self.mysql.ejecutar_sp_uno('loginLimiteConsumir', [
+                'ip:' + ip, 'u:' + usuario,
+                self.capacidad_ip, self.por_segundo_ip,
+                self.capacidad_usuario, self.por_segundo_usuario
+            ])
+            self.mysql.connection.commit()
+        except Exception as e:
+            self.mysql.connection.rollback()
+            with self._lock:
+                self.errores_compartido += 1
+            print(f"[limite_login] Sin límite compartido: {e}")
+            return 0.0
+        espera = float(fila['espera_segundos'] or 0) if fila else 0.0
+        if espera:
+            with self._lock:
+                self.limitados_compartido += 1
+        return espera
+
+    def permitir(self, ip, usuario):
+        """
+        Consume un intento para `ip` y `usuario`; devuelve 0 si se permite o
+        los segundos a esperar (para Retry-After) si se rechaza
+        """
+        ip = ip or 'desconocida'
+        usuario = usuario.lower()[:50]
+        espera = self._consumir_local(ip, usuario)
+        if not espera and self.compartido:
+            espera = self._consumir_compartido(ip, usuario)
+        if not espera:
+            with self._lock:
+                self.permitidos += 1
+        return espera
+
+    def limpiar_compartido(self, lote=1000):
+        """Borra por lotes de Limites_Login las cubetas ya llenas; devuelve cuántas"""
+        segundos_llenado = int(max(
+            self.capacidad_ip / self.por_segundo_ip,
+            self.capacidad_usuario / self.por_segundo_usuario
+        )) + 1
+        total = 0
+        while True:
+            fila = self.mysql.ejecutar_sp_uno('loginLimitesLimpiar', [segundos_llenado, lote])
+            self.mysql.connection.commit()
+            eliminados = int(fila['limites_eliminados']) if fila else 0
+            total += eliminados
+            if eliminados < lote:
+                return total
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'permitidos': self.permitidos,
+                'limitados_ip': self.limitados_ip,
+                'limitados_usuario': self.limitados_usuario,
+                'limitados_compartido': self.limitados_compartido,
+                'errores_compartido': self.errores_compartido,
+                'claves_locales': len(self._cubetas),
+            }
@@ -0,0 +1,119 @@
+"""
+Cache en memoria de datos de referencia.
+
+Catálogos pequeños que casi no cambian (categorías, métodos de pago,
+géneros, estados, sucursales activas, ...) se cargan al iniciar la app y se
+sirven desde memoria. Cada catálogo se recarga al vencer su TTL o de
+inmediato cuando un endpoint de administración lo modifica
+(`referencias.refrescar(...)` después del commit).
+
+Cada proceso (worker) tiene su propia copia; el TTL acota cuánto tiempo
+puede estar desactualizado un worker que no atendió la modificación.
+"""
+import threading
+import time
+
+
+class DatoReferencia:
+    """Definición de un catálogo de referencia: SP que lo carga y su TTL"""
+
+    __slots__ = ('nombre', 'sp', 'ttl')
+
+    def __init__(self, nombre, sp, ttl=None):
+        self.nombre = nombre
+        self.sp = sp
+        self.ttl = ttl
+
+
+# Catálogos disponibles: nombre lógico -> SP sin parámetros que lo devuelve
+CATALOGOS = (
+    DatoReferencia('categorias', 'categoriasActivas'),
+    DatoReferencia('metodos_pago', 'sp_metodos_pago_lista'),
+    DatoReferencia('metodos_pago_nombre', 'sp_metodos_pago_lista_nombre'),
+    DatoReferencia('clasificaciones', 'sp_clasificaciones_lista'),
+    DatoReferencia('generos', 'sp_generos_lista'),
+    DatoReferencia('materiales', 'sp_materiales_lista'),
+    DatoReferencia('estados_pedidos', 'ventas_estados_pedidos'),
+    DatoReferencia('estados_direcciones', 'sp_estados_direcciones_lista'),
+    DatoReferencia('roles_empleados', 'sp_roles_empleados'),
+    DatoReferencia('sucursales_activas', 'sp_sucursales_activas'),
+)
+
+
+class _Entrada:
+    __slots__ = ('filas', 'cargado', 'lock')
+
+    def __init__(self):
+        self.filas = None
+        self.cargado = 0.0
+        self.lock = threading.Lock()
+
+
+class CacheReferencia:
+    """Cache de catálogos de referencia sobre mysql.ejecutar_sp_filas"""
+
+    def __init__(self, mysql, ttl=300, catalogos=CATALOGOS):
+        self.mysql = mysql
+        self.ttl = ttl
+        self._definiciones = {d.nombre: d for d in catalogos}
+        self._entradas = {d.nombre: _Entrada() for d in catalogos}
+        self.aciertos = 0
+        self.cargas = 0
+
+    def _vigente(self, definicion, entrada):
+        ttl = definicion.ttl if definicion.ttl is not None else self.ttl
+        return entrada.filas is not None and time.monotonic() - entrada.cargado < ttl
+
+    def _cargar(self, definicion, entrada):
+        filas = self.mysql.ejecutar_sp_filas(definicion.sp, [])
+        entrada.filas = [dict(f) for f in filas]
+        entrada.cargado = time.monotonic()
+        self.cargas += 1
+
+    def obtener(self, nombre):
+        """
+        Filas del catálogo (lista de dicts). Se devuelve una copia para que
+        las rutas puedan modificarlas sin alterar el cache.
+        Requiere contexto de aplicación si hay que (re)cargar.
+        """
+        definicion = self._definiciones[nombre]
+        entrada = self._entradas[nombre]
+        filas = entrada.filas
+        if filas is None or not self._vigente(definicion, entrada):
+            with entrada.lock:
+                # Otro hilo pudo haberlo cargado mientras esperábamos
+                if not self._vigente(definicion, entrada):
+                    self._cargar(definicion, entrada)
+                filas = entrada.filas
+        else:
+            self.aciertos += 1
+        return [dict(f) for f in filas]
+
+    def refrescar(self, *nombres):
+        """Recarga ya los catálogos indicados (llamar después del commit que los modifica)"""
+        for nombre in nombres:
+            entrada = self._entradas[nombre]
+            with entrada.lock:
+                try:
+                    self._cargar(self._definiciones[nombre], entrada)
+                except Exception as e:
+                    # Si falla la recarga, forzar que el siguiente acceso lo intente de nuevo
+                    entrada.filas = None
+                    print(f"[referencias] No se pudo refrescar '{nombre}': {e}")
+
+    def cargar_todo(self):
+        """Carga todos los catálogos (al iniciar la app); falla con el primer error"""
+        for nombre, definicion in self._definiciones.items():
+            entrada = self._entradas[nombre]
+            with entrada.lock:
+                self._cargar(definicion, entrada)
+
+    def estadisticas(self):
+        return {
+            'aciertos': self.aciertos,
+            'cargas': self.cargas,
+            'catalogos': {
+                nombre: (len(e.filas) if e.filas is not None else None)
+                for nombre, e in self._entradas.items()
+            },
+        }
@@ -0,0 +1,97 @@
+"""
+Benchmark de Argon2 para elegir los parámetros de contrasenas.py.
+
+Mide el tiempo de verificación (lo que cuesta cada inicio de sesión) con
+distintos memory_cost y sube time_cost hasta acercarse a la latencia
+objetivo sin pasarla. Correrlo en el mismo tipo de servidor donde corre la
+aplicación; imprime las variables de entorno a usar.
+
+    python scripts/benchmark_argon2.py --objetivo-ms 50
+    python scripts/benchmark_argon2.py --objetivo-ms 100 --memoria 19456 65536 --paralelismo 2
+
+Con la concurrencia (ARGON2_CONCURRENCIA) también se estima cuántos
+inicios de sesión por segundo soporta el servidor con esos parámetros.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from argon2 import PasswordHasher
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from config import Config  # noqa: E402
+
+CONTRASENA = 'contraseña de prueba 123'
+
+
+def medir(time_cost, memory_cost, parallelism, repeticiones):
+    """Mediana en ms de ph.verify con esos parámetros"""
+    ph = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    hash_prueba = ph.hash(CONTRASENA)
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        ph.verify(hash_prueba, CONTRASENA)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def elegir(memory_cost, parallelism, objetivo_ms, repeticiones, time_cost_max):
+    """Mayor time_cost cuya mediana no pasa del objetivo (mínimo 1)"""
+    elegido = (1, medir(1, memory_cost, parallelism, repeticiones))
+    for time_cost in range(2, time_cost_max + 1):
+        ms = medir(time_cost, memory_cost, parallelism, repeticiones)
+        if ms > objetivo_ms:
+            break
+        elegido = (time_cost, ms)
+    return elegido
+
+
+def rendimiento(time_cost, memory_cost, parallelism, concurrencia, total):
+    """Verificaciones por segundo con `concurrencia` hilos (como el ejecutor de la app)"""
+    ph = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    hash_prueba = ph.hash(CONTRASENA)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        list(ejecutor.map(lambda _: ph.verify(hash_prueba, CONTRASENA), range(total)))
+    return total / (time.perf_counter() - inicio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objetivo-ms', type=float, default=50, help='latencia máxima por verificación')
+    parser.add_argument('--memoria', type=int, nargs='+', default=[19456, 47104, 65536], help='memory_cost en KiB a probar')
+    parser.add_argument('--paralelismo', type=int, default=Config.ARGON2_PARALLELISM)
+    parser.add_argument('--concurrencia', type=int, default=Config.ARGON2_CONCURRENCIA)
+    parser.add_argument('--repeticiones', type=int, default=7)
+    parser.add_argument('--time-cost-max', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f'Objetivo: {args.objetivo_ms:.0f} ms por verificación, parallelism={args.paralelismo}')
+    print(f'{"memory_cost":>12} {"time_cost":>10} {"mediana ms":>11}')
+    candidatos = []
+    for memory_cost in sorted(args.memoria):
+        time_cost, ms = elegir(memory_cost, args.paralelismo, args.objetivo_ms, args.repeticiones, args.time_cost_max)
+        print(f'{memory_cost:>12} {time_cost:>10} {ms:>11.1f}')
+        if ms <= args.objetivo_ms:
+            candidatos.append((memory_cost, time_cost, ms))
+
+    if not candidatos:
+        print('Ninguna combinación cumple el objetivo; probar con menos memoria o un objetivo mayor')
+        return 1
+
+    # Más memoria encarece los ataques con GPU más que más iteraciones
+    memory_cost, time_cost, ms = max(candidatos)
+    por_segundo = rendimiento(time_cost, memory_cost, args.paralelismo, args.concurrencia, args.concurrencia * 10)
+    print(f'\nSugerido ({ms:.1f} ms, ~{por_segundo:.0f} inicios de sesión/s con {args.concurrencia} hilos):')
+    print(f'ARGON2_TIME_COST={time_cost}')
+    print(f'ARGON2_MEMORY_COST={memory_cost}')
+    print(f'ARGON2_PARALLELISM={args.paralelismo}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
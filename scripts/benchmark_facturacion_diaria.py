@@ -0,0 +1,150 @@
+"""
+Benchmark de facturacionDiaria: versión anterior (un INSERT ... SELECT por
+día) contra la actual (una consulta agrupada unida a Calendario).
+
+Crea temporalmente el procedimiento facturacionDiariaIterativa con la lógica
+anterior, corre las dos versiones con rangos de 1 y 5 años (o los de
+--anios) hasta hoy, verifica que TmpFacturacion quede igual y la borra al
+terminar. Solo lee Facturas; usar en una base de desarrollo con datos.
+
+    python scripts/benchmark_facturacion_diaria.py
+    python scripts/benchmark_facturacion_diaria.py --anios 1 2 5 --repeticiones 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+import MySQLdb
+import MySQLdb.cursors
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from config import Config  # noqa: E402
+
+PROCEDIMIENTO_ITERATIVO = """
+CREATE OR REPLACE PROCEDURE facturacionDiariaIterativa(
+    IN desde DATE,
+    IN hasta DATE
+)
+BEGIN
+    DECLARE fecha_actual DATE;
+
+    SET fecha_actual = desde;
+
+    DROP TEMPORARY TABLE IF EXISTS TmpFacturacion;
+
+    CREATE TEMPORARY TABLE TmpFacturacion (
+        fecha_reporte       DATE NOT NULL PRIMARY KEY,
+        subtotal_facturado  DECIMAL(10, 2) NULL,
+        impuestos_facturados DECIMAL(10, 2) NULL,
+        total_facturado     DECIMAL(10, 2) NULL,
+        conteo_facturas     INT NULL
+    );
+
+    miLoop: LOOP
+        IF fecha_actual > hasta THEN
+            LEAVE miLoop;
+        END IF;
+
+        INSERT INTO TmpFacturacion (
+            fecha_reporte,
+            subtotal_facturado,
+            impuestos_facturados,
+            total_facturado,
+            conteo_facturas
+        )
+        SELECT
+            fecha_actual AS fecha_reporte,
+            IFNULL(SUM(f.subtotal), 0)  AS subtotal_facturado,
+            IFNULL(SUM(f.impuestos), 0) AS impuestos_facturados,
+            IFNULL(SUM(f.total), 0)     AS total_facturado,
+            COUNT(DISTINCT f.id_factura) AS conteo_facturas
+        FROM Facturas f
+        JOIN Estados_Facturas ef
+            ON ef.id_factura = f.id_factura
+           AND ef.estado_factura = 'Pagada'
+        WHERE DATE(f.fecha_emision) = fecha_actual;
+
+        SET fecha_actual = DATE_ADD(fecha_actual, INTERVAL 1 DAY);
+    END LOOP;
+
+    SELECT * FROM TmpFacturacion ORDER BY fecha_reporte;
+END
+"""
+
+
+def conectar():
+    return MySQLdb.connect(
+        host=Config.MYSQL_HOST,
+        port=Config.MYSQL_PORT,
+        user=Config.MYSQL_USER,
+        passwd=Config.MYSQL_PASSWORD,
+        db=Config.MYSQL_DB,
+        charset=Config.MYSQL_CHARSET,
+        cursorclass=MySQLdb.cursors.DictCursor,
+    )
+
+
+def ejecutar(conexion, procedimiento, desde, hasta):
+    """Milisegundos de la llamada y contenido final de TmpFacturacion"""
+    cursor = conexion.cursor()
+    try:
+        inicio = time.perf_counter()
+        cursor.callproc(procedimiento, [desde, hasta])
+        while cursor.nextset():
+            pass
+        ms = (time.perf_counter() - inicio) * 1000
+        cursor.execute('SELECT * FROM TmpFacturacion ORDER BY fecha_reporte')
+        filas = cursor.fetchall()
+    finally:
+        cursor.close()
+    return ms, filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--anios', type=int, nargs='+', default=[1, 5])
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    conexion = conectar()
+    cursor = conexion.cursor()
+    cursor.execute(PROCEDIMIENTO_ITERATIVO)
+    cursor.close()
+
+    diferencias = False
+    try:
+        hasta = date.today()
+        print(f'{"años":>5} {"días":>6} {"iterativa ms":>13} {"agrupada ms":>12} {"mejora":>7}')
+        for anios in args.anios:
+            desde = hasta - timedelta(days=365 * anios)
+            tiempos = {'facturacionDiariaIterativa': [], 'facturacionDiaria': []}
+            resultados = {}
+            for _ in range(args.repeticiones):
+                for procedimiento in tiempos:
+                    ms, filas = ejecutar(conexion, procedimiento, desde, hasta)
+                    tiempos[procedimiento].append(ms)
+                    resultados[procedimiento] = filas
+            iterativa = statistics.median(tiempos['facturacionDiariaIterativa'])
+            agrupada = statistics.median(tiempos['facturacionDiaria'])
+            print(f'{anios:>5} {(hasta - desde).days + 1:>6} {iterativa:>13.1f} {agrupada:>12.1f} '
+                  f'{iterativa / agrupada if agrupada else 0:>6.1f}x')
+            if resultados['facturacionDiariaIterativa'] != resultados['facturacionDiaria']:
+                diferencias = True
+                print(f'  ERROR: TmpFacturacion distinta con {anios} año(s)')
+    finally:
+        cursor = conexion.cursor()
+        cursor.execute('DROP PROCEDURE IF EXISTS facturacionDiariaIterativa')
+        cursor.close()
+        conexion.close()
+
+    if diferencias:
+        return 1
+    print('OK: las dos versiones dejan la misma TmpFacturacion')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -194,7 +194,8 @@ BEGIN
     JOIN Pedidos pe ON pd.id_pedido = pe.id_pedido
     JOIN Estados_Pedidos ep ON pe.id_estado_pedido = ep.id_estado_pedido
     WHERE pd.id_sucursal = var_id_sucursal
-      AND DATE(pe.fecha_pedido) BETWEEN var_fecha_desde AND var_fecha_hasta
+      AND pe.fecha_pedido >= var_fecha_desde
+      AND pe.fecha_pedido < var_fecha_hasta + INTERVAL 1 DAY
       AND ep.estado_pedido != 'Cancelado';
 END $$
 
@@ -211,7 +212,8 @@ BEGIN
     JOIN Pedidos pe ON pd.id_pedido = pe.id_pedido
     JOIN Estados_Pedidos ep ON pe.id_estado_pedido = ep.id_estado_pedido
     WHERE pd.id_sucursal = var_id_sucursal
-      AND DATE(pe.fecha_pedido) BETWEEN var_fecha_desde AND var_fecha_hasta
+      AND pe.fecha_pedido >= var_fecha_desde
+      AND pe.fecha_pedido < var_fecha_hasta + INTERVAL 1 DAY
       AND ep.estado_pedido != 'Cancelado';
 END $$
 
@@ -236,7 +238,8 @@ BEGIN
     JOIN Pedidos pe ON pd.id_pedido = pe.id_pedido
     JOIN Estados_Pedidos ep ON pe.id_estado_pedido = ep.id_estado_pedido
     WHERE pd.id_sucursal = var_id_sucursal
-      AND DATE(pe.fecha_pedido) BETWEEN var_fecha_desde AND var_fecha_hasta
+      AND pe.fecha_pedido >= var_fecha_desde
+      AND pe.fecha_pedido < var_fecha_hasta + INTERVAL 1 DAY
       AND ep.estado_pedido != 'Cancelado'
     GROUP BY pr.id_producto, s.sku, m.nombre_producto
     ORDER BY Unidades_Vendidas DESC
@@ -754,7 +757,8 @@ BEGIN
     JOIN Pedidos_Detalles pd ON p.id_pedido = pd.id_pedido
     JOIN Estados_Pedidos ep ON p.id_estado_pedido = ep.id_estado_pedido
     WHERE
-        (p_fecha_filtro IS NULL OR DATE(p.fecha_pedido) = p_fecha_filtro)
+        (p_fecha_filtro IS NULL OR (p.fecha_pedido >= p_fecha_filtro
+                                    AND p.fecha_pedido < p_fecha_filtro + INTERVAL 1 DAY))
     ORDER BY
         CASE WHEN p_orden = 'ASC' THEN p.fecha_pedido END ASC,
         CASE WHEN p_orden = 'DESC' THEN p.fecha_pedido END DESC
@@ -1612,6 +1616,9 @@ END$$
 
 -- =========================================
 -- devolucionCrear
+-- Un producto surtido de varias sucursales tiene varios renglones en
+-- Pedidos_Detalles: la cantidad devuelta se reparte entre ellos, en orden
+-- de id_pedido_detalle, segun lo que cada uno aun no tiene devuelto
 -- =========================================
 CREATE OR REPLACE PROCEDURE devolucionCrear(
     IN p_id_pedido   INT,
@@ -1628,8 +1635,8 @@ BEGIN
     DECLARE v_cantidad           INT;
     DECLARE v_motivo             VARCHAR(200);
     DECLARE v_id_tipo            INT;
-    DECLARE v_id_pedido_detalle  INT;
     DECLARE v_cantidad_comprada  INT;
+    DECLARE v_cantidad_pendiente INT;
 
     DECLARE EXIT HANDLER FOR SQLEXCEPTION
     BEGIN
@@ -1677,17 +1684,20 @@ BEGIN
         SET v_motivo      = JSON_UNQUOTE(JSON_EXTRACT(p_items_json, CONCAT('$[', v_index, '].motivo')));
         SET v_id_tipo     = JSON_EXTRACT(p_items_json, CONCAT('$[', v_index, '].id_tipo_devolucion'));
 
-        -- Validar que el producto pertenezca al pedido
-        SET v_id_pedido_detalle = NULL;
-
-        SELECT id_pedido_detalle, cantidad_producto
-        INTO v_id_pedido_detalle, v_cantidad_comprada
-        FROM Pedidos_Detalles
-        WHERE id_pedido = p_id_pedido
-          AND id_producto = v_id_producto
-        LIMIT 1;
-
-        IF v_id_pedido_detalle IS NULL THEN
+        -- Validar que el producto pertenezca al pedido (todas sus sucursales)
+        SELECT SUM(pd.cantidad_producto),
+               SUM(pd.cantidad_producto - COALESCE(dv.cantidad_devuelta, 0))
+        INTO v_cantidad_comprada, v_cantidad_pendiente
+        FROM Pedidos_Detalles pd
+        LEFT JOIN (
+            SELECT id_pedido_detalle, SUM(cantidad_devuelta) AS cantidad_devuelta
+            FROM Devoluciones_Detalles
+            GROUP BY id_pedido_detalle
+        ) dv ON dv.id_pedido_detalle = pd.id_pedido_detalle
+        WHERE pd.id_pedido = p_id_pedido
+          AND pd.id_producto = v_id_producto;
+
+        IF v_cantidad_comprada IS NULL THEN
             SIGNAL SQLSTATE '45000'
                 SET MESSAGE_TEXT = 'Error: Uno de los productos solicitados no pertenece al pedido indicado.';
         END IF;
@@ -1698,7 +1708,12 @@ BEGIN
                 SET MESSAGE_TEXT = 'Error: No se puede devolver una cantidad mayor a la comprada.';
         END IF;
 
-        -- Insertar detalle de devoluciÃ³n
+        IF v_cantidad > v_cantidad_pendiente THEN
+            SIGNAL SQLSTATE '45000'
+                SET MESSAGE_TEXT = 'Error: La cantidad a devolver excede las unidades que aun no se han devuelto.';
+        END IF;
+
+        -- Insertar detalle de devoluciÃ³n, repartido entre los renglones del producto
         INSERT INTO Devoluciones_Detalles (
             id_devolucion,
             id_pedido_detalle,
@@ -1706,14 +1721,33 @@ BEGIN
             motivo_devolucion,
             id_estado_devolucion,
             id_tipo_devoluciones
-        ) VALUES (
+        )
+        SELECT
             v_id_devolucion,
-            v_id_pedido_detalle,
-            v_cantidad,
+            x.id_pedido_detalle,
+            LEAST(x.pendiente, v_cantidad - x.pendiente_previo),
             v_motivo,
             v_id_estado_pendiente,
             v_id_tipo
-        );
+        FROM (
+            SELECT
+                pd.id_pedido_detalle,
+                pd.cantidad_producto - COALESCE(dv.cantidad_devuelta, 0) AS pendiente,
+                COALESCE(SUM(pd.cantidad_producto - COALESCE(dv.cantidad_devuelta, 0)) OVER (
+                    ORDER BY pd.id_pedido_detalle
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                ), 0) AS pendiente_previo
+            FROM Pedidos_Detalles pd
+            LEFT JOIN (
+                SELECT id_pedido_detalle, SUM(cantidad_devuelta) AS cantidad_devuelta
+                FROM Devoluciones_Detalles
+                GROUP BY id_pedido_detalle
+            ) dv ON dv.id_pedido_detalle = pd.id_pedido_detalle
+            WHERE pd.id_pedido = p_id_pedido
+              AND pd.id_producto = v_id_producto
+        ) x
+        WHERE x.pendiente > 0
+          AND x.pendiente_previo < v_cantidad;
 
         SET v_index = v_index + 1;
     END WHILE;
@@ -1723,18 +1757,52 @@ BEGIN
     SELECT v_id_devolucion AS id_devolucion_generada;
 END$$
 
+-- =========================================
+-- calendarioLlenar
+-- Agrega a Calendario los dias de p_desde a p_hasta que falten (hasta
+-- 100000 dias por llamada)
+-- =========================================
+CREATE OR REPLACE PROCEDURE calendarioLlenar(
+    IN p_desde DATE,
+    IN p_hasta DATE
+)
+BEGIN
+    INSERT IGNORE INTO Calendario (fecha, anio, mes, dia, dia_semana, inicio_mes)
+    SELECT
+        d.fecha,
+        YEAR(d.fecha),
+        MONTH(d.fecha),
+        DAY(d.fecha),
+        WEEKDAY(d.fecha) + 1,
+        d.fecha - INTERVAL (DAY(d.fecha) - 1) DAY
+    FROM (
+        SELECT p_desde + INTERVAL (u.n + 10 * de.n + 100 * ce.n + 1000 * mi.n + 10000 * dm.n) DAY AS fecha
+        FROM (SELECT 0 AS n UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4
+              UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9) u
+        CROSS JOIN (SELECT 0 AS n UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4
+              UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9) de
+        CROSS JOIN (SELECT 0 AS n UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4
+              UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9) ce
+        CROSS JOIN (SELECT 0 AS n UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4
+              UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9) mi
+        CROSS JOIN (SELECT 0 AS n UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4
+              UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9) dm
+        WHERE u.n + 10 * de.n + 100 * ce.n + 1000 * mi.n + 10000 * dm.n <= DATEDIFF(p_hasta, p_desde)
+    ) d;
+END$$
+
 -- =========================================
 -- facturacionDiaria
+-- Facturas pagadas por dia de desde a hasta, con los dias sin facturas en
+-- cero, en TmpFacturacion (la leen sp_facturacion_diaria_hoy,
+-- sp_facturacion_ordenada, sp_ingresos_mes...). Una sola consulta agrupada
+-- por fecha_emision unida a Calendario en lugar de una consulta por dia
 -- =========================================
 CREATE OR REPLACE PROCEDURE facturacionDiaria(
     IN desde DATE,
     IN hasta DATE
 )
 BEGIN
-    DECLARE fecha_actual DATE;
-
-    SET fecha_actual = desde;
-
     DROP TEMPORARY TABLE IF EXISTS TmpFacturacion;
 
     CREATE TEMPORARY TABLE TmpFacturacion (
@@ -1745,32 +1813,41 @@ BEGIN
         conteo_facturas     INT NULL
     );
 
-    miLoop: LOOP
-        IF fecha_actual > hasta THEN
-            LEAVE miLoop;
-        END IF;
+    -- Calendario ya trae los dias de la instalacion (create_tables.sql);
+    -- solo se completa si el rango se sale de ellos
+    IF (SELECT COUNT(*) FROM Calendario WHERE fecha BETWEEN desde AND hasta) < DATEDIFF(hasta, desde) + 1 THEN
+        CALL calendarioLlenar(desde, hasta);
+    END IF;
 
-        INSERT INTO TmpFacturacion (
-            fecha_reporte,
-            subtotal_facturado,
-            impuestos_facturados,
-            total_facturado,
-            conteo_facturas
-        )
+    INSERT INTO TmpFacturacion (
+        fecha_reporte,
+        subtotal_facturado,
+        impuestos_facturados,
+        total_facturado,
+        conteo_facturas
+    )
+    SELECT
+        c.fecha,
+        IFNULL(d.subtotal_facturado, 0),
+        IFNULL(d.impuestos_facturados, 0),
+        IFNULL(d.total_facturado, 0),
+        IFNULL(d.conteo_facturas, 0)
+    FROM Calendario c
+    LEFT JOIN (
         SELECT
-            fecha_actual AS fecha_reporte,
-            IFNULL(SUM(f.subtotal), 0)  AS subtotal_facturado,
-            IFNULL(SUM(f.impuestos), 0) AS impuestos_facturados,
-            IFNULL(SUM(f.total), 0)     AS total_facturado,
+            f.fecha_emision,
+            SUM(f.subtotal)  AS subtotal_facturado,
+            SUM(f.impuestos) AS impuestos_facturados,
+            SUM(f.total)     AS total_facturado,
             COUNT(DISTINCT f.id_factura) AS conteo_facturas
         FROM Facturas f
         JOIN Estados_Facturas ef
             ON ef.id_factura = f.id_factura
            AND ef.estado_factura = 'Pagada'
-        WHERE DATE(f.fecha_emision) = fecha_actual;
-
-        SET fecha_actual = DATE_ADD(fecha_actual, INTERVAL 1 DAY);
-    END LOOP;
+        WHERE f.fecha_emision BETWEEN desde AND hasta
+        GROUP BY f.fecha_emision
+    ) d ON d.fecha_emision = c.fecha
+    WHERE c.fecha BETWEEN desde AND hasta;
 
     IF (SELECT COALESCE(SUM(conteo_facturas),0) FROM TmpFacturacion) = 0 THEN
         SELECT 'No hubo facturas pagadas en este rango de fechas.' AS mensaje;
@@ -2129,19 +2206,126 @@ BEGIN
     WHERE id_pedido = id_pedidoSP;
 END$$
 
+-- =========================================
+-- surtidoAsignar
+-- Motor de surtido: reparte la cantidad de cada producto de la tabla
+-- temporal TmpSurtidoLineas (id_producto, cantidad) entre sucursales
+-- activas, para todas las lineas en una sola sentencia, y deja en
+-- TmpSurtido (id_producto, id_sucursal, cantidad) un renglon por sucursal.
+-- Lo disponible en cada sucursal es stock_actual menos las reservas
+-- vigentes de otros carritos (con p_id_carrito NULL todas son ajenas).
+-- Las sucursales donde p_id_carrito ya aparto el producto van primero;
+-- despues, segun p_politica (NULL = 'mayor_existencia'):
+--   'mayor_existencia'  de mayor a menor disponible; reparte entre el
+--                       menor numero posible de sucursales
+--   'menos_sucursales'  si una sucursal cubre sola la linea se toma la mas
+--                       justa (las grandes quedan enteras para surtir
+--                       lineas grandes sin partirlas); si no, como la
+--                       anterior
+-- Los empates se rompen por id_sucursal: mismo carrito y mismas
+-- existencias dan siempre el mismo reparto. Si no alcanza, el producto
+-- queda con menos de lo pedido; el que llama compara contra
+-- TmpSurtidoLineas. Bloquea las existencias de los productos de las lineas
+-- hasta el fin de la transaccion, asi que los renglones de TmpSurtido se
+-- pueden insertar en Pedidos_Detalles sin volver a validarlos (ver
+-- @pedido_detalles_surtido en valida_stock_sobreventa).
+-- Uso interno (no devuelve resultados)
+-- =========================================
+CREATE OR REPLACE PROCEDURE surtidoAsignar(
+    IN p_id_carrito CHAR(32),
+    IN p_politica VARCHAR(20)
+)
+BEGIN
+    DECLARE v_politica VARCHAR(20) DEFAULT COALESCE(p_politica, 'mayor_existencia');
+    DECLARE v_bloqueo INT;
+
+    IF v_politica NOT IN ('mayor_existencia', 'menos_sucursales') THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'ERROR_POLITICA_SURTIDO';
+    END IF;
+
+    DROP TEMPORARY TABLE IF EXISTS TmpSurtido;
+    CREATE TEMPORARY TABLE TmpSurtido (
+        id_producto INT NOT NULL,
+        id_sucursal INT NOT NULL,
+        cantidad INT NOT NULL,
+        PRIMARY KEY (id_producto, id_sucursal)
+    );
+
+    -- Agregado: sin filas da NULL en lugar de NOT FOUND
+    SELECT MAX(sp.stock_actual)
+    INTO v_bloqueo
+    FROM Sucursales_Productos sp
+    JOIN TmpSurtidoLineas l ON l.id_producto = sp.id_producto
+    FOR UPDATE;
+
+    -- Cada sucursal aporta lo que falta despues de las anteriores en el
+    -- orden de la politica (acumulado_previo), hasta cubrir la linea
+    INSERT INTO TmpSurtido (id_producto, id_sucursal, cantidad)
+    SELECT a.id_producto, a.id_sucursal, LEAST(a.disponible, a.cantidad - a.acumulado_previo)
+    FROM (
+        SELECT
+            d.id_producto,
+            d.id_sucursal,
+            d.cantidad,
+            d.disponible,
+            COALESCE(SUM(d.disponible) OVER (
+                PARTITION BY d.id_producto
+                ORDER BY
+                    d.reservado_propio > 0 DESC,
+                    (v_politica = 'menos_sucursales' AND d.disponible >= d.cantidad) DESC,
+                    CASE
+                        WHEN v_politica = 'menos_sucursales' AND d.disponible >= d.cantidad
+                        THEN d.disponible
+                        ELSE -d.disponible
+                    END,
+                    d.id_sucursal
+                ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+            ), 0) AS acumulado_previo
+        FROM (
+            SELECT
+                l.id_producto,
+                l.cantidad,
+                sp.id_sucursal,
+                sp.stock_actual - COALESCE(SUM(
+                    CASE WHEN r.id_carrito <=> p_id_carrito THEN 0 ELSE r.cantidad END
+                ), 0) AS disponible,
+                COALESCE(SUM(
+                    CASE WHEN r.id_carrito <=> p_id_carrito THEN r.cantidad ELSE 0 END
+                ), 0) AS reservado_propio
+            FROM TmpSurtidoLineas l
+            JOIN Sucursales_Productos sp ON sp.id_producto = l.id_producto
+            JOIN Sucursales s ON s.id_sucursal = sp.id_sucursal
+            LEFT JOIN Reservas_Stock r
+                ON r.id_producto = sp.id_producto
+               AND r.id_sucursal = sp.id_sucursal
+               AND r.fecha_expiracion > NOW()
+            WHERE s.activo_sucursal = 1
+              AND l.cantidad > 0
+            GROUP BY l.id_producto, l.cantidad, sp.id_sucursal, sp.stock_actual
+        ) d
+        WHERE d.disponible > 0
+    ) a
+    WHERE a.acumulado_previo < a.cantidad;
+END$$
+
 -- =========================================
 -- pedidoCrear
+-- Cada producto se reparte entre sucursales con surtidoAsignar
+-- (p_politica_surtido) y lleva un renglon de detalle por sucursal.
+-- Devuelve el id del pedido creado (id_pedido)
 -- =========================================
 CREATE OR REPLACE PROCEDURE pedidoCrear(
-    IN p_id_tmp_pedido INT
+    IN p_id_tmp_pedido INT,
+    IN p_politica_surtido VARCHAR(20)
 )
 BEGIN
     DECLARE v_id_pedido INT;
+    DECLARE v_fecha_pedido DATE;
     DECLARE v_id_cliente INT;
     DECLARE v_id_estado_confirmado INT;
     DECLARE v_id_usuario INT;
     DECLARE v_items_carrito INT;
-    DECLARE v_items_sin_sucursal INT;
+    DECLARE v_items_sin_surtir INT;
     DECLARE v_rfc CHAR(13);
     DECLARE v_id_direccion INT;
     DECLARE v_telefono VARCHAR(15);
@@ -2149,6 +2333,7 @@ BEGIN
     DECLARE EXIT HANDLER FOR SQLEXCEPTION
     BEGIN
         ROLLBACK;
+        SET @pedido_detalles_surtido = NULL;
         RESIGNAL;
     END;
 
@@ -2168,15 +2353,6 @@ BEGIN
         id_tmp_pedido INT NOT NULL
     );
 
-    -- Sucursales seleccionadas
-    DROP TEMPORARY TABLE IF EXISTS TmpSucursalesSeleccionadas;
-    CREATE TEMPORARY TABLE TmpSucursalesSeleccionadas (
-        id_producto INT NOT NULL,
-        id_sucursal INT NOT NULL,
-        cantidad_producto INT NOT NULL,
-        PRIMARY KEY (id_producto)
-    );
-
     -- Usuario del carrito
     SELECT id_usuario
     INTO v_id_usuario
@@ -2227,48 +2403,33 @@ BEGIN
         SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'ERROR_FALTA_TELEFONO';
     END IF;
 
-    -- Elegir sucursales para cada producto
-    INSERT INTO TmpSucursalesSeleccionadas (id_producto, id_sucursal, cantidad_producto)
-    SELECT
-        t.id_producto,
-        COALESCE(
-            (
-                SELECT sp2.id_sucursal
-                FROM Sucursales_Productos sp2
-                JOIN Sucursales s2 ON s2.id_sucursal = sp2.id_sucursal
-                WHERE sp2.id_producto = t.id_producto
-                  AND s2.activo_sucursal = 1
-                  AND sp2.stock_actual >= t.cantidad_producto
-                ORDER BY sp2.stock_actual DESC
-                LIMIT 1
-            ),
-            (
-                SELECT sp2.id_sucursal
-                FROM Sucursales_Productos sp2
-                JOIN Sucursales s2 ON s2.id_sucursal = sp2.id_sucursal
-                WHERE sp2.id_producto = t.id_producto
-                  AND s2.activo_sucursal = 1
-                ORDER BY sp2.stock_actual DESC
-                LIMIT 1
-            )
-        ) AS id_sucursal,
-        t.cantidad_producto
-    FROM TmpItems_Pedido t
-    WHERE t.id_tmp_pedido = p_id_tmp_pedido;
+    -- Repartir cada producto entre sucursales
+    DROP TEMPORARY TABLE IF EXISTS TmpSurtidoLineas;
+    CREATE TEMPORARY TABLE TmpSurtidoLineas (
+        id_producto INT NOT NULL PRIMARY KEY,
+        cantidad INT NOT NULL
+    );
 
-    -- Validar sucursal asignada
-    SELECT COUNT(*)
-    INTO v_items_sin_sucursal
+    INSERT INTO TmpSurtidoLineas (id_producto, cantidad)
+    SELECT t.id_producto, SUM(t.cantidad_producto)
     FROM TmpItems_Pedido t
     WHERE t.id_tmp_pedido = p_id_tmp_pedido
-      AND NOT EXISTS (
-          SELECT 1
-          FROM TmpSucursalesSeleccionadas tss
-          WHERE tss.id_producto = t.id_producto
-            AND tss.id_sucursal IS NOT NULL
-      );
+    GROUP BY t.id_producto;
 
-    IF v_items_sin_sucursal > 0 THEN
+    CALL surtidoAsignar(NULL, p_politica_surtido);
+
+    -- Validar que cada producto quedo completo
+    SELECT COUNT(*)
+    INTO v_items_sin_surtir
+    FROM TmpSurtidoLineas l
+    LEFT JOIN (
+        SELECT id_producto, SUM(cantidad) AS cantidad
+        FROM TmpSurtido
+        GROUP BY id_producto
+    ) a ON a.id_producto = l.id_producto
+    WHERE COALESCE(a.cantidad, 0) < l.cantidad;
+
+    IF v_items_sin_surtir > 0 THEN
         SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'ERROR_STOCK_INSUFICIENTE';
     END IF;
 
@@ -2310,14 +2471,26 @@ BEGIN
         SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'ERROR_NO_SE_PUDO_ASOCIAR_CLIENTE';
     END IF;
 
-    -- Detalles del pedido
-    INSERT INTO Pedidos_Detalles (id_sucursal, id_pedido, id_producto, cantidad_producto)
-    SELECT
-        COALESCE(tss.id_sucursal, NULL) AS id_sucursal,
-        v_id_pedido,
-        tss.id_producto,
-        tss.cantidad_producto
-    FROM TmpSucursalesSeleccionadas tss;
+    -- Detalles del pedido (un renglon por sucursal). Ya estan surtidos y
+    -- validados: valida_stock_sobreventa no repite la seleccion por renglon
+    SET @pedido_detalles_surtido = v_id_pedido;
+
+    INSERT INTO Pedidos_Detalles (id_sucursal, id_pedido, id_producto, cantidad_producto,
+                                  precio_unitario, costo_unitario, descuento_producto)
+    SELECT ts.id_sucursal, v_id_pedido, ts.id_producto, ts.cantidad,
+           pr.precio_unitario, pr.costo_unitario, COALESCE(pr.descuento_producto, 0)
+    FROM TmpSurtido ts
+    JOIN Productos pr ON pr.id_producto = ts.id_producto;
+
+    SET @pedido_detalles_surtido = NULL;
+
+    -- Ventas_Diarias del pedido completo en una sola sentencia: el trigger
+    -- de Pedidos_Detalles omite los renglones de este INSERT
+    SELECT DATE(fecha_pedido) INTO v_fecha_pedido
+    FROM Pedidos
+    WHERE id_pedido = v_id_pedido;
+
+    CALL ventasDiariasAplicar(v_id_pedido, NULL, v_fecha_pedido, v_id_estado_confirmado, 1);
 
     -- ValidaciÃ³n final
     IF NOT EXISTS (
@@ -2332,9 +2505,12 @@ BEGIN
     -- Limpiar temporales
     DELETE FROM TmpItems_Pedido WHERE id_tmp_pedido = p_id_tmp_pedido;
     DELETE FROM TmpPedidos      WHERE id_tmp_pedido = p_id_tmp_pedido;
-    DROP TEMPORARY TABLE IF EXISTS TmpSucursalesSeleccionadas;
+    DROP TEMPORARY TABLE IF EXISTS TmpSurtidoLineas;
+    DROP TEMPORARY TABLE IF EXISTS TmpSurtido;
 
     COMMIT;
+
+    SELECT v_id_pedido AS id_pedido;
 END$$
 
 -- =========================================
@@ -2343,6 +2519,20 @@ END$$
 CREATE OR REPLACE PROCEDURE pedidoFacturar(
     IN id_pedidoSP INT
 )
+BEGIN
+    CALL pedidoFacturarTotal(id_pedidoSP, NULL);
+END$$
+
+-- =========================================
+-- pedidoFacturarTotal
+-- Factura el pedido por p_total (el que se cobro en el checkout, ya con el
+-- descuento de clasificacion) o, con p_total NULL, por el total de sus
+-- renglones con los precios y descuentos guardados al crear el pedido
+-- =========================================
+CREATE OR REPLACE PROCEDURE pedidoFacturarTotal(
+    IN id_pedidoSP INT,
+    IN p_total DECIMAL(12,2)
+)
 BEGIN
     DECLARE id_empresaSP INT;
     DECLARE subtotalSP DECIMAL(10,2);
@@ -2389,15 +2579,22 @@ BEGIN
             SET MESSAGE_TEXT = 'El pedido ya tiene una factura registrada.';
     END IF;
 
-    -- Total con descuento
-    SELECT SUM(
-        (pr.precio_unitario - (pr.precio_unitario * COALESCE(pr.descuento_producto, 0) / 100))
-        * pd.cantidad_producto
-    )
-    INTO total
-    FROM Pedidos_Detalles pd
-    JOIN Productos pr ON pr.id_producto = pd.id_producto
-    WHERE pd.id_pedido = id_pedidoSP;
+    -- Total con descuento, de los precios guardados en el pedido (los
+    -- renglones anteriores a guardarlos toman los de Productos)
+    IF p_total IS NULL THEN
+        SELECT SUM(
+            (COALESCE(pd.precio_unitario, pr.precio_unitario)
+                - (COALESCE(pd.precio_unitario, pr.precio_unitario)
+                   * COALESCE(pd.descuento_producto, pr.descuento_producto, 0) / 100))
+            * pd.cantidad_producto
+        )
+        INTO total
+        FROM Pedidos_Detalles pd
+        JOIN Productos pr ON pr.id_producto = pd.id_producto
+        WHERE pd.id_pedido = id_pedidoSP;
+    ELSE
+        SET total = p_total;
+    END IF;
 
     -- Calcular subtotal e impuestos (IVA 16%)
     SET subtotalSP = total / 1.16;
@@ -2441,6 +2638,200 @@ BEGIN
     );
 END$$
 
+-- =========================================
+-- pedidoCheckout
+-- Checkout del carrito en una sola llamada y una sola transaccion: recibe
+-- los productos como JSON ([{"id_producto": 1, "cantidad": 2}, ...]) y crea
+-- el pedido con sus detalles (mismas validaciones que pedidoCrear). Los
+-- productos se reparten entre sucursales con surtidoAsignar
+-- (p_politica_surtido), un renglon de detalle por sucursal; primero salen
+-- de las sucursales que tiene apartadas el carrito p_id_carrito
+-- (Reservas_Stock). Al final suelta las reservas y vacia el carrito.
+-- Con p_solicitar_factura el pedido queda en la cola Facturacion_Trabajos
+-- (con el descuento de clasificacion del cliente y el total cobrado) y la
+-- factura la genera el worker (facturacionTrabajoEjecutar) por ese total:
+-- un fallo al facturar ya no deshace el pedido.
+-- Devuelve una fila con id_pedido, id_factura (siempre NULL: la factura se
+-- genera despues), estado_factura ('Pendiente', o NULL sin factura),
+-- total_pedido, descuento_clasificacion y total (a pagar)
+-- =========================================
+CREATE OR REPLACE PROCEDURE pedidoCheckout(
+    IN p_id_usuario INT,
+    IN p_id_carrito CHAR(32),
+    IN p_items_json JSON,
+    IN p_solicitar_factura BOOLEAN,
+    IN p_politica_surtido VARCHAR(20)
+)
+BEGIN
+    DECLARE v_id_pedido INT;
+    DECLARE v_fecha_pedido DATE;
+    DECLARE v_id_cliente INT;
+    DECLARE v_id_estado_confirmado INT;
+    DECLARE v_items_carrito INT;
+    DECLARE v_items_sin_surtir INT;
+    DECLARE v_rfc CHAR(13);
+    DECLARE v_id_direccion INT;
+    DECLARE v_telefono VARCHAR(15);
+    DECLARE v_descuento_clasificacion DECIMAL(5,2) DEFAULT 0;
+    DECLARE v_total_pedido DECIMAL(12,2) DEFAULT 0;
+    DECLARE v_total DECIMAL(12,2) DEFAULT 0;
+    DECLARE v_estado_factura VARCHAR(20) DEFAULT NULL;
+
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        SET @pedido_detalles_surtido = NULL;
+        DROP TEMPORARY TABLE IF EXISTS TmpSurtidoLineas;
+        DROP TEMPORARY TABLE IF EXISTS TmpSurtido;
+        RESIGNAL;
+    END;
+
+    START TRANSACTION;
+
+    -- Cliente y su descuento de clasificacion
+    SELECT c.id_cliente, COALESCE(cl.descuento_clasificacion, 0)
+    INTO v_id_cliente, v_descuento_clasificacion
+    FROM Clientes c
+    LEFT JOIN Clasificaciones cl ON cl.id_clasificacion = c.id_clasificacion
+    WHERE c.id_usuario = p_id_usuario
+    LIMIT 1;
+
+    IF v_id_cliente IS NULL THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'ERROR_SIN_CLIENTE';
+    END IF;
+
+    -- Datos fiscales
+    SELECT rfc_usuario, id_direccion, telefono
+    INTO v_rfc, v_id_direccion, v_telefono
+    FROM Usuarios
+    WHERE id_usuario = p_id_usuario;
+
+    IF v_rfc IS NULL THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'ERROR_FALTA_RFC';
+    END IF;
+
+    IF v_id_direccion IS NULL THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'ERROR_FALTA_DIRECCION';
+    END IF;
+
+    IF v_telefono IS NULL THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'ERROR_FALTA_TELEFONO';
+    END IF;
+
+    -- Productos del carrito (agrupados por producto) repartidos entre sucursales
+    DROP TEMPORARY TABLE IF EXISTS TmpSurtidoLineas;
+    CREATE TEMPORARY TABLE TmpSurtidoLineas (
+        id_producto INT NOT NULL PRIMARY KEY,
+        cantidad INT NOT NULL
+    );
+
+    INSERT INTO TmpSurtidoLineas (id_producto, cantidad)
+    SELECT jt.id_producto, SUM(jt.cantidad)
+    FROM JSON_TABLE(p_items_json, '$[*]' COLUMNS (
+        id_producto INT PATH '$.id_producto',
+        cantidad INT PATH '$.cantidad'
+    )) jt
+    WHERE jt.id_producto IS NOT NULL
+      AND jt.cantidad > 0
+    GROUP BY jt.id_producto;
+
+    CALL surtidoAsignar(p_id_carrito, p_politica_surtido);
+
+    SELECT COUNT(*), COALESCE(SUM(COALESCE(a.cantidad, 0) < l.cantidad), 0)
+    INTO v_items_carrito, v_items_sin_surtir
+    FROM TmpSurtidoLineas l
+    LEFT JOIN (
+        SELECT id_producto, SUM(cantidad) AS cantidad
+        FROM TmpSurtido
+        GROUP BY id_producto
+    ) a ON a.id_producto = l.id_producto;
+
+    IF v_items_carrito = 0 THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'ERROR_CARRITO_VACIO';
+    END IF;
+
+    IF v_items_sin_surtir > 0 THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'ERROR_STOCK_INSUFICIENTE';
+    END IF;
+
+    -- Estado "Confirmado"
+    SELECT id_estado_pedido
+    INTO v_id_estado_confirmado
+    FROM Estados_Pedidos
+    WHERE estado_pedido = 'Confirmado'
+    LIMIT 1;
+
+    IF v_id_estado_confirmado IS NULL THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'ERROR_ESTADO_NO_EXISTE';
+    END IF;
+
+    -- Crear pedido
+    INSERT INTO Pedidos (id_estado_pedido)
+    VALUES (v_id_estado_confirmado);
+
+    SET v_id_pedido = LAST_INSERT_ID();
+
+    INSERT INTO Pedidos_Clientes (id_pedido, id_cliente)
+    VALUES (v_id_pedido, v_id_cliente);
+
+    -- Ya surtidos y validados: valida_stock_sobreventa no repite la seleccion
+    SET @pedido_detalles_surtido = v_id_pedido;
+
+    INSERT INTO Pedidos_Detalles (id_sucursal, id_pedido, id_producto, cantidad_producto,
+                                  precio_unitario, costo_unitario, descuento_producto)
+    SELECT ts.id_sucursal, v_id_pedido, ts.id_producto, ts.cantidad,
+           pr.precio_unitario, pr.costo_unitario, COALESCE(pr.descuento_producto, 0)
+    FROM TmpSurtido ts
+    JOIN Productos pr ON pr.id_producto = ts.id_producto;
+
+    SET @pedido_detalles_surtido = NULL;
+
+    -- Ventas_Diarias del pedido completo en una sola sentencia: el trigger
+    -- de Pedidos_Detalles omite los renglones de este INSERT
+    SELECT DATE(fecha_pedido) INTO v_fecha_pedido
+    FROM Pedidos
+    WHERE id_pedido = v_id_pedido;
+
+    CALL ventasDiariasAplicar(v_id_pedido, NULL, v_fecha_pedido, v_id_estado_confirmado, 1);
+
+    DROP TEMPORARY TABLE IF EXISTS TmpSurtidoLineas;
+    DROP TEMPORARY TABLE IF EXISTS TmpSurtido;
+
+    -- Las reservas ya son renglones del pedido
+    DELETE FROM Reservas_Stock WHERE id_carrito = p_id_carrito;
+    DELETE FROM Carritos_Items WHERE id_carrito = p_id_carrito;
+
+    -- Total con descuento de producto (el precio ya incluye IVA) y con el de
+    -- clasificacion, de los precios guardados en los renglones del pedido
+    SELECT COALESCE(SUM(
+        (pd.precio_unitario - (pd.precio_unitario * pd.descuento_producto / 100))
+        * pd.cantidad_producto
+    ), 0)
+    INTO v_total_pedido
+    FROM Pedidos_Detalles pd
+    WHERE pd.id_pedido = v_id_pedido;
+
+    SET v_total = v_total_pedido - (v_total_pedido * v_descuento_clasificacion / 100);
+
+    -- Factura opcional: se encola (misma transaccion que el pedido)
+    IF p_solicitar_factura THEN
+        INSERT INTO Facturacion_Trabajos (id_pedido, descuento_clasificacion, total)
+        VALUES (v_id_pedido, v_descuento_clasificacion, v_total);
+
+        SET v_estado_factura = 'Pendiente';
+    END IF;
+
+    COMMIT;
+
+    SELECT
+        v_id_pedido AS id_pedido,
+        NULL AS id_factura,
+        v_estado_factura AS estado_factura,
+        v_total_pedido AS total_pedido,
+        v_descuento_clasificacion AS descuento_clasificacion,
+        v_total AS total;
+END$$
+
 -- =========================================
 -- pedido_cancelar
 -- =========================================
@@ -3010,10 +3401,7 @@ BEGIN
         TRUE
     );
 
-    SELECT id_producto
-    INTO IDproducto
-    FROM Productos
-    WHERE id_sku = IDsku;
+    SET IDproducto = LAST_INSERT_ID();
 
     -- Talla (solo anillos)
     IF nombre_categoriaSP = 'Anillos' THEN
@@ -3032,132 +3420,1187 @@ BEGIN
         INSERT INTO Productos_Plata_Ley(id_producto, ley)
         VALUES (IDproducto, v_ley);
     END IF;
+
+    -- Id del producto creado
+    SELECT IDproducto AS id_producto;
+END$$
+
+-- =========================================
+-- productoImagenAgregar
+-- =========================================
+CREATE OR REPLACE PROCEDURE productoImagenAgregar(
+    IN p_sku        VARCHAR(20),
+    IN p_url_imagen VARCHAR(500)
+)
+BEGIN
+    DECLARE v_id_producto INT DEFAULT NULL;
+    DECLARE v_id_sku INT DEFAULT NULL;
+
+    IF p_sku IS NULL OR TRIM(p_sku) = '' THEN
+        SIGNAL SQLSTATE '45000'
+            SET MESSAGE_TEXT = 'Error: El SKU es requerido';
+    END IF;
+
+    IF p_url_imagen IS NULL OR TRIM(p_url_imagen) = '' THEN
+        SIGNAL SQLSTATE '45000'
+            SET MESSAGE_TEXT = 'Error: La URL de la imagen es requerida';
+    END IF;
+
+    SELECT id_sku
+    INTO v_id_sku
+    FROM Sku
+    WHERE UPPER(sku) = UPPER(TRIM(p_sku))
+    LIMIT 1;
+
+    IF v_id_sku IS NULL THEN
+        SIGNAL SQLSTATE '45000'
+            SET MESSAGE_TEXT = 'Error: El SKU no existe';
+    END IF;
+
+    SELECT id_producto
+    INTO v_id_producto
+    FROM Productos
+    WHERE id_sku = v_id_sku
+    LIMIT 1;
+
+    IF v_id_producto IS NULL THEN
+        SIGNAL SQLSTATE '45000'
+            SET MESSAGE_TEXT = 'Error: No se encontrÃ³ un producto asociado al SKU';
+    END IF;
+
+    INSERT INTO Imagenes_Productos (id_producto, url_imagen)
+    VALUES (v_id_producto, TRIM(p_url_imagen));
+
+    SELECT LAST_INSERT_ID() AS id_imagen_producto;
+END$$
+
+DELIMITER ;
+
+DELIMITER $$
+
+-- =========================================
+-- productosCatalogo
+-- =========================================
+CREATE OR REPLACE PROCEDURE productosCatalogo(
+    IN p_nombre_categoria VARCHAR(100)
+)
+BEGIN
+    IF p_nombre_categoria IS NOT NULL AND p_nombre_categoria <> '' THEN
+        SELECT
+            p.id_producto,
+            m.nombre_producto AS nombre,
+            p.precio_unitario AS precio_original,
+            COALESCE(p.descuento_producto, 0) AS descuento_producto,
+            (p.precio_unitario - (p.precio_unitario * COALESCE(p.descuento_producto, 0) / 100)) AS precio,
+            s.sku,
+            c.nombre_categoria,
+            c.id_categoria,
+            pip.url_imagen AS imagen_url
+        FROM Productos p
+        JOIN Modelos m ON p.id_modelo = m.id_modelo
+        JOIN Sku s ON p.id_sku = s.id_sku
+        JOIN Categorias c ON m.id_categoria = c.id_categoria
+        LEFT JOIN Productos_Imagen_Principal pip ON pip.id_producto = p.id_producto
+        WHERE p.activo_producto = 1
+          AND c.nombre_categoria = p_nombre_categoria
+        ORDER BY m.nombre_producto;
+    ELSE
+        SELECT
+            p.id_producto,
+            m.nombre_producto AS nombre,
+            p.precio_unitario AS precio_original,
+            COALESCE(p.descuento_producto, 0) AS descuento_producto,
+            (p.precio_unitario - (p.precio_unitario * COALESCE(p.descuento_producto, 0) / 100)) AS precio,
+            s.sku,
+            c.nombre_categoria,
+            c.id_categoria,
+            pip.url_imagen AS imagen_url
+        FROM Productos p
+        JOIN Modelos m ON p.id_modelo = m.id_modelo
+        JOIN Sku s ON p.id_sku = s.id_sku
+        JOIN Categorias c ON m.id_categoria = c.id_categoria
+        LEFT JOIN Productos_Imagen_Principal pip ON pip.id_producto = p.id_producto
+        WHERE p.activo_producto = 1
+        ORDER BY m.nombre_producto;
+    END IF;
+END$$
+
+-- =========================================
+-- productosCatalogoPagina
+-- Una pagina del catalogo publico con paginacion por llave
+-- (nombre_producto, id_producto): devuelve los productos que van despues
+-- del ultimo de la pagina anterior (NULL = primera pagina). Pide
+-- p_limite + 1 filas para que la app sepa si hay pagina siguiente
+-- =========================================
+CREATE OR REPLACE PROCEDURE productosCatalogoPagina(
+    IN p_nombre_categoria VARCHAR(100),
+    IN p_despues_nombre VARCHAR(150),
+    IN p_despues_id INT,
+    IN p_limite INT
+)
+BEGIN
+    SELECT
+        p.id_producto,
+        m.nombre_producto AS nombre,
+        p.precio_unitario AS precio_original,
+        COALESCE(p.descuento_producto, 0) AS descuento_producto,
+        (p.precio_unitario - (p.precio_unitario * COALESCE(p.descuento_producto, 0) / 100)) AS precio,
+        s.sku,
+        c.nombre_categoria,
+        c.id_categoria,
+        pip.url_imagen AS imagen_url
+    FROM Productos p
+    JOIN Modelos m ON p.id_modelo = m.id_modelo
+    JOIN Sku s ON p.id_sku = s.id_sku
+    JOIN Categorias c ON m.id_categoria = c.id_categoria
+    LEFT JOIN Productos_Imagen_Principal pip ON pip.id_producto = p.id_producto
+    WHERE p.activo_producto = 1
+      AND (p_nombre_categoria IS NULL OR p_nombre_categoria = '' OR c.nombre_categoria = p_nombre_categoria)
+      AND (p_despues_nombre IS NULL
+           OR m.nombre_producto > p_despues_nombre
+           OR (m.nombre_producto = p_despues_nombre AND p.id_producto > p_despues_id))
+    ORDER BY m.nombre_producto, p.id_producto
+    LIMIT p_limite;
+END$$
+
+-- =========================================
+-- sp_productos_indice_busqueda
+-- Productos activos con los campos que indexa la busqueda en memoria
+-- (busqueda.py): nombre, SKU, categoria, material, kilataje y ley; el
+-- resto son los que muestran el catalogo publico y el de ventas
+-- =========================================
+CREATE OR REPLACE PROCEDURE sp_productos_indice_busqueda()
+BEGIN
+    SELECT
+        p.id_producto,
+        m.nombre_producto AS nombre,
+        s.sku,
+        c.nombre_categoria,
+        c.id_categoria,
+        mat.material,
+        pok.kilataje,
+        ppl.ley,
+        p.precio_unitario AS precio_original,
+        COALESCE(p.descuento_producto, 0) AS descuento_producto,
+        (p.precio_unitario - (p.precio_unitario * COALESCE(p.descuento_producto, 0) / 100)) AS precio,
+        p.precio_unitario,
+        p.costo_unitario,
+        p.activo_producto,
+        gp.genero_producto,
+        pip.url_imagen AS imagen_url
+    FROM Productos p
+    JOIN Modelos m ON p.id_modelo = m.id_modelo
+    JOIN Sku s ON p.id_sku = s.id_sku
+    JOIN Categorias c ON m.id_categoria = c.id_categoria
+    JOIN Materiales mat ON p.id_material = mat.id_material
+    JOIN Generos_Productos gp ON m.id_genero_producto = gp.id_genero_producto
+    LEFT JOIN Productos_Oro_Kilataje pok ON pok.id_producto = p.id_producto
+    LEFT JOIN Productos_Plata_Ley ppl ON ppl.id_producto = p.id_producto
+    LEFT JOIN Productos_Imagen_Principal pip ON pip.id_producto = p.id_producto
+    WHERE p.activo_producto = 1;
+END$$
+
+-- =========================================
+-- versionDatosIncrementar
+-- Incrementa la version de un dominio de datos ('catalogo', 'ventas', ...).
+-- La llaman los triggers; la ranura depende de la conexion para repartir
+-- la escritura entre varias filas
+-- =========================================
+CREATE OR REPLACE PROCEDURE versionDatosIncrementar(
+    IN p_nombre_dato VARCHAR(30)
+)
+BEGIN
+    INSERT INTO Versiones_Datos (nombre_dato, ranura, version)
+    VALUES (p_nombre_dato, CONNECTION_ID() MOD 8, 1)
+    ON DUPLICATE KEY UPDATE version = version + 1;
+END$$
+
+-- =========================================
+-- sp_versiones_datos
+-- Version y ultima modificacion de cada dominio de datos
+-- =========================================
+CREATE OR REPLACE PROCEDURE sp_versiones_datos()
+BEGIN
+    SELECT
+        nombre_dato,
+        SUM(version) AS version,
+        MAX(fecha_actualizacion) AS fecha_actualizacion
+    FROM Versiones_Datos
+    GROUP BY nombre_dato;
+END$$
+
+-- =========================================
+-- sp_catalogo_version
+-- Version actual del catalogo publico (la incrementan los triggers de
+-- Productos, Modelos, Categorias e Imagenes_Productos); la app la usa para
+-- invalidar su cache
+-- =========================================
+CREATE OR REPLACE PROCEDURE sp_catalogo_version()
+BEGIN
+    SELECT
+        COALESCE(SUM(version), 0) AS version,
+        MAX(fecha_actualizacion) AS fecha_actualizacion
+    FROM Versiones_Datos
+    WHERE nombre_dato = 'catalogo';
+END$$
+
+-- =========================================
+-- producto_info_carrito
+-- =========================================
+CREATE OR REPLACE PROCEDURE producto_info_carrito(
+    IN p_id_producto INT
+)
+BEGIN
+    SELECT
+        p.id_producto,
+        m.nombre_producto AS nombre,
+        p.precio_unitario AS precio,
+        COALESCE(p.descuento_producto, 0) AS descuento_producto,
+        s.sku
+    FROM Productos p
+    INNER JOIN Modelos m ON p.id_modelo = m.id_modelo
+    INNER JOIN Sku s ON p.id_sku = s.id_sku
+    WHERE p.id_producto = p_id_producto
+      AND p.activo_producto = 1;
+END$$
+
+-- =========================================
+-- carritoTocar
+-- Crea el carrito si no existe y extiende su vencimiento. Si ya estaba
+-- vencido se vacia antes, para no revivir productos abandonados.
+-- Uso interno de los SP de carrito (no devuelve resultados)
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritoTocar(
+    IN p_id_carrito CHAR(32),
+    IN p_id_usuario INT,
+    IN p_ttl_segundos INT
+)
+BEGIN
+    DELETE ci
+    FROM Carritos_Items ci
+    JOIN Carritos c ON c.id_carrito = ci.id_carrito
+    WHERE c.id_carrito = p_id_carrito
+      AND c.fecha_expiracion <= NOW();
+
+    DELETE r
+    FROM Reservas_Stock r
+    JOIN Carritos c ON c.id_carrito = r.id_carrito
+    WHERE c.id_carrito = p_id_carrito
+      AND c.fecha_expiracion <= NOW();
+
+    INSERT INTO Carritos (id_carrito, id_usuario, fecha_expiracion)
+    VALUES (p_id_carrito, p_id_usuario, NOW() + INTERVAL p_ttl_segundos SECOND)
+    ON DUPLICATE KEY UPDATE
+        fecha_expiracion = VALUES(fecha_expiracion),
+        id_usuario = COALESCE(id_usuario, VALUES(id_usuario));
+END$$
+
+-- =========================================
+-- reservaStockAjustar
+-- Deja apartada para el carrito exactamente p_cantidad del producto, con
+-- vencimiento en p_ttl_reserva segundos, repartida entre sucursales
+-- activas igual que se surtira el pedido (surtidoAsignar con
+-- p_politica_surtido; las sucursales que ya tenia van primero). Si no
+-- alcanza lo disponible, o con p_cantidad <= 0, suelta la reserva.
+-- Uso interno de los SP de carrito (no devuelve resultados)
+-- =========================================
+CREATE OR REPLACE PROCEDURE reservaStockAjustar(
+    IN p_id_carrito CHAR(32),
+    IN p_id_producto INT,
+    IN p_cantidad INT,
+    IN p_ttl_reserva INT,
+    IN p_politica_surtido VARCHAR(20)
+)
+BEGIN
+    DECLARE v_asignado INT DEFAULT 0;
+
+    IF COALESCE(p_cantidad, 0) > 0 THEN
+        DROP TEMPORARY TABLE IF EXISTS TmpSurtidoLineas;
+        CREATE TEMPORARY TABLE TmpSurtidoLineas (
+            id_producto INT NOT NULL PRIMARY KEY,
+            cantidad INT NOT NULL
+        );
+
+        INSERT INTO TmpSurtidoLineas (id_producto, cantidad)
+        VALUES (p_id_producto, p_cantidad);
+
+        CALL surtidoAsignar(p_id_carrito, p_politica_surtido);
+
+        -- Agregado: sin filas da 0 en lugar de NOT FOUND, que cortaria el
+        -- cursor de carritoReservar
+        SELECT COALESCE(SUM(cantidad), 0)
+        INTO v_asignado
+        FROM TmpSurtido;
+    END IF;
+
+    DELETE FROM Reservas_Stock
+    WHERE id_carrito = p_id_carrito
+      AND id_producto = p_id_producto;
+
+    IF COALESCE(p_cantidad, 0) > 0 AND v_asignado >= p_cantidad THEN
+        INSERT INTO Reservas_Stock (id_carrito, id_producto, id_sucursal, cantidad, fecha_expiracion)
+        SELECT p_id_carrito, t.id_producto, t.id_sucursal, t.cantidad,
+               NOW() + INTERVAL p_ttl_reserva SECOND
+        FROM TmpSurtido t;
+    END IF;
+
+    DROP TEMPORARY TABLE IF EXISTS TmpSurtidoLineas;
+    DROP TEMPORARY TABLE IF EXISTS TmpSurtido;
+END$$
+
+-- =========================================
+-- carritoReservar
+-- Ajusta las reservas de todos los productos del carrito (en orden de
+-- id_producto, para que dos carritos no se bloqueen cruzado). Con
+-- p_solo_pendientes solo toca las que faltan, no cubren la cantidad o
+-- vencen en menos de la mitad de p_ttl_reserva, para que ver el carrito no
+-- bloquee existencias en cada request.
+-- Uso interno de los SP de carrito (no devuelve resultados)
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritoReservar(
+    IN p_id_carrito CHAR(32),
+    IN p_ttl_reserva INT,
+    IN p_politica_surtido VARCHAR(20),
+    IN p_solo_pendientes BOOLEAN
+)
+BEGIN
+    DECLARE v_fin INT DEFAULT 0;
+    DECLARE v_id_producto INT;
+    DECLARE v_cantidad INT;
+
+    DECLARE cur_items CURSOR FOR
+        SELECT ci.id_producto, ci.cantidad
+        FROM Carritos_Items ci
+        LEFT JOIN (
+            SELECT id_producto, SUM(cantidad) AS cantidad, MIN(fecha_expiracion) AS fecha_expiracion
+            FROM Reservas_Stock
+            WHERE id_carrito = p_id_carrito
+            GROUP BY id_producto
+        ) r ON r.id_producto = ci.id_producto
+        WHERE ci.id_carrito = p_id_carrito
+          AND (
+              NOT p_solo_pendientes
+              OR r.id_producto IS NULL
+              OR r.cantidad <> ci.cantidad
+              OR r.fecha_expiracion < NOW() + INTERVAL (p_ttl_reserva DIV 2) SECOND
+          )
+        ORDER BY ci.id_producto;
+
+    DECLARE CONTINUE HANDLER FOR NOT FOUND SET v_fin = 1;
+
+    OPEN cur_items;
+    leer: LOOP
+        FETCH cur_items INTO v_id_producto, v_cantidad;
+        IF v_fin = 1 THEN
+            LEAVE leer;
+        END IF;
+        CALL reservaStockAjustar(p_id_carrito, v_id_producto, v_cantidad, p_ttl_reserva, p_politica_surtido);
+    END LOOP;
+    CLOSE cur_items;
+END$$
+
+-- =========================================
+-- reservasExpiradasLimpiar
+-- Borra hasta p_lote reservas vencidas (las vencidas ya no cuentan al
+-- calcular lo disponible; esto solo libera espacio). Llamar en ciclo
+-- mientras reservas_eliminadas = p_lote
+-- =========================================
+CREATE OR REPLACE PROCEDURE reservasExpiradasLimpiar(
+    IN p_lote INT
+)
+BEGIN
+    DELETE FROM Reservas_Stock
+    WHERE fecha_expiracion <= NOW()
+    ORDER BY fecha_expiracion
+    LIMIT p_lote;
+
+    SELECT ROW_COUNT() AS reservas_eliminadas;
+END$$
+
+-- =========================================
+-- carritoResumen
+-- Total y numero de piezas del carrito
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritoResumen(
+    IN p_id_carrito CHAR(32)
+)
+BEGIN
+    SELECT
+        COALESCE(SUM(ci.precio * ci.cantidad), 0) AS total,
+        COALESCE(SUM(ci.cantidad), 0) AS total_items
+    FROM Carritos_Items ci
+    WHERE ci.id_carrito = p_id_carrito;
+END$$
+
+-- =========================================
+-- carritoObtener
+-- Productos de un carrito vigente, en el orden en que se agregaron
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritoObtener(
+    IN p_id_carrito CHAR(32)
+)
+BEGIN
+    SELECT
+        ci.id_producto,
+        ci.nombre,
+        ci.precio,
+        ci.sku,
+        ci.cantidad
+    FROM Carritos_Items ci
+    JOIN Carritos c ON c.id_carrito = ci.id_carrito
+    WHERE ci.id_carrito = p_id_carrito
+      AND c.fecha_expiracion > NOW()
+    ORDER BY ci.fecha_agregado, ci.id_producto;
+END$$
+
+-- =========================================
+-- carritoItemAgregar
+-- Suma p_cantidad del producto al carrito (alta o incremento en una sola
+-- sentencia) con su precio vigente con descuento, tomado de Productos, y
+-- aparta la nueva cantidad (reservaStockAjustar). Devuelve agregado = 0 si
+-- el producto no existe o no esta activo, reservado = 0 si no hay
+-- existencias para apartarlo, y el resumen del carrito
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritoItemAgregar(
+    IN p_id_carrito CHAR(32),
+    IN p_id_usuario INT,
+    IN p_ttl_segundos INT,
+    IN p_ttl_reserva INT,
+    IN p_politica_surtido VARCHAR(20),
+    IN p_id_producto INT,
+    IN p_cantidad INT
+)
+BEGIN
+    DECLARE v_agregado INT DEFAULT 0;
+    DECLARE v_cantidad INT;
+
+    CALL carritoTocar(p_id_carrito, p_id_usuario, p_ttl_segundos);
+
+    INSERT INTO Carritos_Items (id_carrito, id_producto, nombre, sku, precio, cantidad)
+    SELECT
+        p_id_carrito,
+        p.id_producto,
+        m.nombre_producto,
+        s.sku,
+        ROUND(p.precio_unitario - (p.precio_unitario * COALESCE(p.descuento_producto, 0) / 100), 2),
+        p_cantidad
+    FROM Productos p
+    INNER JOIN Modelos m ON p.id_modelo = m.id_modelo
+    INNER JOIN Sku s ON p.id_sku = s.id_sku
+    WHERE p.id_producto = p_id_producto
+      AND p.activo_producto = 1
+    ON DUPLICATE KEY UPDATE
+        cantidad = Carritos_Items.cantidad + VALUES(cantidad),
+        precio = VALUES(precio),
+        nombre = VALUES(nombre),
+        sku = VALUES(sku);
+
+    SET v_agregado = ROW_COUNT() > 0;
+
+    IF v_agregado THEN
+        SELECT MAX(cantidad)
+        INTO v_cantidad
+        FROM Carritos_Items
+        WHERE id_carrito = p_id_carrito
+          AND id_producto = p_id_producto;
+
+        CALL reservaStockAjustar(p_id_carrito, p_id_producto, v_cantidad, p_ttl_reserva, p_politica_surtido);
+    END IF;
+
+    SELECT
+        v_agregado AS agregado,
+        EXISTS (
+            SELECT 1
+            FROM Reservas_Stock r
+            WHERE r.id_carrito = p_id_carrito
+              AND r.id_producto = p_id_producto
+        ) AS reservado,
+        COALESCE(SUM(ci.precio * ci.cantidad), 0) AS total,
+        COALESCE(SUM(ci.cantidad), 0) AS total_items
+    FROM Carritos_Items ci
+    WHERE ci.id_carrito = p_id_carrito;
+END$$
+
+-- =========================================
+-- carritoItemCantidad
+-- Fija la cantidad de un producto que ya esta en el carrito y ajusta su
+-- reserva
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritoItemCantidad(
+    IN p_id_carrito CHAR(32),
+    IN p_ttl_segundos INT,
+    IN p_ttl_reserva INT,
+    IN p_politica_surtido VARCHAR(20),
+    IN p_id_producto INT,
+    IN p_cantidad INT
+)
+BEGIN
+    CALL carritoTocar(p_id_carrito, NULL, p_ttl_segundos);
+
+    UPDATE Carritos_Items
+    SET cantidad = p_cantidad
+    WHERE id_carrito = p_id_carrito
+      AND id_producto = p_id_producto;
+
+    IF EXISTS (
+        SELECT 1
+        FROM Carritos_Items
+        WHERE id_carrito = p_id_carrito
+          AND id_producto = p_id_producto
+    ) THEN
+        CALL reservaStockAjustar(p_id_carrito, p_id_producto, p_cantidad, p_ttl_reserva, p_politica_surtido);
+    END IF;
+
+    CALL carritoResumen(p_id_carrito);
+END$$
+
+-- =========================================
+-- carritoItemEliminar
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritoItemEliminar(
+    IN p_id_carrito CHAR(32),
+    IN p_ttl_segundos INT,
+    IN p_id_producto INT
+)
+BEGIN
+    CALL carritoTocar(p_id_carrito, NULL, p_ttl_segundos);
+
+    DELETE FROM Carritos_Items
+    WHERE id_carrito = p_id_carrito
+      AND id_producto = p_id_producto;
+
+    DELETE FROM Reservas_Stock
+    WHERE id_carrito = p_id_carrito
+      AND id_producto = p_id_producto;
+
+    CALL carritoResumen(p_id_carrito);
+END$$
+
+-- =========================================
+-- carritoVaciar
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritoVaciar(
+    IN p_id_carrito CHAR(32)
+)
+BEGIN
+    DELETE FROM Carritos_Items
+    WHERE id_carrito = p_id_carrito;
+
+    DELETE FROM Reservas_Stock
+    WHERE id_carrito = p_id_carrito;
+END$$
+
+-- =========================================
+-- carritoConsultar
+-- Solo lectura: por producto del carrito vigente devuelve el precio vigente
+-- con descuento, si sigue activo, si su cantidad esta apartada (en una o
+-- varias sucursales) y lo disponible para el carrito en sucursales activas
+-- (stock_actual menos reservas vigentes ajenas: total y la mayor de una
+-- sola sucursal). disponible = 1 si el producto esta activo y apartado o,
+-- sin p_exigir_reserva, si lo disponible cubre la cantidad aunque su
+-- reserva ya haya vencido. No aparta, no extiende el vencimiento ni guarda
+-- precios: es lo que usa ver el carrito
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritoConsultar(
+    IN p_id_carrito CHAR(32),
+    IN p_exigir_reserva BOOLEAN
+)
+BEGIN
+    SELECT
+        ci.id_producto,
+        COALESCE(m.nombre_producto, ci.nombre) AS nombre,
+        COALESCE(s.sku, ci.sku) AS sku,
+        ci.cantidad,
+        ci.precio AS precio_anterior,
+        COALESCE(
+            ROUND(p.precio_unitario - (p.precio_unitario * COALESCE(p.descuento_producto, 0) / 100), 2),
+            ci.precio
+        ) AS precio,
+        COALESCE(p.activo_producto, 0) AS activo,
+        (r.id_carrito IS NOT NULL) AS reservado,
+        r.fecha_expiracion AS reserva_expira,
+        COALESCE(st.stock_total, 0) AS stock_total,
+        COALESCE(st.stock_max_sucursal, 0) AS stock_max_sucursal,
+        (COALESCE(p.activo_producto, 0) = 1
+            AND (r.id_carrito IS NOT NULL
+                 OR (NOT p_exigir_reserva AND COALESCE(st.stock_total, 0) >= ci.cantidad))) AS disponible
+    FROM Carritos_Items ci
+    JOIN Carritos c ON c.id_carrito = ci.id_carrito
+    LEFT JOIN Productos p ON p.id_producto = ci.id_producto
+    LEFT JOIN Modelos m ON m.id_modelo = p.id_modelo
+    LEFT JOIN Sku s ON s.id_sku = p.id_sku
+    LEFT JOIN (
+        SELECT id_producto, id_carrito, SUM(cantidad) AS cantidad, MIN(fecha_expiracion) AS fecha_expiracion
+        FROM Reservas_Stock
+        WHERE id_carrito = p_id_carrito
+          AND fecha_expiracion > NOW()
+        GROUP BY id_producto, id_carrito
+    ) r
+        ON r.id_producto = ci.id_producto
+       AND r.cantidad >= ci.cantidad
+    LEFT JOIN (
+        SELECT
+            d.id_producto,
+            SUM(d.disponible) AS stock_total,
+            MAX(d.disponible) AS stock_max_sucursal
+        FROM (
+            SELECT
+                sp.id_producto,
+                GREATEST(sp.stock_actual - COALESCE(SUM(ro.cantidad), 0), 0) AS disponible
+            FROM Sucursales_Productos sp
+            JOIN Sucursales su ON su.id_sucursal = sp.id_sucursal
+            LEFT JOIN Reservas_Stock ro
+                ON ro.id_producto = sp.id_producto
+               AND ro.id_sucursal = sp.id_sucursal
+               AND ro.fecha_expiracion > NOW()
+               AND ro.id_carrito <> p_id_carrito
+            WHERE su.activo_sucursal = 1
+              AND sp.id_producto IN (
+                  SELECT id_producto FROM Carritos_Items WHERE id_carrito = p_id_carrito
+              )
+            GROUP BY sp.id_producto, sp.id_sucursal, sp.stock_actual
+        ) d
+        GROUP BY d.id_producto
+    ) st ON st.id_producto = ci.id_producto
+    WHERE ci.id_carrito = p_id_carrito
+      AND c.fecha_expiracion > NOW()
+    ORDER BY ci.fecha_agregado, ci.id_producto;
+END$$
+
+-- =========================================
+-- carritoCotizar
+-- Recotiza todo el carrito antes de pagar: renueva las reservas que lo
+-- necesitan (carritoReservar), devuelve el carrito como carritoConsultar
+-- (disponible = activo y apartado) y deja guardados en el carrito los
+-- precios vigentes
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritoCotizar(
+    IN p_id_carrito CHAR(32),
+    IN p_ttl_reserva INT,
+    IN p_politica_surtido VARCHAR(20)
+)
+BEGIN
+    IF EXISTS (
+        SELECT 1
+        FROM Carritos
+        WHERE id_carrito = p_id_carrito
+          AND fecha_expiracion > NOW()
+    ) THEN
+        CALL carritoReservar(p_id_carrito, p_ttl_reserva, p_politica_surtido, TRUE);
+    END IF;
+
+    CALL carritoConsultar(p_id_carrito, TRUE);
+
+    UPDATE Carritos_Items ci
+    JOIN Productos p ON p.id_producto = ci.id_producto
+    JOIN Modelos m ON m.id_modelo = p.id_modelo
+    SET ci.precio = ROUND(p.precio_unitario - (p.precio_unitario * COALESCE(p.descuento_producto, 0) / 100), 2),
+        ci.nombre = m.nombre_producto
+    WHERE ci.id_carrito = p_id_carrito
+      AND p.activo_producto = 1;
+END$$
+
+-- =========================================
+-- carritoReemplazar
+-- Sustituye el contenido del carrito por p_items_json
+-- ([{"id_producto": 1, "cantidad": 2}, ...]) en una sola sentencia. Nombre,
+-- SKU y precio salen de Productos (nunca del cliente); se ignoran productos
+-- inactivos y cantidades no positivas. Aparta las nuevas cantidades y
+-- devuelve el carrito recotizado (mismo resultado que carritoCotizar)
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritoReemplazar(
+    IN p_id_carrito CHAR(32),
+    IN p_id_usuario INT,
+    IN p_ttl_segundos INT,
+    IN p_ttl_reserva INT,
+    IN p_politica_surtido VARCHAR(20),
+    IN p_items_json JSON
+)
+BEGIN
+    CALL carritoTocar(p_id_carrito, p_id_usuario, p_ttl_segundos);
+
+    DELETE FROM Carritos_Items
+    WHERE id_carrito = p_id_carrito;
+
+    DELETE FROM Reservas_Stock
+    WHERE id_carrito = p_id_carrito;
+
+    INSERT INTO Carritos_Items (id_carrito, id_producto, nombre, sku, precio, cantidad)
+    SELECT
+        p_id_carrito,
+        p.id_producto,
+        m.nombre_producto,
+        s.sku,
+        ROUND(p.precio_unitario - (p.precio_unitario * COALESCE(p.descuento_producto, 0) / 100), 2),
+        j.cantidad
+    FROM (
+        SELECT jt.id_producto, SUM(jt.cantidad) AS cantidad
+        FROM JSON_TABLE(p_items_json, '$[*]' COLUMNS (
+            id_producto INT PATH '$.id_producto',
+            cantidad INT PATH '$.cantidad'
+        )) jt
+        WHERE jt.cantidad > 0
+        GROUP BY jt.id_producto
+    ) j
+    INNER JOIN Productos p ON p.id_producto = j.id_producto
+    INNER JOIN Modelos m ON p.id_modelo = m.id_modelo
+    INNER JOIN Sku s ON p.id_sku = s.id_sku
+    WHERE p.activo_producto = 1;
+
+    CALL carritoReservar(p_id_carrito, p_ttl_reserva, p_politica_surtido, FALSE);
+    CALL carritoCotizar(p_id_carrito, p_ttl_reserva, p_politica_surtido);
+END$$
+
+-- =========================================
+-- carritoAsignarUsuario
+-- Al iniciar sesion: asocia el carrito anonimo al usuario o, si el usuario
+-- ya tenia un carrito vigente (p. ej. desde otro dispositivo), pasa ahi los
+-- productos del anonimo (y se vuelven a apartar las cantidades unidas).
+-- Devuelve el id del carrito con el que sigue la sesion (NULL si no hay
+-- ninguno)
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritoAsignarUsuario(
+    IN p_id_carrito CHAR(32),
+    IN p_id_usuario INT,
+    IN p_ttl_segundos INT,
+    IN p_ttl_reserva INT,
+    IN p_politica_surtido VARCHAR(20)
+)
+BEGIN
+    DECLARE v_carrito_usuario CHAR(32) DEFAULT NULL;
+    DECLARE v_carrito_valido INT DEFAULT 0;
+
+    SELECT id_carrito
+    INTO v_carrito_usuario
+    FROM Carritos
+    WHERE id_usuario = p_id_usuario
+      AND fecha_expiracion > NOW()
+      AND id_carrito <> COALESCE(p_id_carrito, '')
+    ORDER BY fecha_expiracion DESC
+    LIMIT 1;
+
+    -- El carrito de la sesion solo cuenta si esta vigente y es anonimo o del mismo usuario
+    SELECT COUNT(*)
+    INTO v_carrito_valido
+    FROM Carritos
+    WHERE id_carrito = p_id_carrito
+      AND fecha_expiracion > NOW()
+      AND (id_usuario IS NULL OR id_usuario = p_id_usuario);
+
+    IF v_carrito_valido = 0 THEN
+        SELECT v_carrito_usuario AS id_carrito;
+    ELSEIF v_carrito_usuario IS NULL THEN
+        UPDATE Carritos
+        SET id_usuario = p_id_usuario,
+            fecha_expiracion = NOW() + INTERVAL p_ttl_segundos SECOND
+        WHERE id_carrito = p_id_carrito;
+
+        SELECT p_id_carrito AS id_carrito;
+    ELSE
+        INSERT INTO Carritos_Items (id_carrito, id_producto, nombre, sku, precio, cantidad)
+        SELECT v_carrito_usuario, ci.id_producto, ci.nombre, ci.sku, ci.precio, ci.cantidad
+        FROM Carritos_Items ci
+        WHERE ci.id_carrito = p_id_carrito
+        ON DUPLICATE KEY UPDATE
+            cantidad = Carritos_Items.cantidad + VALUES(cantidad),
+            precio = VALUES(precio);
+
+        DELETE FROM Carritos WHERE id_carrito = p_id_carrito;
+
+        UPDATE Carritos
+        SET fecha_expiracion = NOW() + INTERVAL p_ttl_segundos SECOND
+        WHERE id_carrito = v_carrito_usuario;
+
+        CALL carritoReservar(v_carrito_usuario, p_ttl_reserva, p_politica_surtido, FALSE);
+
+        SELECT v_carrito_usuario AS id_carrito;
+    END IF;
+END$$
+
+-- =========================================
+-- carritosExpiradosLimpiar
+-- Borra los carritos vencidos (sus productos se borran en cascada)
+-- =========================================
+CREATE OR REPLACE PROCEDURE carritosExpiradosLimpiar()
+BEGIN
+    DELETE FROM Carritos
+    WHERE fecha_expiracion <= NOW();
+
+    SELECT ROW_COUNT() AS carritos_eliminados;
+END$$
+
+-- =========================================
+-- idempotenciaIniciar
+-- Registra la clave como 'En proceso' si no existe (o si la anterior
+-- vencio) y devuelve la fila de la clave con nueva = 1 si la tomo esta
+-- peticion. Con nueva = 0 el que llama compara hash_solicitud y repite la
+-- respuesta guardada o responde que sigue en proceso. Una clave que se
+-- quedo 'En proceso' (worker caido, respuesta sin guardar) no se vuelve a
+-- abrir antes de vencer: su operacion pudo haberse confirmado. Hacer commit
+-- enseguida para que los reintentos concurrentes vean la clave
+-- =========================================
+CREATE OR REPLACE PROCEDURE idempotenciaIniciar(
+    IN p_id_usuario INT,
+    IN p_operacion VARCHAR(40),
+    IN p_clave VARCHAR(100),
+    IN p_hash_solicitud CHAR(64),
+    IN p_ttl_segundos INT
+)
+BEGIN
+    DECLARE v_nueva INT DEFAULT 0;
+
+    DELETE FROM Claves_Idempotencia
+    WHERE id_usuario = p_id_usuario
+      AND operacion = p_operacion
+      AND clave = p_clave
+      AND fecha_expiracion <= NOW();
+
+    INSERT IGNORE INTO Claves_Idempotencia (id_usuario, operacion, clave, hash_solicitud, fecha_expiracion)
+    VALUES (p_id_usuario, p_operacion, p_clave, p_hash_solicitud, NOW() + INTERVAL p_ttl_segundos SECOND);
+
+    SET v_nueva = ROW_COUNT() > 0;
+
+    SELECT
+        v_nueva AS nueva,
+        hash_solicitud,
+        estado,
+        codigo_respuesta,
+        tipo_contenido,
+        respuesta
+    FROM Claves_Idempotencia
+    WHERE id_usuario = p_id_usuario
+      AND operacion = p_operacion
+      AND clave = p_clave;
+END$$
+
+-- =========================================
+-- idempotenciaCompletar
+-- Guarda la respuesta de la peticion que tomo la clave
+-- =========================================
+CREATE OR REPLACE PROCEDURE idempotenciaCompletar(
+    IN p_id_usuario INT,
+    IN p_operacion VARCHAR(40),
+    IN p_clave VARCHAR(100),
+    IN p_codigo_respuesta SMALLINT,
+    IN p_tipo_contenido VARCHAR(100),
+    IN p_respuesta MEDIUMTEXT
+)
+BEGIN
+    UPDATE Claves_Idempotencia
+    SET estado = 'Completada',
+        codigo_respuesta = p_codigo_respuesta,
+        tipo_contenido = p_tipo_contenido,
+        respuesta = p_respuesta
+    WHERE id_usuario = p_id_usuario
+      AND operacion = p_operacion
+      AND clave = p_clave;
+END$$
+
+-- =========================================
+-- idempotenciaLiberar
+-- Suelta una clave en proceso cuya peticion fallo, para que el reintento
+-- vuelva a ejecutar la operacion
+-- =========================================
+CREATE OR REPLACE PROCEDURE idempotenciaLiberar(
+    IN p_id_usuario INT,
+    IN p_operacion VARCHAR(40),
+    IN p_clave VARCHAR(100)
+)
+BEGIN
+    DELETE FROM Claves_Idempotencia
+    WHERE id_usuario = p_id_usuario
+      AND operacion = p_operacion
+      AND clave = p_clave
+      AND estado = 'En proceso';
+END$$
+
+-- =========================================
+-- idempotenciaExpiradasLimpiar
+-- Borra hasta p_lote claves vencidas. Llamar en ciclo mientras
+-- claves_eliminadas = p_lote
+-- =========================================
+CREATE OR REPLACE PROCEDURE idempotenciaExpiradasLimpiar(
+    IN p_lote INT
+)
+BEGIN
+    DELETE FROM Claves_Idempotencia
+    WHERE fecha_expiracion <= NOW()
+    ORDER BY fecha_expiracion
+    LIMIT p_lote;
+
+    SELECT ROW_COUNT() AS claves_eliminadas;
+END$$
+
+-- =========================================
+-- loginLimiteConsumir
+-- Token bucket de inicios de sesion compartido entre workers: recarga las
+-- cubetas de la IP y del usuario (p_por_segundo_* fichas por segundo hasta
+-- p_capacidad_*) y, si las dos tienen ficha, consume una de cada una.
+-- Devuelve espera_segundos: 0 si se permite el intento, o lo que falta
+-- para tener ficha en la cubeta mas vacia
+-- =========================================
+CREATE OR REPLACE PROCEDURE loginLimiteConsumir(
+    IN p_clave_ip VARCHAR(120),
+    IN p_clave_usuario VARCHAR(120),
+    IN p_capacidad_ip INT,
+    IN p_por_segundo_ip DOUBLE,
+    IN p_capacidad_usuario INT,
+    IN p_por_segundo_usuario DOUBLE
+)
+BEGIN
+    DECLARE v_fichas_ip DECIMAL(10,3);
+    DECLARE v_fichas_usuario DECIMAL(10,3);
+
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        RESIGNAL;
+    END;
+
+    START TRANSACTION;
+
+    -- Recarga por el tiempo transcurrido (crea la cubeta llena si no existe)
+    INSERT INTO Limites_Login (clave, fichas, actualizado)
+    VALUES (p_clave_ip, p_capacidad_ip, NOW(6))
+    ON DUPLICATE KEY UPDATE
+        fichas = LEAST(p_capacidad_ip, fichas + TIMESTAMPDIFF(MICROSECOND, actualizado, NOW(6)) / 1000000 * p_por_segundo_ip),
+        actualizado = NOW(6);
+
+    INSERT INTO Limites_Login (clave, fichas, actualizado)
+    VALUES (p_clave_usuario, p_capacidad_usuario, NOW(6))
+    ON DUPLICATE KEY UPDATE
+        fichas = LEAST(p_capacidad_usuario, fichas + TIMESTAMPDIFF(MICROSECOND, actualizado, NOW(6)) / 1000000 * p_por_segundo_usuario),
+        actualizado = NOW(6);
+
+    SELECT fichas INTO v_fichas_ip FROM Limites_Login WHERE clave = p_clave_ip;
+    SELECT fichas INTO v_fichas_usuario FROM Limites_Login WHERE clave = p_clave_usuario;
+
+    IF v_fichas_ip >= 1 AND v_fichas_usuario >= 1 THEN
+        UPDATE Limites_Login
+        SET fichas = fichas - 1
+        WHERE clave IN (p_clave_ip, p_clave_usuario);
+    END IF;
+
+    COMMIT;
+
+    SELECT GREATEST(
+        IF(v_fichas_ip >= 1, 0, (1 - v_fichas_ip) / p_por_segundo_ip),
+        IF(v_fichas_usuario >= 1, 0, (1 - v_fichas_usuario) / p_por_segundo_usuario)
+    ) AS espera_segundos;
 END$$
 
 -- =========================================
--- productoImagenAgregar
+-- loginLimitesLimpiar
+-- Borra hasta p_lote cubetas sin intentos en p_segundos_llenado (ya se
+-- recargaron por completo: equivalen a no tener fila). Llamar en ciclo
+-- mientras limites_eliminados = p_lote
 -- =========================================
-CREATE OR REPLACE PROCEDURE productoImagenAgregar(
-    IN p_sku        VARCHAR(20),
-    IN p_url_imagen VARCHAR(500)
+CREATE OR REPLACE PROCEDURE loginLimitesLimpiar(
+    IN p_segundos_llenado INT,
+    IN p_lote INT
 )
 BEGIN
-    DECLARE v_id_producto INT DEFAULT NULL;
-    DECLARE v_id_sku INT DEFAULT NULL;
+    DELETE FROM Limites_Login
+    WHERE actualizado <= NOW(6) - INTERVAL p_segundos_llenado SECOND
+    ORDER BY actualizado
+    LIMIT p_lote;
 
-    IF p_sku IS NULL OR TRIM(p_sku) = '' THEN
-        SIGNAL SQLSTATE '45000'
-            SET MESSAGE_TEXT = 'Error: El SKU es requerido';
-    END IF;
-
-    IF p_url_imagen IS NULL OR TRIM(p_url_imagen) = '' THEN
-        SIGNAL SQLSTATE '45000'
-            SET MESSAGE_TEXT = 'Error: La URL de la imagen es requerida';
-    END IF;
+    SELECT ROW_COUNT() AS limites_eliminados;
+END$$
 
-    SELECT id_sku
-    INTO v_id_sku
-    FROM Sku
-    WHERE UPPER(sku) = UPPER(TRIM(p_sku))
-    LIMIT 1;
+-- =========================================
+-- facturacionTrabajosTomar
+-- Reserva para este worker hasta p_lote trabajos de facturacion listos
+-- (Pendiente con fecha_disponible cumplida, o En proceso sin avance en
+-- p_ttl_proceso segundos: worker caido). SKIP LOCKED deja que varios
+-- workers tomen trabajos distintos sin esperarse. Devuelve id_trabajo,
+-- id_pedido e intentos (ya contando este)
+-- =========================================
+CREATE OR REPLACE PROCEDURE facturacionTrabajosTomar(
+    IN p_lote INT,
+    IN p_ttl_proceso INT
+)
+BEGIN
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        DROP TEMPORARY TABLE IF EXISTS TmpTrabajosTomados;
+        RESIGNAL;
+    END;
 
-    IF v_id_sku IS NULL THEN
-        SIGNAL SQLSTATE '45000'
-            SET MESSAGE_TEXT = 'Error: El SKU no existe';
-    END IF;
+    DROP TEMPORARY TABLE IF EXISTS TmpTrabajosTomados;
+    CREATE TEMPORARY TABLE TmpTrabajosTomados (
+        id_trabajo INT NOT NULL PRIMARY KEY
+    );
 
-    SELECT id_producto
-    INTO v_id_producto
-    FROM Productos
-    WHERE id_sku = v_id_sku
-    LIMIT 1;
+    START TRANSACTION;
 
-    IF v_id_producto IS NULL THEN
-        SIGNAL SQLSTATE '45000'
-            SET MESSAGE_TEXT = 'Error: No se encontrÃ³ un producto asociado al SKU';
-    END IF;
+    INSERT INTO TmpTrabajosTomados (id_trabajo)
+    SELECT id_trabajo
+    FROM Facturacion_Trabajos
+    WHERE (estado = 'Pendiente' AND fecha_disponible <= NOW())
+       OR (estado = 'En proceso' AND fecha_actualizacion <= NOW() - INTERVAL p_ttl_proceso SECOND)
+    ORDER BY id_trabajo
+    LIMIT p_lote
+    FOR UPDATE SKIP LOCKED;
 
-    INSERT INTO Imagenes_Productos (id_producto, url_imagen)
-    VALUES (v_id_producto, TRIM(p_url_imagen));
+    UPDATE Facturacion_Trabajos t
+    JOIN TmpTrabajosTomados tt ON tt.id_trabajo = t.id_trabajo
+    SET t.estado = 'En proceso',
+        t.intentos = t.intentos + 1;
 
-    SELECT LAST_INSERT_ID() AS id_imagen_producto;
-END$$
+    COMMIT;
 
-DELIMITER ;
+    SELECT t.id_trabajo, t.id_pedido, t.intentos
+    FROM Facturacion_Trabajos t
+    JOIN TmpTrabajosTomados tt ON tt.id_trabajo = t.id_trabajo
+    ORDER BY t.id_trabajo;
 
-DELIMITER $$
+    DROP TEMPORARY TABLE IF EXISTS TmpTrabajosTomados;
+END$$
 
 -- =========================================
--- productosCatalogo
+-- facturacionTrabajoEjecutar
+-- Genera la factura de un trabajo tomado por el total que se cobro en el
+-- checkout (pedidoFacturarTotal) y lo marca Completado en la misma
+-- transaccion. Si falla, deshace la factura y deja el trabajo Pendiente
+-- para reintentar tras p_espera_segundos * 2^(intentos - 1), o en Error al
+-- llegar a p_max_intentos. Si la factura ya existe solo marca el trabajo;
+-- si el pedido se cancelo mientras esperaba, lo marca Cancelado sin
+-- factura. Devuelve estado, id_factura y ultimo_error
 -- =========================================
-CREATE OR REPLACE PROCEDURE productosCatalogo(
-    IN p_nombre_categoria VARCHAR(100)
+CREATE OR REPLACE PROCEDURE facturacionTrabajoEjecutar(
+    IN p_id_trabajo INT,
+    IN p_max_intentos INT,
+    IN p_espera_segundos INT
 )
 BEGIN
-    IF p_nombre_categoria IS NOT NULL AND p_nombre_categoria <> '' THEN
-        SELECT
-            p.id_producto,
-            m.nombre_producto AS nombre,
-            p.precio_unitario AS precio_original,
-            COALESCE(p.descuento_producto, 0) AS descuento_producto,
-            (p.precio_unitario - (p.precio_unitario * COALESCE(p.descuento_producto, 0) / 100)) AS precio,
-            s.sku,
-            c.nombre_categoria,
-            c.id_categoria,
-            (SELECT ip.url_imagen
-             FROM Imagenes_Productos ip
-             WHERE ip.id_producto = p.id_producto
-             ORDER BY ip.fecha_carga DESC
-             LIMIT 1) AS imagen_url
-        FROM Productos p
-        JOIN Modelos m ON p.id_modelo = m.id_modelo
-        JOIN Sku s ON p.id_sku = s.id_sku
-        JOIN Categorias c ON m.id_categoria = c.id_categoria
-        WHERE p.activo_producto = 1
-          AND c.nombre_categoria = p_nombre_categoria
-        ORDER BY m.nombre_producto;
-    ELSE
-        SELECT
-            p.id_producto,
-            m.nombre_producto AS nombre,
-            p.precio_unitario AS precio_original,
-            COALESCE(p.descuento_producto, 0) AS descuento_producto,
-            (p.precio_unitario - (p.precio_unitario * COALESCE(p.descuento_producto, 0) / 100)) AS precio,
-            s.sku,
-            c.nombre_categoria,
-            c.id_categoria,
-            (SELECT ip.url_imagen
-             FROM Imagenes_Productos ip
-             WHERE ip.id_producto = p.id_producto
-             ORDER BY ip.fecha_carga DESC
-             LIMIT 1) AS imagen_url
-        FROM Productos p
-        JOIN Modelos m ON p.id_modelo = m.id_modelo
-        JOIN Sku s ON p.id_sku = s.id_sku
-        JOIN Categorias c ON m.id_categoria = c.id_categoria
-        WHERE p.activo_producto = 1
-        ORDER BY m.nombre_producto;
+    DECLARE v_id_pedido INT DEFAULT NULL;
+    DECLARE v_descuento DECIMAL(5,2) DEFAULT 0;
+    DECLARE v_total_cobrado DECIMAL(12,2) DEFAULT NULL;
+    DECLARE v_id_estado_pedido INT DEFAULT NULL;
+    DECLARE v_id_factura INT DEFAULT NULL;
+    DECLARE v_total DECIMAL(10,2);
+    DECLARE v_error TEXT;
+
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        GET DIAGNOSTICS CONDITION 1 v_error = MESSAGE_TEXT;
+        ROLLBACK;
+
+        UPDATE Facturacion_Trabajos
+        SET estado = IF(intentos >= p_max_intentos, 'Error', 'Pendiente'),
+            ultimo_error = LEFT(v_error, 500),
+            fecha_disponible = NOW() + INTERVAL (p_espera_segundos * POW(2, LEAST(GREATEST(intentos - 1, 0), 10))) SECOND
+        WHERE id_trabajo = p_id_trabajo;
+
+        SELECT estado, id_factura, ultimo_error
+        FROM Facturacion_Trabajos
+        WHERE id_trabajo = p_id_trabajo;
+    END;
+
+    START TRANSACTION;
+
+    SELECT MAX(id_pedido), MAX(descuento_clasificacion), MAX(total)
+    INTO v_id_pedido, v_descuento, v_total_cobrado
+    FROM Facturacion_Trabajos
+    WHERE id_trabajo = p_id_trabajo
+      AND estado = 'En proceso'
+    FOR UPDATE;
+
+    IF v_id_pedido IS NOT NULL THEN
+        -- Bloquea el pedido: una cancelacion concurrente espera a este trabajo
+        SELECT MAX(id_estado_pedido)
+        INTO v_id_estado_pedido
+        FROM Pedidos
+        WHERE id_pedido = v_id_pedido
+        FOR UPDATE;
+
+        -- Un intento anterior pudo crear la factura y caerse antes de marcar el trabajo
+        SELECT MAX(id_factura)
+        INTO v_id_factura
+        FROM Facturas
+        WHERE id_pedido = v_id_pedido;
+
+        IF v_id_factura IS NULL AND v_id_estado_pedido = 4 THEN
+            UPDATE Facturacion_Trabajos
+            SET estado = 'Cancelado',
+                ultimo_error = NULL
+            WHERE id_trabajo = p_id_trabajo;
+        ELSE
+            IF v_id_factura IS NULL AND v_total_cobrado IS NOT NULL THEN
+                CALL pedidoFacturarTotal(v_id_pedido, v_total_cobrado);
+
+                SELECT MAX(id_factura)
+                INTO v_id_factura
+                FROM Facturas
+                WHERE id_pedido = v_id_pedido;
+            ELSEIF v_id_factura IS NULL THEN
+                -- Trabajos encolados antes de guardar el total cobrado
+                CALL pedidoFacturar(v_id_pedido);
+
+                SELECT id_factura, total
+                INTO v_id_factura, v_total
+                FROM Facturas
+                WHERE id_pedido = v_id_pedido
+                ORDER BY id_factura DESC
+                LIMIT 1;
+
+                IF v_descuento > 0 THEN
+                    CALL sp_factura_actualizar_total_descuento(
+                        v_id_factura, v_total - (v_total * v_descuento / 100)
+                    );
+                END IF;
+            END IF;
+
+            UPDATE Facturacion_Trabajos
+            SET estado = 'Completado',
+                id_factura = v_id_factura,
+                ultimo_error = NULL
+            WHERE id_trabajo = p_id_trabajo;
+        END IF;
     END IF;
+
+    COMMIT;
+
+    SELECT estado, id_factura, ultimo_error
+    FROM Facturacion_Trabajos
+    WHERE id_trabajo = p_id_trabajo;
 END$$
 
 -- =========================================
--- producto_info_carrito
+-- facturaEstadoPedido
+-- Estado de la factura de un pedido del usuario (para que el cliente
+-- consulte despues del checkout): estado_factura 'Completado' con
+-- id_factura si ya existe, el del trabajo en cola si no, o NULL si no se
+-- solicito. Sin filas si el pedido no es del usuario
 -- =========================================
-CREATE OR REPLACE PROCEDURE producto_info_carrito(
-    IN p_id_producto INT
+CREATE OR REPLACE PROCEDURE facturaEstadoPedido(
+    IN p_id_pedido INT,
+    IN p_id_usuario INT
 )
 BEGIN
     SELECT
-        p.id_producto,
-        m.nombre_producto AS nombre,
-        p.precio_unitario AS precio,
-        COALESCE(p.descuento_producto, 0) AS descuento_producto,
-        s.sku
-    FROM Productos p
-    INNER JOIN Modelos m ON p.id_modelo = m.id_modelo
-    INNER JOIN Sku s ON p.id_sku = s.id_sku
-    WHERE p.id_producto = p_id_producto
-      AND p.activo_producto = 1;
+        p.id_pedido,
+        COALESCE(f.id_factura, t.id_factura) AS id_factura,
+        CASE
+            WHEN f.id_factura IS NOT NULL THEN 'Completado'
+            ELSE t.estado
+        END AS estado_factura,
+        COALESCE(t.intentos, 0) AS intentos
+    FROM Pedidos p
+    JOIN Pedidos_Clientes pc ON pc.id_pedido = p.id_pedido
+    JOIN Clientes c ON c.id_cliente = pc.id_cliente
+    LEFT JOIN Facturacion_Trabajos t ON t.id_pedido = p.id_pedido
+    LEFT JOIN (
+        SELECT id_pedido, MAX(id_factura) AS id_factura
+        FROM Facturas
+        WHERE id_pedido = p_id_pedido
+        GROUP BY id_pedido
+    ) f ON f.id_pedido = p.id_pedido
+    WHERE p.id_pedido = p_id_pedido
+      AND c.id_usuario = p_id_usuario
+    LIMIT 1;
 END$$
 
 -- =========================================
@@ -3349,15 +4792,6 @@ BEGIN
     FROM vClientesRecurrentes;
 END$$
 
--- =========================================
--- sp_cliente_max_id
--- =========================================
-CREATE OR REPLACE PROCEDURE sp_cliente_max_id()
-BEGIN
-    SELECT MAX(id_cliente) AS id_cliente
-    FROM Clientes;
-END$$
-
 -- =========================================
 -- sp_cliente_obtener_usuario
 -- =========================================
@@ -3396,7 +4830,8 @@ CREATE OR REPLACE PROCEDURE sp_devoluciones_count_rango(
 BEGIN
     SELECT COUNT(*) AS total_devoluciones
     FROM Devoluciones d
-    WHERE DATE(d.fecha_devolucion) BETWEEN p_fecha_desde AND p_fecha_hasta;
+    WHERE d.fecha_devolucion >= p_fecha_desde
+      AND d.fecha_devolucion < p_fecha_hasta + INTERVAL 1 DAY;
 END$$
 
 -- =========================================
@@ -3458,7 +4893,7 @@ BEGIN
     JOIN Devoluciones_Detalles dd ON d.id_devolucion = dd.id_devolucion
     JOIN Pedidos_Detalles pd ON dd.id_pedido_detalle = pd.id_pedido_detalle
     JOIN Productos pr ON pd.id_producto = pr.id_producto
-    WHERE YEAR(d.fecha_devolucion) >= YEAR(CURDATE()) - p_anios_atras
+    WHERE d.fecha_devolucion >= MAKEDATE(YEAR(CURDATE()) - p_anios_atras, 1)
     GROUP BY YEAR(d.fecha_devolucion)
     ORDER BY anio ASC;
 END$$
@@ -3507,15 +4942,6 @@ BEGIN
     LIMIT p_limit;
 END$$
 
--- =========================================
--- sp_devolucion_max_id
--- =========================================
-CREATE OR REPLACE PROCEDURE sp_devolucion_max_id()
-BEGIN
-    SELECT MAX(id_devolucion) AS id_devolucion
-    FROM Devoluciones;
-END$$
-
 -- =========================================
 -- sp_empleados_lista
 -- =========================================
@@ -3564,7 +4990,7 @@ CREATE OR REPLACE PROCEDURE sp_facturacion_diaria_ayer()
 BEGIN
     SELECT *
     FROM TmpFacturacion
-    WHERE DATE(fecha_reporte) = DATE_SUB(CURDATE(), INTERVAL 1 DAY);
+    WHERE fecha_reporte = DATE_SUB(CURDATE(), INTERVAL 1 DAY);
 END$$
 
 -- =========================================
@@ -3574,7 +5000,7 @@ CREATE OR REPLACE PROCEDURE sp_facturacion_diaria_hoy()
 BEGIN
     SELECT *
     FROM TmpFacturacion
-    WHERE DATE(fecha_reporte) = CURDATE();
+    WHERE fecha_reporte = CURDATE();
 END$$
 
 -- =========================================
@@ -3936,16 +5362,18 @@ END$$
 
 -- =========================================
 -- sp_pedidos_count_rango
+-- Pedidos no cancelados entre dos fechas (suma de las ranuras de
+-- Ventas_Diarias_Pedidos)
 -- =========================================
 CREATE OR REPLACE PROCEDURE sp_pedidos_count_rango(
     IN p_fecha_desde DATE,
     IN p_fecha_hasta DATE
 )
 BEGIN
-    SELECT COUNT(*) AS total_pedidos
-    FROM Pedidos p
-    WHERE DATE(p.fecha_pedido) BETWEEN p_fecha_desde AND p_fecha_hasta
-      AND p.id_estado_pedido <> 4;
+    SELECT COALESCE(SUM(pedidos), 0) AS total_pedidos
+    FROM Ventas_Diarias_Pedidos
+    WHERE fecha BETWEEN p_fecha_desde AND p_fecha_hasta
+      AND id_estado_pedido <> 4;
 END$$
 
 -- =========================================
@@ -4005,26 +5433,18 @@ BEGIN
     DEALLOCATE PREPARE stmt;
 END$$
 
--- =========================================
--- sp_pedido_max_id
--- =========================================
-CREATE OR REPLACE PROCEDURE sp_pedido_max_id()
-BEGIN
-    SELECT MAX(id_pedido) AS id_pedido
-    FROM Pedidos;
-END$$
-
 -- =========================================
 -- sp_pedido_productos
+-- Un renglon por producto (suma sus sucursales, ver devolucionCrear)
 -- =========================================
 CREATE OR REPLACE PROCEDURE sp_pedido_productos(
     IN p_id_pedido INT
 )
 BEGIN
     SELECT
-        pd.id_pedido_detalle,
+        MIN(pd.id_pedido_detalle) AS id_pedido_detalle,
         pd.id_producto,
-        pd.cantidad_producto,
+        CAST(SUM(pd.cantidad_producto) AS SIGNED) AS cantidad_producto,
         m.nombre_producto,
         p.precio_unitario,
         s.sku
@@ -4032,7 +5452,9 @@ BEGIN
     JOIN Productos p ON pd.id_producto = p.id_producto
     JOIN Modelos m ON p.id_modelo = m.id_modelo
     JOIN Sku s ON p.id_sku = s.id_sku
-    WHERE pd.id_pedido = p_id_pedido;
+    WHERE pd.id_pedido = p_id_pedido
+    GROUP BY pd.id_producto, m.nombre_producto, p.precio_unitario, s.sku
+    ORDER BY MIN(pd.id_pedido_detalle);
 END$$
 
 DELIMITER ;
@@ -4113,6 +5535,46 @@ BEGIN
     END IF;
 END$$
 
+-- =========================================
+-- sp_productos_catalogo_ventas_pagina
+-- Igual que sp_productos_catalogo_ventas, por paginas
+-- (ver productosCatalogoPagina)
+-- =========================================
+CREATE OR REPLACE PROCEDURE sp_productos_catalogo_ventas_pagina(
+    IN p_categoria VARCHAR(100),
+    IN p_despues_nombre VARCHAR(150),
+    IN p_despues_id INT,
+    IN p_limite INT
+)
+BEGIN
+    SELECT
+        p.id_producto,
+        p.precio_unitario,
+        p.descuento_producto,
+        p.costo_unitario,
+        p.activo_producto,
+        m.nombre_producto,
+        m.nombre_producto AS nombre,
+        s.sku,
+        c.nombre_categoria,
+        c.id_categoria,
+        mat.material,
+        gp.genero_producto
+    FROM Productos p
+    INNER JOIN Modelos m          ON p.id_modelo          = m.id_modelo
+    INNER JOIN Categorias c       ON m.id_categoria       = c.id_categoria
+    INNER JOIN Sku s              ON p.id_sku             = s.id_sku
+    INNER JOIN Materiales mat     ON p.id_material        = mat.id_material
+    INNER JOIN Generos_Productos gp ON m.id_genero_producto = gp.id_genero_producto
+    WHERE p.activo_producto = 1
+      AND (p_categoria IS NULL OR p_categoria = '' OR c.nombre_categoria = p_categoria)
+      AND (p_despues_nombre IS NULL
+           OR m.nombre_producto > p_despues_nombre
+           OR (m.nombre_producto = p_despues_nombre AND p.id_producto > p_despues_id))
+    ORDER BY m.nombre_producto, p.id_producto
+    LIMIT p_limite;
+END$$
+
 -- =========================================
 -- sp_productos_count
 -- =========================================
@@ -4139,13 +5601,15 @@ BEGIN
 END$$
 
 -- =========================================
--- sp_producto_max_id
+-- sp_*_max_id (eliminados)
+-- Con varios pedidos o altas simultaneas MAX(id) puede devolver el id de
+-- otra conexion; pedidoCrear, pedidoCheckout, productoAlta, clienteCrear y
+-- devolucionCrear devuelven el id que generaron (LAST_INSERT_ID)
 -- =========================================
-CREATE OR REPLACE PROCEDURE sp_producto_max_id()
-BEGIN
-    SELECT MAX(id_producto) AS id_producto
-    FROM Productos;
-END$$
+DROP PROCEDURE IF EXISTS sp_cliente_max_id$$
+DROP PROCEDURE IF EXISTS sp_devolucion_max_id$$
+DROP PROCEDURE IF EXISTS sp_pedido_max_id$$
+DROP PROCEDURE IF EXISTS sp_producto_max_id$$
 
 DELIMITER ;
 
@@ -4287,7 +5751,8 @@ BEGIN
     JOIN Pedidos_Clientes pc ON p.id_pedido = pc.id_pedido
     JOIN Clientes c ON pc.id_cliente = c.id_cliente
     JOIN Usuarios u ON c.id_usuario = u.id_usuario
-    WHERE DATE(p.fecha_pedido) BETWEEN p_fecha_desde AND p_fecha_hasta
+    WHERE p.fecha_pedido >= p_fecha_desde
+      AND p.fecha_pedido < p_fecha_hasta + INTERVAL 1 DAY
       AND p.id_estado_pedido <> 4
     GROUP BY u.id_usuario, u.nombre_primero, u.nombre_segundo,
              u.apellido_paterno, u.apellido_materno, u.nombre_usuario
@@ -4324,7 +5789,8 @@ BEGIN
     JOIN Pedidos_Clientes pc ON p.id_pedido = pc.id_pedido
     JOIN Clientes c ON pc.id_cliente = c.id_cliente
     JOIN Usuarios u ON c.id_usuario = u.id_usuario
-    WHERE DATE(p.fecha_pedido) BETWEEN p_fecha_desde AND p_fecha_hasta
+    WHERE p.fecha_pedido >= p_fecha_desde
+      AND p.fecha_pedido < p_fecha_hasta + INTERVAL 1 DAY
       AND p.id_estado_pedido <> 4
     GROUP BY u.id_usuario, u.nombre_primero, u.nombre_segundo,
              u.apellido_paterno, u.apellido_materno, u.nombre_usuario
@@ -4354,16 +5820,16 @@ BEGIN
     INSERT INTO TmpTop_Productos (nombre, cantidad_vendida)
     SELECT
         m.nombre_producto,
-        SUM(pd.cantidad_producto) AS total_vendido
-    FROM Pedidos pe
-    JOIN Pedidos_Detalles pd ON pe.id_pedido = pd.id_pedido
-    JOIN Productos p ON pd.id_producto = p.id_producto
+        SUM(vd.unidades) AS total_vendido
+    FROM Ventas_Diarias vd
+    JOIN Productos p ON vd.id_producto = p.id_producto
     JOIN Modelos m ON p.id_modelo = m.id_modelo
     WHERE
-        (var_fecha_desde IS NULL OR DATE(pe.fecha_pedido) >= var_fecha_desde)
-        AND (var_fecha_hasta IS NULL OR DATE(pe.fecha_pedido) <= var_fecha_hasta)
-        AND pe.id_estado_pedido <> 4
+        (var_fecha_desde IS NULL OR vd.fecha >= var_fecha_desde)
+        AND (var_fecha_hasta IS NULL OR vd.fecha <= var_fecha_hasta)
+        AND vd.id_estado_pedido <> 4
     GROUP BY m.nombre_producto
+    HAVING total_vendido > 0
     ORDER BY total_vendido DESC
     LIMIT var_n;
 
@@ -4401,7 +5867,8 @@ BEGIN
     JOIN Productos p ON pd.id_producto = p.id_producto
     JOIN Modelos m ON p.id_modelo = m.id_modelo
     JOIN Sku s ON p.id_sku = s.id_sku
-    WHERE DATE(pe.fecha_pedido) BETWEEN p_fecha_desde AND p_fecha_hasta
+    WHERE pe.fecha_pedido >= p_fecha_desde
+      AND pe.fecha_pedido < p_fecha_hasta + INTERVAL 1 DAY
       AND pe.id_estado_pedido <> 4
     GROUP BY m.id_modelo, m.nombre_producto, s.sku
     ORDER BY ingresos_totales DESC
@@ -4465,6 +5932,26 @@ BEGIN
     WHERE id_usuario = p_id_usuario;
 END$$
 
+-- =====================================================
+-- usuarioContrasenaRehash
+-- Reemplaza el hash de la contrasena por uno con los parametros vigentes
+-- de Argon2 al iniciar sesion, solo si sigue siendo p_hash_anterior (no
+-- pisa un cambio de contrasena hecho mientras tanto). Devuelve actualizado
+-- =====================================================
+CREATE OR REPLACE PROCEDURE usuarioContrasenaRehash(
+    IN p_id_usuario INT,
+    IN p_hash_anterior VARCHAR(500),
+    IN p_hash_nuevo VARCHAR(500)
+)
+BEGIN
+    UPDATE Usuarios
+    SET contrasena = p_hash_nuevo
+    WHERE id_usuario = p_id_usuario
+      AND contrasena = p_hash_anterior;
+
+    SELECT ROW_COUNT() AS actualizado;
+END$$
+
 -- =====================================================
 -- sp_usuario_obtener_rol_por_username
 -- =====================================================
@@ -4595,44 +6082,253 @@ END$$
 
 -- =========================================
 -- sp_ventas_por_anio
+-- Ventas y pedidos por anio desde los hechos diarios (Ventas_Diarias y la
+-- suma de las ranuras de Ventas_Diarias_Pedidos), sin recorrer los
+-- renglones de pedido
 -- =========================================
 CREATE OR REPLACE PROCEDURE sp_ventas_por_anio(
     IN p_anios_atras INT
 )
 BEGIN
     SELECT
-        YEAR(p.fecha_pedido) AS anio,
-        COALESCE(SUM(pd.cantidad_producto * pr.precio_unitario), 0) AS total_anio,
-        COUNT(DISTINCT p.id_pedido) AS pedidos_anio
-    FROM Pedidos p
-    JOIN Pedidos_Detalles pd ON p.id_pedido = pd.id_pedido
-    JOIN Productos pr ON pd.id_producto = pr.id_producto
-    WHERE p.id_estado_pedido <> 4
-      AND YEAR(p.fecha_pedido) >= YEAR(CURDATE()) - p_anios_atras
-    GROUP BY YEAR(p.fecha_pedido)
-    ORDER BY anio ASC;
+        v.anio,
+        v.total_anio,
+        COALESCE(n.pedidos_anio, 0) AS pedidos_anio
+    FROM (
+        SELECT YEAR(fecha) AS anio, COALESCE(SUM(ingreso), 0) AS total_anio
+        FROM Ventas_Diarias
+        WHERE id_estado_pedido <> 4
+          AND fecha >= MAKEDATE(YEAR(CURDATE()) - p_anios_atras, 1)
+        GROUP BY YEAR(fecha)
+    ) v
+    LEFT JOIN (
+        SELECT YEAR(fecha) AS anio, SUM(pedidos) AS pedidos_anio
+        FROM Ventas_Diarias_Pedidos
+        WHERE id_estado_pedido <> 4
+          AND fecha >= MAKEDATE(YEAR(CURDATE()) - p_anios_atras, 1)
+        GROUP BY YEAR(fecha)
+    ) n ON n.anio = v.anio
+    ORDER BY v.anio ASC;
 END$$
 
 -- =========================================
 -- sp_ventas_por_anio_todos
+-- Como sp_ventas_por_anio para los p_limit anios mas recientes con ventas
 -- =========================================
 CREATE OR REPLACE PROCEDURE sp_ventas_por_anio_todos(
     IN p_limit INT
 )
 BEGIN
     SELECT
-        YEAR(p.fecha_pedido) AS anio,
-        COALESCE(SUM(pd.cantidad_producto * pr.precio_unitario), 0) AS total_anio,
-        COUNT(DISTINCT p.id_pedido) AS pedidos_anio
-    FROM Pedidos p
-    JOIN Pedidos_Detalles pd ON p.id_pedido = pd.id_pedido
-    JOIN Productos pr ON pd.id_producto = pr.id_producto
-    WHERE p.id_estado_pedido <> 4
-    GROUP BY YEAR(p.fecha_pedido)
-    ORDER BY anio DESC
+        v.anio,
+        v.total_anio,
+        COALESCE(n.pedidos_anio, 0) AS pedidos_anio
+    FROM (
+        SELECT YEAR(fecha) AS anio, COALESCE(SUM(ingreso), 0) AS total_anio
+        FROM Ventas_Diarias
+        WHERE id_estado_pedido <> 4
+        GROUP BY YEAR(fecha)
+    ) v
+    LEFT JOIN (
+        SELECT YEAR(fecha) AS anio, SUM(pedidos) AS pedidos_anio
+        FROM Ventas_Diarias_Pedidos
+        WHERE id_estado_pedido <> 4
+        GROUP BY YEAR(fecha)
+    ) n ON n.anio = v.anio
+    ORDER BY v.anio DESC
     LIMIT p_limit;
 END$$
 
+-- =========================================
+-- ventasDiariasAplicar
+-- Suma (p_signo = 1) o resta (p_signo = -1) en Ventas_Diarias, bajo la
+-- fecha y estado indicados, los renglones del pedido p_id_pedido (solo
+-- p_id_pedido_detalle si no es NULL): unidades, ingreso y costo con el
+-- precio guardado en el renglon, el pedido y lo devuelto (Completado). La
+-- llaman los triggers de Pedidos y Pedidos_Detalles, y pedidoCrear /
+-- pedidoCheckout una vez por pedido tras insertar todos sus renglones
+-- =========================================
+CREATE OR REPLACE PROCEDURE ventasDiariasAplicar(
+    IN p_id_pedido INT,
+    IN p_id_pedido_detalle INT,
+    IN p_fecha DATE,
+    IN p_id_estado_pedido INT,
+    IN p_signo INT
+)
+BEGIN
+    INSERT INTO Ventas_Diarias (
+        fecha, id_sucursal, id_producto, id_estado_pedido,
+        unidades, ingreso, costo, pedidos, unidades_devueltas, ingreso_devuelto
+    )
+    SELECT
+        p_fecha,
+        pd.id_sucursal,
+        pd.id_producto,
+        p_id_estado_pedido,
+        p_signo * pd.cantidad_producto,
+        p_signo * pd.cantidad_producto * COALESCE(pd.precio_unitario, pr.precio_unitario),
+        p_signo * pd.cantidad_producto * COALESCE(pd.costo_unitario, pr.costo_unitario),
+        p_signo,
+        p_signo * COALESCE(dv.unidades, 0),
+        p_signo * COALESCE(dv.unidades, 0) * COALESCE(pd.precio_unitario, pr.precio_unitario)
+    FROM Pedidos_Detalles pd
+    JOIN Productos pr ON pr.id_producto = pd.id_producto
+    LEFT JOIN (
+        SELECT dd.id_pedido_detalle, SUM(dd.cantidad_devuelta) AS unidades
+        FROM Devoluciones d
+        JOIN Devoluciones_Detalles dd ON dd.id_devolucion = d.id_devolucion
+        JOIN Estados_Devoluciones ed ON ed.id_estado_devolucion = dd.id_estado_devolucion
+        WHERE d.id_pedido = p_id_pedido
+          AND ed.estado_devolucion = 'Completado'
+        GROUP BY dd.id_pedido_detalle
+    ) dv ON dv.id_pedido_detalle = pd.id_pedido_detalle
+    WHERE pd.id_pedido = p_id_pedido
+      AND (p_id_pedido_detalle IS NULL OR pd.id_pedido_detalle = p_id_pedido_detalle)
+    ON DUPLICATE KEY UPDATE
+        unidades = unidades + VALUES(unidades),
+        ingreso = ingreso + VALUES(ingreso),
+        costo = costo + VALUES(costo),
+        pedidos = pedidos + VALUES(pedidos),
+        unidades_devueltas = unidades_devueltas + VALUES(unidades_devueltas),
+        ingreso_devuelto = ingreso_devuelto + VALUES(ingreso_devuelto);
+
+    -- Al mover un pedido de estado quedan filas sin pedidos
+    IF p_signo < 0 THEN
+        DELETE FROM Ventas_Diarias
+        WHERE fecha = p_fecha
+          AND id_estado_pedido = p_id_estado_pedido
+          AND pedidos <= 0;
+    END IF;
+END$$
+
+-- =========================================
+-- ventasDiariasDevolucion
+-- Suma p_unidades (negativas para restar) a lo devuelto del renglon de
+-- pedido p_id_pedido_detalle en Ventas_Diarias. La llaman los triggers de
+-- Devoluciones_Detalles cuando una devolucion entra o sale de Completado
+-- =========================================
+CREATE OR REPLACE PROCEDURE ventasDiariasDevolucion(
+    IN p_id_pedido_detalle INT,
+    IN p_unidades INT
+)
+BEGIN
+    UPDATE Ventas_Diarias vd
+    JOIN Pedidos_Detalles pd ON pd.id_pedido_detalle = p_id_pedido_detalle
+    JOIN Pedidos p ON p.id_pedido = pd.id_pedido
+    JOIN Productos pr ON pr.id_producto = pd.id_producto
+    SET vd.unidades_devueltas = vd.unidades_devueltas + p_unidades,
+        vd.ingreso_devuelto = vd.ingreso_devuelto + p_unidades * COALESCE(pd.precio_unitario, pr.precio_unitario)
+    WHERE vd.fecha = DATE(p.fecha_pedido)
+      AND vd.id_sucursal = pd.id_sucursal
+      AND vd.id_producto = pd.id_producto
+      AND vd.id_estado_pedido = p.id_estado_pedido;
+END$$
+
+-- =========================================
+-- ventasDiariasRango
+-- Primer y ultimo dia con pedidos (para reconstruir todo el historial)
+-- =========================================
+CREATE OR REPLACE PROCEDURE ventasDiariasRango()
+BEGIN
+    SELECT
+        DATE(MIN(fecha_pedido)) AS desde,
+        DATE(MAX(fecha_pedido)) AS hasta
+    FROM Pedidos;
+END$$
+
+-- =========================================
+-- ventasDiariasReconstruir
+-- Recalcula Ventas_Diarias y Ventas_Diarias_Pedidos de p_desde a p_hasta
+-- (inclusive) desde los pedidos, en una transaccion. Antes completa el
+-- precio y costo de los renglones que no los guardaron (pedidos previos a
+-- esas columnas) con los vigentes del producto. Los conteos de pedidos
+-- quedan en la ranura 0. Al terminar incrementa la version de 'ventas' para
+-- que los reportes con ETag no sigan sirviendo los totales anteriores.
+-- Llamar por periodos cortos (ver 'flask --app app
+-- reconstruir-ventas-diarias'). Devuelve filas_ventas y filas_pedidos
+-- =========================================
+CREATE OR REPLACE PROCEDURE ventasDiariasReconstruir(
+    IN p_desde DATE,
+    IN p_hasta DATE
+)
+BEGIN
+    DECLARE v_filas_ventas INT DEFAULT 0;
+    DECLARE v_filas_pedidos INT DEFAULT 0;
+
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        RESIGNAL;
+    END;
+
+    START TRANSACTION;
+
+    UPDATE Pedidos_Detalles pd
+    JOIN Pedidos p ON p.id_pedido = pd.id_pedido
+    JOIN Productos pr ON pr.id_producto = pd.id_producto
+    SET pd.precio_unitario = pr.precio_unitario,
+        pd.costo_unitario = pr.costo_unitario,
+        pd.descuento_producto = COALESCE(pr.descuento_producto, 0)
+    WHERE pd.precio_unitario IS NULL
+      AND p.fecha_pedido >= p_desde
+      AND p.fecha_pedido < p_hasta + INTERVAL 1 DAY;
+
+    DELETE FROM Ventas_Diarias
+    WHERE fecha BETWEEN p_desde AND p_hasta;
+
+    INSERT INTO Ventas_Diarias (
+        fecha, id_sucursal, id_producto, id_estado_pedido,
+        unidades, ingreso, costo, pedidos, unidades_devueltas, ingreso_devuelto
+    )
+    SELECT
+        DATE(p.fecha_pedido),
+        pd.id_sucursal,
+        pd.id_producto,
+        p.id_estado_pedido,
+        SUM(pd.cantidad_producto),
+        SUM(pd.cantidad_producto * pd.precio_unitario),
+        SUM(pd.cantidad_producto * pd.costo_unitario),
+        COUNT(*),
+        SUM(COALESCE(dv.unidades, 0)),
+        SUM(COALESCE(dv.unidades, 0) * pd.precio_unitario)
+    FROM Pedidos p
+    JOIN Pedidos_Detalles pd ON pd.id_pedido = p.id_pedido
+    LEFT JOIN (
+        SELECT dd.id_pedido_detalle, SUM(dd.cantidad_devuelta) AS unidades
+        FROM Pedidos pp
+        JOIN Devoluciones d ON d.id_pedido = pp.id_pedido
+        JOIN Devoluciones_Detalles dd ON dd.id_devolucion = d.id_devolucion
+        JOIN Estados_Devoluciones ed ON ed.id_estado_devolucion = dd.id_estado_devolucion
+        WHERE pp.fecha_pedido >= p_desde
+          AND pp.fecha_pedido < p_hasta + INTERVAL 1 DAY
+          AND ed.estado_devolucion = 'Completado'
+        GROUP BY dd.id_pedido_detalle
+    ) dv ON dv.id_pedido_detalle = pd.id_pedido_detalle
+    WHERE p.fecha_pedido >= p_desde
+      AND p.fecha_pedido < p_hasta + INTERVAL 1 DAY
+    GROUP BY DATE(p.fecha_pedido), pd.id_sucursal, pd.id_producto, p.id_estado_pedido;
+
+    SET v_filas_ventas = ROW_COUNT();
+
+    DELETE FROM Ventas_Diarias_Pedidos
+    WHERE fecha BETWEEN p_desde AND p_hasta;
+
+    INSERT INTO Ventas_Diarias_Pedidos (fecha, id_estado_pedido, ranura, pedidos)
+    SELECT DATE(fecha_pedido), id_estado_pedido, 0, COUNT(*)
+    FROM Pedidos
+    WHERE fecha_pedido >= p_desde
+      AND fecha_pedido < p_hasta + INTERVAL 1 DAY
+    GROUP BY DATE(fecha_pedido), id_estado_pedido;
+
+    SET v_filas_pedidos = ROW_COUNT();
+
+    CALL versionDatosIncrementar('ventas');
+
+    COMMIT;
+
+    SELECT v_filas_ventas AS filas_ventas, v_filas_pedidos AS filas_pedidos;
+END$$
+
 -- =========================================
 -- sucursalActualizar
 -- =========================================
@@ -4961,7 +6657,8 @@ BEGIN
     LEFT JOIN Clientes cl ON pc.id_cliente = cl.id_cliente
     LEFT JOIN Usuarios u ON cl.id_usuario = u.id_usuario
     WHERE
-        (p_fecha_filtro IS NULL OR DATE(p.fecha_pedido) = p_fecha_filtro)
+        (p_fecha_filtro IS NULL OR (p.fecha_pedido >= p_fecha_filtro
+                                    AND p.fecha_pedido < p_fecha_filtro + INTERVAL 1 DAY))
     ORDER BY
         CASE WHEN p_orden_fecha = 'ASC' THEN p.fecha_pedido END ASC,
         CASE WHEN p_orden_fecha = 'DESC' OR p_orden_fecha IS NULL THEN p.fecha_pedido END DESC
@@ -5270,11 +6967,9 @@ CREATE OR REPLACE PROCEDURE sp_producto_imagen_obtener(
     IN p_id_producto INT
 )
 BEGIN
-    SELECT ip.url_imagen 
-    FROM Imagenes_Productos ip 
-    WHERE ip.id_producto = p_id_producto 
-    ORDER BY ip.fecha_carga DESC 
-    LIMIT 1;
+    SELECT pip.url_imagen
+    FROM Productos_Imagen_Principal pip
+    WHERE pip.id_producto = p_id_producto;
 END$$
 
 -- =========================================
@@ -319,6 +319,11 @@ CREATE TABLE IF NOT EXISTS Pedidos (
     FOREIGN KEY (id_estado_pedido) REFERENCES Estados_Pedidos(id_estado_pedido)
 );
 
+-- Reportes por rango de fechas (fecha_pedido >= desde AND fecha_pedido <
+-- hasta + INTERVAL 1 DAY), casi siempre excluyendo un estado
+CREATE INDEX IF NOT EXISTS idx_pedidos_fecha_estado
+    ON Pedidos (fecha_pedido, id_estado_pedido);
+
 
 
 CREATE TABLE IF NOT EXISTS Pedidos_Clientes (
@@ -343,17 +348,40 @@ CREATE TABLE IF NOT EXISTS Devoluciones (
     FOREIGN KEY (id_pedido) REFERENCES Pedidos(id_pedido)
 );
 
+CREATE INDEX IF NOT EXISTS idx_devoluciones_fecha
+    ON Devoluciones (fecha_devolucion);
+
 CREATE TABLE IF NOT EXISTS Pedidos_Detalles(
     id_pedido_detalle INT PRIMARY KEY AUTO_INCREMENT,
     id_sucursal INT NOT NULL,
     id_pedido INT NOT NULL,
     id_producto     INT NOT NULL,
     cantidad_producto  INT NOT NULL,
+    precio_unitario DECIMAL(10,2) NULL,
+    costo_unitario DECIMAL(10,2) NULL,
+    descuento_producto TINYINT NULL,
     FOREIGN KEY (id_pedido) REFERENCES Pedidos(id_pedido),
     FOREIGN KEY (id_sucursal, id_producto) REFERENCES Sucursales_Productos(id_sucursal, id_producto),
-    UNIQUE (id_pedido, id_producto)
+    UNIQUE KEY uq_pedidos_detalles_sucursal (id_pedido, id_producto, id_sucursal)
 );    
 
+-- Un producto puede surtirse de varias sucursales (surtidoAsignar): un
+-- renglon por sucursal. En bases creadas con la llave anterior
+-- (id_pedido, id_producto) se agrega la nueva antes de quitar la vieja,
+-- que tambien sostiene la llave foranea de id_pedido
+ALTER TABLE Pedidos_Detalles
+    ADD UNIQUE KEY IF NOT EXISTS uq_pedidos_detalles_sucursal (id_pedido, id_producto, id_sucursal);
+ALTER TABLE Pedidos_Detalles DROP INDEX IF EXISTS id_pedido;
+
+-- Precio, costo y descuento del producto al momento del pedido (los llenan
+-- pedidoCrear y pedidoCheckout); las ventas, el total cobrado y la factura
+-- ya no cambian si despues cambia el precio. Los renglones anteriores los
+-- completa ventasDiariasReconstruir
+ALTER TABLE Pedidos_Detalles
+    ADD COLUMN IF NOT EXISTS precio_unitario DECIMAL(10,2) NULL,
+    ADD COLUMN IF NOT EXISTS costo_unitario DECIMAL(10,2) NULL,
+    ADD COLUMN IF NOT EXISTS descuento_producto TINYINT NULL;
+
 CREATE TABLE IF NOT EXISTS Estados_Devoluciones (
     id_estado_devolucion INT PRIMARY KEY AUTO_INCREMENT,
     estado_devolucion ENUM('Pendiente', 'Completado','Autorizado','Rechazado') NOT NULL 
@@ -413,6 +441,9 @@ CREATE TABLE IF NOT EXISTS Facturas (
     FOREIGN KEY (id_empresa) REFERENCES Empresas(id_empresa)
 );
 
+CREATE INDEX IF NOT EXISTS idx_facturas_fecha_emision
+    ON Facturas (fecha_emision);
+
 CREATE TABLE IF NOT EXISTS Estados_Facturas (
     id_estado_factura INT PRIMARY KEY AUTO_INCREMENT,
     id_factura INT NOT NULL,
@@ -437,6 +468,9 @@ CREATE TABLE IF NOT EXISTS Pagos (
     FOREIGN KEY (id_pedido) REFERENCES Pedidos(id_pedido)
 );
 
+CREATE INDEX IF NOT EXISTS idx_pagos_fecha
+    ON Pagos (fecha_pago);
+
 
 CREATE TABLE IF NOT EXISTS Montos_Pagos (
     id_montos_pago INT PRIMARY KEY AUTO_INCREMENT,
@@ -456,3 +490,190 @@ CREATE TABLE IF NOT EXISTS Imagenes_Productos (
         ON DELETE CASCADE -- If product is deleted, images are deleted
 );
 
+-- Búsqueda de la imagen más reciente de un producto
+CREATE INDEX IF NOT EXISTS idx_imagenes_productos_producto_fecha
+    ON Imagenes_Productos (id_producto, fecha_carga);
+
+-- Imagen principal (la más reciente) de cada producto, precalculada para que
+-- el catálogo la obtenga con un JOIN. La mantiene el trigger
+-- imagenProductoAI_catalogo en cada alta de imagen (productoImagenAgregar y
+-- la imagen por defecto de trg_asignar_imagen_default)
+CREATE TABLE IF NOT EXISTS Productos_Imagen_Principal (
+    id_producto INT PRIMARY KEY,
+    id_imagen_producto INT NOT NULL,
+    url_imagen VARCHAR(255) NOT NULL,
+    fecha_carga DATETIME NOT NULL,
+    FOREIGN KEY (id_producto) REFERENCES Productos(id_producto)
+        ON DELETE CASCADE,
+    FOREIGN KEY (id_imagen_producto) REFERENCES Imagenes_Productos(id_imagen_producto)
+        ON DELETE CASCADE
+);
+
+-- Carga inicial para bases que ya tenían imágenes
+INSERT IGNORE INTO Productos_Imagen_Principal (id_producto, id_imagen_producto, url_imagen, fecha_carga)
+SELECT id_producto, id_imagen_producto, url_imagen, fecha_carga
+FROM (
+    SELECT
+        ip.*,
+        ROW_NUMBER() OVER (
+            PARTITION BY ip.id_producto
+            ORDER BY ip.fecha_carga DESC, ip.id_imagen_producto DESC
+        ) AS orden
+    FROM Imagenes_Productos ip
+) ultimas
+WHERE orden = 1;
+
+-- Carritos de compra del lado del servidor (ver carrito.py). La cookie de
+-- sesión solo guarda id_carrito; los carritos vencidos se ignoran al leer y
+-- los borra carritosExpiradosLimpiar (flask limpiar-carritos)
+CREATE TABLE IF NOT EXISTS Carritos (
+    id_carrito CHAR(32) PRIMARY KEY,
+    id_usuario INT NULL,
+    fecha_creacion DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    fecha_expiracion DATETIME NOT NULL,
+    INDEX idx_carritos_usuario (id_usuario),
+    INDEX idx_carritos_expiracion (fecha_expiracion),
+    FOREIGN KEY (id_usuario) REFERENCES Usuarios(id_usuario)
+        ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS Carritos_Items (
+    id_carrito CHAR(32) NOT NULL,
+    id_producto INT NOT NULL,
+    nombre VARCHAR(150) NOT NULL,
+    sku VARCHAR(20) NOT NULL,
+    precio DECIMAL(10,2) NOT NULL,
+    cantidad INT NOT NULL,
+    fecha_agregado DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id_carrito, id_producto),
+    FOREIGN KEY (id_carrito) REFERENCES Carritos(id_carrito)
+        ON DELETE CASCADE,
+    FOREIGN KEY (id_producto) REFERENCES Productos(id_producto)
+        ON DELETE CASCADE
+);
+
+-- Reservas de existencias de los carritos (ver carrito.py): al agregar al
+-- carrito se aparta la cantidad, repartida entre sucursales igual que se
+-- surtira el pedido (surtidoAsignar), por RESERVA_STOCK_MINUTOS.
+-- Lo disponible para vender es stock_actual menos las reservas vigentes; el
+-- checkout convierte las reservas en renglones del pedido. Las vencidas se
+-- ignoran al leer y las borra reservasExpiradasLimpiar por lotes
+CREATE TABLE IF NOT EXISTS Reservas_Stock (
+    id_carrito CHAR(32) NOT NULL,
+    id_producto INT NOT NULL,
+    id_sucursal INT NOT NULL,
+    cantidad INT NOT NULL,
+    fecha_expiracion DATETIME NOT NULL,
+    PRIMARY KEY (id_carrito, id_producto, id_sucursal),
+    INDEX idx_reservas_stock_producto (id_producto, id_sucursal, fecha_expiracion),
+    INDEX idx_reservas_stock_expiracion (fecha_expiracion),
+    FOREIGN KEY (id_carrito) REFERENCES Carritos(id_carrito)
+        ON DELETE CASCADE,
+    FOREIGN KEY (id_sucursal, id_producto) REFERENCES Sucursales_Productos(id_sucursal, id_producto)
+);
+
+-- Claves de idempotencia (ver idempotencia.py): checkout, alta de pedidos y
+-- registro de pagos guardan la respuesta de cada Idempotency-Key para que un
+-- reintento la repita sin volver a crear el pedido o el pago. id_usuario = 0
+-- para peticiones sin sesion. Vencen tras IDEMPOTENCIA_TTL_HORAS y las borra
+-- idempotenciaExpiradasLimpiar por lotes
+CREATE TABLE IF NOT EXISTS Claves_Idempotencia (
+    id_usuario INT NOT NULL,
+    operacion VARCHAR(40) NOT NULL,
+    clave VARCHAR(100) NOT NULL,
+    hash_solicitud CHAR(64) NOT NULL,
+    estado ENUM('En proceso', 'Completada') NOT NULL DEFAULT 'En proceso',
+    codigo_respuesta SMALLINT NULL,
+    tipo_contenido VARCHAR(100) NULL,
+    respuesta MEDIUMTEXT NULL,
+    fecha_creacion DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    fecha_expiracion DATETIME NOT NULL,
+    PRIMARY KEY (id_usuario, operacion, clave),
+    INDEX idx_claves_idempotencia_expiracion (fecha_expiracion)
+);
+
+-- Cola de facturas del checkout (ver facturacion.py): si el cliente pide
+-- factura, pedidoCheckout deja aqui el pedido y el worker
+-- 'flask --app app facturar-pendientes' la genera fuera del request. Un
+-- fallo no deshace el pedido: se reintenta con espera creciente hasta
+-- FACTURAS_MAX_INTENTOS y despues queda en 'Error'. total es lo que se
+-- cobro en el checkout (con el descuento de clasificacion): la factura se
+-- emite por ese monto aunque el precio del producto cambie antes de que el
+-- worker la genere. 'Cancelado': el pedido se cancelo mientras el trabajo
+-- esperaba y no se factura
+CREATE TABLE IF NOT EXISTS Facturacion_Trabajos (
+    id_trabajo INT PRIMARY KEY AUTO_INCREMENT,
+    id_pedido INT NOT NULL,
+    descuento_clasificacion DECIMAL(5,2) NOT NULL DEFAULT 0,
+    total DECIMAL(12,2) NULL,
+    estado ENUM('Pendiente', 'En proceso', 'Completado', 'Error', 'Cancelado') NOT NULL DEFAULT 'Pendiente',
+    intentos INT NOT NULL DEFAULT 0,
+    ultimo_error VARCHAR(500) NULL,
+    id_factura INT NULL,
+    fecha_creacion DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    fecha_disponible DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    fecha_actualizacion DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE (id_pedido),
+    INDEX idx_facturacion_trabajos_estado (estado, fecha_disponible),
+    FOREIGN KEY (id_pedido) REFERENCES Pedidos(id_pedido),
+    FOREIGN KEY (id_factura) REFERENCES Facturas(id_factura)
+);
+
+-- Cubetas (token bucket) de intentos de inicio de sesion compartidas entre
+-- workers (ver limite_login.py). clave es 'ip:<direccion>' o 'u:<usuario>';
+-- las fichas se recuperan segun el tiempo desde actualizado
+CREATE TABLE IF NOT EXISTS Limites_Login (
+    clave VARCHAR(120) NOT NULL PRIMARY KEY,
+    fichas DECIMAL(10,3) NOT NULL,
+    actualizado DATETIME(6) NOT NULL,
+    INDEX idx_limites_login_actualizado (actualizado)
+);
+
+-- Hechos de ventas por dia, sucursal, producto y estado del pedido (fecha
+-- del pedido). Los mantienen los triggers de Pedidos, Pedidos_Detalles y
+-- Devoluciones_Detalles al crear, cambiar de estado (cancelar) o devolver, y
+-- se reconstruyen con 'flask --app app reconstruir-ventas-diarias'. Los
+-- reportes de ventas suman estas filas en lugar de recorrer los pedidos.
+-- pedidos cuenta los pedidos con ese producto y sucursal; lo devuelto son
+-- las devoluciones en estado Completado
+CREATE TABLE IF NOT EXISTS Ventas_Diarias (
+    fecha DATE NOT NULL,
+    id_sucursal INT NOT NULL,
+    id_producto INT NOT NULL,
+    id_estado_pedido INT NOT NULL,
+    unidades INT NOT NULL DEFAULT 0,
+    ingreso DECIMAL(14,2) NOT NULL DEFAULT 0,
+    costo DECIMAL(14,2) NOT NULL DEFAULT 0,
+    pedidos INT NOT NULL DEFAULT 0,
+    unidades_devueltas INT NOT NULL DEFAULT 0,
+    ingreso_devuelto DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (fecha, id_sucursal, id_producto, id_estado_pedido),
+    INDEX idx_ventas_diarias_producto (id_producto, fecha)
+);
+
+-- Pedidos por dia y estado (un pedido con varios productos cuenta una vez).
+-- Como en Versiones_Datos, cada dia y estado se reparte en ranuras
+-- (CONNECTION_ID() MOD 8) para que los checkouts concurrentes del dia no
+-- esperen por la misma fila; el conteo es la suma de sus ranuras
+CREATE TABLE IF NOT EXISTS Ventas_Diarias_Pedidos (
+    fecha DATE NOT NULL,
+    id_estado_pedido INT NOT NULL,
+    ranura TINYINT UNSIGNED NOT NULL DEFAULT 0,
+    pedidos INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (fecha, id_estado_pedido, ranura)
+);
+
+-- Dimension de fechas: un renglon por dia. Los reportes por dia (ver
+-- facturacionDiaria) la unen a los datos agrupados para devolver en cero
+-- los dias sin movimientos con una sola consulta
+CREATE TABLE IF NOT EXISTS Calendario (
+    fecha DATE NOT NULL PRIMARY KEY,
+    anio SMALLINT NOT NULL,
+    mes TINYINT NOT NULL,
+    dia TINYINT NOT NULL,
+    dia_semana TINYINT NOT NULL,   -- 1 = lunes
+    inicio_mes DATE NOT NULL,
+    INDEX idx_calendario_anio_mes (anio, mes)
+);
+
+CALL calendarioLlenar('2000-01-01', '2050-12-31');
@@ -10,12 +10,29 @@ CREATE TABLE IF NOT EXISTS Productos_Actualizados (
 fecha_actualizacion_producto TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Versiones de datos por dominio ('catalogo', 'ventas', 'inventario',
+-- 'devoluciones'). Los triggers las incrementan con versionDatosIncrementar y
+-- la app las usa para invalidar caches (catalogo_cache.py) y como validadores
+-- ETag / Last-Modified (condicional.py). Cada dominio se reparte en ranuras
+-- (CONNECTION_ID() MOD 8) para que transacciones concurrentes no esperen por
+-- la misma fila; la versión del dominio es la suma de sus ranuras.
+CREATE TABLE IF NOT EXISTS Versiones_Datos (
+    nombre_dato VARCHAR(30) NOT NULL,
+    ranura TINYINT UNSIGNED NOT NULL,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    fecha_actualizacion TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (nombre_dato, ranura)
+);
+
 DELIMITER $$
 
 CREATE OR REPLACE TRIGGER productoAIUD
 AFTER UPDATE ON Productos
 FOR EACH ROW
 BEGIN
+    -- Cualquier cambio de producto invalida el cache del catálogo
+    CALL versionDatosIncrementar('catalogo');
+
     IF NEW.descuento_producto <> OLD.descuento_producto THEN
 INSERT INTO Productos_Actualizados (
             id_producto,
@@ -38,6 +55,92 @@ INSERT INTO Productos_Actualizados (
     END IF;
 END $$
 
+CREATE OR REPLACE TRIGGER productoAI_catalogo
+AFTER INSERT ON Productos
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('catalogo');
+END $$
+
+CREATE OR REPLACE TRIGGER imagenProductoAI_catalogo
+AFTER INSERT ON Imagenes_Productos
+FOR EACH ROW
+BEGIN
+    -- La imagen nueva pasa a ser la principal salvo que ya haya una más reciente
+    -- (el orden de las asignaciones importa: fecha_carga se actualiza al final)
+    INSERT INTO Productos_Imagen_Principal (id_producto, id_imagen_producto, url_imagen, fecha_carga)
+    VALUES (NEW.id_producto, NEW.id_imagen_producto, NEW.url_imagen, NEW.fecha_carga)
+    ON DUPLICATE KEY UPDATE
+        id_imagen_producto = IF(VALUES(fecha_carga) >= fecha_carga, VALUES(id_imagen_producto), id_imagen_producto),
+        url_imagen = IF(VALUES(fecha_carga) >= fecha_carga, VALUES(url_imagen), url_imagen),
+        fecha_carga = GREATEST(fecha_carga, VALUES(fecha_carga));
+
+    CALL versionDatosIncrementar('catalogo');
+END $$
+
+CREATE OR REPLACE TRIGGER modeloAU_catalogo
+AFTER UPDATE ON Modelos
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('catalogo');
+END $$
+
+CREATE OR REPLACE TRIGGER categoriaAI_catalogo
+AFTER INSERT ON Categorias
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('catalogo');
+END $$
+
+CREATE OR REPLACE TRIGGER categoriaAU_catalogo
+AFTER UPDATE ON Categorias
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('catalogo');
+END $$
+
+CREATE OR REPLACE TRIGGER kilatajeAI_catalogo
+AFTER INSERT ON Productos_Oro_Kilataje
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('catalogo');
+END $$
+
+CREATE OR REPLACE TRIGGER kilatajeAU_catalogo
+AFTER UPDATE ON Productos_Oro_Kilataje
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('catalogo');
+END $$
+
+CREATE OR REPLACE TRIGGER kilatajeAD_catalogo
+AFTER DELETE ON Productos_Oro_Kilataje
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('catalogo');
+END $$
+
+CREATE OR REPLACE TRIGGER leyAI_catalogo
+AFTER INSERT ON Productos_Plata_Ley
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('catalogo');
+END $$
+
+CREATE OR REPLACE TRIGGER leyAU_catalogo
+AFTER UPDATE ON Productos_Plata_Ley
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('catalogo');
+END $$
+
+CREATE OR REPLACE TRIGGER leyAD_catalogo
+AFTER DELETE ON Productos_Plata_Ley
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('catalogo');
+END $$
+
 DELIMITER ;
 
 
@@ -141,25 +244,48 @@ DELIMITER $$
 CREATE TRIGGER valida_stock_sobreventa
 BEFORE INSERT ON Pedidos_Detalles
 FOR EACH ROW
-BEGIN
+validar: BEGIN
     DECLARE IDproducto INT;
     DECLARE IDsucursal INT DEFAULT NULL;
     DECLARE stockSucursalProducto INT;
     DECLARE productoSKU VARCHAR(12);
     DECLARE mensaje VARCHAR(500);
+
+    -- Renglones que ya surtió y validó el SP que los inserta (pedidoCrear y
+    -- pedidoCheckout: surtidoAsignar bloquea y valida las existencias de
+    -- todo el pedido en una sola pasada). Esos SP ponen
+    -- @pedido_detalles_surtido = id del pedido solo durante su INSERT y lo
+    -- limpian después; cualquier otro INSERT se valida completo
+    IF @pedido_detalles_surtido <=> NEW.id_pedido AND NEW.id_sucursal IS NOT NULL THEN
+        LEAVE validar;
+    END IF;
     
     SET IDproducto = NEW.id_producto;
 
-    -- SIEMPRE asignar automáticamente la sucursal con mayor stock disponible para este producto
+    -- Respetar la sucursal que ya eligió el SP (p. ej. la reservada por el
+    -- carrito en pedidoCheckout) si está activa y maneja el producto
+    IF NEW.id_sucursal IS NOT NULL THEN
+        SELECT sp.id_sucursal INTO IDsucursal
+        FROM Sucursales_Productos sp
+        JOIN Sucursales s ON s.id_sucursal = sp.id_sucursal
+        WHERE sp.id_producto = IDproducto
+          AND sp.id_sucursal = NEW.id_sucursal
+          AND s.activo_sucursal = 1
+        LIMIT 1;
+    END IF;
+
+    -- Si no, asignar automáticamente la sucursal con mayor stock disponible para este producto
     -- Primero intentar encontrar una sucursal activa con stock suficiente
-    SELECT sp.id_sucursal INTO IDsucursal
-    FROM Sucursales_Productos sp
-    JOIN Sucursales s ON s.id_sucursal = sp.id_sucursal
-    WHERE sp.id_producto = IDproducto
-      AND s.activo_sucursal = 1
-      AND sp.stock_actual >= NEW.cantidad_producto
-    ORDER BY sp.stock_actual DESC
-    LIMIT 1;
+    IF IDsucursal IS NULL THEN
+        SELECT sp.id_sucursal INTO IDsucursal
+        FROM Sucursales_Productos sp
+        JOIN Sucursales s ON s.id_sucursal = sp.id_sucursal
+        WHERE sp.id_producto = IDproducto
+          AND s.activo_sucursal = 1
+          AND sp.stock_actual >= NEW.cantidad_producto
+        ORDER BY sp.stock_actual DESC
+        LIMIT 1;
+    END IF;
 
     -- Si no se encontró una con stock suficiente, buscar cualquier sucursal activa con el producto
     IF IDsucursal IS NULL THEN
@@ -184,7 +310,7 @@ BEGIN
         SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = mensaje;
     END IF;
 
-    -- Asignar automáticamente la sucursal con mayor stock (ignorando el valor que venga)
+    -- Sucursal que surte el renglón
     SET NEW.id_sucursal = IDsucursal;
 
     -- Validar stock
@@ -197,13 +323,13 @@ BEGIN
         SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'El producto no está registrado en la sucursal seleccionada.';
     END IF;
 
-    SELECT s.sku INTO productoSKU 
-    FROM Sku s 
-    JOIN Productos p ON s.id_sku = p.id_sku 
-    WHERE p.id_producto = NEW.id_producto 
-    LIMIT 1;
-
     IF NEW.cantidad_producto > stockSucursalProducto THEN
+        SELECT s.sku INTO productoSKU 
+        FROM Sku s 
+        JOIN Productos p ON s.id_sku = p.id_sku 
+        WHERE p.id_producto = NEW.id_producto 
+        LIMIT 1;
+
         SET mensaje = CONCAT('Stock insuficiente para ', COALESCE(productoSKU, 'producto'), ' | Disponible: ', stockSucursalProducto, ' | Solicitado: ', NEW.cantidad_producto);
         SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = mensaje;
     END IF;
@@ -870,3 +996,246 @@ BEGIN
     END IF;
 END $$
 DELIMITER ;
+
+
+
+
+-- ======================================================
+-- Versiones de datos de ventas, inventario y devoluciones
+-- (validadores ETag / Last-Modified de los reportes, ver condicional.py).
+-- La app no borra filas de estas tablas, por eso solo INSERT / UPDATE.
+-- ======================================================
+DELIMITER $$
+
+CREATE OR REPLACE TRIGGER pedidoAI_version
+AFTER INSERT ON Pedidos
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('ventas');
+END $$
+
+CREATE OR REPLACE TRIGGER pedidoAU_version
+AFTER UPDATE ON Pedidos
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('ventas');
+END $$
+
+CREATE OR REPLACE TRIGGER pedidoDetalleAI_version
+AFTER INSERT ON Pedidos_Detalles
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('ventas');
+END $$
+
+CREATE OR REPLACE TRIGGER pedidoDetalleAU_version
+AFTER UPDATE ON Pedidos_Detalles
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('ventas');
+END $$
+
+CREATE OR REPLACE TRIGGER facturaAI_version
+AFTER INSERT ON Facturas
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('ventas');
+END $$
+
+CREATE OR REPLACE TRIGGER estadoFacturaAI_version
+AFTER INSERT ON Estados_Facturas
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('ventas');
+END $$
+
+CREATE OR REPLACE TRIGGER estadoFacturaAU_version
+AFTER UPDATE ON Estados_Facturas
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('ventas');
+END $$
+
+CREATE OR REPLACE TRIGGER pagoAI_version
+AFTER INSERT ON Pagos
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('ventas');
+END $$
+
+CREATE OR REPLACE TRIGGER montoPagoAI_version
+AFTER INSERT ON Montos_Pagos
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('ventas');
+END $$
+
+CREATE OR REPLACE TRIGGER montoPagoAU_version
+AFTER UPDATE ON Montos_Pagos
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('ventas');
+END $$
+
+CREATE OR REPLACE TRIGGER sucursalProductoAI_version
+AFTER INSERT ON Sucursales_Productos
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('inventario');
+END $$
+
+CREATE OR REPLACE TRIGGER sucursalProductoAU_version
+AFTER UPDATE ON Sucursales_Productos
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('inventario');
+END $$
+
+CREATE OR REPLACE TRIGGER devolucionAI_version
+AFTER INSERT ON Devoluciones
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('devoluciones');
+END $$
+
+CREATE OR REPLACE TRIGGER devolucionAU_version
+AFTER UPDATE ON Devoluciones
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('devoluciones');
+END $$
+
+CREATE OR REPLACE TRIGGER devolucionDetalleAI_version
+AFTER INSERT ON Devoluciones_Detalles
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('devoluciones');
+END $$
+
+CREATE OR REPLACE TRIGGER devolucionDetalleAU_version
+AFTER UPDATE ON Devoluciones_Detalles
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('devoluciones');
+END $$
+
+CREATE OR REPLACE TRIGGER reembolsoAI_version
+AFTER INSERT ON Reembolsos
+FOR EACH ROW
+BEGIN
+    CALL versionDatosIncrementar('devoluciones');
+END $$
+
+DELIMITER ;
+
+
+
+
+-- ======================================================
+-- Hechos de ventas diarias (Ventas_Diarias, Ventas_Diarias_Pedidos):
+-- se actualizan al crear pedidos y renglones, al cambiar el estado o la
+-- fecha de un pedido (cancelar) y cuando una devolucion entra o sale de
+-- Completado. Para recalcular un periodo: ventasDiariasReconstruir
+-- ======================================================
+DELIMITER $$
+
+CREATE OR REPLACE TRIGGER pedidoAI_ventas_diarias
+AFTER INSERT ON Pedidos
+FOR EACH ROW
+BEGIN
+    IF NEW.fecha_pedido IS NOT NULL THEN
+        INSERT INTO Ventas_Diarias_Pedidos (fecha, id_estado_pedido, ranura, pedidos)
+        VALUES (DATE(NEW.fecha_pedido), NEW.id_estado_pedido, CONNECTION_ID() MOD 8, 1)
+        ON DUPLICATE KEY UPDATE pedidos = pedidos + 1;
+    END IF;
+END $$
+
+CREATE OR REPLACE TRIGGER pedidoDetalleAI_ventas_diarias
+AFTER INSERT ON Pedidos_Detalles
+FOR EACH ROW
+aplicar: BEGIN
+    DECLARE v_fecha DATE;
+    DECLARE v_id_estado_pedido INT;
+
+    -- pedidoCrear y pedidoCheckout aplican el pedido completo con una sola
+    -- llamada despues de insertar sus renglones
+    IF @pedido_detalles_surtido <=> NEW.id_pedido THEN
+        LEAVE aplicar;
+    END IF;
+
+    SELECT DATE(fecha_pedido), id_estado_pedido
+    INTO v_fecha, v_id_estado_pedido
+    FROM Pedidos
+    WHERE id_pedido = NEW.id_pedido;
+
+    IF v_fecha IS NOT NULL THEN
+        CALL ventasDiariasAplicar(NEW.id_pedido, NEW.id_pedido_detalle, v_fecha, v_id_estado_pedido, 1);
+    END IF;
+END $$
+
+CREATE OR REPLACE TRIGGER pedidoAU_ventas_diarias
+AFTER UPDATE ON Pedidos
+FOR EACH ROW
+BEGIN
+    IF NOT (OLD.id_estado_pedido <=> NEW.id_estado_pedido)
+       OR NOT (DATE(OLD.fecha_pedido) <=> DATE(NEW.fecha_pedido)) THEN
+
+        IF OLD.fecha_pedido IS NOT NULL THEN
+            CALL ventasDiariasAplicar(OLD.id_pedido, NULL, DATE(OLD.fecha_pedido), OLD.id_estado_pedido, -1);
+
+            -- En la ranura de esta conexion: una ranura puede quedar
+            -- negativa, la suma del dia y estado es la correcta
+            INSERT INTO Ventas_Diarias_Pedidos (fecha, id_estado_pedido, ranura, pedidos)
+            VALUES (DATE(OLD.fecha_pedido), OLD.id_estado_pedido, CONNECTION_ID() MOD 8, -1)
+            ON DUPLICATE KEY UPDATE pedidos = pedidos - 1;
+        END IF;
+
+        IF NEW.fecha_pedido IS NOT NULL THEN
+            CALL ventasDiariasAplicar(NEW.id_pedido, NULL, DATE(NEW.fecha_pedido), NEW.id_estado_pedido, 1);
+
+            INSERT INTO Ventas_Diarias_Pedidos (fecha, id_estado_pedido, ranura, pedidos)
+            VALUES (DATE(NEW.fecha_pedido), NEW.id_estado_pedido, CONNECTION_ID() MOD 8, 1)
+            ON DUPLICATE KEY UPDATE pedidos = pedidos + 1;
+        END IF;
+    END IF;
+END $$
+
+CREATE OR REPLACE TRIGGER devolucionDetalleAI_ventas_diarias
+AFTER INSERT ON Devoluciones_Detalles
+FOR EACH ROW
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM Estados_Devoluciones
+        WHERE id_estado_devolucion = NEW.id_estado_devolucion
+          AND estado_devolucion = 'Completado'
+    ) THEN
+        CALL ventasDiariasDevolucion(NEW.id_pedido_detalle, NEW.cantidad_devuelta);
+    END IF;
+END $$
+
+CREATE OR REPLACE TRIGGER devolucionDetalleAU_ventas_diarias
+AFTER UPDATE ON Devoluciones_Detalles
+FOR EACH ROW
+BEGIN
+    DECLARE v_id_completado INT;
+
+    SELECT id_estado_devolucion INTO v_id_completado
+    FROM Estados_Devoluciones
+    WHERE estado_devolucion = 'Completado'
+    LIMIT 1;
+
+    IF NOT (OLD.id_estado_devolucion <=> NEW.id_estado_devolucion)
+       OR OLD.cantidad_devuelta <> NEW.cantidad_devuelta
+       OR OLD.id_pedido_detalle <> NEW.id_pedido_detalle THEN
+
+        IF OLD.id_estado_devolucion = v_id_completado THEN
+            CALL ventasDiariasDevolucion(OLD.id_pedido_detalle, -OLD.cantidad_devuelta);
+        END IF;
+
+        IF NEW.id_estado_devolucion = v_id_completado THEN
+            CALL ventasDiariasDevolucion(NEW.id_pedido_detalle, NEW.cantidad_devuelta);
+        END IF;
+    END IF;
+END $$
+
+DELIMITER ;
@@ -1,4 +1,4 @@
-CREATE VIEW vtopVentasMes AS
+CREATE OR REPLACE VIEW vtopVentasMes AS
 SELECT	
 p.id_producto,
 s.sku AS SKU_Producto, 
@@ -11,7 +11,8 @@ JOIN Sku s on p.id_sku=s.id_sku
 JOIN Pedidos_Detalles pd ON p.id_producto=pd.id_producto 
 JOIN Pedidos pe ON pd.id_pedido=pe.id_pedido  
 WHERE 
-MONTH(pe.fecha_pedido) = MONTH(CURRENT_DATE) AND YEAR(pe.fecha_pedido) = YEAR(CURRENT_DATE) AND pe.id_estado_pedido != (
+pe.fecha_pedido >= CURRENT_DATE - INTERVAL (DAYOFMONTH(CURRENT_DATE) - 1) DAY
+AND pe.fecha_pedido < LAST_DAY(CURRENT_DATE) + INTERVAL 1 DAY AND pe.id_estado_pedido != (
 	SELECT id_estado_pedido 
 	FROM Estados_Pedidos 
 	WHERE estado_pedido = 'Cancelado'
@@ -0,0 +1,250 @@
+"""
+EXPLAIN de los reportes filtrados por fecha.
+
+Corre EXPLAIN sobre las consultas de los procedimientos y vistas de reportes
+que filtran Pedidos, Facturas, Pagos y Devoluciones por rango de fechas, y
+verifica que esas tablas se lean por su índice de fecha (type range/ref) y
+no completas (type ALL). Termina con código 1 si alguna se lee completa.
+Las consultas se leen de create_stored_procedures.sql (el SELECT de cada
+procedimiento con sus parámetros como valores), así que el EXPLAIN sigue al
+procedimiento si este cambia; las vistas se consultan por su nombre.
+
+Con pocas filas el optimizador prefiere leer la tabla completa aunque exista
+el índice, por eso --generar agrega N pedidos sintéticos repartidos en
+--anios años, con su factura y pago, y una devolución para uno de cada 20
+pedidos completados. Crea datos reales: usar solo en una base de desarrollo.
+
+    python scripts/explain_reportes.py --generar 500000
+    python scripts/explain_reportes.py --dias 31
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import uuid
+from datetime import date, datetime, timedelta
+
+import MySQLdb
+import MySQLdb.cursors
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from config import Config  # noqa: E402
+
+LOTE = 5000
+
+RUTA_PROCEDIMIENTOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'create_stored_procedures.sql')
+
+# (procedimiento o vista, tabla o alias que debe leerse por índice, parámetros
+# del procedimiento en orden; None para una vista). La consulta se toma del
+# cuerpo del procedimiento en create_stored_procedures.sql, no de una copia.
+CONSULTAS = [
+    ('sp_top_clientes_gasto', 'p', ('desde', 'hasta', 'limite')),
+    ('sp_top_clientes_pedidos', 'p', ('desde', 'hasta')),
+    ('sp_top_productos_vendidos', 'pe', ('desde', 'hasta', 'limite')),
+    ('gestor_ventas_totales_sucursal', 'pe', ('sucursal', 'desde', 'hasta')),
+    ('gestor_pedidos_count_sucursal', 'pe', ('sucursal', 'desde', 'hasta')),
+    ('gestor_top_productos_sucursal', 'pe', ('sucursal', 'desde', 'hasta', 'limite')),
+    ('admin_pedidos_filtrados', 'p', ('hasta', 'orden')),
+    ('ventas_pedidos_lista', 'p', ('hasta', 'orden')),
+    ('vtopVentasMes', 'pe', None),
+    ('facturacionDiaria', 'f', ('desde', 'hasta')),
+    ('admin_kpi_ventas_totales', 'Facturas', ('desde', 'hasta')),
+    ('sp_facturacion_diaria_vista', 'Facturas', ('desde', 'hasta')),
+    ('sp_cobrado_por_mes', 'p', ('desde', 'hasta')),
+    ('sp_devoluciones_count_rango', 'd', ('desde', 'hasta')),
+]
+
+
+def consulta_procedimiento(fuente, nombre, claves):
+    """
+    SELECT del cuerpo del procedimiento `nombre` (su última definición en
+    `fuente`) con los parámetros IN cambiados por %(clave)s en el orden de
+    `claves`. Es la primera sentencia SELECT, o el SELECT de un
+    INSERT ... SELECT, que usa algún parámetro.
+    """
+    definiciones = re.findall(
+        r'CREATE\s+OR\s+REPLACE\s+PROCEDURE\s+`?%s`?\s*\((.*?)\)\s*BEGIN\b(.*?)\bEND\s*\$\$' % re.escape(nombre),
+        fuente, re.S | re.I)
+    if not definiciones:
+        raise SystemExit(f'{nombre}: no está en {RUTA_PROCEDIMIENTOS}')
+    encabezado, cuerpo = (re.sub(r'--[^\n]*', '', texto) for texto in definiciones[-1])
+    parametros = re.findall(r'\b(?:IN|OUT|INOUT)\s+(\w+)', encabezado, re.I)
+    if len(parametros) != len(claves):
+        raise SystemExit(f'{nombre}: recibe {len(parametros)} parámetros, CONSULTAS indica {len(claves)}')
+
+    cuerpo = cuerpo.replace('%', '%%')
+    for parametro, clave in zip(parametros, claves):
+        cuerpo = re.sub(r'\b%s\b' % re.escape(parametro), '%%(%s)s' % clave, cuerpo)
+    for sentencia in cuerpo.split(';'):
+        sentencia = sentencia.strip()
+        if '%(' not in sentencia:
+            continue
+        if re.match(r'SELECT\b', sentencia, re.I):
+            return sentencia
+        insercion = re.match(r'INSERT\b.*?\)\s*(SELECT\b.*)', sentencia, re.S | re.I)
+        if insercion:
+            return insercion.group(1)
+    raise SystemExit(f'{nombre}: no se encontró un SELECT que use sus parámetros')
+
+
+def consultas():
+    """[(reporte, tabla, sql)] con las consultas actuales de procedimientos y vistas"""
+    with open(RUTA_PROCEDIMIENTOS, encoding='utf-8-sig') as archivo:
+        fuente = archivo.read()
+    return [
+        (nombre, tabla, f'SELECT * FROM {nombre}' if claves is None
+         else consulta_procedimiento(fuente, nombre, claves))
+        for nombre, tabla, claves in CONSULTAS
+    ]
+
+
+def conectar():
+    return MySQLdb.connect(
+        host=Config.MYSQL_HOST,
+        port=Config.MYSQL_PORT,
+        user=Config.MYSQL_USER,
+        passwd=Config.MYSQL_PASSWORD,
+        db=Config.MYSQL_DB,
+        charset=Config.MYSQL_CHARSET,
+        cursorclass=MySQLdb.cursors.DictCursor,
+    )
+
+
+def generar(conexion, total, anios):
+    """
+    Inserta `total` pedidos con factura y pago, por lotes de LOTE. Los ids
+    nuevos se leen de vuelta con id_pedido > el último anterior: correr sin
+    otras escrituras de pedidos en la base.
+    """
+    cursor = conexion.cursor()
+    cursor.execute('SELECT id_estado_pedido, estado_pedido FROM Estados_Pedidos')
+    estados = {fila['estado_pedido']: fila['id_estado_pedido'] for fila in cursor.fetchall()}
+    cursor.execute('SELECT MIN(id_empresa) AS id_empresa FROM Empresas')
+    id_empresa = cursor.fetchone()['id_empresa']
+    cursor.execute('SELECT MIN(id_metodo_pago) AS id_metodo_pago FROM Metodos_Pagos')
+    id_metodo_pago = cursor.fetchone()['id_metodo_pago']
+    if not estados or id_empresa is None or id_metodo_pago is None:
+        raise SystemExit('Faltan catálogos (Estados_Pedidos, Empresas, Metodos_Pagos): correr insert_data.sql')
+
+    # Casi todos completados para que puedan tener devolución
+    pesos = [(estados.get('Completado'), 80), (estados.get('Confirmado'), 8),
+             (estados.get('Procesado'), 7), (estados.get('Cancelado'), 5)]
+    ids_estado = [id_estado for id_estado, _ in pesos if id_estado]
+    pesos_estado = [peso for id_estado, peso in pesos if id_estado]
+    # Hasta hace 3 días: la devolución (pedido + 3 días) no puede quedar en el futuro
+    fin = datetime.combine(date.today() - timedelta(days=3), datetime.min.time())
+    minutos = anios * 365 * 24 * 60
+
+    hechos = 0
+    while hechos < total:
+        n = min(LOTE, total - hechos)
+        pedidos = sorted(
+            (fin - timedelta(minutes=random.randrange(minutos)),
+             random.choices(ids_estado, pesos_estado)[0])
+            for _ in range(n)
+        )
+        try:
+            cursor.execute('SELECT COALESCE(MAX(id_pedido), 0) AS ultimo FROM Pedidos')
+            ultimo = cursor.fetchone()['ultimo']
+            cursor.executemany('INSERT INTO Pedidos (fecha_pedido, id_estado_pedido) VALUES (%s, %s)', pedidos)
+            cursor.execute('SELECT id_pedido, fecha_pedido, id_estado_pedido FROM Pedidos WHERE id_pedido > %s',
+                           [ultimo])
+            nuevos = cursor.fetchall()
+
+            facturas = []
+            for pedido in nuevos:
+                subtotal = round(random.uniform(200, 20000), 2)
+                facturas.append((str(uuid.uuid4()), pedido['id_pedido'], id_empresa, pedido['fecha_pedido'].date(),
+                                 subtotal, round(subtotal * 0.16, 2), round(subtotal * 1.16, 2)))
+            cursor.executemany(
+                'INSERT INTO Facturas (folio, id_pedido, id_empresa, fecha_emision, subtotal, impuestos, total) '
+                'VALUES (%s, %s, %s, %s, %s, %s, %s)', facturas)
+            cursor.execute('SELECT id_factura, id_pedido, fecha_emision, total FROM Facturas WHERE id_pedido > %s',
+                           [ultimo])
+            nuevas = cursor.fetchall()
+            cursor.executemany(
+                "INSERT INTO Estados_Facturas (id_factura, estado_factura, fecha_estado_factura) "
+                "VALUES (%s, 'Pagada', %s)",
+                [(f['id_factura'], f['fecha_emision']) for f in nuevas])
+            cursor.executemany(
+                'INSERT INTO Pagos (id_factura, id_pedido, fecha_pago) VALUES (%s, %s, %s)',
+                [(f['id_factura'], f['id_pedido'], f['fecha_emision']) for f in nuevas])
+            cursor.execute('SELECT pa.id_pago, f.total FROM Pagos pa JOIN Facturas f ON f.id_factura = pa.id_factura '
+                           'WHERE pa.id_pedido > %s', [ultimo])
+            cursor.executemany(
+                'INSERT INTO Montos_Pagos (id_metodo_pago, id_pago, monto_metodo_pago) VALUES (%s, %s, %s)',
+                [(id_metodo_pago, pago['id_pago'], pago['total']) for pago in cursor.fetchall()])
+
+            devoluciones = [
+                (pedido['id_pedido'], pedido['fecha_pedido'].date() + timedelta(days=3))
+                for pedido in nuevos
+                if pedido['id_estado_pedido'] == estados.get('Completado') and random.random() < 0.05
+            ]
+            if devoluciones:
+                cursor.executemany('INSERT INTO Devoluciones (id_pedido, fecha_devolucion) VALUES (%s, %s)', devoluciones)
+            conexion.commit()
+        except Exception:
+            conexion.rollback()
+            raise
+        hechos += n
+        print(f'  {hechos}/{total} pedidos generados')
+
+    # Estadísticas al día para que el optimizador vea el tamaño real
+    for tabla in ('Pedidos', 'Facturas', 'Estados_Facturas', 'Pagos', 'Montos_Pagos', 'Devoluciones'):
+        cursor.execute(f'ANALYZE TABLE {tabla}')
+        cursor.fetchall()
+    cursor.close()
+
+
+def explicar(conexion, sql, parametros):
+    cursor = conexion.cursor()
+    try:
+        cursor.execute('EXPLAIN ' + sql, parametros)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--generar', type=int, default=0, help='pedidos sintéticos a agregar antes del EXPLAIN')
+    parser.add_argument('--anios', type=int, default=5, help='años en que se reparten los pedidos generados')
+    parser.add_argument('--dias', type=int, default=31, help='días del rango consultado, hasta hoy')
+    parser.add_argument('--sucursal', type=int, default=1, help='sucursal para los reportes gestor_*_sucursal')
+    args = parser.parse_args()
+
+    reportes = consultas()
+    conexion = conectar()
+    try:
+        if args.generar:
+            print(f'Generando {args.generar} pedidos en {args.anios} años...')
+            generar(conexion, args.generar, args.anios)
+
+        hasta = date.today()
+        parametros = {'desde': hasta - timedelta(days=args.dias - 1), 'hasta': hasta,
+                      'sucursal': args.sucursal, 'limite': 10, 'orden': 'DESC'}
+        completas = []
+        print(f'{"reporte":<52} {"tabla":<10} {"type":<8} {"key":<28} {"rows":>10}')
+        for reporte, tabla, sql in reportes:
+            filas = [fila for fila in explicar(conexion, sql, parametros) if fila['table'] == tabla]
+            if not filas:
+                print(f'{reporte:<52} {tabla:<10} (no aparece en el plan)')
+                continue
+            for fila in filas:
+                print(f'{reporte:<52} {tabla:<10} {fila["type"] or "":<8} '
+                      f'{fila["key"] or "":<28} {fila["rows"] or 0:>10}')
+                if fila['type'] == 'ALL':
+                    completas.append(reporte)
+    finally:
+        conexion.close()
+
+    if completas:
+        print('\nLeen la tabla completa: ' + ', '.join(completas))
+        return 1
+    print('\nOK: todos los reportes usan el índice de fecha')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
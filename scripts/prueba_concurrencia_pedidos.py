@@ -0,0 +1,197 @@
+"""
+Prueba de concurrencia de pedidos contra una MariaDB local.
+
+Lanza checkouts en paralelo (cada hilo con su propia conexión) y verifica que
+el id que devuelve cada llamada corresponde a SU pedido: el cliente del
+pedido y sus detalles (producto y cantidad) deben ser exactamente los que
+mandó ese hilo, y ningún id se repite. Con los antiguos sp_*_max_id dos
+hilos podían quedarse con el mismo MAX(id_pedido).
+
+Crea pedidos reales y descuenta inventario: usar solo en una base de
+desarrollo. Los usuarios deben ser clientes con RFC, dirección y teléfono y
+los productos deben tener existencias en alguna sucursal activa.
+
+    python scripts/prueba_concurrencia_pedidos.py --usuarios 5 6 --productos 1 2 3
+    python scripts/prueba_concurrencia_pedidos.py --modo crear --hilos 16 --pedidos 200 ...
+
+Modos:
+    checkout  pedidoCheckout (carrito como JSON), el que usa /api/carrito/checkout
+    crear     tablas temporales + pedidoCrear, el que usa /api/ventas/pedidos/crear
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import MySQLdb
+import MySQLdb.cursors
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from config import Config  # noqa: E402
+
+
+def conectar():
+    return MySQLdb.connect(
+        host=Config.MYSQL_HOST,
+        port=Config.MYSQL_PORT,
+        user=Config.MYSQL_USER,
+        passwd=Config.MYSQL_PASSWORD,
+        db=Config.MYSQL_DB,
+        charset=Config.MYSQL_CHARSET,
+        cursorclass=MySQLdb.cursors.DictCursor,
+    )
+
+
+def llamar_sp(conexion, nombre, params):
+    """Primera fila del primer result set del SP (consume el resto)"""
+    cursor = conexion.cursor()
+    try:
+        cursor.callproc(nombre, params)
+        fila = cursor.fetchone() if cursor.description else None
+        while cursor.nextset():
+            pass
+        return fila
+    finally:
+        cursor.close()
+
+
+def pedido_checkout(conexion, id_usuario, items):
+    fila = llamar_sp(conexion, 'pedidoCheckout', [id_usuario, None, json.dumps(items), False, Config.SURTIDO_POLITICA])
+    conexion.commit()
+    return fila['id_pedido'] if fila else None
+
+
+def pedido_crear(conexion, id_usuario, items):
+    cursor = conexion.cursor()
+    cursor.execute("""
+        CREATE TEMPORARY TABLE IF NOT EXISTS TmpPedidos (
+            id_tmp_pedido INT AUTO_INCREMENT PRIMARY KEY,
+            fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
+            id_usuario INT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TEMPORARY TABLE IF NOT EXISTS TmpItems_Pedido (
+            id_tmp_item INT AUTO_INCREMENT PRIMARY KEY,
+            id_producto INT NOT NULL,
+            cantidad_producto INT NOT NULL,
+            id_tmp_pedido INT NOT NULL
+        )
+    """)
+    cursor.close()
+    id_tmp_pedido = llamar_sp(conexion, 'sp_tmp_pedido_insertar', [id_usuario])['id_tmp_pedido']
+    for item in items:
+        llamar_sp(conexion, 'sp_tmp_item_pedido_insertar', [item['id_producto'], item['cantidad'], id_tmp_pedido])
+    fila = llamar_sp(conexion, 'pedidoCrear', [id_tmp_pedido, Config.SURTIDO_POLITICA])
+    conexion.commit()
+    return fila['id_pedido'] if fila else None
+
+
+MODOS = {
+    'checkout': pedido_checkout,
+    'crear': pedido_crear,
+}
+
+
+def carrito_de(numero, productos):
+    """Carrito distinto para cada pedido, para detectar ids cruzados"""
+    producto = productos[numero % len(productos)]
+    cantidad = 1 + (numero // len(productos)) % 3
+    return [{'id_producto': producto, 'cantidad': cantidad}]
+
+
+def verificar(conexion, id_pedido, id_usuario, items):
+    """Lista de diferencias entre lo enviado y lo guardado en el pedido"""
+    cursor = conexion.cursor()
+    try:
+        cursor.execute("""
+            SELECT c.id_usuario
+            FROM Pedidos_Clientes pc
+            JOIN Clientes c ON c.id_cliente = pc.id_cliente
+            WHERE pc.id_pedido = %s
+        """, (id_pedido,))
+        usuarios = [f['id_usuario'] for f in cursor.fetchall()]
+        # Un producto surtido de varias sucursales tiene varios renglones
+        cursor.execute("""
+            SELECT id_producto, CAST(SUM(cantidad_producto) AS SIGNED) AS cantidad_producto
+            FROM Pedidos_Detalles
+            WHERE id_pedido = %s
+            GROUP BY id_producto
+        """, (id_pedido,))
+        detalles = sorted((f['id_producto'], f['cantidad_producto']) for f in cursor.fetchall())
+    finally:
+        cursor.close()
+
+    errores = []
+    if usuarios != [id_usuario]:
+        errores.append(f'cliente esperado usuario {id_usuario}, encontrado {usuarios}')
+    esperados = sorted((i['id_producto'], i['cantidad']) for i in items)
+    if detalles != esperados:
+        errores.append(f'detalles esperados {esperados}, encontrados {detalles}')
+    return errores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--usuarios', type=int, nargs='+', required=True, help='id_usuario de clientes con datos completos')
+    parser.add_argument('--productos', type=int, nargs='+', required=True, help='id_producto con existencias')
+    parser.add_argument('--modo', choices=sorted(MODOS), default='checkout')
+    parser.add_argument('--hilos', type=int, default=8)
+    parser.add_argument('--pedidos', type=int, default=50)
+    args = parser.parse_args()
+
+    crear = MODOS[args.modo]
+    locales = threading.local()
+    conexiones = []
+
+    def trabajo(numero):
+        if not hasattr(locales, 'conexion'):
+            locales.conexion = conectar()
+            conexiones.append(locales.conexion)
+        id_usuario = args.usuarios[numero % len(args.usuarios)]
+        items = carrito_de(numero, args.productos)
+        try:
+            return numero, id_usuario, items, crear(locales.conexion, id_usuario, items), None
+        except Exception as e:
+            locales.conexion.rollback()
+            return numero, id_usuario, items, None, e
+
+    with ThreadPoolExecutor(max_workers=args.hilos) as ejecutor:
+        resultados = list(ejecutor.map(trabajo, range(args.pedidos)))
+    for conexion in conexiones:
+        conexion.close()
+
+    fallidos = [r for r in resultados if r[4] is not None or not r[3]]
+    creados = [r for r in resultados if r[4] is None and r[3]]
+    errores = []
+
+    vistos = {}
+    for numero, _, _, id_pedido, _ in creados:
+        if id_pedido in vistos:
+            errores.append(f'id_pedido {id_pedido} devuelto a los pedidos {vistos[id_pedido]} y {numero}')
+        vistos[id_pedido] = numero
+
+    conexion = conectar()
+    try:
+        for numero, id_usuario, items, id_pedido, _ in creados:
+            for error in verificar(conexion, id_pedido, id_usuario, items):
+                errores.append(f'pedido #{numero} (id_pedido {id_pedido}): {error}')
+    finally:
+        conexion.close()
+
+    print(f'Modo {args.modo}: {len(creados)} pedidos creados con {args.hilos} hilos, {len(fallidos)} fallidos')
+    for numero, _, _, _, error in fallidos:
+        print(f'  pedido #{numero} falló: {error}')
+    for error in errores:
+        print(f'  ERROR {error}')
+    if errores:
+        print('Hay ids cruzados o repetidos')
+        return 1
+    print('OK: cada llamada recibió el id de su propio pedido')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
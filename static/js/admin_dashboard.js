@@ -1,11 +1,8 @@
+// Todos los widgets del panel en una sola petición (ver widgetsDashboard en main.js)
+const widget = widgetsDashboard('admin');
+
 // Cargar KPIs
-fetch('/api/reporte/kpis')
-    .then(r => {
-        if (!r.ok) {
-            throw new Error(`HTTP ${r.status}: ${r.statusText}`);
-        }
-        return r.json();
-    })
+widget('kpis')
     .then(data => {
         console.log('Datos KPIs recibidos:', data);
 
@@ -70,8 +67,7 @@ fetch('/api/reporte/kpis')
     });
 
 // Gráfica Ventas por Categoría (Bar Chart)
-fetch('/api/reporte/margen-categoria')
-    .then(r => r.json())
+widget('margen_categoria')
     .then(data => {
         if (!data || data.length === 0) {
             document.getElementById('chartVentasCategoria').innerHTML = '<p class="text-center text-muted">No hay datos disponibles</p>';
@@ -106,16 +102,7 @@ fetch('/api/reporte/margen-categoria')
     });
 
 // Gráfica Facturación Diaria (Line Chart)
-fetch('/api/reporte/facturacion-diaria')
-    .then(r => {
-        if (!r.ok) {
-            return r.json().then(err => {
-                console.error('Error HTTP:', err);
-                throw new Error(err.message || 'Error al cargar datos');
-            });
-        }
-        return r.json();
-    })
+widget('facturacion_diaria')
     .then(data => {
         if (!data || data.length === 0 || (data.error)) {
             const msg = data.error ? `Error: ${data.error}` : 'No hay datos disponibles';
@@ -199,8 +186,7 @@ fetch('/api/reporte/facturacion-diaria')
     });
 
 // Ticket Promedio - KPI Cards y Gráfica (usando VIEW vticketspromedio)
-fetch('/api/reporte/ticket-promedio')
-    .then(r => r.json())
+widget('ticket_promedio')
     .then(data => {
         if (!data || data.error) {
             document.getElementById('chartTicketPromedio').innerHTML = '<p class="text-center text-muted">No hay datos disponibles</p>';
@@ -290,7 +276,9 @@ function setDefaultTopFechas() {
     if (selectN) selectN.value = '5';
 }
 
-function cargarTopProductos() {
+// inicial: los datos vienen en /api/dashboard/admin (mismo rango y n por omisión);
+// al aplicar filtros se consulta /api/reporte/top-productos
+function cargarTopProductos(inicial = false) {
     const desde = document.getElementById('topDesde')?.value;
     const hasta = document.getElementById('topHasta')?.value;
     const n = document.getElementById('topN')?.value || 5;
@@ -305,13 +293,16 @@ function cargarTopProductos() {
         container.innerHTML = '<p class="text-center text-muted">Cargando...</p>';
     }
 
-    fetch('/api/reporte/top-productos?' + params.toString())
-        .then(r => {
+    const datos = inicial
+        ? widget('top_productos')
+        : fetch('/api/reporte/top-productos?' + params.toString()).then(r => {
             if (!r.ok) {
                 throw new Error(`HTTP ${r.status}`);
             }
             return r.json();
-        })
+        });
+
+    datos
         .then(data => {
             if (!container) return;
 
@@ -376,5 +367,5 @@ function cargarTopProductos() {
 // Inicializar filtros y cargar top al entrar al dashboard
 document.addEventListener('DOMContentLoaded', () => {
     setDefaultTopFechas();
-    cargarTopProductos();
+    cargarTopProductos(true);
 });
@@ -1,6 +1,8 @@
+// Todos los widgets del panel en una sola petición (ver widgetsDashboard en main.js)
+const widget = widgetsDashboard('auditor');
+
 // Cargar KPIs
-fetch('/api/auditor/kpis')
-    .then(r => r.json())
+widget('kpis')
     .then(data => {
         // Registros Auditados
         document.getElementById('kpiRegistros').textContent = new Intl.NumberFormat('es-MX').format(data.registros_auditados || 0);
@@ -43,8 +45,7 @@ fetch('/api/auditor/kpis')
     });
 
 // Gráfica Devoluciones por Motivo (Pie Chart)
-fetch('/api/auditor/devoluciones-motivo')
-    .then(r => r.json())
+widget('devoluciones_motivo')
     .then(data => {
         if (!data || data.length === 0) {
             document.getElementById('chartDevoluciones').innerHTML = '<p class="text-center text-muted py-5"><i class="bi bi-inbox"></i> No hay datos de devoluciones disponibles</p>';
@@ -123,8 +124,7 @@ fetch('/api/auditor/devoluciones-motivo')
     });
 
 // Gráfica Actividad de Auditoría por Módulo (Bar Chart)
-fetch('/api/auditor/actividad-modulo')
-    .then(r => r.json())
+widget('actividad_modulo')
     .then(data => {
         if (!data) {
             document.getElementById('chartActividadModulo').innerHTML = '<p class="text-center text-muted">No hay datos disponibles</p>';
@@ -189,8 +189,7 @@ fetch('/api/auditor/actividad-modulo')
     });
 
 // Cargar Registros Recientes
-fetch('/api/auditor/registros-recientes')
-    .then(r => r.json())
+widget('registros_recientes')
     .then(data => {
         const tbody = document.getElementById('tablaRegistrosRecientes');
         if (!data || data.length === 0) {
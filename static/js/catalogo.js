@@ -1,20 +1,162 @@
-// Búsqueda de productos
-document.getElementById('searchInput')?.addEventListener('input', function (e) {
-    const searchTerm = e.target.value.toLowerCase();
-    const cards = document.querySelectorAll('.product-card');
+// Búsqueda de productos en el servidor (/api/productos/buscar): nombre, SKU,
+// categoría, material, kilataje y ley, por prefijo y ordenada por relevancia
+let temporizadorBusqueda = null;
+let consultaActual = '';
+
+function mostrarListaCatalogo(mostrar) {
+    document.getElementById('productosGrid').style.display = mostrar ? '' : 'none';
+    document.getElementById('resultadosBusqueda').style.display = mostrar ? 'none' : '';
+    const cargarMas = document.getElementById('cargarMasContainer');
+    const btn = document.getElementById('btnCargarMas');
+    if (cargarMas && btn) {
+        cargarMas.style.display = mostrar && btn.dataset.siguiente ? '' : 'none';
+    }
+}
 
-    cards.forEach(card => {
-        const productName = card.querySelector('.product-name').textContent.toLowerCase();
-        const cardContainer = card.closest('.col-md-4');
+function buscarProductos(consulta) {
+    consultaActual = consulta;
+    if (!consulta) {
+        mostrarListaCatalogo(true);
+        return;
+    }
 
-        if (productName.includes(searchTerm)) {
-            cardContainer.style.display = '';
-        } else {
-            cardContainer.style.display = 'none';
-        }
-    });
+    const params = new URLSearchParams({q: consulta});
+    const categoria = document.getElementById('btnCargarMas')?.dataset.categoria;
+    if (categoria) params.set('categoria', categoria);
+
+    fetch(`/api/productos/buscar?${params.toString()}`)
+        .then(response => {
+            if (!response.ok) throw new Error('Error al buscar productos');
+            return response.json();
+        })
+        .then(data => {
+            // Ignorar respuestas de consultas que ya se reemplazaron
+            if (consulta !== consultaActual) return;
+            const resultados = document.getElementById('resultadosBusqueda');
+            resultados.innerHTML = '';
+            if (data.productos.length === 0) {
+                resultados.innerHTML = `
+                    <div class="col-12 text-center py-5">
+                        <i class="bi bi-search" style="font-size: 4rem; color: #cbd5e1;"></i>
+                        <h3 class="mt-3 text-muted">No se encontraron productos</h3>
+                        <p class="text-muted">Intenta con otro nombre, SKU o material.</p>
+                    </div>`;
+            } else {
+                data.productos.forEach(producto => resultados.appendChild(crearTarjetaProducto(producto)));
+            }
+            mostrarListaCatalogo(false);
+        })
+        .catch(error => console.error('Error:', error));
+}
+
+document.getElementById('searchInput')?.addEventListener('input', function (e) {
+    clearTimeout(temporizadorBusqueda);
+    const consulta = e.target.value.trim();
+    temporizadorBusqueda = setTimeout(() => buscarProductos(consulta), 200);
 });
 
+// Carga incremental del catálogo (paginación por cursor en /api/catalogo)
+const IMAGEN_DEFAULT = '/static/images/defaults/joyeria-default.png';
+
+function escaparHtml(texto) {
+    const div = document.createElement('div');
+    div.textContent = texto == null ? '' : String(texto);
+    return div.innerHTML;
+}
+
+function urlImagenProducto(url) {
+    if (!url) return IMAGEN_DEFAULT;
+    if (url.startsWith('/static/')) return url;
+    return '/static/' + url.replace(/^\/+/, '').replace(/^static\//, '');
+}
+
+function formatearPrecio(valor) {
+    return Number(valor || 0).toLocaleString('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2});
+}
+
+function crearTarjetaProducto(producto) {
+    const descuento = parseInt(producto.descuento_producto || 0, 10);
+    const precio = descuento > 0 ? `
+        <div style="margin-bottom: 8px;">
+            <span class="text-muted text-decoration-line-through" style="font-size: 1rem;">
+                $${formatearPrecio(producto.precio_original)}
+            </span>
+            <span class="badge bg-danger ms-2" style="font-size: 0.85rem; padding: 4px 8px;">-${descuento}%</span>
+        </div>
+        <div>
+            <span style="font-size: 1.8rem; font-weight: 700; color: #ff9500; display: block;">
+                $${formatearPrecio(producto.precio)}
+            </span>
+        </div>` : `
+        <span style="font-size: 1.8rem; font-weight: 700; color: #ff9500;">
+            $${formatearPrecio(producto.precio)}
+        </span>`;
+
+    const col = document.createElement('div');
+    col.className = 'col-md-4 col-lg-4 mb-4';
+    col.innerHTML = `
+        <div class="product-card">
+            <img src="${escaparHtml(urlImagenProducto(producto.imagen_url))}"
+                 alt="${escaparHtml(producto.nombre)}"
+                 class="product-image"
+                 onerror="this.src='${IMAGEN_DEFAULT}';">
+            <div class="product-body">
+                <h3 class="product-name">${escaparHtml(producto.nombre)}</h3>
+                <div class="product-price">${precio}</div>
+                <div class="product-buttons">
+                    <button class="btn btn-ver-detalles" onclick="verDetalles(${Number(producto.id_producto)})">
+                        Ver Detalles
+                    </button>
+                    <button class="btn btn-agregar-carrito" onclick="agregarAlCarrito(${Number(producto.id_producto)})">
+                        <i class="bi bi-cart-plus"></i>
+                        Carrito
+                    </button>
+                </div>
+            </div>
+        </div>`;
+    return col;
+}
+
+let cargandoPagina = false;
+
+function cargarMasProductos() {
+    const btn = document.getElementById('btnCargarMas');
+    if (!btn || cargandoPagina || !btn.dataset.siguiente || consultaActual) return;
+
+    cargandoPagina = true;
+    btn.disabled = true;
+    const params = new URLSearchParams({despues: btn.dataset.siguiente});
+    if (btn.dataset.categoria) params.set('categoria', btn.dataset.categoria);
+
+    fetch(`/api/catalogo?${params.toString()}`)
+        .then(response => {
+            if (!response.ok) throw new Error('Error al cargar más productos');
+            return response.json();
+        })
+        .then(data => {
+            const grid = document.getElementById('productosGrid');
+            data.productos.forEach(producto => grid.appendChild(crearTarjetaProducto(producto)));
+            btn.dataset.siguiente = data.siguiente || '';
+            if (!data.siguiente) {
+                document.getElementById('cargarMasContainer').style.display = 'none';
+            }
+        })
+        .catch(error => console.error('Error:', error))
+        .finally(() => {
+            cargandoPagina = false;
+            btn.disabled = false;
+        });
+}
+
+document.getElementById('btnCargarMas')?.addEventListener('click', cargarMasProductos);
+
+// Cargar la siguiente página automáticamente al acercarse al final de la lista
+if ('IntersectionObserver' in window && document.getElementById('cargarMasContainer')) {
+    new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) cargarMasProductos();
+    }, {rootMargin: '400px'}).observe(document.getElementById('cargarMasContainer'));
+}
+
 // Efecto visual en botones de categoría al hacer clic
 document.querySelectorAll('.btn-categoria').forEach(btn => {
     btn.addEventListener('click', function () {
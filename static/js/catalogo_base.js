@@ -48,7 +48,7 @@
                 if (data.carrito && data.carrito.length > 0) {
                     renderizarCarrito(data.carrito, data.total);
                     actualizarBadgeCarrito(data.total_items);
-                    btnPagar.disabled = false;
+                    btnPagar.disabled = data.todos_disponibles === false;
                 } else {
                     cartItems.innerHTML = `
                         <div class="cart-empty">
@@ -66,6 +66,21 @@
             });
     }
 
+    // Aviso de precio actualizado o falta de existencias (ver /api/carrito/obtener)
+    function avisoDisponibilidad(item) {
+        let aviso = '';
+        if (item.precio_cambio) {
+            aviso += `<div class="cart-item-aviso small text-warning">Precio actualizado (antes $${parseFloat(item.precio_anterior).toLocaleString('es-MX', { minimumFractionDigits: 2 })})</div>`;
+        }
+        if (item.disponible === false) {
+            const texto = !item.activo || item.stock_total <= 0
+                ? 'No disponible'
+                : `Solo ${item.stock_total} disponible(s)`;
+            aviso += `<div class="cart-item-aviso small text-danger">${texto}</div>`;
+        }
+        return aviso;
+    }
+
     // Renderizar items del carrito
     function renderizarCarrito(items, total) {
         cartItems.innerHTML = items.map(item => `
@@ -91,6 +106,7 @@
                             <i class="bi bi-trash"></i>
                         </button>
                     </div>
+                    ${avisoDisponibilidad(item)}
                     <div class="cart-item-total">
                         Subtotal: $${(parseFloat(item.precio) * item.cantidad).toLocaleString('es-MX', { minimumFractionDigits: 2 })}
                     </div>
@@ -188,13 +204,26 @@
     if (btnPagar) {
         btnPagar.addEventListener('click', function () {
             // Obtener carrito actual
-            fetch('/api/carrito/obtener')
+            fetch('/api/carrito/validar', { method: 'POST' })
                 .then(r => r.json())
                 .then(carritoData => {
                     if (!carritoData.carrito || carritoData.carrito.length === 0) {
                         alert('El carrito está vacío');
                         return;
                     }
+                    // Precios y existencias se revisan antes de crear el pedido
+                    if (carritoData.no_disponibles && carritoData.no_disponibles.length > 0) {
+                        const nombres = carritoData.no_disponibles.map(item => '- ' + item.nombre).join('\n');
+                        alert((carritoData.mensaje || 'Algunos productos no están disponibles') + '\n\n' + nombres);
+                        cargarCarrito();
+                        return;
+                    }
+                    if (carritoData.precios_actualizados) {
+                        cargarCarrito();
+                        if (!confirm('Algunos precios de tu carrito cambiaron. El total ahora es $' + parseFloat(carritoData.total).toLocaleString('es-MX', { minimumFractionDigits: 2 }) + '. ¿Deseas continuar con el pago?')) {
+                            return;
+                        }
+                    }
 
                     // Deshabilitar botón
                     btnPagar.disabled = true;
@@ -205,7 +234,7 @@
                     const solicitarFactura = checkSolicitarFactura ? checkSolicitarFactura.checked : false;
                     
                     // Crear pedido desde el carrito
-                    fetch('/api/carrito/checkout', {
+                    fetchIdempotente('checkout', '/api/carrito/checkout', {
                         method: 'POST',
                         headers: {
                             'Content-Type': 'application/json'
@@ -464,9 +493,12 @@
         btn.disabled = true;
         btn.innerHTML = '<span class="spinner-border spinner-border-sm me-2"></span>Procesando...';
 
-        fetch(`/api/ventas/pedidos/${data.id_pedido}/pagar`, {
+        const operacionPago = `pago-pedido-${data.id_pedido}`;
+        fetchIdempotente(operacionPago, `/api/ventas/pedidos/${data.id_pedido}/pagar`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: {
+                'Content-Type': 'application/json'
+            },
             body: JSON.stringify({
                 importe: data.importe,
                 id_metodo_pago: data.id_metodo_pago
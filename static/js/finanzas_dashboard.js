@@ -1,6 +1,8 @@
+// Todos los widgets del panel en una sola petición (ver widgetsDashboard en main.js)
+const widget = widgetsDashboard('finanzas');
+
 // Cargar KPIs
-fetch('/api/finanzas/kpis')
-    .then(r => r.json())
+widget('kpis')
     .then(data => {
         // Ingresos del Mes
         const ingresos = data.ingresos_mes || 0;
@@ -42,8 +44,7 @@ fetch('/api/finanzas/kpis')
     .catch(err => console.error('Error cargando KPIs:', err));
 
 // Gráfica Margen por Categoría (Barras con dos series: Ventas y Margen)
-fetch('/api/finanzas/margen-categoria')
-    .then(r => r.json())
+widget('margen_categoria')
     .then(data => {
         if (!data || data.length === 0) {
             document.getElementById('chartMargenCategoria').innerHTML = '<p class="text-center text-muted">No hay datos disponibles</p>';
@@ -108,8 +109,7 @@ fetch('/api/finanzas/margen-categoria')
     .catch(err => console.error('Error cargando margen:', err));
 
 // Gráfica Facturación vs Cobrado (Líneas)
-fetch('/api/finanzas/facturacion-vs-cobrado')
-    .then(r => r.json())
+widget('facturacion_vs_cobrado')
     .then(data => {
         if (!data || !data.meses || data.meses.length === 0) {
             document.getElementById('chartFacturacionCobrado').innerHTML = '<p class="text-center text-muted">No hay datos disponibles</p>';
@@ -1,6 +1,8 @@
+// Todos los widgets del panel en una sola petición (ver widgetsDashboard en main.js)
+const widget = widgetsDashboard('inventario');
+
 // Cargar KPIs
-fetch('/api/inventario/kpis')
-    .then(r => r.json())
+widget('kpis')
     .then(data => {
         document.getElementById('kpiStock').textContent = new Intl.NumberFormat('es-MX').format(data.productos_stock || 0);
         document.getElementById('kpiStockBajo').textContent = new Intl.NumberFormat('es-MX').format(data.stock_bajo || 0);
@@ -10,8 +12,7 @@ fetch('/api/inventario/kpis')
     .catch(err => console.error('Error cargando KPIs:', err));
 
 // Gráfica Estado de Stock
-fetch('/api/inventario/estado-stock')
-    .then(r => r.json())
+widget('estado_stock')
     .then(data => {
         console.log('Datos recibidos para gráfica:', data);
         const normal = parseInt(data.normal) || 0;
@@ -53,3 +53,67 @@ document.querySelectorAll('form').forEach(form => {
         });
     });
 });
+
+// Idempotency-Key para las operaciones que crean pedidos o registran pagos:
+// si la petición falla por red o tiempo de espera y el usuario reintenta, se
+// reenvía la misma clave y el servidor devuelve la respuesta original sin
+// repetir la operación. La clave se descarta solo con un resultado final
+// (ver fetchIdempotente).
+function claveIdempotencia(operacion) {
+    const nombre = `idempotencia:${operacion}`;
+    let clave = sessionStorage.getItem(nombre);
+    if (!clave) {
+        clave = window.crypto && crypto.randomUUID
+            ? crypto.randomUUID()
+            : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+        sessionStorage.setItem(nombre, clave);
+    }
+    return clave;
+}
+
+function descartarClaveIdempotencia(operacion) {
+    sessionStorage.removeItem(`idempotencia:${operacion}`);
+}
+
+// fetch con la Idempotency-Key de `operacion`. Mientras la petición original
+// sigue en proceso (409 con Retry-After) reintenta con la misma clave. La
+// clave se descarta con 2xx o con un 4xx distinto de 409; con 409, 5xx (un
+// 502/504 del proxy puede llegar aunque el pedido sí se creó) o error de red
+// se conserva, así el siguiente intento recibe la respuesta original.
+const REINTENTOS_IDEMPOTENCIA = 5;
+
+function fetchIdempotente(operacion, url, opciones, reintentos = REINTENTOS_IDEMPOTENCIA) {
+    const headers = Object.assign({}, opciones.headers, {
+        'Idempotency-Key': claveIdempotencia(operacion)
+    });
+    return fetch(url, Object.assign({}, opciones, { headers })).then(response => {
+        const espera = parseInt(response.headers.get('Retry-After'), 10);
+        if (response.status === 409 && !isNaN(espera) && reintentos > 0) {
+            return new Promise(resolve => setTimeout(resolve, espera * 1000))
+                .then(() => fetchIdempotente(operacion, url, opciones, reintentos - 1));
+        }
+        if (response.ok || (response.status >= 400 && response.status < 500 && response.status !== 409)) {
+            descartarClaveIdempotencia(operacion);
+        }
+        return response;
+    });
+}
+
+// Dashboards: todos los widgets de un panel en una sola petición
+// (/api/dashboard/<panel>) en lugar de un fetch por widget. Devuelve
+// widget(nombre), una promesa con los mismos datos que el endpoint individual
+// del widget; se rechaza si la petición o ese widget fallaron en el servidor.
+function widgetsDashboard(panel) {
+    const documento = fetch(`/api/dashboard/${panel}`).then(r => {
+        if (!r.ok) {
+            throw new Error(`HTTP ${r.status}: ${r.statusText}`);
+        }
+        return r.json();
+    });
+    return nombre => documento.then(d => {
+        if (d.errores.includes(nombre)) {
+            throw new Error(`Error al obtener ${nombre}`);
+        }
+        return d.widgets[nombre];
+    });
+}
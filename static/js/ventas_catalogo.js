@@ -1,24 +1,22 @@
-document.getElementById('searchInput').addEventListener('input', filtrarTabla);
 document.getElementById('filterCategoria').addEventListener('change', filtrarTabla);
 document.getElementById('filterEstado').addEventListener('change', filtrarTabla);
 
+// El texto se busca en el servidor (/api/productos/buscar); categoría y estado
+// se filtran sobre las filas mostradas
 function filtrarTabla() {
-    const searchText = document.getElementById('searchInput').value.toLowerCase();
     const categoria = document.getElementById('filterCategoria').value.toLowerCase();
     const estado = document.getElementById('filterEstado').value;
     const rows = document.querySelectorAll('tbody tr');
 
     rows.forEach(row => {
-        const texto = row.textContent.toLowerCase();
         const categoriaRow = row.querySelector('td:nth-child(4)')?.textContent.toLowerCase() || '';
         const estadoRow = row.querySelector('td:nth-child(9)')?.textContent || '';
         const esActivo = estadoRow.includes('Activo');
 
-        const matchSearch = !searchText || texto.includes(searchText);
         const matchCategoria = !categoria || categoriaRow.includes(categoria);
         const matchEstado = !estado || (estado === '1' && esActivo) || (estado === '0' && !esActivo);
 
-        row.style.display = (matchSearch && matchCategoria && matchEstado) ? '' : 'none';
+        row.style.display = (matchCategoria && matchEstado) ? '' : 'none';
     });
 }
 
@@ -26,21 +24,148 @@ function limpiarFiltros() {
     document.getElementById('searchInput').value = '';
     document.getElementById('filterCategoria').value = '';
     document.getElementById('filterEstado').value = '';
+    buscarProductos('');
     filtrarTabla();
 }
 
-document.addEventListener('DOMContentLoaded', function() {
-    const categorias = new Set();
+// Búsqueda por nombre, SKU, categoría, material, kilataje o ley
+let temporizadorBusqueda = null;
+let consultaActual = '';
+let filasCatalogo = null;  // filas paginadas guardadas mientras se muestran resultados
+
+function mostrarFilas(filas) {
+    const tbody = document.querySelector('tbody');
+    tbody.innerHTML = '';
+    filas.forEach(fila => tbody.appendChild(fila));
+    filtrarTabla();
+}
+
+function buscarProductos(consulta) {
+    consultaActual = consulta;
+    const cargarMas = document.getElementById('cargarMasContainer');
+    const btn = document.getElementById('btnCargarMas');
+
+    if (!consulta) {
+        if (filasCatalogo) {
+            mostrarFilas(filasCatalogo);
+            filasCatalogo = null;
+        }
+        if (cargarMas && btn) cargarMas.style.display = btn.dataset.siguiente ? '' : 'none';
+        return;
+    }
+
+    fetch(`/api/productos/buscar?${new URLSearchParams({q: consulta, limite: 50}).toString()}`)
+        .then(response => {
+            if (!response.ok) throw new Error('Error al buscar productos');
+            return response.json();
+        })
+        .then(data => {
+            // Ignorar respuestas de consultas que ya se reemplazaron
+            if (consulta !== consultaActual) return;
+            if (!filasCatalogo) {
+                filasCatalogo = Array.from(document.querySelectorAll('tbody tr'));
+            }
+            if (cargarMas) cargarMas.style.display = 'none';
+            mostrarFilas(data.productos.map(crearFilaProducto));
+            agregarCategoriasFiltro();
+        })
+        .catch(error => console.error('Error:', error));
+}
+
+document.getElementById('searchInput').addEventListener('input', function (e) {
+    clearTimeout(temporizadorBusqueda);
+    const consulta = e.target.value.trim();
+    temporizadorBusqueda = setTimeout(() => buscarProductos(consulta), 200);
+});
+
+function agregarCategoriasFiltro() {
+    const select = document.getElementById('filterCategoria');
+    const existentes = new Set(Array.from(select.options).map(option => option.value));
     document.querySelectorAll('tbody tr').forEach(row => {
         const categoria = row.querySelector('td:nth-child(4)')?.textContent.trim();
-        if (categoria) categorias.add(categoria);
+        if (categoria && !existentes.has(categoria)) {
+            existentes.add(categoria);
+            const option = document.createElement('option');
+            option.value = categoria;
+            option.textContent = categoria;
+            select.appendChild(option);
+        }
     });
+}
 
-    const select = document.getElementById('filterCategoria');
-    categorias.forEach(cat => {
-        const option = document.createElement('option');
-        option.value = cat;
-        option.textContent = cat;
-        select.appendChild(option);
-    });
+function escaparHtml(texto) {
+    const div = document.createElement('div');
+    div.textContent = texto == null ? '' : String(texto);
+    return div.innerHTML;
+}
+
+function formatearPrecio(valor) {
+    return Number(valor || 0).toLocaleString('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2});
+}
+
+// Misma estructura que la macro tabla_productos_solo_lectura
+function crearFilaProducto(producto) {
+    const tr = document.createElement('tr');
+    tr.dataset.sucursales = '';
+    tr.innerHTML = `
+        <td><strong>#${Number(producto.id_producto)}</strong></td>
+        <td>${escaparHtml(producto.nombre || producto.nombre_producto)}</td>
+        <td><code>${escaparHtml(producto.sku)}</code></td>
+        <td>${escaparHtml(producto.nombre_categoria)}</td>
+        <td><strong class="text-success">$${formatearPrecio(producto.precio_unitario)}</strong></td>
+        <td>$${formatearPrecio(producto.costo_unitario)}</td>
+        <td>${escaparHtml(producto.material || 'N/A')}</td>
+        <td>${escaparHtml(producto.genero_producto || 'N/A')}</td>
+        <td>${producto.activo_producto
+            ? '<span class="badge bg-success">Activo</span>'
+            : '<span class="badge bg-secondary">Inactivo</span>'}</td>`;
+    return tr;
+}
+
+// Carga incremental (paginación por cursor en /api/ventas/catalogo)
+let cargandoPagina = false;
+
+function cargarMasProductos() {
+    const btn = document.getElementById('btnCargarMas');
+    if (!btn || cargandoPagina || !btn.dataset.siguiente || consultaActual) return;
+
+    cargandoPagina = true;
+    btn.disabled = true;
+    const params = new URLSearchParams({despues: btn.dataset.siguiente});
+    if (btn.dataset.categoria) params.set('categoria', btn.dataset.categoria);
+
+    fetch(`/api/ventas/catalogo?${params.toString()}`)
+        .then(response => {
+            if (!response.ok) throw new Error('Error al cargar más productos');
+            return response.json();
+        })
+        .then(data => {
+            const tbody = document.querySelector('tbody');
+            data.productos.forEach(producto => tbody.appendChild(crearFilaProducto(producto)));
+            btn.dataset.siguiente = data.siguiente || '';
+            if (!data.siguiente) {
+                document.getElementById('cargarMasContainer').style.display = 'none';
+            }
+            agregarCategoriasFiltro();
+            filtrarTabla();
+        })
+        .catch(error => console.error('Error:', error))
+        .finally(() => {
+            cargandoPagina = false;
+            btn.disabled = false;
+        });
+}
+
+document.getElementById('btnCargarMas')?.addEventListener('click', cargarMasProductos);
+
+document.addEventListener('DOMContentLoaded', function() {
+    agregarCategoriasFiltro();
+
+    // Cargar la siguiente página automáticamente al acercarse al final de la tabla
+    const contenedor = document.getElementById('cargarMasContainer');
+    if ('IntersectionObserver' in window && contenedor) {
+        new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) cargarMasProductos();
+        }, {rootMargin: '400px'}).observe(contenedor);
+    }
 });
@@ -126,9 +126,11 @@ document.getElementById('btnCrearPedido').addEventListener('click', function ()
     btn.disabled = true;
     btn.innerHTML = '<span class="spinner-border spinner-border-sm me-2"></span>Creando...';
 
-    fetch('/api/ventas/pedidos/crear', {
+    fetchIdempotente('crear-pedido', '/api/ventas/pedidos/crear', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: {
+            'Content-Type': 'application/json'
+        },
         body: JSON.stringify({
             items: items,
             id_cliente: idCliente      // puede ir null si es cliente normal
@@ -215,9 +217,12 @@ document.getElementById('btnRegistrarPagoInmediato').addEventListener('click', f
     btn.disabled = true;
     btn.innerHTML = '<span class="spinner-border spinner-border-sm me-2"></span>Procesando...';
 
-    fetch(`/api/ventas/pedidos/${data.id_pedido}/pagar`, {
+    const operacionPago = `pago-pedido-${data.id_pedido}`;
+    fetchIdempotente(operacionPago, `/api/ventas/pedidos/${data.id_pedido}/pagar`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: {
+            'Content-Type': 'application/json'
+        },
         body: JSON.stringify({
             importe: data.importe,
             id_metodo_pago: data.id_metodo_pago